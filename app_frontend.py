@@ -3,7 +3,12 @@
 import streamlit as st
 import httpx
 import json
-from typing import Dict, Any
+import os
+import time
+import uuid
+from typing import Dict, Any, List
+
+from history_store import HISTORY_DB, HISTORY_PAGE_SIZE, HistoryStore
 
 # ----------------------------------------------------
 # CONFIGURACIÓN (Ruta Correcta para 404)
@@ -13,6 +18,25 @@ TIMEOUT = 125
 
 # RUTA CORRECTA: http://localhost:8000/api/v1/run
 ENDPOINT = f"{CIAN_BASE_URL}/api/v1/run" 
+# Variante en streaming (NDJSON): tokens a medida que se generan + evento final 'result'
+ENDPOINT_STREAM = f"{CIAN_BASE_URL}/api/v1/run_stream"
+# Trabajos asíncronos: la generación sigue en CIAN aunque se cierre la pestaña; el id
+# queda en la URL (?job=...) y al volver la página se reengancha en lugar de empezar otra.
+ENDPOINT_JOBS = f"{CIAN_BASE_URL}/api/v1/jobs"
+JOB_RECONNECTS = 20
+# Control de admisión de CIAN: prioridad interactiva y deadline por debajo de TIMEOUT
+# (si la espera estimada lo supera, CIAN rechaza al instante con Retry-After).
+GATEWAY_HEADERS = {"X-GWA-Priority": "interactive", "X-Deadline-Ms": str((TIMEOUT - 5) * 1000)}
+# Mismo secreto que GWA_FRONTEND_TOKEN de CIAN: sin él, CIAN ignora X-Client-Id y todas
+# las sesiones comparten el cupo de la IP de este servidor.
+FRONTEND_TOKEN = os.environ.get("GWA_FRONTEND_TOKEN", "").strip(' "')
+if FRONTEND_TOKEN:
+    GATEWAY_HEADERS["X-GWA-Frontend-Token"] = FRONTEND_TOKEN
+# Un solo cliente HTTP para todas las sesiones (st.cache_resource): conexiones keep-alive
+# reutilizadas en lugar de abrir un httpx.Client en cada clic.
+CLIENT_MAX_CONNECTIONS = 20
+# El texto en streaming se repinta como mucho cada RENDER_INTERVAL_S, no en cada fragmento.
+RENDER_INTERVAL_S = 0.15
 
 st.set_page_config(
     page_title="G.WA - Agente de Contenido Estratégico",
@@ -23,6 +47,59 @@ st.set_page_config(
 # LÓGICA DE INTERACCIÓN
 # ----------------------------------------------------
 
+@st.cache_resource
+def get_client() -> httpx.Client:
+    """Cliente keep-alive hacia CIAN compartido por todas las sesiones (httpx.Client es seguro entre hilos)."""
+    return httpx.Client(
+        timeout=httpx.Timeout(TIMEOUT, connect=10),
+        limits=httpx.Limits(max_connections=CLIENT_MAX_CONNECTIONS, max_keepalive_connections=CLIENT_MAX_CONNECTIONS),
+    )
+
+
+@st.cache_resource
+def get_history() -> HistoryStore:
+    return HistoryStore(HISTORY_DB)
+
+
+def _user_id() -> str:
+    # Id estable en la URL (?uid=...): el historial sigue al usuario entre recargas y sesiones.
+    if "uid" not in st.query_params:
+        st.query_params["uid"] = uuid.uuid4().hex[:12]
+    return st.query_params["uid"]
+
+
+def _gateway_headers() -> Dict[str, str]:
+    # Un X-Client-Id por usuario: el cupo por cliente de CIAN se aplica a cada usuario,
+    # no a la IP del servidor de Streamlit (compartida por todas las sesiones).
+    return {**GATEWAY_HEADERS, "X-Client-Id": f"streamlit-{_user_id()}"}
+
+
+class StreamView:
+    """Texto que llega en streaming; se repinta como mucho cada RENDER_INTERVAL_S y al terminar."""
+
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.parts: List[str] = []
+        self._painted_at = 0.0
+
+    def add(self, text: str) -> None:
+        self.parts.append(text)
+        if time.monotonic() - self._painted_at >= RENDER_INTERVAL_S:
+            self.flush()
+
+    def flush(self) -> None:
+        self.placeholder.code("".join(self.parts), language="json")
+        self._painted_at = time.monotonic()
+
+
+def _show_http_error(response: httpx.Response) -> None:
+    retry_after = response.headers.get("retry-after")
+    if response.status_code in (429, 503) and retry_after:
+        st.warning(f"Servicio saturado ({response.status_code}). Reintenta en {retry_after} s.")
+    else:
+        st.error(f"Error del servidor ({response.status_code}): {response.text}")
+
+
 def send_request(query: str) -> Dict[str, Any] | None:
     """Envía la consulta al endpoint corregido de CIAN."""
     
@@ -36,21 +113,193 @@ def send_request(query: str) -> Dict[str, Any] | None:
     }
     
     try:
-        with httpx.Client(timeout=TIMEOUT) as client:
-            response = client.post(ENDPOINT, json=payload)
-            response.raise_for_status() 
+        # Sólo result_json: raw_text es el mismo contenido otra vez.
+        response = get_client().post(ENDPOINT, json=payload, params={"fields": "status,result_json"},
+                                     headers=_gateway_headers())
+        response.raise_for_status() 
 
-            agent_output = response.json()
-            return agent_output.get("result_json", None)
+        agent_output = response.json()
+        return agent_output.get("result_json", None)
             
     except httpx.HTTPStatusError as e:
-        st.error(f"Error del servidor ({e.response.status_code}): {e.response.text}")
+        _show_http_error(e.response)
+    except httpx.ConnectError:
+        st.error(f"Error 503: No se pudo conectar a CIAN en {CIAN_BASE_URL}. ¿Están CIAN (8000) y MAGENTA (8001) corriendo?")
+    except Exception as e:
+        st.error(f"Ocurrió un error inesperado: {e}")
+    return None
+
+
+def stream_request(query: str) -> Dict[str, Any] | None:
+    """Envía la consulta a CIAN en streaming y muestra el texto del modelo a medida que llega."""
+    
+    payload = {
+        "template_name": "GWA_STRATEGIC_PLAN", 
+        "context": {}, 
+        "user_prompt": query 
+    }
+    placeholder = st.empty()
+    view = StreamView(placeholder)
+    
+    try:
+        # Sin límite de lectura total: el tiempo de espera se aplica entre fragmentos.
+        with get_client().stream("POST", ENDPOINT_STREAM, json=payload, headers=_gateway_headers()) as response:
+            if response.status_code != 200:
+                response.read()
+                response.raise_for_status()
+
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "token":
+                    view.add(event["text"])
+                elif event["type"] == "error":
+                    st.error(f"Error del modelo: {event['detail']}")
+                    return None
+                elif event["type"] == "result":
+                    placeholder.empty()
+                    return event["output"].get("result_json", None)
+            
+    except httpx.HTTPStatusError as e:
+        _show_http_error(e.response)
+    except httpx.ConnectError:
+        st.error(f"Error 503: No se pudo conectar a CIAN en {CIAN_BASE_URL}. ¿Están CIAN (8000) y MAGENTA (8001) corriendo?")
+    except Exception as e:
+        st.error(f"Ocurrió un error inesperado: {e}")
+    return None
+
+
+def submit_job(query: str) -> str | None:
+    """Encola la consulta como trabajo en CIAN y devuelve su id (el mismo si ya estaba en curso)."""
+    
+    payload = {
+        "template_name": "GWA_STRATEGIC_PLAN", 
+        "context": {}, 
+        "user_prompt": query 
+    }
+    
+    try:
+        response = get_client().post(ENDPOINT_JOBS, json=payload, headers=_gateway_headers(),
+                                     timeout=httpx.Timeout(30, connect=10))
+        response.raise_for_status()
+        return response.json()["job_id"]
+    except httpx.HTTPStatusError as e:
+        _show_http_error(e.response)
     except httpx.ConnectError:
         st.error(f"Error 503: No se pudo conectar a CIAN en {CIAN_BASE_URL}. ¿Están CIAN (8000) y MAGENTA (8001) corriendo?")
     except Exception as e:
         st.error(f"Ocurrió un error inesperado: {e}")
     return None
 
+
+def follow_job(job_id: str) -> Dict[str, Any] | None:
+    """
+    Sigue los eventos del trabajo y muestra el texto a medida que llega. Si la conexión
+    se corta, vuelve a engancharse: CIAN reenvía lo ya generado y continúa.
+    """
+    
+    placeholder = st.empty()
+    status = st.empty()
+    
+    for _ in range(JOB_RECONNECTS):
+        # CIAN reenvía desde el principio lo ya generado: la vista empieza de cero.
+        view = StreamView(placeholder)
+        try:
+            with get_client().stream("GET", f"{ENDPOINT_JOBS}/{job_id}/events", headers=_gateway_headers()) as response:
+                if response.status_code != 200:
+                    response.read()
+                    response.raise_for_status()
+
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "token":
+                        view.add(event["text"])
+                    elif event["type"] == "progress":
+                        position = event.get("position")
+                        status.caption(f"En cola (posición {position + 1})" if position is not None
+                                       else f"Generando... {event['progress'].get('tokens', 0)} fragmentos")
+                    elif event["type"] == "error":
+                        status.empty()
+                        st.error(f"El trabajo terminó con error: {event['detail']}")
+                        return None
+                    elif event["type"] == "result":
+                        placeholder.empty()
+                        status.empty()
+                        return event["output"].get("result_json", None)
+        except (httpx.ReadTimeout, httpx.RemoteProtocolError, httpx.ConnectError):
+            status.caption("Conexión perdida, reintentando...")
+            time.sleep(2)
+            continue
+        except httpx.HTTPStatusError as e:
+            _show_http_error(e.response)
+            return None
+        except Exception as e:
+            st.error(f"Ocurrió un error inesperado: {e}")
+            return None
+    st.warning(f"El trabajo {job_id} sigue en curso en CIAN; recarga la página para volver a engancharte.")
+    st.stop()
+
+
+def run_job(job_id: str, query: str) -> None:
+    """Sigue el trabajo hasta el final y lo pasa al historial; el id sale de la URL al terminar."""
+    st.session_state.job = {"id": job_id, "query": query}
+    st.query_params["job"] = job_id
+    with st.spinner("Generando plan con el Agente IA..."):
+        result = follow_job(job_id)
+    st.session_state.pop("job", None)
+    st.query_params.pop("job", None)
+    if result:
+        save_plan(query, result)
+        st.toast("¡Plan generado con éxito!", icon="✅")
+
+
+def save_plan(query: str, result: Dict[str, Any]) -> None:
+    """Guarda el plan en el historial persistente del usuario y vuelve a la primera página."""
+    ok = isinstance(result, dict) and 'title' in result
+    get_history().add(_user_id(), query, result, ok=ok)
+    st.session_state.history_page = 0
+
+
+def _go_to_page(page: int) -> None:
+    st.session_state.history_page = page
+
+
+def render_history() -> None:
+    """Pinta sólo la página visible del historial: el rerun no crece con los planes guardados."""
+    store, user = get_history(), _user_id()
+    pages = store.pages(user, HISTORY_PAGE_SIZE)
+    page = min(st.session_state.get("history_page", 0), pages - 1)
+    items = store.page(user, page, HISTORY_PAGE_SIZE)
+    if not items:
+        st.info("Aún no se ha generado ningún plan estratégico.")
+        return
+
+    for n, item in enumerate(items):
+        
+        if item['ok']:
+            # Sólo el plan más reciente se muestra desplegado.
+            with st.expander(f"**Solicitud:** {item['query'][:80]}...", expanded=page == 0 and n == 0): 
+                st.markdown(f"### 📄 {item['response']['title']}")
+                
+                st.info(f"**Resumen Ejecutivo:** {item['response']['summary']}")
+                
+                st.markdown("#### Pasos de Acción:")
+                for i, step in enumerate(item['response']['action_steps'], 1):
+                    st.markdown(f"{i}. {step}")
+        else:
+            with st.expander(f"**Solicitud (Error de Parseo):** {item['query'][:80]}...", expanded=False):
+                st.error("Error: MAGENTA no devolvió la estructura JSON correcta.")
+                st.json(item['response']) 
+
+    newer, info, older = st.columns([1, 3, 1])
+    newer.button("← Más recientes", key="history_newer", disabled=page == 0, on_click=_go_to_page, args=(page - 1,))
+    info.caption(f"Página {page + 1} de {pages} · {store.count(user)} planes guardados")
+    older.button("Más antiguos →", key="history_older", disabled=page >= pages - 1, on_click=_go_to_page,
+                 args=(page + 1,))
+
 # ----------------------------------------------------
 # INTERFAZ DE USUARIO (Streamlit)
 # ----------------------------------------------------
@@ -58,44 +307,27 @@ def send_request(query: str) -> Dict[str, Any] | None:
 st.title("G.WA | Generador de Contenido Estratégico 🤖")
 st.markdown("---")
 
-if 'history' not in st.session_state:
-    st.session_state.history = []
-
 query = st.text_area(
     "Escribe tu solicitud (ej: 'Diseña un plan de marketing para lanzar un producto SaaS enfocado en Pymes')", 
     height=150
 )
 
+# Un trabajo lanzado antes de recargar la página (o de perder la conexión) sigue en CIAN.
+pending = st.session_state.get("job") or ({"id": st.query_params["job"], "query": "(trabajo en curso)"}
+                                         if "job" in st.query_params else None)
+if pending:
+    st.info(f"Reanudando el trabajo {pending['id']}...")
+    run_job(pending["id"], pending["query"])
+
 if st.button("Generar Plan Estratégico", type="primary"):
     if query:
-        with st.spinner("Generando plan con el Agente IA... (puede tardar)"):
-            result = send_request(query)
-        
-        if result:
-            st.session_state.history.insert(0, {"query": query, "response": result})
-            st.toast("¡Plan generado con éxito!", icon="✅")
+        job_id = submit_job(query)
+        if job_id:
+            run_job(job_id, query)
     else:
         st.warning("Por favor, introduce una solicitud.")
 
 st.markdown("---")
 st.subheader("Historial de Planes Generados")
 
-if st.session_state.history:
-    for item in st.session_state.history:
-        
-        if isinstance(item['response'], dict) and 'title' in item['response']:
-            with st.expander(f"**Solicitud:** {item['query'][:80]}...", expanded=True): 
-                st.markdown(f"### 📄 {item['response']['title']}")
-                
-                st.info(f"**Resumen Ejecutivo:** {item['response']['summary']}")
-                
-                st.markdown("#### Pasos de Acción:")
-                for i, step in enumerate(item['response']['action_steps'], 1):
-                    st.markdown(f"{i}. {step}")
-        else:
-            with st.expander(f"**Solicitud (Error de Parseo):** {item['query'][:80]}...", expanded=False):
-                st.error("Error: MAGENTA no devolvió la estructura JSON correcta.")
-                st.json(item['response']) 
-                
-else:
-    st.info("Aún no se ha generado ningún plan estratégico.")
\ No newline at end of file
+render_history()
@@ -0,0 +1,86 @@
+# bench_batch.py
+#
+# Un plan por plantilla de plantillas_json/: N llamadas secuenciales a
+# /agent/run frente a un único /agent/run_batch con concurrencia acotada.
+# MAGENTA corre en proceso con un backend falso de latencia fija en el router.
+#
+# Uso:
+#   python -m benchmarks.bench_batch --latency 0.5 --concurrency 8
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+
+os.environ.setdefault("GEMINI_API_KEY", "bench-key")
+
+from benchmarks.fakes import FakeBackend
+from gwa_studio_llms import llm_processor
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.main_service import app as magenta_app
+from gwa_studio_llms.response_cache import ResponseCache
+
+PLANTILLAS_DIR = Path(__file__).resolve().parent.parent / "plantillas_json"
+AUTH = {"Authorization": "Bearer gwa_token_magenta"}
+
+
+def install_fake_backend(latency: float) -> None:
+    backend = FakeBackend(['{"title": "Plan", "summary": "...", "action_steps": []}'], latency_s=latency)
+    service = llm_processor.agent_service
+    service.router = LLMRouter({"gemini": [backend]}, health_interval=0)
+    service.prompt_manager = SimpleNamespace(render_prompt=lambda name, ctx: json.dumps(ctx))
+    service.cache = ResponseCache(db_path="")
+
+
+def build_items():
+    return [
+        {"model_name": "gemini-2.5-flash", "template_name": "GWA_STRATEGIC_PLAN",
+         "context": {"plantilla": path.stem}, "user_prompt": "Plan de lanzamiento", "cache_mode": "bypass"}
+        for path in sorted(PLANTILLAS_DIR.glob("*.json"))
+    ]
+
+
+async def sequential(client: httpx.AsyncClient, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        (await client.post("/agent/run", json=item)).raise_for_status()
+    return time.perf_counter() - start
+
+
+async def batched(client: httpx.AsyncClient, items, concurrency: int) -> float:
+    start = time.perf_counter()
+    response = await client.post("/agent/run_batch", json={"items": items, "concurrency": concurrency})
+    response.raise_for_status()
+    done = json.loads(response.text.splitlines()[-1])
+    assert done["counts"].get("ok") == len(items), done
+    return time.perf_counter() - start
+
+
+async def run(latency: float, concurrency: int) -> None:
+    install_fake_backend(latency)
+    items = build_items()
+    transport = httpx.ASGITransport(app=magenta_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://magenta", headers=AUTH, timeout=None) as client:
+        seq = await sequential(client, items)
+        batch = await batched(client, items, concurrency)
+
+    print(f"{len(items)} plantillas | latencia por plan {latency:.2f}s | concurrencia {concurrency}")
+    print(f"  secuencial : {seq:7.2f}s")
+    print(f"  run_batch  : {batch:7.2f}s  (ideal ~{len(items) / concurrency * latency:.2f}s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de ejecución por lotes.")
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(run(args.latency, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
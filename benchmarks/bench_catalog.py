@@ -0,0 +1,84 @@
+# bench_catalog.py
+#
+# Catálogo de plantillas con miles de entradas sintéticas (copias de
+# plantillas_json/ con nombres y palabras distintas): tiempo de carga inicial,
+# de un refresh sin cambios y con un fichero modificado, y latencia de get,
+# list filtrado y search por prefijo (repetidas, desde la caché de consultas, y en frío).
+#
+# Uso:
+#   python -m benchmarks.bench_catalog --entries 5000
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from plantillas_catalog import PLANTILLAS_DIR, PlantillasCatalog
+
+
+def per_op_us(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return 1e6 * (time.perf_counter() - start) / n
+
+
+def build_library(directory: Path, entries: int) -> None:
+    sources = []
+    for path in sorted(Path(PLANTILLAS_DIR).glob("*.json")):
+        try:
+            sources.append(json.loads(path.read_text(encoding="utf-8")))
+        except ValueError:
+            continue
+    for i in range(entries):
+        data = dict(sources[i % len(sources)])
+        data["nombre"] = f"{data.get('nombre', 'Plantilla')} {i} variante{i % 97}"
+        (directory / f"plantilla_{i:05d}.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark del catálogo de plantillas en memoria.")
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        build_library(directory, args.entries)
+        catalog = PlantillasCatalog(tmp)
+
+        start = time.perf_counter()
+        catalog.refresh()
+        print(f"{len(catalog.entries)} plantillas | {len(catalog.by_keyword)} palabras indexadas")
+        print(f"  carga inicial          : {1000 * (time.perf_counter() - start):8.1f} ms")
+        start = time.perf_counter()
+        catalog.refresh()
+        print(f"  refresh sin cambios    : {1000 * (time.perf_counter() - start):8.1f} ms (sólo stat)")
+        changed = directory / "plantilla_00042.json"
+        changed.write_text(json.dumps({"nombre": "Cambiada", "categoria": "Demo"}), encoding="utf-8")
+        os.utime(changed, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+        start = time.perf_counter()
+        changes = catalog.refresh()
+        print(f"  refresh con 1 cambio   : {1000 * (time.perf_counter() - start):8.1f} ms ({changes['updated']})")
+
+        print(f"  get                    : {per_op_us(lambda: catalog.get('plantilla_01234'), args.ops):8.2f} µs")
+        print(f"  list categoría (20)    : {per_op_us(lambda: catalog.list(categoria='tecnologia'), args.ops):8.2f} µs")
+        print(f"  search 'restau'        : {per_op_us(lambda: catalog.search('restau'), args.ops // 10):8.2f} µs")
+        print(f"  search 'variante7 hero': {per_op_us(lambda: catalog.search('variante7 hero'), args.ops // 10):8.2f} µs")
+
+        def cold(fn):
+            def run():
+                catalog._queries.clear()
+                fn()
+            return run
+
+        print("  sin caché de consultas:")
+        print(f"    list categoría (20)  : {per_op_us(cold(lambda: catalog.list(categoria='tecnologia')), args.ops // 10):8.2f} µs")
+        print(f"    search 'restau'      : {per_op_us(cold(lambda: catalog.search('restau')), args.ops // 10):8.2f} µs")
+        print(f"    search 'variante7 hero': {per_op_us(cold(lambda: catalog.search('variante7 hero')), args.ops // 10):6.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# bench_context_budget.py
+#
+# num_ctx por petición frente al 4096 fijo, contra un Ollama falso que recarga el
+# modelo cuando cambia num_ctx (--load-s) y cuenta los prompts que no caben. Mezcla
+# de contextos: la mayoría cortos, algunos medianos y unos pocos enormes (campo
+# 'ubicacion' con miles de caracteres). Modos:
+#   fijo-4096      : como antes, num_ctx 4096 siempre y el contexto tal cual
+#   presupuesto    : ContextBudgeter (tamaño mínimo que cabe, recorte del contexto)
+#   sin-histéresis : igual, pero bajando de tamaño en cuanto se puede (GWA_CTX_SHRINK_AFTER=0)
+# Se informa la memoria KV media reservada (llama3:8b en fp16, ~128 KiB por token de
+# contexto), los prompts truncados, las recargas del modelo y la latencia media.
+#
+# Uso:
+#   python -m benchmarks.bench_context_budget --requests 200 --load-s 0.05
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from benchmarks.fakes import ServerThread, build_fake_ollama
+from gwa_studio_llms.backends import OllamaBackend
+from gwa_studio_llms.context_budget import ContextBudgeter
+from gwa_studio_llms.llm_processor import AgentExecutionRequest, AgentService
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.prompt_manager import PromptManager
+from gwa_studio_llms.response_cache import ResponseCache
+
+MODEL = "llama3:8b"
+KV_KIB_PER_TOKEN = 128  # 2 (K y V) x 32 capas x 8 cabezas KV x 128 dims x 2 bytes
+
+
+def requests(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    for i in range(n):
+        draw = rng.random()
+        repeat = 3000 if draw < 0.03 else 300 if draw < 0.10 else 1
+        yield AgentExecutionRequest(
+            model_name=MODEL, template_name="template_empresa_melanoma", user_prompt=f"Plan {i}", cache_mode="bypass",
+            context={"ubicacion": "Córdoba, Argentina. " * repeat, "sector": "salud digital",
+                     "nombre_empresa": f"Empresa {i}"})
+
+
+async def run_mode(mode: str, url: str, items, manager: PromptManager):
+    router = LLMRouter({"ollama": [OllamaBackend(url)]}, health_interval=0)
+    budgeter = ContextBudgeter(shrink_after=0 if mode == "sin-histéresis" else 20)
+    agent = AgentService(manager, cache=ResponseCache(db_path=""), router=router, budgeter=budgeter)
+    latencies = []
+    try:
+        for request in items:
+            started = time.perf_counter()
+            if mode == "fijo-4096":
+                context = {**request.context, "user_prompt_trivial": request.user_prompt}
+                parts = manager.render_parts(request.template_name, context)
+                await router.generate(MODEL, parts.messages(), options={"num_ctx": 4096}, response_format="json")
+            else:
+                await agent.run_agent(request)
+            latencies.append(time.perf_counter() - started)
+    finally:
+        await router.aclose()
+    return latencies, budgeter.stats()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="num_ctx adaptativo frente a num_ctx fijo.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--load-s", type=float, default=0.05, help="Recarga del modelo al cambiar num_ctx.")
+    args = parser.parse_args()
+
+    items = list(requests(args.requests))
+    manager = PromptManager()
+    print(f"{args.requests} peticiones (90% cortas, 7% medianas, 3% enormes), recarga {args.load_s * 1000:.0f} ms")
+    for mode in ("fijo-4096", "presupuesto", "sin-histéresis"):
+        app = build_fake_ollama(latency_s=0.0, tokens=1, load_s=args.load_s)
+        with ServerThread(app) as server:
+            latencies, stats = asyncio.run(run_mode(mode, server.base_url, items, manager))
+        kv_mib = statistics.mean(app.state.num_ctx) * KV_KIB_PER_TOKEN / 1024
+        trims = "" if mode == "fijo-4096" else f" | recortes {stats['trims']}"
+        print(f"  {mode:<14} | KV media {kv_mib:6.0f} MiB | truncados {app.state.truncated:3d} | "
+              f"recargas {app.state.loads - 1:3d} | latencia media {1000 * statistics.mean(latencies):6.1f} ms{trims}")
+
+
+if __name__ == "__main__":
+    main()
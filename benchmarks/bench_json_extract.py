@@ -0,0 +1,86 @@
+# bench_json_extract.py
+#
+# Micro-benchmark de extracción de JSON de la salida del LLM:
+#   - regex   : re.search(r'\{.*\}', DOTALL) + limpieza de ``` (LLMAgentExecutor original)
+#   - find    : find('{') / rfind('}') (agent/llm_processor original)
+#   - extractor: IncrementalJSONExtractor (una pasada, con corte temprano)
+#
+# Uso:
+#   python -m benchmarks.bench_json_extract --repeat 50
+
+import argparse
+import json
+import re
+import timeit
+
+from gwa_studio_llms.json_extractor import IncrementalJSONExtractor, extract_json
+
+
+def parse_regex(text: str):
+    match = re.search(r'\{.*\}', text.strip(), re.DOTALL)
+    candidate = match.group(0).strip() if match else text
+    if candidate.startswith('```json'):
+        candidate = candidate[7:].strip()
+    if candidate.endswith('```'):
+        candidate = candidate[:-3].strip()
+    return json.loads(candidate)
+
+
+def parse_find(text: str):
+    start, end = text.find('{'), text.rfind('}') + 1
+    return json.loads(text[start:end])
+
+
+def build_cases():
+    plan = {
+        "title": "Plan de marketing",
+        "summary": "Resumen con llaves {literales} y comillas \"escapadas\".",
+        "action_steps": [f"Paso {i}: acción concreta número {i}" for i in range(2000)],
+    }
+    body = json.dumps(plan, ensure_ascii=False)
+    chatter = "Espero que te sirva. Si necesitas {más} detalles, avísame. " * 200
+    return {
+        "limpio (~90KB)": body,
+        "con fences": f"```json\n{body}\n```",
+        "ruido posterior con llaves": f"Claro, aquí está:\n{body}\n{chatter}",
+    }
+
+
+def safe(fn, text):
+    try:
+        fn(text)
+        return "ok"
+    except Exception as e:
+        return f"FALLA ({type(e).__name__})"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de extracción de JSON.")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--chunk", type=int, default=8, help="Tamaño de fragmento simulado del stream.")
+    args = parser.parse_args()
+
+    for name, text in build_cases().items():
+        print(f"\n== {name} ({len(text)} chars)")
+        for label, fn in (("regex", parse_regex), ("find/rfind", parse_find), ("extractor", extract_json)):
+            status = safe(fn, text)
+            ms = timeit.timeit(lambda: safe(fn, text), number=args.repeat) / args.repeat * 1000
+            print(f"  {label:<11} {ms:8.3f} ms  {status}")
+
+        chunks = [text[i:i + args.chunk] for i in range(0, len(text), args.chunk)]
+
+        def streamed():
+            extractor = IncrementalJSONExtractor()
+            for consumed, chunk in enumerate(chunks, 1):
+                if extractor.feed(chunk) is not None:
+                    return consumed
+            return len(chunks)
+
+        consumed = streamed()
+        ms = timeit.timeit(streamed, number=args.repeat) / args.repeat * 1000
+        print(f"  {'stream':<11} {ms:8.3f} ms  fragmentos leídos {consumed}/{len(chunks)} "
+              f"({100 * (len(chunks) - consumed) / len(chunks):.0f}% de generación evitada)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# bench_metrics_overhead.py
+#
+# Coste de la instrumentación de /metrics:
+#   - ns por operación (Counter.inc, Histogram.observe, Gauge.track)
+#   - µs por ejecución de AgentService.run_agent con métricas activadas y
+#     desactivadas (backend falso sin latencia, caché desactivada)
+#   - tiempo de render del texto Prometheus con las series generadas
+#
+# Uso:
+#   python -m benchmarks.bench_metrics_overhead --requests 5000
+
+import argparse
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("GEMINI_API_KEY", "bench-key")
+
+from benchmarks.fakes import FakeBackend
+from gwa_studio_core.metrics import MetricsRegistry
+from gwa_studio_llms import metrics
+from gwa_studio_llms.llm_processor import AgentExecutionRequest, AgentService
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.response_cache import ResponseCache
+
+
+def per_op_ns(fn, n: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter_ns() - start) / n
+
+
+def primitives(n: int) -> None:
+    registry = MetricsRegistry(enabled=True)
+    counter = registry.counter("c_total", "c", ("model", "template", "status"))
+    histogram = registry.histogram("h_seconds", "h", ("stage", "model", "template"))
+    gauge = registry.gauge("g", "g", ("model",))
+
+    def track():
+        with gauge.track(model="llama3:8b"):
+            pass
+
+    print(f"  Counter.inc       : {per_op_ns(lambda: counter.inc(model='llama3:8b', template='plan', status='ok'), n):7.0f} ns")
+    print(f"  Histogram.observe : {per_op_ns(lambda: histogram.observe(0.42, stage='parse', model='llama3:8b', template='plan'), n):7.0f} ns")
+    print(f"  Gauge.track       : {per_op_ns(track, n):7.0f} ns")
+
+
+async def run_agent_us(service: AgentService, requests: int) -> float:
+    request = AgentExecutionRequest(model_name="llama3:8b", template_name="plan", context={},
+                                    user_prompt="plan", cache_mode="bypass")
+    for _ in range(200):  # calentamiento
+        await service.run_agent(request)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await service.run_agent(request)
+    return 1e6 * (time.perf_counter() - start) / requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Coste por petición de las métricas de MAGENTA.")
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"Primitivas ({args.requests * 20} operaciones):")
+    primitives(args.requests * 20)
+
+    router = LLMRouter({"ollama": [FakeBackend(['{"title": ', '"Plan"}'])]}, health_interval=0)
+    service = AgentService(SimpleNamespace(render_prompt=lambda name, ctx: "prompt"),
+                           cache=ResponseCache(db_path=""), router=router)
+    results = {}
+    for label, enabled in (("sin métricas", False), ("con métricas", True), ("sin métricas", False)):
+        metrics.metrics.enabled = enabled
+        results.setdefault(label, []).append(asyncio.run(run_agent_us(service, args.requests)))
+    off, on = min(results["sin métricas"]), results["con métricas"][0]
+    print(f"run_agent ({args.requests} ejecuciones, backend falso sin latencia):")
+    print(f"  sin métricas : {off:7.1f} µs/petición")
+    print(f"  con métricas : {on:7.1f} µs/petición  (+{on - off:.1f} µs, {100 * (on - off) / off:+.1f}%)")
+
+    start = time.perf_counter()
+    text = metrics.metrics.render()
+    print(f"render /metrics: {1000 * (time.perf_counter() - start):.2f} ms ({len(text.splitlines())} líneas)")
+
+
+if __name__ == "__main__":
+    main()
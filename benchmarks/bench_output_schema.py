@@ -0,0 +1,154 @@
+# bench_output_schema.py
+#
+# Fallos de parseo/esquema y tokens gastados en reintentos, antes y después del esquema
+# de salida por plantilla, con un modelo falso en proceso:
+#   antes   : format=json sin esquema; el cliente valida el plan y, si no sirve,
+#             lo regenera entero (hasta --retries veces)
+#   después : el esquema viaja como decodificación restringida y MAGENTA repara sólo
+#             las claves inválidas (GWA_REPAIR_ATTEMPTS)
+#
+# Supuestos del modelo falso (un fragmento = un token):
+#   - sin esquema, una fracción --invalid-rate de las respuestas tiene una clave mal
+#     formada (action_steps vacío o como texto) y otra --truncated-rate queda cortada
+#   - con esquema la decodificación restringida evita las claves mal formadas; las
+#     respuestas cortadas (num_predict agotado) siguen ocurriendo
+#
+# Uso:
+#   python -m benchmarks.bench_output_schema --requests 500 --invalid-rate 0.15 --truncated-rate 0.03
+
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+from pathlib import Path
+
+from gwa_studio_llms.backends import LLMBackend
+from gwa_studio_llms.llm_processor import AgentExecutionRequest, AgentService
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.output_schema import compile_schema
+from gwa_studio_llms.prompt_manager import PromptManager
+from gwa_studio_llms.response_cache import ResponseCache
+from gwa_studio_llms.template_registry import TemplateRegistry
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "summary": {"type": "string", "minLength": 1},
+        "action_steps": {"type": "array", "minItems": 1, "items": {"type": "string", "minLength": 1}},
+    },
+    "required": ["title", "summary", "action_steps"],
+}
+PLAN = {
+    "title": "Plan de lanzamiento",
+    "summary": "Resumen ejecutivo del plan de negocios para el primer año de operación. " * 4,
+    "action_steps": [f"Paso {i}: acción concreta con responsables, plazos e indicadores de seguimiento." for i in range(12)],
+}
+CHARS_PER_CHUNK = 4
+
+
+class SchemaAwareFakeModel(LLMBackend):
+    kind = "fake"
+
+    def __init__(self, invalid_rate: float, truncated_rate: float, seed: int = 0):
+        super().__init__("fake")
+        self.invalid_rate = invalid_rate
+        self.truncated_rate = truncated_rate
+        self._random = random.Random(seed)
+        self.tokens = 0
+
+    def _answer(self, messages, response_format) -> str:
+        constrained = isinstance(response_format, dict)
+        if messages[-1]["role"] == "user" and len(messages) > 2 and messages[-2]["role"] == "assistant":
+            # Reparación: sólo las claves pedidas (o el plan entero).
+            return json.dumps({k: PLAN[k] for k in response_format["properties"]}, ensure_ascii=False)
+        text = json.dumps(PLAN, ensure_ascii=False)
+        roll = self._random.random()
+        if roll < self.truncated_rate:
+            return text[: len(text) * 2 // 3]
+        if not constrained and roll < self.truncated_rate + self.invalid_rate:
+            broken = dict(PLAN, action_steps=self._random.choice([[], " ".join(PLAN["action_steps"])]))
+            return json.dumps(broken, ensure_ascii=False)
+        return text
+
+    async def stream(self, model, messages, options=None, response_format=None, usage=None):
+        text = self._answer(messages, response_format)
+        for i in range(0, len(text), CHARS_PER_CHUNK):
+            self.tokens += 1
+            yield text[i:i + CHARS_PER_CHUNK]
+
+
+def _agent(template_dir: Path, model: SchemaAwareFakeModel) -> AgentService:
+    registry = TemplateRegistry(base_dir=template_dir, poll_interval=0)
+    return AgentService(PromptManager(registry=registry), cache=ResponseCache(db_path=""),
+                        router=LLMRouter({"ollama": [model]}, health_interval=0))
+
+
+async def run_before(args, template_dir: Path):
+    """Sin esquema: el cliente valida y regenera el plan completo."""
+    validator = compile_schema(SCHEMA)
+    model = SchemaAwareFakeModel(args.invalid_rate, args.truncated_rate, args.seed)
+    agent = _agent(template_dir, model)
+    first_fail = final_fail = calls = retry_tokens = 0
+    for i in range(args.requests):
+        for attempt in range(args.retries + 1):
+            before = model.tokens
+            output = await agent.run_agent(AgentExecutionRequest(
+                model_name="llama3:8b", template_name="libre", context={"empresa": f"E{i}"}, user_prompt="plan",
+                cache_mode="bypass"))
+            calls += 1
+            ok = output.status == "ok" and not validator.validate(output.result_json)
+            if attempt:
+                retry_tokens += model.tokens - before
+            if ok:
+                break
+            first_fail += attempt == 0
+        else:
+            final_fail += 1
+    return first_fail, final_fail, calls, model.tokens, retry_tokens
+
+
+async def run_after(args, template_dir: Path):
+    """Con esquema: decodificación restringida y reparación de las claves inválidas."""
+    model = SchemaAwareFakeModel(args.invalid_rate, args.truncated_rate, args.seed)
+    agent = _agent(template_dir, model)
+    first_fail = final_fail = calls = retry_tokens = 0
+    for i in range(args.requests):
+        output = await agent.run_agent(AgentExecutionRequest(
+            model_name="llama3:8b", template_name="con_esquema", context={"empresa": f"E{i}"}, user_prompt="plan",
+            cache_mode="bypass"))
+        calls += 1 + len(output.validation["repairs"])
+        retry_tokens += sum(r["tokens"] for r in output.validation["repairs"])
+        first_fail += output.validation["first_pass"] != "valid"
+        final_fail += output.status != "ok"
+    return first_fail, final_fail, calls, model.tokens, retry_tokens
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fallos de parseo/esquema y tokens de reintento, antes y después.")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--invalid-rate", type=float, default=0.15)
+    parser.add_argument("--truncated-rate", type=float, default=0.03)
+    parser.add_argument("--retries", type=int, default=2, help="Regeneraciones completas del cliente en 'antes'.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template_dir = Path(tmp)
+        prompt = {"system": "Eres un estratega. Devuelve el plan en JSON.", "prompt": "Plan para $empresa."}
+        (template_dir / "libre.json").write_text(json.dumps(prompt), encoding="utf-8")
+        (template_dir / "con_esquema.json").write_text(json.dumps({**prompt, "output_schema": SCHEMA}),
+                                                       encoding="utf-8")
+        print(f"{args.requests} peticiones | {len(json.dumps(PLAN)) // CHARS_PER_CHUNK} tokens por plan | "
+              f"inválidas {args.invalid_rate:.0%} | cortadas {args.truncated_rate:.0%}")
+        for label, run in (("antes", run_before), ("después", run_after)):
+            first_fail, final_fail, calls, tokens, retry_tokens = asyncio.run(run(args, template_dir))
+            n = args.requests
+            print(f"  {label:<8} | fallo 1ª pasada {first_fail / n:6.1%} | fallo final {final_fail / n:6.1%} | "
+                  f"llamadas/petición {calls / n:4.2f} | tokens/petición {tokens / n:6.1f} | "
+                  f"tokens en reintentos/petición {retry_tokens / n:6.1f}")
+
+
+if __name__ == "__main__":
+    main()
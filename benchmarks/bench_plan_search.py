@@ -0,0 +1,96 @@
+# bench_plan_search.py
+#
+# Latencia de búsqueda en el almacén de planes de CIAN (SQLite + FTS5) con muchos planes:
+#   carga   : --plans planes sintéticos (título, resumen y pasos con vocabulario de
+#             marketing) insertados en lotes de --batch por transacción; el filtro de
+#             fecha pide el último 5 % cargado
+#   consulta: términos raros y frecuentes, prefijo, filtros por plantilla/modelo/fecha,
+#             orden por relevancia y por recientes, y el listado con cursor
+#
+# Uso:
+#   python -m benchmarks.bench_plan_search --plans 200000 --queries 200
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from gwa_studio_core.core_api.plans import PlanStore
+
+SECTORS = ["cafetería", "academia", "clínica", "gimnasio", "panadería", "inmobiliaria", "librería", "hotel",
+           "veterinaria", "taller", "floristería", "consultora", "restaurante", "óptica", "farmacia", "estudio"]
+CHANNELS = ["Instagram", "TikTok", "LinkedIn", "newsletter", "SEO", "YouTube", "podcast", "eventos", "radio"]
+ACTIONS = ["lanzar", "segmentar", "fidelizar", "medir", "optimizar", "posicionar", "automatizar", "captar"]
+TEMPLATES = ["plan", "template_empresa_melanoma", "landing_b", "ficha"]
+MODELS = ["llama3:8b", "gemini-2.5-flash", "mistral:7b"]
+
+
+def _plan(rng: random.Random, i: int) -> dict:
+    sector = rng.choice(SECTORS)
+    steps = [f"{rng.choice(ACTIONS).capitalize()} en {rng.choice(CHANNELS)} para {sector} semana {rng.randint(1, 52)}"
+             for _ in range(rng.randint(4, 10))]
+    return {
+        "source": "agent", "template": rng.choice(TEMPLATES), "model": rng.choice(MODELS),
+        "user_prompt": f"Plan de marketing para una {sector} número {i}",
+        "result": {"title": f"Plan {sector} {i}", "summary": f"Estrategia de {rng.choice(CHANNELS)} para {sector}",
+                   "action_steps": steps},
+    }
+
+
+def _measure(label: str, calls, repeat: int) -> None:
+    times = []
+    for i in range(repeat):
+        call = calls[i % len(calls)]
+        start = time.perf_counter()
+        call()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    print(f"  {label:<34} p50 {statistics.median(times):7.2f} ms | p95 {times[int(len(times) * 0.95) - 1]:7.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latencia de búsqueda en el almacén de planes.")
+    parser.add_argument("--plans", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=5_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    recent_from = args.plans * 95 // 100
+    with tempfile.TemporaryDirectory() as tmp:
+        store = PlanStore(str(Path(tmp) / "plans.db"))
+        start = time.perf_counter()
+        since = None
+        for offset in range(0, args.plans, args.batch):
+            if since is None and offset >= recent_from:
+                since = time.time()
+            store.add_many(_plan(rng, i) for i in range(offset, min(args.plans, offset + args.batch)))
+        elapsed = time.perf_counter() - start
+        size_mb = sum(p.stat().st_size for p in Path(tmp).iterdir()) / 1e6
+        print(f"{store.count()} planes cargados en {elapsed:.1f} s ({store.count() / elapsed:,.0f}/s) | {size_mb:.0f} MB")
+
+        rare = [lambda i=i: store.search(str(i)) for i in rng.sample(range(args.plans // 2, args.plans), 50)]
+        common = [lambda s=s: store.search(s) for s in SECTORS]
+        _measure("término raro (relevancia)", rare, args.queries)
+        _measure("término frecuente (relevancia)", common, args.queries)
+        _measure("término frecuente (recientes)", [lambda s=s: store.search(s, sort="recent") for s in SECTORS],
+                 args.queries)
+        _measure("prefijo de 3 letras", [lambda s=s: store.search(s[:3], sort="recent") for s in SECTORS],
+                 args.queries)
+        _measure("dos términos + plantilla + modelo",
+                 [lambda s=s, c=c: store.search(f"{s} {c}", template="plan", model="llama3:8b")
+                  for s in SECTORS for c in CHANNELS], args.queries)
+        _measure("frecuente, sólo el 5 % reciente", [lambda s=s: store.search(s, since=since) for s in SECTORS],
+                 args.queries)
+        _measure("listado por plantilla (página 1)", [lambda t=t: store.list(template=t) for t in TEMPLATES],
+                 args.queries)
+        _measure("búsqueda, página 50 (offset)", [lambda s=s: store.search(s, sort="recent", offset=1000)
+                                                 for s in SECTORS], args.queries)
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# bench_prefix_reuse.py
+#
+# Reutilización del prefijo estático de las plantillas contra Ollama falsos que
+# simulan la caché de prompt de llama.cpp (un slot por nodo, evaluación del prompt
+# a --prompt-tps tokens/s). Se alternan las dos plantillas reales
+# (template_empresa_melanoma .json y .jinja) con contextos distintos en tres modos:
+#   antes      : un único mensaje con el contexto delante de las instrucciones
+#   split      : prefijo estático como mensaje system + sufijo dinámico, sin afinidad
+#   split+afin : además, el router devuelve cada prefijo al nodo que ya lo tiene
+# y se informa el tiempo medio de evaluación del prompt, los tokens evaluados y el
+# ahorro frente a 'antes'.
+#
+# Uso:
+#   python -m benchmarks.bench_prefix_reuse --requests 60 --prompt-tps 400
+
+import argparse
+import asyncio
+import contextlib
+import statistics
+
+from benchmarks.fakes import ServerThread, build_fake_ollama
+from gwa_studio_llms.backends import OllamaBackend
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.prompt_manager import PromptManager
+from gwa_studio_llms.template_registry import PromptParts, TemplateRegistry
+
+CITIES = ["Córdoba", "Rosario", "Mendoza", "Salta", "La Plata", "Neuquén"]
+SECTORS = ["salud digital", "dermatología", "telemedicina"]
+
+
+def prompts(registry: TemplateRegistry, n: int):
+    manager = PromptManager(registry=registry)
+    for i in range(n):
+        context = {"ubicacion": CITIES[i % len(CITIES)], "sector": SECTORS[i % len(SECTORS)],
+                   "nombre_empresa": f"Empresa {i}", "nombre_ciudad": CITIES[i % len(CITIES)],
+                   "user_prompt_trivial": f"Plan {i}"}
+        if i % 2:
+            yield registry.render_jinja_parts("template_empresa_melanoma", context=context, user_prompt=f"Plan {i}")
+        else:
+            yield manager.render_parts("template_empresa_melanoma", context)
+
+
+async def run_mode(mode: str, urls, parts, concurrency: int):
+    router = LLMRouter({"ollama": [OllamaBackend(url) for url in urls]}, health_interval=0)
+    semaphore = asyncio.Semaphore(concurrency)
+    usages = []
+
+    async def one(p: PromptParts):
+        if mode == "antes":
+            messages, key = [{"role": "user", "content": f"{p.suffix}\n\n{p.prefix}"}], None
+        else:
+            messages, key = p.messages(), (p.prefix_key if mode == "split+afin" else None)
+        usage = {}
+        async with semaphore:
+            await router.generate("llama3:8b", messages, usage=usage, prefix_key=key)
+        usages.append(usage)
+
+    await asyncio.gather(*(one(p) for p in parts))
+    await router.aclose()
+    return usages, router.stats()["prefix_affinity"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ahorro de evaluación de prompt por reutilización de prefijo.")
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--nodes", type=int, default=2)
+    parser.add_argument("--prompt-tps", type=float, default=400.0, help="Tokens de prompt evaluados por segundo.")
+    parser.add_argument("--concurrency", type=int, default=2)
+    args = parser.parse_args()
+
+    registry = TemplateRegistry(poll_interval=0)
+    parts = list(prompts(registry, args.requests))
+    print(f"{args.requests} peticiones, 2 plantillas alternadas, {args.nodes} nodos con 1 slot, "
+          f"prompt a {args.prompt_tps:.0f} tok/s, concurrencia {args.concurrency}")
+    baseline = None
+    for mode in ("antes", "split", "split+afin"):
+        with contextlib.ExitStack() as stack:
+            urls = [stack.enter_context(ServerThread(build_fake_ollama(latency_s=0.0, tokens=1, slots=1,
+                                                                        prompt_tps=args.prompt_tps))).base_url
+                    for _ in range(args.nodes)]
+            usages, affinity = asyncio.run(run_mode(mode, urls, parts, args.concurrency))
+        eval_ms = statistics.mean(u["prompt_eval_ms"] for u in usages)
+        tokens = statistics.mean(u["prompt_tokens"] for u in usages)
+        baseline = baseline or eval_ms
+        hits = f"{affinity['hit_rate']:.0%}" if affinity["requests"] else "n/a"
+        print(f"  {mode:<11} | eval. prompt {eval_ms:7.1f} ms | {tokens:6.1f} tokens evaluados | "
+              f"afinidad {hits:>4} | ahorro {100 * (1 - eval_ms / baseline):5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
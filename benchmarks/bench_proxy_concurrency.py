@@ -0,0 +1,83 @@
+# bench_proxy_concurrency.py
+#
+# Compara el proxy CIAN síncrono original (requests.post + threadpool) con el
+# proxy asíncrono con pool keep-alive, contra un MAGENTA falso lento.
+#
+# Uso:
+#   python -m benchmarks.bench_proxy_concurrency --concurrency 300 --latency 1.0
+
+import argparse
+import asyncio
+import time
+
+import httpx
+import requests
+from fastapi import FastAPI, HTTPException
+
+from benchmarks.fakes import ServerThread, build_fake_magenta
+from gwa_studio_core.core_api import llm_proxy
+from gwa_studio_core.core_api.main import app as cian_app
+
+PAYLOAD = {"template_name": "GWA_STRATEGIC_PLAN", "context": {}, "user_prompt": "bench"}
+
+
+def build_legacy_cian(magenta_url: str) -> FastAPI:
+    """Réplica del endpoint síncrono previo: un worker del threadpool por llamada."""
+    app = FastAPI()
+
+    @app.post("/api/v1/run")
+    def run(payload: dict):
+        payload = {"model_name": "gemini-2.5-flash", **payload}
+        response = requests.post(
+            f"{magenta_url}/agent/run", json=payload,
+            headers=llm_proxy.INTERNAL_HEADERS, timeout=600.0,
+        )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code)
+        return response.json()
+
+    return app
+
+
+async def drive(app: FastAPI, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://cian", timeout=None) as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            *(client.post("/api/v1/run", json=PAYLOAD) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+    failed = sum(1 for r in responses if r.status_code != 200)
+    if failed:
+        raise RuntimeError(f"{failed} peticiones fallaron")
+    return elapsed
+
+
+async def run_async_proxy(magenta_url: str, concurrency: int) -> float:
+    llm_proxy.MAGENTA_BASE_URL = magenta_url
+    await llm_proxy.open_magenta_client()
+    try:
+        return await drive(cian_app, concurrency)
+    finally:
+        await llm_proxy.close_magenta_client()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de concurrencia del proxy CIAN.")
+    parser.add_argument("--concurrency", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=1.0, help="Latencia simulada de MAGENTA (s).")
+    args = parser.parse_args()
+
+    with ServerThread(build_fake_magenta(args.latency)) as magenta:
+        legacy = asyncio.run(drive(build_legacy_cian(magenta.base_url), args.concurrency))
+        pooled = asyncio.run(run_async_proxy(magenta.base_url, args.concurrency))
+
+    ideal = args.latency
+    print(f"Peticiones concurrentes: {args.concurrency} | latencia MAGENTA: {args.latency:.2f}s")
+    print(f"  sync + requests (threadpool): {legacy:7.2f}s  ({args.concurrency / legacy:7.1f} req/s)")
+    print(f"  async + pool keep-alive     : {pooled:7.2f}s  ({args.concurrency / pooled:7.1f} req/s)")
+    print(f"  mejora: x{legacy / pooled:.1f} (ideal ~{ideal:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# bench_response_encoding.py
+#
+# Bytes en la red y CPU de serialización por petición, antes y después de dar forma a
+# las respuestas de /api/v1/run:
+#   antes   : MAGENTA y CIAN responden con FastAPI por defecto (response_model ->
+#             jsonable_encoder -> json.dumps), sin comprimir y con raw_text + result_json;
+#             CIAN parsea con response.json(); la landing de cian_mini_bridge igual
+#   después : EncodedJSONResponse (orjson si está instalado), `fields=result_json` en
+#             los dos saltos y gzip/br negociado con Accept-Encoding
+#
+# Salto MAGENTA -> CIAN y CIAN -> cliente por separado; la CPU es la de serializar,
+# parsear y comprimir (sin red ni ASGI), media de --iterations repeticiones.
+#
+# Uso:
+#   python -m benchmarks.bench_response_encoding --iterations 2000 --steps 12
+
+import argparse
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from gwa_studio_core import encoding
+from gwa_studio_core.core_api.llm_proxy import PLAN_FIELDS, AgentOutput as CianOutput
+from gwa_studio_llms.llm_processor import AgentOutput
+
+
+def _stdlib_response(value) -> bytes:
+    # Lo que hace starlette.responses.JSONResponse.render.
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _output(steps: int) -> AgentOutput:
+    plan = {
+        "title": "Plan de lanzamiento de una cafetería de especialidad en Córdoba",
+        "summary": "Resumen ejecutivo del plan de negocio para el primer año: posicionamiento, canales, "
+                   "presupuesto y métricas de seguimiento por trimestre. " * 3,
+        "action_steps": [f"Paso {i + 1}: acción concreta con responsable, plazo de {i + 2} semanas, presupuesto "
+                         f"estimado y un indicador de seguimiento para la revisión mensual." for i in range(steps)],
+    }
+    return AgentOutput(
+        status="ok", raw_text=json.dumps(plan, ensure_ascii=False, indent=2), result_json=plan,
+        model_used="llama3:8b", prompt_template="GWA_STRATEGIC_PLAN",
+        context_budget={"num_ctx": 4096, "num_predict": 1024, "prompt_tokens": 812, "trimmed": []},
+        validation={"first_pass": "valid", "repairs": []},
+    )
+
+
+def _cpu_us(fn, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def _landing():
+    from fastapi.testclient import TestClient
+
+    import cian_mini_bridge
+    with TestClient(cian_mini_bridge.app) as client:
+        return client.post("/api/v1/run", json={"template_type": "academia_idiomas", "mision": "Enseñar idiomas",
+                                                "inline_html": True}).json()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bytes en la red y CPU de serialización, antes y después.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--steps", type=int, default=12, help="Pasos de acción del plan generado.")
+    parser.add_argument("--accept-encoding", default="br, gzip")
+    args = parser.parse_args()
+
+    output = _output(args.steps)
+    client_fields = encoding.parse_fields("result_json", AgentOutput.model_fields)
+    upstream_fields = tuple(dict.fromkeys(client_fields + PLAN_FIELDS))
+    codec = encoding.negotiate_encoding(args.accept_encoding, encoding.ENCODINGS)
+
+    # --- antes ---
+    def magenta_before() -> bytes:
+        return _stdlib_response(jsonable_encoder(AgentOutput.model_validate(output.model_dump())))
+
+    magenta_body = magenta_before()
+
+    def cian_before() -> bytes:
+        parsed = json.loads(magenta_body)
+        return _stdlib_response(jsonable_encoder(CianOutput.model_validate(parsed)))
+
+    cian_body = cian_before()
+
+    # --- después ---
+    def magenta_after() -> bytes:
+        return encoding.EncodedJSONResponse(encoding.select_fields(output.model_dump(), upstream_fields),
+                                            accept_encoding=args.accept_encoding).body
+
+    magenta_wire = magenta_after()
+    magenta_plain = encoding.dumps(encoding.select_fields(output.model_dump(), upstream_fields))
+
+    def cian_after() -> bytes:
+        parsed = encoding.loads(magenta_plain)  # httpx ya entrega el cuerpo descomprimido
+        return encoding.EncodedJSONResponse(encoding.select_fields(parsed, client_fields),
+                                            accept_encoding=args.accept_encoding).body
+
+    cian_wire = cian_after()
+
+    landing = _landing()
+    landing_before = _stdlib_response(landing)
+    landing_after = encoding.EncodedJSONResponse(landing, accept_encoding=args.accept_encoding).body
+
+    print(f"serializador: {'orjson' if encoding.orjson is not None else 'json'} | compresión: {codec or 'ninguna'} "
+          f"(nivel gzip {encoding.GZIP_LEVEL}) | plan de {args.steps} pasos")
+    rows = [
+        ("MAGENTA -> CIAN", len(magenta_body), len(magenta_wire), _cpu_us(magenta_before, args.iterations),
+         _cpu_us(magenta_after, args.iterations)),
+        ("CIAN -> cliente", len(cian_body), len(cian_wire), _cpu_us(cian_before, args.iterations),
+         _cpu_us(cian_after, args.iterations)),
+        ("landing -> cliente", len(landing_before), len(landing_after),
+         _cpu_us(lambda: _stdlib_response(landing), args.iterations),
+         _cpu_us(lambda: encoding.EncodedJSONResponse(landing, accept_encoding=args.accept_encoding),
+                 args.iterations)),
+    ]
+    for label, bytes_before, bytes_after, cpu_before, cpu_after in rows:
+        print(f"  {label:<18} | bytes {bytes_before:6d} -> {bytes_after:6d} ({bytes_after / bytes_before:5.1%}) | "
+              f"CPU {cpu_before:7.1f} -> {cpu_after:7.1f} µs/petición")
+    total_before = sum(r[1] for r in rows[:2])
+    total_after = sum(r[2] for r in rows[:2])
+    print(f"  /run, dos saltos  | bytes {total_before:6d} -> {total_after:6d} ({total_after / total_before:5.1%}) | "
+          f"CPU {rows[0][3] + rows[1][3]:7.1f} -> {rows[0][4] + rows[1][4]:7.1f} µs/petición")
+
+
+if __name__ == "__main__":
+    main()
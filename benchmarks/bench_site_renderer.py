@@ -0,0 +1,101 @@
+# bench_site_renderer.py
+#
+# Render de landings de cian_mini_bridge: f-string completo por petición (como lo
+# hacía run_engine) frente al layout precompilado, con la caché por contenido vacía
+# (render + compresión) y con acierto. También compara el tamaño de la respuesta
+# de /api/v1/run con el HTML duplicado frente a enviarlo una vez, y el de la página
+# servida comprimida.
+#
+# Uso:
+#   python -m benchmarks.bench_site_renderer --ops 5000
+
+import argparse
+import json
+import time
+
+from plantillas_catalog import PLANTILLAS_DIR, PlantillasCatalog
+from site_renderer import DEFAULT_STYLE, SiteRenderer
+
+CONTENT = {"empresa": "English World Córdoba", "slogan": "Habla el mundo con confianza",
+           "mision": "Enseñar idiomas con clases conversacionales y certificaciones internacionales.",
+           "servicios": ["Inglés General", "Inglés para Negocios", "Preparación Exámenes (TOEFL, IELTS)",
+                         "Francés", "Portugués"]}
+
+
+def legacy_render(data, empresa, slogan, mision, servicios):
+    return f"""
+    <!DOCTYPE html>
+    <html lang="es">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <style>
+            :root {{ --accent: {data['c_accent']}; --bg: {data['c_bg']}; --text: {data['c_text']}; }}
+            body {{ background: var(--bg); color: var(--text); font-family: '{data['f_main']}', sans-serif; margin: 0; padding: 20px; }}
+            .hero {{ text-align: center; padding: 60px 20px; border: 2px solid var(--accent); border-radius: 30px; }}
+            h1 {{ font-size: {data['s_h']}rem; color: var(--accent); margin: 0; }}
+            .slogan {{ font-size: {data['s_s']}rem; color: {data['c_slogan']}; font-weight: bold; }}
+            .grid {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); gap: 20px; margin-top: 30px; }}
+            .card {{ background: rgba(255,255,255,0.05); padding: 20px; border-radius: 15px; border-left: 5px solid var(--accent); }}
+        </style>
+    </head>
+    <body>
+        <div class="hero">
+            <h1>{empresa}</h1>
+            <p class="slogan">{slogan}</p>
+        </div>
+        <div class="grid">
+            <div class="card"><h3>🎯 Misión</h3><p>{mision}</p></div>
+            <div class="card"><h3>🛠️ Servicios</h3><ul>{''.join([f"<li>{s}</li>" for s in servicios])}</ul></div>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def per_op_us(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return 1e6 * (time.perf_counter() - start) / n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark del render de landings.")
+    parser.add_argument("--ops", type=int, default=5000)
+    args = parser.parse_args()
+
+    catalog = PlantillasCatalog(PLANTILLAS_DIR)
+    catalog.refresh()
+    entry = catalog.get("academia_idiomas")
+    renderer = SiteRenderer(max_pages=args.ops)
+    style = dict(DEFAULT_STYLE)
+    counter = iter(range(10 ** 9))
+
+    def miss():
+        renderer.render(entry, style, {**CONTENT, "mision": f"Misión {next(counter)}"})
+
+    legacy = per_op_us(lambda: legacy_render(style, **CONTENT), args.ops)
+    cold = per_op_us(miss, args.ops)
+    page = renderer.render(entry, style, CONTENT)
+    warm = per_op_us(lambda: renderer.render(entry, style, CONTENT), args.ops)
+    print(f"render por petición ({args.ops} ops)")
+    print(f"  f-string (antes, sin comprimir) : {legacy:8.2f} µs")
+    print(f"  precompilado, caché fallida     : {cold:8.2f} µs (incluye gzip{'/brotli' if 'br' in page.bodies else ''})")
+    print(f"  precompilado, caché acertada    : {warm:8.2f} µs")
+
+    html = legacy_render(style, **CONTENT)
+    before = len(json.dumps({"result_json": {"visual_html": html, "data_json": {"web_html": html}}},
+                            ensure_ascii=False).encode("utf-8"))
+    after = len(json.dumps({"result_json": {"visual_html": page.html, "page_id": page.page_id,
+                                            "data_json": {"web_html": {"ref": "visual_html", "page_id": page.page_id}}}},
+                           ensure_ascii=False).encode("utf-8"))
+    print("tamaño")
+    print(f"  /api/v1/run con HTML duplicado  : {before:8d} B")
+    print(f"  /api/v1/run con HTML una vez    : {after:8d} B ({100 * after / before:.0f}%)")
+    for encoding, body in page.bodies.items():
+        print(f"  página {encoding or 'sin comprimir':<24} : {len(body):8d} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# bench_startup.py
+#
+# Presupuesto de arranque de CIAN y MAGENTA, cada medida en un proceso nuevo:
+#   import : importar el módulo de la app (lo que paga cada worker antes de abrir el puerto)
+#   live   : desde lanzar uvicorn hasta el primer 200 de GET /live
+#   ready  : hasta el primer 200 de GET /ready (warm-up terminado)
+# Se informa la mediana de --runs arranques y los módulos que más tardan en importarse.
+# Si la mediana supera GWA_IMPORT_BUDGET_S / GWA_LIVE_BUDGET_S / GWA_READY_BUDGET_S el
+# script termina con código 1, para usarlo como control en CI antes de publicar una imagen.
+#
+# Uso:
+#   python -m benchmarks.bench_startup --runs 5
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+APPS = {
+    "cian": ("gwa_studio_core.core_api.main", "app"),
+    "magenta": ("gwa_studio_llms.main_service", "app"),
+}
+BUDGETS_S = {
+    "import": float(os.environ.get("GWA_IMPORT_BUDGET_S", "1.5")),
+    "live": float(os.environ.get("GWA_LIVE_BUDGET_S", "2.5")),
+    "ready": float(os.environ.get("GWA_READY_BUDGET_S", "5")),
+}
+# Sin backends reales: Ollama inalcanzable y sin precarga, y una clave de Gemini ficticia.
+ENV = {**os.environ, "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "bench"), "GWA_PRELOAD_MODELS": "",
+       "GWA_OLLAMA_HOSTS": "http://127.0.0.1:9", "GWA_JOB_DB": ":memory:"}
+
+
+def import_seconds(module: str) -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], env=ENV, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, top: int = 5):
+    """Imports directos del módulo de la app con más tiempo acumulado según -X importtime."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=ENV,
+                         capture_output=True, text=True, check=True)
+    totals = {}
+    for line in out.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        # Un espacio = import de primer nivel, tres = importado directamente por éste.
+        if len(name) - len(name.lstrip()) == 3:
+            root = name.strip().split(".")[0]
+            totals[root] = totals.get(root, 0) + int(parts[1])
+    return sorted(totals.items(), key=lambda kv: -kv[1])[:top]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cold_start(module: str, attr: str, timeout_s: float = 60):
+    """Segundos hasta el primer 200 de /live y de /ready en un uvicorn recién lanzado."""
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", f"{module}:{attr}", "--port", str(port),
+                               "--log-level", "warning"], env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    live = ready = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1) as client:
+            while ready is None and time.perf_counter() - started < timeout_s:
+                try:
+                    if live is None and client.get("/live").status_code == 200:
+                        live = time.perf_counter() - started
+                    if live is not None and client.get("/ready").status_code == 200:
+                        ready = time.perf_counter() - started
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait(30)
+    if ready is None:
+        raise RuntimeError(f"{module} no estuvo listo en {timeout_s:.0f} s")
+    return live, ready
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tiempo de import y de arranque en frío de CIAN y MAGENTA.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--services", default="cian,magenta")
+    args = parser.parse_args()
+
+    over_budget = []
+    print("Presupuesto: " + ", ".join(f"{k} {v:.1f} s" for k, v in BUDGETS_S.items()))
+    for service in args.services.split(","):
+        module, attr = APPS[service]
+        imports = [import_seconds(module) for _ in range(args.runs)]
+        starts = [cold_start(module, attr) for _ in range(args.runs)]
+        medians = {
+            "import": statistics.median(imports),
+            "live": statistics.median(s[0] for s in starts),
+            "ready": statistics.median(s[1] for s in starts),
+        }
+        print(f"  {service:<8} | " + " | ".join(f"{k} {v * 1000:6.0f} ms" for k, v in medians.items()))
+        print("           más lentos: " + ", ".join(f"{name} {us / 1000:.0f} ms" for name, us in slowest_imports(module)))
+        over_budget += [f"{service}.{k}" for k, v in medians.items() if v > BUDGETS_S[k]]
+
+    if over_budget:
+        print(f"FUERA DE PRESUPUESTO: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# bench_tail_latency.py
+#
+# Latencia p50/p95/p99 del router con backends falsos que se atascan de vez en
+# cuando (primer token con `--stall` segundos extra en un `--stall-rate` de las
+# llamadas). Compara:
+#   - baseline : sin hedging
+#   - hedging  : segundo intento en otro nodo tras ~p95 del primer token
+#   - sin CB / breaker : un nodo siempre atascado junto a dos sanos; con el
+#                        circuit breaker el nodo atascado sale del pool
+#
+# Uso:
+#   python -m benchmarks.bench_tail_latency --requests 1000 --concurrency 16
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from benchmarks.fakes import FakeBackend
+from gwa_studio_llms.circuit_breaker import CircuitBreaker
+from gwa_studio_llms.llm_router import LLMRouter
+
+MESSAGES = [{"role": "user", "content": "plan"}]
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def measure(router: LLMRouter, requests: int, concurrency: int) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await router.generate("llama3:8b", MESSAGES)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies
+
+
+def report(label: str, latencies: List[float], router: LLMRouter) -> None:
+    ms = [1000 * v for v in latencies]
+    hedging = router.stats()["hedging"]
+    print(f"  {label:<9}: p50 {percentile(ms, 0.50):7.1f} ms | p95 {percentile(ms, 0.95):7.1f} ms | "
+          f"p99 {percentile(ms, 0.99):7.1f} ms | media {statistics.mean(ms):7.1f} ms | "
+          f"hedges {hedging['launched']} (ganados {hedging['won']})")
+
+
+def flaky_pool(args, nodes: int, stall_rate: float):
+    return [
+        FakeBackend(latency_s=args.latency, stall_probability=stall_rate, stall_s=args.stall, seed=i, name=f"node-{i}")
+        for i in range(nodes)
+    ]
+
+
+async def run(args) -> None:
+    print(f"{args.requests} peticiones | concurrencia {args.concurrency} | latencia {args.latency * 1000:.0f} ms | "
+          f"{args.stall_rate:.0%} atascadas +{args.stall:.1f}s")
+
+    for label, hedge in (("baseline", False), ("hedging", True)):
+        router = LLMRouter({"ollama": flaky_pool(args, 3, args.stall_rate)}, health_interval=0, hedge=hedge)
+        await measure(router, 40, args.concurrency)  # calentamiento: muestras para el p95
+        router.hedge_stats = {"launched": 0, "won": 0}
+        report(label, await measure(router, args.requests, args.concurrency), router)
+
+    for label, breaker in (("sin CB", lambda: CircuitBreaker(cooldown_s=3600, slow_s=1e9)),
+                           ("breaker", lambda: CircuitBreaker(cooldown_s=3600, slow_s=args.latency * 5))):
+        stuck = FakeBackend(latency_s=args.latency + args.stall, name="stuck")
+        router = LLMRouter({"ollama": [stuck, *flaky_pool(args, 2, 0.0)]}, health_interval=0, breaker_factory=breaker)
+        report(label, await measure(router, args.requests, args.concurrency), router)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de latencia de cola: hedging y circuit breaker.")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--stall", type=float, default=1.0)
+    parser.add_argument("--stall-rate", type=float, default=0.03)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# bench_ttft.py
+#
+# Tiempo hasta el primer byte útil en CIAN: /api/v1/run (respuesta completa)
+# frente a /api/v1/run_stream (tokens NDJSON), contra un MAGENTA falso.
+#
+# Uso:
+#   python -m benchmarks.bench_ttft --latency 5 --tokens 50
+
+import argparse
+import time
+
+import httpx
+
+from benchmarks.fakes import ServerThread, build_fake_magenta
+from gwa_studio_core.core_api import llm_proxy
+from gwa_studio_core.core_api.main import app as cian_app
+
+PAYLOAD = {"template_name": "GWA_STRATEGIC_PLAN", "context": {}, "user_prompt": "bench"}
+
+
+def time_to_first_content(url: str) -> float:
+    start = time.perf_counter()
+    with httpx.stream("POST", url, json=PAYLOAD, timeout=None) as response:
+        response.raise_for_status()
+        for chunk in response.iter_bytes():
+            if chunk:
+                return time.perf_counter() - start
+    raise RuntimeError("Respuesta vacía")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de tiempo al primer token.")
+    parser.add_argument("--latency", type=float, default=5.0, help="Duración simulada de la generación (s).")
+    parser.add_argument("--tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    with ServerThread(build_fake_magenta(args.latency, args.tokens)) as magenta:
+        llm_proxy.MAGENTA_BASE_URL = magenta.base_url
+        with ServerThread(cian_app) as cian:
+            blocking = time_to_first_content(f"{cian.base_url}/api/v1/run")
+            streaming = time_to_first_content(f"{cian.base_url}/api/v1/run_stream")
+
+    print(f"Generación simulada: {args.latency:.1f}s en {args.tokens} tokens")
+    print(f"  /api/v1/run        primer contenido: {blocking * 1000:8.1f} ms")
+    print(f"  /api/v1/run_stream primer token    : {streaming * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
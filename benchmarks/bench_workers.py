@@ -0,0 +1,144 @@
+# bench_workers.py
+#
+# Throughput de MAGENTA con 1, 2, 4 y 8 workers (gwa_studio_core.serve), con un Ollama
+# falso sin latencia en su propio proceso: lo que queda es el trabajo de CPU de MAGENTA
+# por petición (validación, render de la plantilla con el presupuesto de contexto, parseo
+# del JSON, serialización). La carga sale de varios procesos generadores para que el
+# cliente no sea el cuello de botella. Caché en modo 'bypass': cada petición se genera.
+#
+# El escalado está acotado por los núcleos de la máquina (se imprimen al principio):
+# con un solo núcleo más workers sólo añaden cambios de contexto.
+#
+# Uso:
+#   python -m benchmarks.bench_workers --workers 1,2,4,8 --seconds 10 --concurrency 64
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.fakes import build_fake_ollama
+
+AUTH = {"Authorization": "Bearer gwa_token_magenta"}
+CONTEXT = {"nombre_empresa": "Empresa", "sector": "salud digital", "nombre_ciudad": "Córdoba",
+           "ubicacion": "Córdoba, Argentina. " * 40}
+
+
+def fake_ollama_app():
+    return build_fake_ollama(latency_s=0.0, tokens=4)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, timeout_s: float = 60) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} no respondió en {timeout_s:.0f} s")
+
+
+async def _load(url: str, seconds: float, concurrency: int, seed: int):
+    latencies, errors = [], 0
+    stop_at = time.monotonic() + seconds
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, headers=AUTH, timeout=30, limits=limits) as client:
+        async def user(n: int):
+            nonlocal errors
+            i = 0
+            while time.monotonic() < stop_at:
+                i += 1
+                started = time.perf_counter()
+                response = await client.post("/agent/run", json={
+                    "model_name": "llama3:8b", "template_name": "template_empresa_melanoma", "context": CONTEXT,
+                    "user_prompt": f"Plan {seed}-{n}-{i}", "cache_mode": "bypass"})
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(user(n) for n in range(concurrency)))
+    return latencies, errors
+
+
+def _generator(url: str, seconds: float, concurrency: int, seed: int, results) -> None:
+    results.put(asyncio.run(_load(url, seconds, concurrency, seed)))
+
+
+def run_workers(workers: int, seconds: float, concurrency: int, generators: int, ollama_url: str):
+    port = _free_port()
+    env = {**os.environ, "GWA_OLLAMA_HOSTS": ollama_url, "GWA_STATE_DIR": tempfile.mkdtemp(prefix="gwa_bench_"),
+           "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "bench"), "GWA_HEALTH_CHECK_INTERVAL": "0"}
+    server = subprocess.Popen([sys.executable, "-m", "gwa_studio_core.serve", "magenta", "--workers", str(workers),
+                               "--host", "127.0.0.1", "--port", str(port)], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(f"{url}/ready")
+        # Calentamiento: que cada worker haya cargado plantillas y conexiones.
+        asyncio.run(_load(url, 1.0, workers * 2, seed=-1))
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_generator, args=(url, seconds, concurrency // generators, g, results))
+                 for g in range(generators)]
+        for proc in procs:
+            proc.start()
+        collected = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+    finally:
+        server.terminate()
+        server.wait(30)
+    latencies = [lat for lats, _ in collected for lat in lats]
+    errors = sum(err for _, err in collected)
+    return latencies, errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput de MAGENTA con N workers.")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--generators", type=int, default=max(1, min(4, (os.cpu_count() or 1) // 2)))
+    args = parser.parse_args()
+
+    ollama_port = _free_port()
+    ollama = subprocess.Popen([sys.executable, "-m", "uvicorn", "benchmarks.bench_workers:fake_ollama_app",
+                               "--factory", "--port", str(ollama_port), "--log-level", "warning"])
+    ollama_url = f"http://127.0.0.1:{ollama_port}"
+    print(f"{os.cpu_count()} núcleos | {args.concurrency} conexiones desde {args.generators} proceso(s) | "
+          f"{args.seconds:.0f} s por medida")
+    try:
+        _wait_ready(f"{ollama_url}/api/tags")
+        baseline = None
+        for workers in (int(w) for w in args.workers.split(",")):
+            latencies, errors = run_workers(workers, args.seconds, args.concurrency, args.generators, ollama_url)
+            rps = len(latencies) / args.seconds
+            baseline = baseline or rps
+            p50 = statistics.median(latencies) * 1000 if latencies else float("nan")
+            p99 = statistics.quantiles(latencies, n=100)[98] * 1000 if len(latencies) > 100 else float("nan")
+            print(f"  {workers} worker(s) | {rps:7.1f} req/s (x{rps / baseline:4.2f}) | p50 {p50:6.1f} ms | "
+                  f"p99 {p99:6.1f} ms | errores {errors}")
+    finally:
+        ollama.terminate()
+        ollama.wait(10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+# fakes.py - Servidores locales falsos para benchmarks (sin modelos reales)
+
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from gwa_studio_llms.backends import BackendError, LLMBackend
+
+FAKE_RESULT = {"title": "fake", "summary": "Plan generado por el servidor falso.", "action_steps": ["uno", "dos"]}
+
+
+class LatencyProfile:
+    """
+    Perfil de un servidor LLM falso para pruebas de carga:
+      - primer token con distribución 'fixed', 'uniform' (entre p50/2 y 2·p50) o
+        'lognormal' (ajustada para que sus percentiles 50 y 99 sean p50_s y p99_s)
+      - `tokens_per_s` fragmentos por segundo después del primero
+      - `malformed_rate` fracción de respuestas que no son JSON válido (truncadas)
+    """
+
+    def __init__(self, distribution: str = "lognormal", p50_s: float = 0.2, p99_s: float = 1.0,
+                 tokens_per_s: float = 50.0, tokens: int = 20, malformed_rate: float = 0.0, seed: int = 0):
+        if distribution not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Distribución de latencia desconocida: {distribution}")
+        self.distribution = distribution
+        self.p50_s = p50_s
+        self.p99_s = max(p99_s, p50_s)
+        self.tokens_per_s = tokens_per_s
+        self.tokens = tokens
+        self.malformed_rate = malformed_rate
+        self._random = random.Random(seed)
+
+    def first_token_s(self) -> float:
+        if self.distribution == "fixed" or self.p50_s <= 0:
+            return self.p50_s
+        if self.distribution == "uniform":
+            return self._random.uniform(self.p50_s / 2, self.p50_s * 2)
+        sigma = math.log(self.p99_s / self.p50_s) / 2.326  # z del percentil 99
+        return self._random.lognormvariate(math.log(self.p50_s), sigma)
+
+    def text(self) -> str:
+        raw = json.dumps(FAKE_RESULT)
+        if self.malformed_rate and self._random.random() < self.malformed_rate:
+            return "Claro, aquí tienes el plan: " + raw[: len(raw) // 2]
+        return raw
+
+    async def chunks(self):
+        """Fragmentos de una respuesta con los tiempos del perfil."""
+        raw = self.text()
+        step = max(1, math.ceil(len(raw) / self.tokens))
+        await asyncio.sleep(self.first_token_s())
+        for i in range(0, len(raw), step):
+            if i and self.tokens_per_s:
+                await asyncio.sleep(1 / self.tokens_per_s)
+            yield raw[i:i + step]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: v for k, v in vars(self).items() if not k.startswith("_")}
+
+
+class FakeBackend(LLMBackend):
+    """
+    Backend en proceso para el router: emite `chunks` tras `latency_s` segundos.
+    Con `stall_probability` una fracción de las llamadas tarda `stall_s` más en dar
+    el primer token (modelo cargándose, nodo atascado). `calls` cuenta las
+    generaciones, `sent` los fragmentos entregados y `cancelled` las abortadas.
+    """
+
+    kind = "fake"
+
+    def __init__(self, chunks: Optional[List[str]] = None, latency_s: float = 0.0, name: str = "fake",
+                 error: Optional[BackendError] = None, stall_probability: float = 0.0, stall_s: float = 0.0,
+                 seed: int = 0):
+        super().__init__(name)
+        self.chunks = chunks if chunks is not None else [json.dumps(FAKE_RESULT)]
+        self.latency_s = latency_s
+        self.error = error
+        self.stall_probability = stall_probability
+        self.stall_s = stall_s
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.sent = 0
+        self.cancelled = 0
+        self.last_messages = None
+        self.last_options = None
+
+    async def stream(self, model, messages, options=None, response_format=None, usage=None):
+        self.calls += 1
+        self.last_messages = messages
+        self.last_options = options
+        delay = self.latency_s
+        if self.stall_probability and self._random.random() < self.stall_probability:
+            delay += self.stall_s
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        for chunk in self.chunks:
+            self.sent += 1
+            yield chunk
+
+
+def build_fake_magenta(latency_s: float = 1.0, tokens: int = 20) -> FastAPI:
+    """
+    MAGENTA falso: responde /agent/run con un AgentOutput tras `latency_s` segundos,
+    y /agent/run_stream con `tokens` fragmentos NDJSON repartidos en ese tiempo.
+    """
+    app = FastAPI(title="Fake MAGENTA")
+
+    def _output(payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "raw_text": json.dumps(FAKE_RESULT),
+            "result_json": FAKE_RESULT,
+            "model_used": payload.get("model_name", "fake"),
+            "prompt_template": payload.get("template_name", ""),
+        }
+
+    @app.get("/status")
+    async def status():
+        return {"status": "ok", "service": "Magenta LLM Service"}
+
+    @app.post("/agent/run")
+    async def run(payload: Dict[str, Any]):
+        await asyncio.sleep(latency_s)
+        return _output(payload)
+
+    @app.post("/agent/run_stream")
+    async def run_stream(payload: Dict[str, Any]):
+        output = _output(payload)
+        raw = output["raw_text"]
+        step = max(1, len(raw) // tokens)
+
+        async def events():
+            for i in range(0, len(raw), step):
+                await asyncio.sleep(latency_s / tokens)
+                yield json.dumps({"type": "token", "text": raw[i:i + step]}) + "\n"
+            yield json.dumps({"type": "result", "output": output}) + "\n"
+
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    return app
+
+
+def keep_alive_seconds(value: Any) -> float:
+    """keep_alive de la API de Ollama en segundos: número, duración ("5m", "1h30m") o negativo = siempre."""
+    if value is None:
+        return 300.0
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        parts = re.findall(r"(-?[\d.]+)(ms|s|m|h)", str(value))
+        seconds = sum(float(n) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit] for n, unit in parts)
+    return math.inf if seconds < 0 else seconds
+
+
+def build_fake_ollama(latency_s: float = 0.1, tokens: int = 10, text: str = "",
+                      profile: Optional[LatencyProfile] = None, load_s: float = 0.0,
+                      prompt_tps: float = 0.0, slots: int = 1) -> FastAPI:
+    """
+    Host de Ollama falso: /api/tags para los health checks y /api/chat en streaming
+    (NDJSON con `tokens` fragmentos repartidos en `latency_s`, o con los tiempos de
+    `profile` si se da). `app.state.healthy = False` lo hace responder 503;
+    `app.state.requests` cuenta los /api/chat recibidos y `app.state.traceparents`
+    guarda la cabecera traceparent de cada uno.
+
+    Simula la residencia de modelos: el primer uso de un modelo descargado (chat o
+    /api/generate sin prompt) espera `load_s`, y queda cargado durante su
+    keep_alive. /api/ps lista los cargados; `app.state.loads` cuenta las cargas y
+    `app.state.keep_alives` guarda el keep_alive de cada petición. Como Ollama, un
+    num_ctx distinto del cargado (2048 si no se da) obliga a recargar el modelo;
+    `app.state.num_ctx` guarda el de cada /api/chat y `app.state.truncated` cuenta
+    los prompts que no cabían (~4 caracteres por token).
+
+    Con `prompt_tps` simula la caché de prompt de llama.cpp: cada uno de los `slots`
+    recuerda el último prompt (mensajes con sus roles, ~4 caracteres por token) y
+    sólo se evalúa, a `prompt_tps` tokens/s antes del primer token, lo que no
+    coincide con el prefijo más largo en caché. prompt_eval_count y
+    prompt_eval_duration informan esa parte, como Ollama.
+    """
+    app = FastAPI(title="Fake Ollama")
+    app.state.healthy = True
+    app.state.requests = 0
+    app.state.traceparents = []
+    app.state.loads = 0
+    app.state.keep_alives = []
+    app.state.loaded = {}  # modelo -> (listo en, caduca en, num_ctx), en time.monotonic()
+    app.state.num_ctx = []
+    app.state.truncated = 0
+    app.state.kv = []  # último prompt de cada slot
+    raw = text or json.dumps(FAKE_RESULT)
+
+    def evaluate_prompt(payload: Dict[str, Any]) -> Tuple[int, float]:
+        """(tokens evaluados, segundos) del prompt descontando el prefijo que ya está en un slot."""
+        if not prompt_tps:
+            return 42, 0.0
+        prompt = "".join(f"<|{m['role']}|>{m['content']}" for m in payload.get("messages", []))
+        shared = [len(os.path.commonprefix([prompt, cached])) for cached in app.state.kv]
+        best = max(range(len(shared)), key=shared.__getitem__) if shared else None
+        if best is not None and shared[best] > 0:
+            app.state.kv.pop(best)
+        elif len(app.state.kv) >= slots:
+            app.state.kv.pop(0)
+        app.state.kv.append(prompt)
+        evaluated = max(1, (len(prompt) - (shared[best] if best is not None else 0)) // 4)
+        return evaluated, evaluated / prompt_tps
+
+    async def ensure_loaded(model: str, keep_alive: Any, options: Optional[Dict[str, Any]] = None) -> int:
+        app.state.keep_alives.append(keep_alive)
+        num_ctx = int((options or {}).get("num_ctx") or 2048)
+        now = time.monotonic()
+        ready_at, expires_at, loaded_ctx = app.state.loaded.get(model, (0.0, 0.0, num_ctx))
+        if expires_at <= now or loaded_ctx != num_ctx:
+            app.state.loads += 1
+            ready_at = now + load_s
+        app.state.loaded[model] = (ready_at, ready_at + keep_alive_seconds(keep_alive), num_ctx)
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        return num_ctx
+
+    @app.get("/api/ps")
+    async def ps():
+        now, wall = time.monotonic(), time.time()
+        models = []
+        for name, (ready_at, expires_at, _) in app.state.loaded.items():
+            if ready_at <= now < expires_at:
+                expires = wall + min(expires_at - now, 1e9)
+                models.append({"name": name, "model": name,
+                               "expires_at": datetime.fromtimestamp(expires, timezone.utc).isoformat()})
+        return {"models": models}
+
+    @app.post("/api/generate")
+    async def generate(payload: Dict[str, Any]):
+        if payload.get("prompt"):
+            return JSONResponse({"error": "el servidor falso sólo implementa la carga sin prompt"}, status_code=400)
+        await ensure_loaded(payload["model"], payload.get("keep_alive"), payload.get("options"))
+        return {"model": payload["model"], "response": "", "done": True, "done_reason": "load"}
+
+    @app.get("/api/tags")
+    async def tags():
+        if not app.state.healthy:
+            return JSONResponse({"error": "unhealthy"}, status_code=503)
+        return {"models": [{"name": "llama3:8b"}]}
+
+    @app.post("/api/chat")
+    async def chat(payload: Dict[str, Any], request: Request):
+        app.state.requests += 1
+        app.state.traceparents.append(request.headers.get("traceparent"))
+        if not app.state.healthy:
+            return JSONResponse({"error": "unhealthy"}, status_code=503)
+        num_ctx = await ensure_loaded(payload["model"], payload.get("keep_alive"), payload.get("options"))
+        app.state.num_ctx.append(num_ctx)
+        if sum(len(m["content"]) for m in payload.get("messages", [])) // 4 > num_ctx:
+            app.state.truncated += 1
+        step = max(1, len(raw) // tokens)
+
+        async def pieces():
+            for i in range(0, len(raw), step):
+                await asyncio.sleep(latency_s / tokens)
+                yield raw[i:i + step]
+
+        prompt_tokens, prompt_eval_s = evaluate_prompt(payload)
+
+        async def events():
+            count = 0
+            if prompt_eval_s:
+                await asyncio.sleep(prompt_eval_s)
+            async for piece in (profile.chunks() if profile else pieces()):
+                count += 1
+                chunk = {"model": payload["model"], "message": {"role": "assistant", "content": piece}, "done": False}
+                yield json.dumps(chunk) + "\n"
+            yield json.dumps({"model": payload["model"], "message": {"role": "assistant", "content": ""}, "done": True,
+                              "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prompt_eval_s * 1e9),
+                              "eval_count": count}) + "\n"
+
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    return app
+
+
+def build_fake_gemini(profile: Optional[LatencyProfile] = None) -> FastAPI:
+    """
+    API de Gemini falsa para el SDK google-genai (`http_options.base_url`): sólo
+    streamGenerateContent con alt=sse, que es lo que usa GeminiBackend.
+    `app.state.requests` cuenta las llamadas.
+    """
+    app = FastAPI(title="Fake Gemini")
+    app.state.requests = 0
+    profile = profile or LatencyProfile(distribution="fixed", p50_s=0.05)
+
+    @app.post("/{version}/models/{model}:streamGenerateContent")
+    async def stream_generate_content(version: str, model: str):
+        app.state.requests += 1
+
+        async def events():
+            count = 0
+            async for piece in profile.chunks():
+                count += 1
+                chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}}],
+                         "modelVersion": model}
+                yield f"data: {json.dumps(chunk)}\r\n\r\n"
+            final = {"candidates": [{"content": {"role": "model", "parts": [{"text": ""}]}, "finishReason": "STOP"}],
+                     "usageMetadata": {"promptTokenCount": 42, "candidatesTokenCount": count}, "modelVersion": model}
+            yield f"data: {json.dumps(final)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServerThread:
+    """Ejecuta una app ASGI con uvicorn en un hilo de fondo (contexto `with`)."""
+
+    def __init__(self, app: FastAPI, port: int = 0):
+        self.port = port or _free_port()
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", backlog=4096)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "ServerThread":
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("El servidor falso no arrancó a tiempo.")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
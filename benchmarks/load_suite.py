@@ -0,0 +1,241 @@
+# load_suite.py
+#
+# Prueba de carga de la pila completa sin modelos reales: CIAN y MAGENTA corren en
+# proceso (uvicorn en hilos) contra un Ollama y una API de Gemini falsos con
+# latencia de primer token, velocidad de tokens y tasa de salidas mal formadas
+# configurables. MAGENTA usa su router, plantillas y parser reales (caché en
+# 'bypass'), así que se mide todo el camino HTTP.
+#
+# La carga es de lazo abierto: las llegadas siguen un proceso de Poisson a cada
+# tasa de `--rates`, con independencia de lo que tarden las respuestas, y la
+# latencia se mide desde el instante de llegada programado (sin omisión
+# coordinada). Por cada nivel se informa throughput, p50/p95/p99, parse_fail,
+# errores por código y el pico de peticiones en vuelo.
+#
+# Uso:
+#   python -m benchmarks.load_suite                       # compara con load_baseline.json
+#   python -m benchmarks.load_suite --rates 10,40 --duration 10 --out informe.json
+#   python -m benchmarks.load_suite --update-baseline     # fija la línea base actual
+#
+# Sale con código 1 si algún nivel empeora más de `--tolerance` respecto a la línea base.
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+os.environ.setdefault("GEMINI_API_KEY", "bench-key")
+# Sin exportar spans por defecto: miles de peticiones llenarían gwa_traces.jsonl.
+os.environ.setdefault("GWA_TRACE_EXPORTER", "none")
+
+from google import genai
+from google.genai import types
+
+from benchmarks.fakes import LatencyProfile, ServerThread, build_fake_gemini, build_fake_ollama
+from gwa_studio_core.core_api import admission, llm_proxy
+from gwa_studio_core.core_api.main import app as cian_app
+from gwa_studio_llms import llm_processor
+from gwa_studio_llms.backends import GeminiBackend, OllamaBackend
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.main_service import app as magenta_app
+from gwa_studio_llms.model_manager import model_manager
+from gwa_studio_llms.response_cache import ResponseCache
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "load_baseline.json"
+TEMPLATE = "template_empresa_melanoma"
+CONTEXT = {"ubicacion": "Córdoba", "sector": "salud digital", "nombre_empresa": "DermaIA"}
+# Métricas comparadas con la línea base: (clave, True si más alto es peor).
+COMPARED = (("p50_ms", True), ("p95_ms", True), ("p99_ms", True), ("throughput_rps", False))
+# Con menos respuestas que esto el p99 es una sola muestra y no se compara.
+MIN_SAMPLES_P99 = 100
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@contextlib.contextmanager
+def running_stack(args):
+    """Fakes + MAGENTA + CIAN en hilos; devuelve la URL base de CIAN."""
+    ollama_profile = LatencyProfile(args.ollama_dist, args.ollama_p50, args.ollama_p99, args.ollama_tps,
+                                    malformed_rate=args.malformed_rate, seed=1)
+    gemini_profile = LatencyProfile(args.gemini_dist, args.gemini_p50, args.gemini_p99, args.gemini_tps,
+                                    malformed_rate=args.malformed_rate, seed=2)
+    with contextlib.ExitStack() as stack:
+        ollama_urls = [stack.enter_context(ServerThread(build_fake_ollama(profile=ollama_profile))).base_url
+                       for _ in range(args.ollama_nodes)]
+        gemini_url = stack.enter_context(ServerThread(build_fake_gemini(gemini_profile))).base_url
+
+        service = llm_processor.agent_service
+        service.router = LLMRouter({
+            "ollama": [OllamaBackend(url) for url in ollama_urls],
+            "gemini": [GeminiBackend(genai.Client(api_key="bench", http_options=types.HttpOptions(base_url=gemini_url)))],
+        }, health_interval=0)
+        service.cache = ResponseCache(db_path="")
+        model_manager.router = service.router  # precarga y keep_alive contra los Ollama falsos
+
+        magenta = stack.enter_context(ServerThread(magenta_app))
+        llm_proxy.MAGENTA_BASE_URL = magenta.base_url
+        # La suite hace de front-end de confianza: un X-Client-Id por petición, sin cupo común.
+        admission.FRONTEND_TOKEN = admission.FRONTEND_TOKEN or "load-suite"
+        cian = stack.enter_context(ServerThread(cian_app))
+        yield cian.base_url, {"ollama": ollama_profile.to_dict(), "gemini": gemini_profile.to_dict()}
+
+
+async def run_level(client: httpx.AsyncClient, rate: float, duration: float, gemini_share: float,
+                    seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    arrivals, t = [], rng.expovariate(rate)
+    while t < duration:
+        arrivals.append(t)
+        t += rng.expovariate(rate)
+
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    in_flight = peak = 0
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    last_done = start
+
+    async def one(index: int, offset: float) -> None:
+        nonlocal in_flight, peak, last_done
+        await asyncio.sleep(max(0.0, start + offset - loop.time()))
+        model = "gemini-2.5-flash" if rng.random() < gemini_share else "llama3:8b"
+        payload = {"model_name": model, "template_name": TEMPLATE, "context": CONTEXT,
+                   "user_prompt": f"Plan {index}", "cache_mode": "bypass"}
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            response = await client.post("/api/v1/run", json=payload,
+                                         headers={"X-Client-Id": f"load-{index}",
+                                                  "X-GWA-Frontend-Token": admission.FRONTEND_TOKEN})
+            key = response.json().get("status", "ok") if response.status_code == 200 else str(response.status_code)
+        except httpx.HTTPError as e:
+            key = type(e).__name__
+        finally:
+            in_flight -= 1
+        now = loop.time()
+        last_done = max(last_done, now)
+        statuses[key] = statuses.get(key, 0) + 1
+        if key in ("ok", "parse_fail"):
+            latencies.append(1000 * (now - start - offset))
+
+    await asyncio.gather(*(one(i, offset) for i, offset in enumerate(arrivals)))
+
+    total = len(arrivals)
+    answered = statuses.get("ok", 0) + statuses.get("parse_fail", 0)
+    elapsed = max(last_done - start, 1e-9)
+    return {
+        "rate_rps": rate,
+        "requests": total,
+        "statuses": statuses,
+        "throughput_rps": round(answered / elapsed, 2),
+        "parse_fail_rate": round(statuses.get("parse_fail", 0) / max(answered, 1), 4),
+        "error_rate": round((total - answered) / max(total, 1), 4),
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "mean_ms": round(statistics.mean(latencies), 1) if latencies else 0.0,
+        "peak_in_flight": peak,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regresiones del informe frente a la línea base (mismas tasas); lista vacía si no hay."""
+    base_levels = {level["rate_rps"]: level for level in baseline.get("levels", [])}
+    problems = []
+    for level in report["levels"]:
+        base = base_levels.get(level["rate_rps"])
+        if base is None:
+            continue
+        for key, higher_is_worse in COMPARED:
+            if key == "p99_ms" and level["requests"] < MIN_SAMPLES_P99:
+                continue
+            current, reference = level[key], base[key]
+            if higher_is_worse and current > reference * (1 + tolerance):
+                problems.append(f"{level['rate_rps']} rps: {key} {current} > {reference} (+{tolerance:.0%})")
+            if not higher_is_worse and current < reference * (1 - tolerance):
+                problems.append(f"{level['rate_rps']} rps: {key} {current} < {reference} (-{tolerance:.0%})")
+        if level["error_rate"] > base["error_rate"] + tolerance / 10:
+            problems.append(f"{level['rate_rps']} rps: error_rate {level['error_rate']} > {base['error_rate']}")
+    return problems
+
+
+async def run_suite(args) -> Dict[str, Any]:
+    rates = [float(r) for r in args.rates.split(",")]
+    with running_stack(args) as (cian_url, profiles):
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=1000)
+        async with httpx.AsyncClient(base_url=cian_url, timeout=args.timeout, limits=limits) as client:
+            await run_level(client, 5, 1, args.gemini_share, seed=0)  # calentamiento (conexiones, plantillas)
+            levels = []
+            for i, rate in enumerate(rates):
+                level = await run_level(client, rate, args.duration, args.gemini_share, seed=100 + i)
+                print(f"  {rate:6.1f} rps | {level['requests']:5d} peticiones | {level['throughput_rps']:6.1f} rps "
+                      f"servidas | p50 {level['p50_ms']:7.1f} ms | p95 {level['p95_ms']:7.1f} ms | "
+                      f"p99 {level['p99_ms']:7.1f} ms | en vuelo máx {level['peak_in_flight']:4d} | {level['statuses']}")
+                levels.append(level)
+    return {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"rates": rates, "duration_s": args.duration, "gemini_share": args.gemini_share,
+                   "ollama_nodes": args.ollama_nodes, "profiles": profiles},
+        "levels": levels,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga de CIAN + MAGENTA con backends LLM falsos.")
+    parser.add_argument("--rates", default="10,25,50", help="Tasas de llegada (peticiones/s) separadas por comas.")
+    parser.add_argument("--duration", type=float, default=5.0, help="Segundos de carga por nivel.")
+    parser.add_argument("--gemini-share", type=float, default=0.3, help="Fracción de peticiones a gemini-*.")
+    parser.add_argument("--ollama-nodes", type=int, default=2)
+    parser.add_argument("--ollama-dist", default="lognormal", choices=("fixed", "uniform", "lognormal"))
+    parser.add_argument("--ollama-p50", type=float, default=0.15, help="Primer token p50 (s).")
+    parser.add_argument("--ollama-p99", type=float, default=0.6, help="Primer token p99 (s).")
+    parser.add_argument("--ollama-tps", type=float, default=200.0, help="Tokens por segundo tras el primero.")
+    parser.add_argument("--gemini-dist", default="lognormal", choices=("fixed", "uniform", "lognormal"))
+    parser.add_argument("--gemini-p50", type=float, default=0.1)
+    parser.add_argument("--gemini-p99", type=float, default=0.4)
+    parser.add_argument("--gemini-tps", type=float, default=400.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.02, help="Fracción de salidas que no son JSON.")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--out", default="load_report.json", help="Informe JSON de la ejecución.")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Empeoramiento relativo admitido.")
+    parser.add_argument("--update-baseline", action="store_true", help="Guarda esta ejecución como línea base.")
+    args = parser.parse_args()
+
+    print(f"Carga de lazo abierto: {args.rates} rps x {args.duration:.0f}s, {args.gemini_share:.0%} gemini, "
+          f"{args.malformed_rate:.0%} salidas mal formadas")
+    report = asyncio.run(run_suite(args))
+    Path(args.out).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Informe: {args.out}")
+
+    if args.update_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Línea base actualizada: {args.baseline}")
+        return 0
+    if not Path(args.baseline).exists():
+        print(f"Sin línea base en {args.baseline}; use --update-baseline para fijarla.")
+        return 0
+    problems = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+    for problem in problems:
+        print(f"REGRESIÓN: {problem}")
+    if not problems:
+        print("Sin regresiones respecto a la línea base.")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
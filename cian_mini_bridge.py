@@ -1,70 +1,183 @@
-import os, json, uvicorn
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
-
-app = FastAPI()
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
-
-RUTA_PLANTILLAS = r"D:\proyectos\GWA-Strategic-Agent\plantillas_json"
-
-@app.post("/api/v1/run")
-async def run_engine(data: dict):
-    modo = data.get("modo_ejecucion", "A")
-    empresa = data.get("empresa", "G.WA Agency")
-    modelo_ia = data.get("model_id", "Llama-3.2")
-    nom_plantilla = data.get("template_type")
-    
-    # Lógica de Llenado Total por IA (Modo B)
-    if modo == "B":
-        slogan = f"Futuro impulsado por {modelo_ia} para {empresa}."
-        mision = f"Liderar la transformación digital usando la arquitectura de {modelo_ia}."
-        vision = f"Establecer un estándar global de innovación tecnológica para el 2030."
-        servicios = ["Estrategia Multimodal", "Automatización IA", "Desarrollo Responsivo"]
-        canales = data.get("canales_lista", [])
-        redes_final = {c: f"🚀 ESTRATEGIA {c}: Contenido viral optimizado por {modelo_ia}." for c in canales}
-        t_reel, t_video = f"Intro a {empresa}", f"Masterclass {modelo_ia}"
-    else:
-        slogan, mision, vision = data.get("slogan"), data.get("mision"), data.get("vision")
-        servicios, redes_final = data.get("servicios"), data.get("redes")
-        t_reel, t_video = data.get("tema_reel"), data.get("tema_video")
-
-    # DISEÑO WEB RESPONSIVO PROFESIONAL
-    web_code = f"""
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <style>
-            :root {{ --accent: {data['c_accent']}; --bg: {data['c_bg']}; --text: {data['c_text']}; }}
-            body {{ background: var(--bg); color: var(--text); font-family: '{data['f_main']}', sans-serif; margin: 0; padding: 20px; }}
-            .hero {{ text-align: center; padding: 60px 20px; border: 2px solid var(--accent); border-radius: 30px; }}
-            h1 {{ font-size: {data['s_h']}rem; color: var(--accent); margin: 0; }}
-            .slogan {{ font-size: {data['s_s']}rem; color: {data['c_slogan']}; font-weight: bold; }}
-            .grid {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); gap: 20px; margin-top: 30px; }}
-            .card {{ background: rgba(255,255,255,0.05); padding: 20px; border-radius: 15px; border-left: 5px solid var(--accent); }}
-        </style>
-    </head>
-    <body>
-        <div class="hero">
-            <h1>{empresa}</h1>
-            <p class="slogan">{slogan}</p>
-        </div>
-        <div class="grid">
-            <div class="card"><h3>🎯 Misión</h3><p>{mision}</p></div>
-            <div class="card"><h3>🛠️ Servicios</h3><ul>{''.join([f"<li>{s}</li>" for s in servicios])}</ul></div>
-        </div>
-    </body>
-    </html>
-    """
-
-    res_json = {
-        "metadata": {"ia": modelo_ia, "modo": modo, "fecha": str(datetime.now())},
-        "empresa": empresa, "slogan": slogan, "redes": redes_final,
-        "web_html": web_code, "multimedia": {"reel": t_reel, "video": t_video}
-    }
-    return {"result_json": {"visual_html": web_code, "data_json": res_json}}
-
-if __name__ == "__main__":
+import os, asyncio, uvicorn
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+from datetime import datetime
+
+from gwa_studio_core.core_api import plans
+from gwa_studio_core.encoding import EncodedJSONResponse, dumps
+from plantillas_catalog import catalog, summaries
+from site_renderer import renderer
+
+# Cada cuántos segundos se buscan plantillas nuevas/modificadas (0 = sólo al arrancar y con POST /reload).
+CATALOG_RELOAD_S = float(os.environ.get("GWA_CATALOG_RELOAD_S", "2"))
+MAX_PAGE = 100
+
+
+async def _watch_catalog():
+    while True:
+        await asyncio.sleep(CATALOG_RELOAD_S)
+        changes = catalog.apply(await asyncio.to_thread(catalog.scan))
+        if any(changes.values()):
+            print(f"INFO: catálogo de plantillas recargado: {changes}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    catalog.refresh()
+    watcher = asyncio.create_task(_watch_catalog()) if CATALOG_RELOAD_S > 0 else None
+    try:
+        yield
+    finally:
+        if watcher:
+            watcher.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=["ETag", "Content-Encoding"])
+# Búsqueda en los planes y landings guardados (mismo GWA_PLAN_DB que CIAN).
+app.include_router(plans.router, prefix="/api/v1")
+
+RUTA_PLANTILLAS = str(catalog.directory)
+
+
+def _json_with_etag(request: Request, etag: str, body: bytes) -> Response:
+    """200 con ETag, o 304 sin cuerpo si el cliente ya tiene esa versión (If-None-Match)."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _page(request: Request, total: int, offset: int, limit: int, entries) -> Response:
+    body = dumps({"total": total, "offset": offset, "limit": limit, "items": summaries(entries)})
+    # La respuesta de una URL sólo depende de la versión del catálogo.
+    return _json_with_etag(request, f'"{catalog.version}"', body)
+
+
+@app.get("/api/v1/plantillas")
+async def list_plantillas(request: Request, categoria: Optional[str] = None, seccion: Optional[str] = None,
+                          offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=MAX_PAGE)):
+    total, entries = catalog.list(categoria, seccion, offset, limit)
+    return _page(request, total, offset, limit, entries)
+
+
+@app.get("/api/v1/plantillas/search")
+async def search_plantillas(request: Request, q: str = "", categoria: Optional[str] = None,
+                            seccion: Optional[str] = None, offset: int = Query(0, ge=0),
+                            limit: int = Query(20, ge=1, le=MAX_PAGE)):
+    total, entries = catalog.search(q, categoria, seccion, offset, limit)
+    return _page(request, total, offset, limit, entries)
+
+
+@app.get("/api/v1/plantillas/categorias")
+async def list_categorias():
+    return catalog.categories()
+
+
+@app.get("/api/v1/plantillas/stats")
+async def catalog_stats():
+    return catalog.stats()
+
+
+@app.post("/api/v1/plantillas/reload")
+async def reload_plantillas():
+    """Relee sólo los ficheros modificados, nuevos o borrados de plantillas_json/."""
+    return catalog.apply(await asyncio.to_thread(catalog.scan))
+
+
+@app.get("/api/v1/plantillas/{plantilla_id}")
+async def get_plantilla(plantilla_id: str, request: Request):
+    entry = catalog.get(plantilla_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Plantilla '{plantilla_id}' no encontrada.")
+    return _json_with_etag(request, entry.etag, entry.body)
+
+# Valores por defecto de cada plantilla para run_engine, por (id, etag): se recalculan sólo si el fichero cambia.
+_engine_defaults = {}
+
+
+def _plantilla_defaults(plantilla_id: Optional[str]) -> dict:
+    entry = catalog.get(plantilla_id) if plantilla_id else None
+    if entry is None:
+        return {}
+    cached = _engine_defaults.get(plantilla_id)
+    if cached is None or cached[0] != entry.etag:
+        full = entry.to_dict()
+        estilo = full["estilo"]
+        items = next(iter(full["items"].values()), [])
+        defaults = {"empresa": full["empresa"], "slogan": full["slogan"], "servicios": items,
+                    "c_bg": estilo.get("color_fondo"), "c_accent": estilo.get("color_acento"),
+                    "f_main": estilo.get("fuente")}
+        cached = _engine_defaults[plantilla_id] = (entry.etag, {k: v for k, v in defaults.items() if v})
+    return cached[1]
+
+
+@app.post("/api/v1/run")
+async def run_engine(data: dict, request: Request):
+    # Lo que no venga en la petición sale de la plantilla elegida (catálogo en memoria, sin leer disco).
+    data = {**_plantilla_defaults(data.get("template_type")), **data}
+    modo = data.get("modo_ejecucion", "A")
+    empresa = data.get("empresa", "G.WA Agency")
+    modelo_ia = data.get("model_id", "Llama-3.2")
+    nom_plantilla = data.get("template_type")
+    
+    # Lógica de Llenado Total por IA (Modo B)
+    if modo == "B":
+        slogan = f"Futuro impulsado por {modelo_ia} para {empresa}."
+        mision = f"Liderar la transformación digital usando la arquitectura de {modelo_ia}."
+        vision = f"Establecer un estándar global de innovación tecnológica para el 2030."
+        servicios = ["Estrategia Multimodal", "Automatización IA", "Desarrollo Responsivo"]
+        canales = data.get("canales_lista", [])
+        redes_final = {c: f"🚀 ESTRATEGIA {c}: Contenido viral optimizado por {modelo_ia}." for c in canales}
+        t_reel, t_video = f"Intro a {empresa}", f"Masterclass {modelo_ia}"
+    else:
+        slogan, mision, vision = data.get("slogan"), data.get("mision"), data.get("vision")
+        servicios, redes_final = data.get("servicios"), data.get("redes")
+        t_reel, t_video = data.get("tema_reel"), data.get("tema_video")
+
+    # DISEÑO WEB RESPONSIVO PROFESIONAL: layout precompilado por plantilla y caché por contenido.
+    page = renderer.render(catalog.get(nom_plantilla) if nom_plantilla else None, data,
+                           {"empresa": empresa, "slogan": slogan, "mision": mision, "servicios": servicios})
+    page_url = f"/api/v1/pages/{page.page_id}"
+
+    res_json = {
+        "metadata": {"ia": modelo_ia, "modo": modo, "fecha": str(datetime.now())},
+        "empresa": empresa, "slogan": slogan, "redes": redes_final,
+        # El HTML viaja una sola vez (visual_html); aquí sólo va la referencia.
+        "web_html": {"ref": "visual_html", "page_id": page.page_id, "url": page_url},
+        "multimedia": {"reel": t_reel, "video": t_video}
+    }
+    result = {"page_id": page.page_id, "page_url": page_url, "data_json": res_json}
+    # inline_html=false: el cliente descarga la página de page_url (comprimida y con ETag).
+    if data.get("inline_html", True):
+        result["visual_html"] = page.html
+    # Al almacén de planes va todo salvo el HTML (se sirve desde page_url).
+    await plans.record([{"source": "landing", "template": nom_plantilla or "", "model": modelo_ia,
+                         "result": result, "context": data}])
+    # El HTML en línea pesa casi todo el cuerpo y se comprime muy bien (br/gzip según Accept-Encoding).
+    return EncodedJSONResponse({"result_json": result}, accept_encoding=request.headers.get("accept-encoding", ""))
+
+
+@app.get("/api/v1/pages/stats")
+async def pages_stats():
+    return renderer.stats()
+
+
+@app.get("/api/v1/pages/{page_id}")
+async def get_page(page_id: str, request: Request):
+    """Página ya renderizada, pre-comprimida según Accept-Encoding. Es inmutable: su id es el hash de las entradas."""
+    page = renderer.get(page_id)
+    if page is None:
+        raise HTTPException(status_code=404, detail=f"Página '{page_id}' no encontrada (expirada o inexistente).")
+    headers = {"ETag": page.etag, "Cache-Control": "public, max-age=86400, immutable", "Vary": "Accept-Encoding"}
+    if page.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    encoding, body = page.body(request.headers.get("accept-encoding", ""))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="text/html; charset=utf-8", headers=headers)
+
+if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
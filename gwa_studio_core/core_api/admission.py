@@ -0,0 +1,316 @@
+# admission.py - Control de admisión del gateway CIAN
+#
+# Cada backend (pool de modelos de MAGENTA: gemini / ollama) tiene un número
+# máximo de peticiones en curso y una cola acotada con prioridades. Cuando la
+# cola está llena, cuando la espera estimada supera el deadline del llamador o
+# cuando un cliente supera su cupo, se rechaza enseguida con 429/503 y
+# Retry-After en lugar de dejar que la petición muera por timeout.
+#
+# Con varios workers (gwa_studio_core.serve) los límites siguen siendo del servicio:
+# las plazas por backend y la cola se reparten entre los workers (cada uno ordena su
+# propia cola sin esperar a los demás) y el cupo y la tasa por cliente se cuentan en
+# el estado compartido (shared_state), porque un cliente reparte sus conexiones. Ese
+# SQLite nunca se toca desde el event loop: las tomas de plaza esperan al hilo del
+# estado compartido, las liberaciones se difieren y el total en curso por backend se
+# acumula en memoria y se vuelca de una vez.
+#
+# El cliente es la IP del llamador. X-Client-Id sólo se respeta si la petición trae
+# X-GWA-Frontend-Token con el secreto GWA_FRONTEND_TOKEN: lo usan los front-ends propios
+# (Streamlit) que reparten una misma IP entre muchos usuarios. Un llamador cualquiera
+# no puede saltarse su cupo cambiando la cabecera en cada petición.
+
+import asyncio
+import heapq
+import hmac
+import itertools
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from gwa_studio_core.shared_state import WORKERS, SharedState, shared_state, split_limit
+
+# Peticiones simultáneas hacia MAGENTA por backend, y peticiones en espera por backend.
+GATEWAY_MAX_CONCURRENCY = int(os.environ.get("GWA_GATEWAY_MAX_CONCURRENCY", "32"))
+GATEWAY_MAX_QUEUE = int(os.environ.get("GWA_GATEWAY_MAX_QUEUE", "128"))
+# Peticiones en curso (o en cola) por cliente.
+CLIENT_MAX_CONCURRENCY = int(os.environ.get("GWA_CLIENT_MAX_CONCURRENCY", "8"))
+# Peticiones por minuto por cliente (0 = sin límite de tasa).
+CLIENT_MAX_RPM = int(os.environ.get("GWA_CLIENT_MAX_RPM", "0"))
+# Secreto compartido con los front-ends de confianza. Vacío = X-Client-Id no se respeta nunca.
+FRONTEND_TOKEN = os.environ.get("GWA_FRONTEND_TOKEN", "").strip(' "')
+FRONTEND_TOKEN_HEADER = "x-gwa-frontend-token"
+# Deadline por defecto si el llamador no envía X-Deadline-Ms (por debajo del timeout de Streamlit).
+DEFAULT_DEADLINE_S = float(os.environ.get("GWA_DEFAULT_DEADLINE_S", "120"))
+# Estimación inicial de la duración de una petición, antes de tener medidas.
+INITIAL_SERVICE_TIME_S = float(os.environ.get("GWA_INITIAL_SERVICE_TIME_S", "5"))
+
+# Menor valor = más prioridad.
+PRIORITIES = {"interactive": 0, "batch": 1}
+_EWMA_ALPHA = 0.2
+
+
+def backend_for(model_name: str) -> str:
+    """Mismo criterio que el router de MAGENTA: 'gemini-*' -> gemini, el resto -> ollama."""
+    return "gemini" if model_name.startswith("gemini") else "ollama"
+
+
+def client_id_for(request: Request) -> str:
+    """Clave del cupo y la tasa por cliente: X-Client-Id de un front-end de confianza o la IP del llamador."""
+    headers = request.headers
+    client_id = headers.get("x-client-id")
+    token = headers.get(FRONTEND_TOKEN_HEADER, "")
+    if client_id and FRONTEND_TOKEN and hmac.compare_digest(token.encode("utf-8"), FRONTEND_TOKEN.encode("utf-8")):
+        return client_id
+    return request.client.host if request.client else "anonymous"
+
+
+def _reject(status_code: int, detail: str, retry_after_s: float) -> HTTPException:
+    return HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after_s)))},
+    )
+
+
+class Ticket:
+    """Plaza concedida. `release()` es idempotente (se llama al terminar la respuesta o el stream)."""
+
+    def __init__(self, controller: "AdmissionController", queue: "BackendQueue", client_id: str):
+        self._controller = controller
+        self._queue = queue
+        self._client_id = client_id
+        self._granted_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._queue.release(time.monotonic() - self._granted_at)
+        self._controller._client_done(self._client_id)
+        self._controller._track(self._queue.name, -1)
+
+
+class BackendQueue:
+    """Semáforo con cola de prioridad acotada y medidas de espera para un backend."""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.service_time_s = INITIAL_SERVICE_TIME_S
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "deadline": 0, "timeout": 0}
+        self.wait_count = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, f in self._heap if not f.done())
+
+    def estimated_wait(self, priority: int) -> float:
+        """Espera estimada para una petición nueva: turnos por delante x duración media."""
+        ahead = sum(1 for p, _, f in self._heap if p <= priority and not f.done())
+        if self.active < self.max_concurrency and ahead == 0:
+            return 0.0
+        return (ahead // self.max_concurrency + 1) * self.service_time_s
+
+    def _record_wait(self, waited_s: float) -> None:
+        self.admitted += 1
+        self.wait_count += 1
+        self.wait_total_s += waited_s
+        self.wait_max_s = max(self.wait_max_s, waited_s)
+
+    async def acquire(self, priority: int, deadline_s: float) -> None:
+        if self.active < self.max_concurrency and self.queued == 0:
+            self.active += 1
+            self._record_wait(0.0)
+            return
+
+        if self.queued >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise _reject(503, f"Cola del backend '{self.name}' llena. Reintente más tarde.", self.estimated_wait(priority))
+
+        estimate = self.estimated_wait(priority)
+        if estimate > deadline_s:
+            self.rejected["deadline"] += 1
+            raise _reject(
+                503,
+                f"Espera estimada en '{self.name}' ({estimate:.1f}s) superior al deadline ({deadline_s:.1f}s).",
+                estimate,
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), deadline_s)
+        except asyncio.TimeoutError:
+            if not self._abandon(future):
+                self._record_wait(time.monotonic() - start)
+                return
+            self.rejected["timeout"] += 1
+            raise _reject(503, f"Deadline agotado esperando turno en '{self.name}'.", self.service_time_s)
+        except asyncio.CancelledError:
+            # El cliente se fue: si ya se le había cedido la plaza, se devuelve.
+            if not self._abandon(future):
+                self.release(None)
+            raise
+        self._record_wait(time.monotonic() - start)
+
+    def _abandon(self, future: asyncio.Future) -> bool:
+        """Saca a un esperador de la cola. False si ya había recibido la plaza."""
+        if future.done():
+            return False
+        future.cancel()
+        return True
+
+    def release(self, service_time_s: Optional[float]) -> None:
+        if service_time_s is not None:
+            self.service_time_s += _EWMA_ALPHA * (service_time_s - self.service_time_s)
+        # La plaza pasa directamente al siguiente esperador vivo (active no cambia).
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_ms": {
+                "avg": round(1000 * self.wait_total_s / self.wait_count, 2) if self.wait_count else 0.0,
+                "max": round(1000 * self.wait_max_s, 2),
+            },
+            "service_time_ms": round(1000 * self.service_time_s, 2),
+        }
+
+
+class AdmissionController:
+    """Una BackendQueue por backend más el cupo de peticiones simultáneas y la tasa por cliente."""
+
+    def __init__(self, max_concurrency: int = GATEWAY_MAX_CONCURRENCY, max_queue: int = GATEWAY_MAX_QUEUE,
+                 client_max_concurrency: int = CLIENT_MAX_CONCURRENCY, default_deadline_s: float = DEFAULT_DEADLINE_S,
+                 client_max_rpm: int = CLIENT_MAX_RPM, shared: SharedState = shared_state, workers: int = WORKERS):
+        # Límites globales del servicio; cada worker se queda con su parte de plazas y cola.
+        self.max_concurrency = split_limit(max_concurrency, workers)
+        self.max_queue = split_limit(max_queue, workers)
+        self.client_max_concurrency = client_max_concurrency
+        self.client_max_rpm = client_max_rpm
+        self.default_deadline_s = default_deadline_s
+        self.shared = shared if shared.enabled else None
+        self.queues: Dict[str, BackendQueue] = {}
+        self.clients: Dict[str, int] = {}
+        self._rate: Dict[str, Tuple[int, int]] = {}
+        # Variación de peticiones en curso por backend aún no volcada al estado compartido.
+        self._active_delta: Dict[str, int] = {}
+        self._active_lock = threading.Lock()
+        self.rejected_client_cap = 0
+        self.rejected_rate = 0
+
+    def queue(self, backend: str) -> BackendQueue:
+        if backend not in self.queues:
+            self.queues[backend] = BackendQueue(backend, self.max_concurrency, self.max_queue)
+        return self.queues[backend]
+
+    async def _client_acquire(self, client_id: str) -> bool:
+        if self.shared is not None:
+            if not await self.shared.run(self.shared.try_acquire, f"client:{client_id}", self.client_max_concurrency):
+                return False
+        elif self.clients.get(client_id, 0) >= self.client_max_concurrency:
+            return False
+        self.clients[client_id] = self.clients.get(client_id, 0) + 1
+        return True
+
+    def _client_done(self, client_id: str) -> None:
+        remaining = self.clients.get(client_id, 1) - 1
+        if remaining > 0:
+            self.clients[client_id] = remaining
+        else:
+            self.clients.pop(client_id, None)
+        if self.shared is not None:
+            self.shared.defer(self.shared.release, f"client:{client_id}")
+
+    async def _over_rate(self, client_id: str) -> bool:
+        """Cuenta la petición en la ventana del minuto actual; True si el cliente pasa de client_max_rpm."""
+        if self.client_max_rpm <= 0:
+            return False
+        if self.shared is not None:
+            return await self.shared.run(self.shared.hit, f"rpm:{client_id}", 60) > self.client_max_rpm
+        minute = int(time.time() // 60)
+        window, count = self._rate.get(client_id, (minute, 0))
+        count = count + 1 if window == minute else 1
+        if len(self._rate) > 10000:
+            self._rate = {c: v for c, v in self._rate.items() if v[0] == minute}
+        self._rate[client_id] = (minute, count)
+        return count > self.client_max_rpm
+
+    def _track(self, backend: str, delta: int) -> None:
+        # Peticiones en curso de todo el servicio (todos los workers), para /admission/stats.
+        # Sólo informativo: se acumula y un único volcado pendiente escribe lo acumulado.
+        if self.shared is None:
+            return
+        with self._active_lock:
+            pending = bool(self._active_delta)
+            self._active_delta[backend] = self._active_delta.get(backend, 0) + delta
+        if not pending:
+            self.shared.defer(self._flush_active)
+
+    def _flush_active(self) -> None:
+        with self._active_lock:
+            deltas, self._active_delta = self._active_delta, {}
+        for backend, delta in deltas.items():
+            if delta:
+                self.shared.add(f"active:{backend}", delta)
+
+    async def admit(self, backend: str, priority: str = "interactive", client_id: str = "anonymous",
+                    deadline_s: Optional[float] = None) -> Ticket:
+        """Espera turno en la cola del backend o levanta HTTPException 429/503 con Retry-After."""
+        queue = self.queue(backend)
+        if await self._over_rate(client_id):
+            self.rejected_rate += 1
+            raise _reject(429, f"El cliente '{client_id}' superó {self.client_max_rpm} peticiones por minuto.",
+                          60 - time.time() % 60)
+        if not await self._client_acquire(client_id):
+            self.rejected_client_cap += 1
+            raise _reject(429, f"Demasiadas peticiones simultáneas del cliente '{client_id}'.", queue.service_time_s)
+
+        try:
+            await queue.acquire(PRIORITIES.get(priority, PRIORITIES["interactive"]),
+                                self.default_deadline_s if deadline_s is None else deadline_s)
+        except BaseException:
+            self._client_done(client_id)
+            raise
+        self._track(backend, 1)
+        return Ticket(self, queue, client_id)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "backends": {name: q.stats() for name, q in self.queues.items()},
+            "clients_in_flight": len(self.clients),
+            "rejected_client_cap": self.rejected_client_cap,
+            "rejected_rate": self.rejected_rate,
+        }
+        if self.shared is not None:
+            self._flush_active()
+            stats["service_active"] = {key.split(":", 1)[1]: value
+                                       for key, value in self.shared.totals("active:").items()}
+        return stats
+
+
+# Instancia compartida por las rutas del proxy.
+admission = AdmissionController()
@@ -0,0 +1,694 @@
+# jobs.py - Trabajos asíncronos del gateway CIAN
+#
+# Para generaciones largas: POST /api/v1/jobs encola la petición y responde 202 al
+# instante con su id. El cliente consulta GET /jobs/{id} (estado y progreso), recoge
+# GET /jobs/{id}/result, o se engancha a GET /jobs/{id}/events (NDJSON con el texto
+# generado hasta ahora y lo que siga llegando), también tras perder la conexión. Si la
+# petición trae `callback_url`, CIAN le hace POST con el trabajo al terminar (sólo a
+# hosts de GWA_JOB_CALLBACK_HOSTS o, si no se configura, a direcciones públicas).
+#
+# Los trabajos viven en SQLite (GWA_JOB_DB) y sobreviven a un reinicio del gateway.
+# GWA_JOB_WORKERS tareas toman trabajos de la cola (prioridad y orden de llegada) con
+# un lease que renuevan mientras generan: si el proceso muere, al vencer el lease
+# cualquier worker, de éste u otro proceso, lo retoma (hasta GWA_JOB_MAX_ATTEMPTS
+# intentos). Cada worker pasa por el control de admisión con la prioridad del trabajo
+# ('batch' por defecto) y llama a /agent/run_stream de MAGENTA por el pool compartido.
+
+import asyncio
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import Field
+
+from gwa_studio_core.core_api import llm_proxy, plans
+from gwa_studio_core.core_api.admission import PRIORITIES, admission, backend_for, client_id_for
+from gwa_studio_core.core_api.metrics import job_seconds, jobs_finished_total, tracer
+from gwa_studio_core.shared_state import split_limit
+from gwa_studio_core.tracing import TRACEPARENT_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Ruta del archivo SQLite de los trabajos (":memory:" = sin persistencia, para pruebas).
+JOB_DB = os.environ.get("GWA_JOB_DB", "gwa_jobs.db").strip(' "')
+JOB_WORKERS = int(os.environ.get("GWA_JOB_WORKERS", "4"))
+# Un trabajo 'running' cuyo lease vence sin renovarse se da por huérfano y se reintenta.
+JOB_LEASE_S = float(os.environ.get("GWA_JOB_LEASE_S", "30"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("GWA_JOB_MAX_ATTEMPTS", "3"))
+# Cada cuánto mira la cola un worker ocioso (un submit en este proceso lo despierta antes).
+JOB_POLL_S = float(os.environ.get("GWA_JOB_POLL_S", "1"))
+# Espera máxima en el control de admisión: un trabajo no tiene prisa, pero no debe bloquear un worker para siempre.
+JOB_ADMISSION_DEADLINE_S = float(os.environ.get("GWA_JOB_ADMISSION_DEADLINE_S", "600"))
+# Los trabajos terminados se borran pasado este tiempo (0 = nunca).
+JOB_RETENTION_S = float(os.environ.get("GWA_JOB_RETENTION_S", str(7 * 24 * 3600)))
+JOB_CALLBACK_RETRIES = int(os.environ.get("GWA_JOB_CALLBACK_RETRIES", "3"))
+# Hosts a los que se puede avisar con callback_url, separados por comas ("*.dominio" admite
+# subdominios). Vacío = cualquier host público: se rechazan localhost, loopback, redes
+# privadas, link-local y demás direcciones reservadas, también si el nombre resuelve a
+# una de ellas, para que un cliente no use el gateway contra servicios internos (MAGENTA).
+JOB_CALLBACK_HOSTS = tuple(h.strip().lower() for h in os.environ.get("GWA_JOB_CALLBACK_HOSTS", "").split(",")
+                           if h.strip(' "'))
+# Sin novedades, /events envía un evento 'progress' con esta cadencia (el cliente no se cree colgado).
+JOB_EVENTS_HEARTBEAT_S = float(os.environ.get("GWA_JOB_EVENTS_HEARTBEAT_S", "5"))
+
+TERMINAL = ("done", "error", "cancelled")
+NDJSON_MEDIA_TYPE = llm_proxy.NDJSON_MEDIA_TYPE
+
+router = APIRouter()
+
+
+class JobRequest(llm_proxy.ProxyAgentExecutionRequest):
+    callback_url: Optional[str] = Field(None, pattern=r"^https?://", description="URL a la que CIAN hace POST con el trabajo al terminar (host de GWA_JOB_CALLBACK_HOSTS o público).")
+
+
+def _listed_host(host: str) -> bool:
+    return any(host == pattern or (pattern.startswith("*.") and host.endswith(pattern[1:]))
+               for pattern in JOB_CALLBACK_HOSTS)
+
+
+def _public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_callback_url(url: str) -> None:
+    """ValueError si `url` no es un destino de aviso permitido (comprobación al encolar, sin DNS)."""
+    try:
+        parsed = httpx.URL(url)
+    except httpx.InvalidURL as e:
+        raise ValueError(f"callback_url no es una URL válida: {e}")
+    host = parsed.host.lower()
+    if parsed.scheme not in ("http", "https") or not host:
+        raise ValueError("callback_url debe ser una URL http(s) con host.")
+    if JOB_CALLBACK_HOSTS:
+        if not _listed_host(host):
+            raise ValueError(f"El host '{host}' de callback_url no está permitido (GWA_JOB_CALLBACK_HOSTS).")
+        return
+    if host == "localhost" or host.endswith(".localhost"):
+        raise ValueError("callback_url no puede apuntar a localhost.")
+    try:
+        public = _public_address(host)
+    except ValueError:
+        return  # un nombre: se resuelve y comprueba al avisar
+    if not public:
+        raise ValueError(f"callback_url no puede apuntar a una dirección privada o reservada ({host}).")
+
+
+async def _resolves_to_public(url: str) -> bool:
+    """Al avisar: sin lista de hosts, todas las direcciones del nombre deben ser públicas."""
+    if JOB_CALLBACK_HOSTS:
+        return True
+    parsed = httpx.URL(url)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parsed.host, parsed.port or 443)
+    except OSError:
+        return False
+    return bool(infos) and all(_public_address(info[4][0]) for info in infos)
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class JobStore:
+    """Cola y estado de los trabajos en SQLite; segura entre hilos y entre procesos (WAL + UPDATE atómico)."""
+
+    def __init__(self, db_path: str = JOB_DB):
+        self.db_path = db_path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Se abre al primer uso: importar el gateway no crea el archivo.
+        if self._db is None:
+            db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=10)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL, client_id TEXT NOT NULL, "
+                "dedupe_key TEXT NOT NULL, request TEXT NOT NULL, callback_url TEXT, created_at REAL NOT NULL, "
+                "available_at REAL NOT NULL, started_at REAL, finished_at REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "worker TEXT, lease_until REAL, progress TEXT NOT NULL DEFAULT '{}', result TEXT, error TEXT, "
+                "error_code INTEGER, callback_status TEXT)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created_at)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status)")
+            self._db = db
+        return self._db
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn().execute(sql, params)
+
+    def submit(self, request: Dict[str, Any], client_id: str, priority: str = "batch",
+               callback_url: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Encola un trabajo. Si el mismo cliente ya tiene uno idéntico en cola o en curso,
+        devuelve ése (created=False): reenviar tras un corte no lanza otra generación.
+        """
+        dedupe_key = hashlib.sha256(_dumps([client_id, request]).encode("utf-8")).hexdigest()
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT * FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                                 (dedupe_key,)).fetchone()
+                if row is None:
+                    job_id = uuid.uuid4().hex
+                    db.execute(
+                        "INSERT INTO jobs (id, status, priority, client_id, dedupe_key, request, callback_url, "
+                        "created_at, available_at, progress) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, PRIORITIES.get(priority, PRIORITIES["batch"]), client_id, dedupe_key,
+                         _dumps(request), callback_url, now, now, _dumps({"stage": "queued", "tokens": 0, "chars": 0})),
+                    )
+                    row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                    created = True
+                else:
+                    created = False
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return dict(row), created
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def position(self, job: Dict[str, Any]) -> int:
+        """Trabajos en cola por delante de éste (misma prioridad o mejor, llegados antes)."""
+        row = self._execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority < ? OR (priority = ? AND created_at < ?))",
+            (job["priority"], job["priority"], job["created_at"]),
+        ).fetchone()
+        return row[0]
+
+    def claim(self, worker: str, lease_s: float = JOB_LEASE_S) -> Optional[Dict[str, Any]]:
+        """Toma el siguiente trabajo listo (o uno en curso con el lease vencido) para `worker`."""
+        now = time.time()
+        row = self._execute(
+            "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+            "started_at = COALESCE(started_at, ?) WHERE id = ("
+            "SELECT id FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+            "OR (status = 'running' AND lease_until < ?) ORDER BY priority, created_at LIMIT 1) RETURNING *",
+            (worker, now + lease_s, now, now, now),
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def heartbeat(self, job_id: str, worker: str, progress: Dict[str, Any], lease_s: float = JOB_LEASE_S) -> bool:
+        """Renueva el lease y guarda el progreso. False si el trabajo ya no es de este worker (cancelado o retomado)."""
+        cursor = self._execute(
+            "UPDATE jobs SET lease_until = ?, progress = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + lease_s, _dumps(progress), job_id, worker),
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, worker: str, result: Dict[str, Any], progress: Dict[str, Any]) -> bool:
+        cursor = self._execute(
+            "UPDATE jobs SET status = 'done', result = ?, progress = ?, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (_dumps(result), _dumps(progress), time.time(), job_id, worker),
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker: str, code: int, detail: str, progress: Dict[str, Any]) -> bool:
+        cursor = self._execute(
+            "UPDATE jobs SET status = 'error', error_code = ?, error = ?, progress = ?, finished_at = ?, "
+            "lease_until = NULL WHERE id = ? AND worker = ? AND status = 'running'",
+            (code, detail, _dumps(progress), time.time(), job_id, worker),
+        )
+        return cursor.rowcount == 1
+
+    def retry(self, job_id: str, worker: str, delay_s: float, count_attempt: bool = True) -> bool:
+        """Devuelve el trabajo a la cola, disponible dentro de `delay_s`."""
+        cursor = self._execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, available_at = ?, "
+            "attempts = attempts - ?, progress = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + delay_s, 0 if count_attempt else 1, _dumps({"stage": "queued", "tokens": 0, "chars": 0}),
+             job_id, worker),
+        )
+        return cursor.rowcount == 1
+
+    def cancel(self, job_id: str) -> bool:
+        cursor = self._execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status IN ('queued', 'running')",
+            (time.time(), job_id),
+        )
+        return cursor.rowcount == 1
+
+    def set_callback_status(self, job_id: str, status: str) -> None:
+        self._execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+
+    def pending_callbacks(self) -> List[Dict[str, Any]]:
+        rows = self._execute(
+            "SELECT * FROM jobs WHERE callback_url IS NOT NULL AND callback_status IS NULL "
+            "AND status IN ('done', 'error', 'cancelled')"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def purge(self, older_than_s: float = JOB_RETENTION_S) -> int:
+        if older_than_s <= 0:
+            return 0
+        cursor = self._execute("DELETE FROM jobs WHERE status IN ('done', 'error', 'cancelled') AND finished_at < ?",
+                               (time.time() - older_than_s,))
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def public_job(job: Dict[str, Any], store: Optional[JobStore] = None) -> Dict[str, Any]:
+    """Vista del trabajo para el cliente (sin la petición ni el resultado completos)."""
+    view = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "priority": next((name for name, value in PRIORITIES.items() if value == job["priority"]), "batch"),
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "attempts": job["attempts"],
+        "progress": json.loads(job["progress"] or "{}"),
+        "poll_url": f"/api/v1/jobs/{job['id']}",
+        "result_url": f"/api/v1/jobs/{job['id']}/result",
+        "events_url": f"/api/v1/jobs/{job['id']}/events",
+    }
+    if job["status"] == "queued" and store is not None:
+        view["position"] = store.position(job)
+    if job["status"] == "error":
+        view["error"] = {"status_code": job["error_code"], "detail": job["error"]}
+    if job["callback_url"]:
+        view["callback_status"] = job["callback_status"]
+    return view
+
+
+class LiveJob:
+    """Texto generado por un trabajo en curso en este proceso; /events lo sigue sin tocar SQLite."""
+
+    __slots__ = ("chunks", "tokens", "chars", "stage", "_changed")
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.tokens = 0
+        self.chars = 0
+        self.stage = "admission"
+        self._changed = asyncio.Event()
+
+    def progress(self) -> Dict[str, Any]:
+        return {"stage": self.stage, "tokens": self.tokens, "chars": self.chars}
+
+    def notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _JobFailed(Exception):
+    def __init__(self, status_code: int, detail: str, retryable: bool):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retryable = retryable
+
+
+class _Requeued(Exception):
+    """El trabajo volvió a la cola sin ejecutarse (sin plaza en el control de admisión)."""
+
+
+class JobRunner:
+    """
+    Workers que consumen la cola de JobStore contra MAGENTA, y avisos de fin por callback.
+    Las llamadas a JobStore van por asyncio.to_thread: la base es de todos los procesos
+    de CIAN y esperar su bloqueo de escritura no debe parar el event loop.
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS, lease_s: float = JOB_LEASE_S,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, poll_s: float = JOB_POLL_S,
+                 callback_transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.store = store
+        self.workers = workers
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.poll_s = poll_s
+        self.callback_transport = callback_transport
+        self.instance = uuid.uuid4().hex[:8]
+        self.live: Dict[str, LiveJob] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._callbacks: "set[asyncio.Task]" = set()
+
+    def wake(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self) -> None:
+        if self._tasks or self.workers <= 0:
+            return
+        self._wake = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work(f"{self.instance}-{i}")) for i in range(self.workers)]
+        self._tasks.append(loop.create_task(self._resume()))
+
+    async def _resume(self) -> None:
+        try:
+            await asyncio.to_thread(self.store.purge)
+            # Avisos que quedaron pendientes si el gateway se paró justo al terminar un trabajo.
+            for job in await asyncio.to_thread(self.store.pending_callbacks):
+                self._schedule_callback(job)
+        except sqlite3.Error as e:
+            logger.error(f"No se pudo revisar la cola de trabajos al arrancar: {e}")
+
+    async def aclose(self) -> None:
+        tasks = self._tasks + list(self._callbacks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._callbacks.clear()
+
+    async def _work(self, worker: str) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim, worker, self.lease_s)
+            except sqlite3.Error as e:
+                logger.error(f"No se pudo leer la cola de trabajos: {e}")
+                job = None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_s)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run(job, worker)
+            except Exception as e:
+                logger.error(f"Error inesperado en el trabajo {job['id']}: {e}")
+
+    async def run(self, job: Dict[str, Any], worker: str) -> None:
+        """Ejecuta un trabajo ya reclamado por `worker` hasta dejarlo terminado o de vuelta en la cola."""
+        job_id = job["id"]
+        if job["attempts"] > self.max_attempts:
+            await asyncio.to_thread(self.store.fail, job_id, worker, 500,
+                                    f"Abandonado tras {self.max_attempts} intentos.", json.loads(job["progress"] or "{}"))
+            await self._finished(job_id, "error", job)
+            return
+
+        live = self.live[job_id] = LiveJob()
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(job_id, worker, live))
+        request = json.loads(job["request"])
+        span = tracer.start_trace("job", None, job_id=job_id, model=request.get("model_name", ""),
+                                  attempt=job["attempts"]).start()
+        started = time.perf_counter()
+        job_seconds.observe(max(0.0, time.time() - job["created_at"]), stage="queue_wait")
+        try:
+            output = await self._generate(job_id, request, worker, live, span)
+        except _JobFailed as e:
+            span.set_error(e.detail)
+            if e.retryable and job["attempts"] < self.max_attempts:
+                # 1 s, 2 s, 4 s...: MAGENTA caído o backend saturado.
+                await asyncio.to_thread(self.store.retry, job_id, worker, 2 ** (job["attempts"] - 1))
+                logger.warning(f"Trabajo {job_id} reintentado ({job['attempts']}/{self.max_attempts}): {e.detail}")
+            elif await asyncio.to_thread(self.store.fail, job_id, worker, e.status_code, e.detail, live.progress()):
+                await self._finished(job_id, "error", job)
+        except _Requeued:
+            pass
+        except asyncio.CancelledError:
+            # Parada del gateway: el trabajo vuelve a la cola sin gastar un intento.
+            await asyncio.to_thread(self.store.retry, job_id, worker, 0, count_attempt=False)
+            raise
+        else:
+            if output is not None:
+                live.stage = "done"
+                if await asyncio.to_thread(self.store.finish, job_id, worker, output, live.progress()):
+                    job_seconds.observe(time.perf_counter() - started, stage="run")
+                    await self._finished(job_id, "done", job)
+                    await plans.record([plans.agent_plan(request, output)])
+        finally:
+            heartbeat.cancel()
+            span.end()
+            self.live.pop(job_id, None)
+            live.notify()
+
+    async def _heartbeat(self, job_id: str, worker: str, live: LiveJob) -> None:
+        # Renueva el lease y publica el progreso; si el trabajo se canceló (aquí o en otro
+        # proceso) o lo retomó otro worker, se corta la generación.
+        while True:
+            await asyncio.sleep(self.lease_s / 3)
+            if not await asyncio.to_thread(self.store.heartbeat, job_id, worker, live.progress(), self.lease_s):
+                live.stage = "cancelled"
+                live.notify()
+                return
+
+    async def _generate(self, job_id: str, request: Dict[str, Any], worker: str, live: LiveJob,
+                        span) -> Optional[Dict[str, Any]]:
+        model_name = request.get("model_name", "")
+        try:
+            ticket = await admission.admit(backend_for(model_name), priority=await self._priority_name(job_id),
+                                           client_id=f"jobs-{worker}", deadline_s=JOB_ADMISSION_DEADLINE_S)
+        except HTTPException as e:
+            # Cola del backend llena: se vuelve a intentar más tarde sin contar como intento.
+            retry_after = float((e.headers or {}).get("Retry-After", "1"))
+            await asyncio.to_thread(self.store.retry, job_id, worker, retry_after, count_attempt=False)
+            raise _Requeued()
+
+        client = llm_proxy.get_magenta_client()
+        live.stage = "generating"
+        live.notify()
+        try:
+            async with client.stream("POST", "/agent/run_stream", json=llm_proxy._build_magenta_payload(
+                    llm_proxy.ProxyAgentExecutionRequest(**request)),
+                    headers={TRACEPARENT_HEADER: span.context.traceparent}) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    error = llm_proxy._magenta_error(response)
+                    raise _JobFailed(error.status_code, str(error.detail), retryable=error.status_code >= 500)
+                async for line in response.aiter_lines():
+                    if live.stage == "cancelled":
+                        return None
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "token":
+                        live.chunks.append(event["text"])
+                        live.tokens += 1
+                        live.chars += len(event["text"])
+                        live.notify()
+                    elif event["type"] == "error":
+                        raise _JobFailed(502, event.get("detail", "Error del modelo."), retryable=True)
+                    elif event["type"] == "result":
+                        return event["output"]
+        except httpx.HTTPError as e:
+            error = llm_proxy._connection_error(e)
+            raise _JobFailed(error.status_code, str(error.detail), retryable=True)
+        finally:
+            ticket.release()
+        raise _JobFailed(502, "MAGENTA cerró el stream sin resultado.", retryable=True)
+
+    async def _priority_name(self, job_id: str) -> str:
+        job = await asyncio.to_thread(self.store.get, job_id)
+        value = job["priority"] if job is not None else PRIORITIES["batch"]
+        return next((name for name, v in PRIORITIES.items() if v == value), "batch")
+
+    async def _finished(self, job_id: str, status: str, job: Dict[str, Any]) -> None:
+        jobs_finished_total.inc(status=status)
+        job_seconds.observe(max(0.0, time.time() - job["created_at"]), stage="total")
+        if job["callback_url"]:
+            self._schedule_callback(await asyncio.to_thread(self.store.get, job_id))
+
+    def _schedule_callback(self, job: Optional[Dict[str, Any]]) -> None:
+        if job is None:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._callback(job))
+        except RuntimeError:
+            return
+        self._callbacks.add(task)
+        task.add_done_callback(self._callbacks.discard)
+
+    async def _callback(self, job: Dict[str, Any]) -> None:
+        body = {**public_job(job), "result": json.loads(job["result"]) if job["result"] else None}
+        status = "failed"
+        try:
+            check_callback_url(job["callback_url"])
+            allowed = await _resolves_to_public(job["callback_url"])
+        except ValueError:
+            allowed = False
+        if not allowed:
+            # También los avisos guardados antes de cambiar GWA_JOB_CALLBACK_HOSTS.
+            await asyncio.to_thread(self.store.set_callback_status, job["id"], "blocked")
+            logger.warning(f"Aviso del trabajo {job['id']} bloqueado: {job['callback_url']} no es un destino permitido.")
+            return
+        async with httpx.AsyncClient(timeout=10, transport=self.callback_transport) as client:
+            for attempt in range(JOB_CALLBACK_RETRIES):
+                try:
+                    response = await client.post(job["callback_url"], json=body)
+                    if response.status_code < 400:
+                        status = "ok"
+                        break
+                    status = f"failed: HTTP {response.status_code}"
+                except httpx.HTTPError as e:
+                    status = f"failed: {e.__class__.__name__}"
+                await asyncio.sleep(2 ** attempt)
+        await asyncio.to_thread(self.store.set_callback_status, job["id"], status)
+        if status != "ok":
+            logger.warning(f"No se pudo avisar del fin del trabajo {job['id']} a {job['callback_url']}: {status}")
+
+
+# Instancias compartidas por las rutas y el lifespan de CIAN. GWA_JOB_WORKERS es del
+# servicio: con varios workers de CIAN cada proceso arranca su parte.
+job_store = JobStore()
+job_runner = JobRunner(job_store, workers=split_limit(JOB_WORKERS))
+
+
+def _get_job(job_id: str) -> Dict[str, Any]:
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo '{job_id}' no encontrado.")
+    return job
+
+
+# --- Rutas (montadas en /api/v1) ---
+
+@router.post("/jobs", status_code=202, summary="Encola una ejecución del agente y devuelve el id del trabajo")
+async def submit_job(request: JobRequest, http_request: Request):
+    """
+    Responde 202 al instante. Prioridad con X-GWA-Priority (por defecto 'batch') y
+    cliente como en el control de admisión (X-Client-Id de un front-end de confianza o
+    la IP del llamador). Reenviar la misma petición mientras sigue en curso devuelve el
+    mismo trabajo (200) en lugar de crear otro.
+    """
+    headers = http_request.headers
+    client_id = client_id_for(http_request)
+    priority = headers.get("x-gwa-priority", "batch")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Prioridad desconocida: '{priority}'.")
+    if request.callback_url is not None:
+        try:
+            check_callback_url(request.callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    job, created = await asyncio.to_thread(job_store.submit, request.model_dump(exclude={"callback_url"}),
+                                           client_id, priority, request.callback_url)
+    if created:
+        job_runner.wake()
+    view = await asyncio.to_thread(public_job, job, job_store)
+    return JSONResponse(view, status_code=202 if created else 200, headers={"Location": view["poll_url"]})
+
+
+@router.get("/jobs/stats", summary="Trabajos por estado y workers de este proceso")
+def get_job_stats():
+    return {"counts": job_store.counts(), "workers": job_runner.workers, "running_here": len(job_runner.live)}
+
+
+@router.get("/jobs/{job_id}", summary="Estado y progreso de un trabajo")
+def get_job(job_id: str):
+    job = _get_job(job_id)
+    view = public_job(job, job_store)
+    live = job_runner.live.get(job_id)
+    if live is not None:
+        view["progress"] = live.progress()
+    return view
+
+
+@router.get("/jobs/{job_id}/result", summary="Resultado de un trabajo (202 mientras no termina)")
+def get_job_result(job_id: str):
+    job = _get_job(job_id)
+    if job["status"] == "done":
+        return json.loads(job["result"])
+    if job["status"] == "error":
+        raise HTTPException(status_code=job["error_code"] or 500, detail=job["error"])
+    if job["status"] == "cancelled":
+        raise HTTPException(status_code=409, detail="El trabajo fue cancelado.")
+    return JSONResponse(public_job(job, job_store), status_code=202, headers={"Retry-After": "2"})
+
+
+@router.delete("/jobs/{job_id}", summary="Cancela un trabajo en cola o en curso")
+async def cancel_job(job_id: str):
+    # En el event loop (no en el threadpool) para avisar al LiveJob; SQLite, en un hilo.
+    job = await asyncio.to_thread(_get_job, job_id)
+    if not await asyncio.to_thread(job_store.cancel, job_id):
+        raise HTTPException(status_code=409, detail=f"El trabajo ya terminó ({job['status']}).")
+    live = job_runner.live.get(job_id)
+    if live is not None:
+        live.stage = "cancelled"
+        live.notify()
+    jobs_finished_total.inc(status="cancelled")
+    return public_job(await asyncio.to_thread(job_store.get, job_id))
+
+
+async def _job_events(job_id: str) -> AsyncIterator[str]:
+    sent = 0
+    live: Optional[LiveJob] = None
+    while True:
+        current = job_runner.live.get(job_id)
+        if live is not None and sent < len(live.chunks):
+            # Al (re)conectarse llega de una vez todo lo generado hasta ahora; también
+            # lo último que llegó justo antes de terminar el trabajo.
+            yield _dumps({"type": "token", "text": "".join(live.chunks[sent:])}) + "\n"
+            sent = len(live.chunks)
+            continue
+        if current is not None:
+            if current is not live:
+                live, sent = current, 0
+                continue
+            yield _dumps({"type": "progress", "status": "running", "progress": live.progress()}) + "\n"
+            await live.wait(JOB_EVENTS_HEARTBEAT_S)
+            continue
+
+        live = None
+        job = await asyncio.to_thread(job_store.get, job_id)
+        if job is None:
+            return
+        if job["status"] == "done":
+            yield _dumps({"type": "result", "output": json.loads(job["result"])}) + "\n"
+            return
+        if job["status"] in ("error", "cancelled"):
+            detail = job["error"] if job["status"] == "error" else "El trabajo fue cancelado."
+            yield _dumps({"type": "error", "status": job["status"], "detail": detail}) + "\n"
+            return
+        # En cola, o en curso en otro proceso: sólo hay el progreso guardado en SQLite.
+        view = await asyncio.to_thread(public_job, job, job_store)
+        yield _dumps({"type": "progress", **{k: v for k, v in view.items()
+                                             if k in ("status", "progress", "position")}}) + "\n"
+        # Se vuelve a SQLite cada segundo, pero si un worker de este proceso lo toma se engancha enseguida.
+        for _ in range(20):
+            await asyncio.sleep(min(1.0, JOB_EVENTS_HEARTBEAT_S) / 20)
+            if job_id in job_runner.live:
+                break
+
+
+@router.get("/jobs/{job_id}/events", summary="Sigue un trabajo en NDJSON (token, progress, result/error)")
+async def get_job_events(job_id: str):
+    """
+    Se puede abrir en cualquier momento, también tras una desconexión: primero llega el
+    texto ya generado y luego el resto a medida que se produce; cierra con 'result' o 'error'.
+    """
+    await asyncio.to_thread(_get_job, job_id)
+    return StreamingResponse(_job_events(job_id), media_type=NDJSON_MEDIA_TYPE, headers=llm_proxy.STREAM_HEADERS)
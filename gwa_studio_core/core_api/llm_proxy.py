@@ -1,39 +1,121 @@
-# llm_proxy.py (VERSIÓN FINAL Y CORREGIDA PARA ELIMINAR COMILLAS)
+# llm_proxy.py (VERSIÓN ASÍNCRONA CON POOL DE CONEXIONES A MAGENTA)
 
 import os
-from fastapi import APIRouter, HTTPException
-from typing import Dict, Any, List
+import time
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Dict, Any, List, Literal, Optional
 from pydantic import BaseModel, Field
-import requests
-from requests.exceptions import ConnectionError, Timeout, RequestException
-import json
+import httpx
+
+from gwa_studio_core.core_api.admission import Ticket, admission, backend_for, client_id_for
+from gwa_studio_core.core_api import plans
+from gwa_studio_core.core_api.metrics import RequestTimer
+from gwa_studio_core.encoding import EncodedJSONResponse, loads, parse_fields, select_fields
+from gwa_studio_core.metrics import OTHER_LABEL
+from gwa_studio_core.tracing import TRACEPARENT_HEADER, Span
 
 router = APIRouter()
 
 # --- 1. Definición de Modelos Pydantic para el Proxy ---
 class ProxyAgentExecutionRequest(BaseModel):
+    model_name: str = Field("gemini-2.5-flash", description="Modelo LLM; MAGENTA lo enruta a Gemini ('gemini-*') o al pool de Ollama.")
     template_name: str = Field(..., description="Nombre de la plantilla de prompt a usar.")
     context: Dict[str, Any] = Field(..., description="Variables de contexto para inyectar en la plantilla.")
     user_prompt: str = Field(..., description="La pregunta o instrucción específica del usuario.")
+    cache_mode: Literal["use", "refresh", "bypass"] = Field("use", description="Uso de la caché de respuestas de MAGENTA: 'use', 'refresh' o 'bypass'.")
+
+# Mismo límite que MAGENTA (GWA_BATCH_MAX_ITEMS): un lote mayor se rechaza aquí con 422
+# antes de ocupar plaza en la cola de admisión.
+BATCH_MAX_ITEMS = int(os.environ.get("GWA_BATCH_MAX_ITEMS", "500"))
+
+class ProxyBatchRequest(BaseModel):
+    items: List[ProxyAgentExecutionRequest] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS, description="Peticiones a ejecutar en lote.")
+    concurrency: Optional[int] = Field(None, ge=1, description="Ejecuciones simultáneas en MAGENTA (acotado por su configuración).")
 
 class AgentOutput(BaseModel):
-    status: str = Field(..., description="Estado de la ejecución: 'ok' o 'parse_fail'.")
+    status: str = Field(..., description="Estado de la ejecución: 'ok', 'parse_fail' o 'schema_fail'.")
     raw_text: str = Field(..., description="Texto crudo de la respuesta del LLM.")
     result_json: Dict[str, Any] = Field(..., description="El output JSON estructurado.")
     model_used: str = Field(..., description="Modelo LLM utilizado.")
     prompt_template: str = Field(..., description="Nombre de la plantilla de prompt utilizada.")
+    context_budget: Optional[Dict[str, Any]] = Field(None, description="num_ctx/num_predict elegidos por MAGENTA y campos del contexto recortados.")
+    validation: Optional[Dict[str, Any]] = Field(None, description="Validación de MAGENTA contra el esquema de salida de la plantilla y reparaciones.")
 
 
 # --- 2. URLs y Configuración de Conexión ---
 # 💥 CORRECCIÓN CRÍTICA: Elimina comillas y espacios al leer la variable de entorno.
-MAGENTA_BASE_URL = os.environ.get("MAGENTA_BASE_URL", "http://localhost:8001").strip(' "') 
-FIXED_INTERNAL_TOKEN = "gwa_token_magenta" 
+MAGENTA_BASE_URL = os.environ.get("MAGENTA_BASE_URL", "http://localhost:8001").strip(' "')
+FIXED_INTERNAL_TOKEN = "gwa_token_magenta"
 
 INTERNAL_HEADERS = {
     "Authorization": f"Bearer {FIXED_INTERNAL_TOKEN}",
     "Content-Type": "application/json"
 }
 
+# Pool de conexiones keep-alive hacia MAGENTA. Una generación lenta sólo ocupa
+# un socket del pool (no un worker del threadpool), así que el límite real de
+# concurrencia es MAGENTA_MAX_CONNECTIONS.
+MAGENTA_MAX_CONNECTIONS = int(os.environ.get("MAGENTA_MAX_CONNECTIONS", "500"))
+MAGENTA_MAX_KEEPALIVE = int(os.environ.get("MAGENTA_MAX_KEEPALIVE", "100"))
+MAGENTA_KEEPALIVE_EXPIRY = float(os.environ.get("MAGENTA_KEEPALIVE_EXPIRY", "60"))
+MAGENTA_CONNECT_TIMEOUT = float(os.environ.get("MAGENTA_CONNECT_TIMEOUT", "10"))
+MAGENTA_READ_TIMEOUT = float(os.environ.get("MAGENTA_READ_TIMEOUT", "600"))
+# Tiempo máximo esperando un socket libre cuando el pool está lleno.
+MAGENTA_POOL_TIMEOUT = float(os.environ.get("MAGENTA_POOL_TIMEOUT", "30"))
+
+# Campos que CIAN pide siempre a MAGENTA en /run aunque el cliente no los quiera (almacén de planes).
+PLAN_FIELDS = ("status", "result_json", "model_used", "prompt_template")
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Evita que proxies intermedios acumulen el stream antes de reenviarlo.
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+_magenta_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_magenta_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=MAGENTA_BASE_URL,
+        headers=INTERNAL_HEADERS,
+        limits=httpx.Limits(
+            max_connections=MAGENTA_MAX_CONNECTIONS,
+            max_keepalive_connections=MAGENTA_MAX_KEEPALIVE,
+            keepalive_expiry=MAGENTA_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            MAGENTA_READ_TIMEOUT,
+            connect=MAGENTA_CONNECT_TIMEOUT,
+            pool=MAGENTA_POOL_TIMEOUT,
+        ),
+        transport=transport,
+    )
+
+
+async def open_magenta_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    """Abre el pool de conexiones hacia MAGENTA (se llama en el lifespan de CIAN)."""
+    global _magenta_client
+    if _magenta_client is None:
+        _magenta_client = _build_magenta_client(transport)
+    return _magenta_client
+
+
+async def close_magenta_client() -> None:
+    """Cierra el pool y libera los sockets keep-alive (lifespan de CIAN)."""
+    global _magenta_client
+    if _magenta_client is not None:
+        await _magenta_client.aclose()
+        _magenta_client = None
+
+
+def get_magenta_client() -> httpx.AsyncClient:
+    """Devuelve el cliente compartido. Si el router se monta sin lifespan, lo crea bajo demanda."""
+    global _magenta_client
+    if _magenta_client is None:
+        _magenta_client = _build_magenta_client()
+    return _magenta_client
+
 
 # --- 3. Endpoints del Proxy (CIAN) ---
 
@@ -43,46 +125,233 @@ def list_available_templates_via_proxy():
     raise HTTPException(status_code=501, detail="Endpoint de plantillas no implementado en MAGENTA.")
 
 
-# RUTA FINAL: /run (que se convierte en /api/v1/run)
-@router.post("/run", response_model=AgentOutput, summary="Ejecuta el Agente LLM con plantillas")
-def run_agent_inference_via_proxy( 
-    request: ProxyAgentExecutionRequest
-):
-    model_name = "gemini-2.5-flash"
-    
-    magenta_payload = {
-        "model_name": model_name,
+def _build_magenta_payload(request: ProxyAgentExecutionRequest) -> Dict[str, Any]:
+    return {
+        "model_name": request.model_name,
         "template_name": request.template_name,
         "context": request.context,
-        "user_prompt": request.user_prompt
+        "user_prompt": request.user_prompt,
+        "cache_mode": request.cache_mode,
     }
 
-    magenta_url = f"{MAGENTA_BASE_URL}/agent/run"
-    
-    try:
-        response = requests.post(
-            magenta_url, 
-            json=magenta_payload, 
-            headers=INTERNAL_HEADERS,
-            timeout=600.0
+
+def _connection_error(e: httpx.HTTPError) -> HTTPException:
+    """Traduce los errores de red hacia MAGENTA a un 503 del gateway."""
+    if isinstance(e, httpx.ConnectError):
+        return HTTPException(
+            status_code=503,
+            detail="Error de conexión con Magenta LLM Service. Asegúrese de que el servicio esté corriendo en puerto 8001."
+        )
+    if isinstance(e, httpx.PoolTimeout):
+        return HTTPException(
+            status_code=503,
+            detail="Pool de conexiones hacia MAGENTA saturado. Reintente en unos segundos."
         )
+    return HTTPException(
+        status_code=503,
+        detail=f"Error de conexión con el servicio API (MAGENTA): {e}"
+    )
 
-        if response.status_code != 200:
-            error_detail = response.json().get("detail", f"Error desconocido en Magenta Service. Código: {response.status_code}")
-            raise HTTPException(
-                status_code=response.status_code, 
-                detail=error_detail
+
+def _magenta_error(response: httpx.Response) -> HTTPException:
+    try:
+        error_detail = response.json().get("detail")
+    except ValueError:
+        error_detail = None
+    return HTTPException(
+        status_code=response.status_code,
+        detail=error_detail or f"Error desconocido en Magenta Service. Código: {response.status_code}"
+    )
+
+
+def _request_timer(route: str, model_name: str, template: str, http_request: Request) -> RequestTimer:
+    """Métricas y span 'gateway'; continúa la traza del llamador si envía `traceparent`."""
+    return RequestTimer(route, model_name, template, traceparent=http_request.headers.get(TRACEPARENT_HEADER))
+
+
+def _trace_headers(span: Span) -> Dict[str, str]:
+    """Cabecera W3C hacia MAGENTA (se suma a INTERNAL_HEADERS del pool): el salto es el padre."""
+    return {TRACEPARENT_HEADER: span.context.traceparent}
+
+
+async def _admit(http_request: Request, model_name: str, default_priority: str, timer: RequestTimer) -> Ticket:
+    """
+    Control de admisión: cola por backend con prioridad y deadline, y cupo por cliente.
+    Cabeceras opcionales: X-GWA-Priority (interactive | batch), X-Client-Id (sólo con
+    X-GWA-Frontend-Token; si no, el cliente es la IP) y X-Deadline-Ms (tiempo máximo que
+    el llamador está dispuesto a esperar).
+    """
+    headers = http_request.headers
+    client_id = client_id_for(http_request)
+    deadline_ms = headers.get("x-deadline-ms")
+    try:
+        deadline_s = float(deadline_ms) / 1000 if deadline_ms else None
+    except ValueError:
+        timer.finish(400)
+        raise HTTPException(status_code=400, detail="X-Deadline-Ms debe ser un número de milisegundos.")
+    try:
+        with timer.child_span("admission", backend=backend_for(model_name)):
+            ticket = await admission.admit(
+                backend_for(model_name),
+                priority=headers.get("x-gwa-priority", default_priority),
+                client_id=client_id,
+                deadline_s=deadline_s,
             )
+    except HTTPException as e:
+        timer.finish(e.status_code)
+        raise
+    timer.stage("queue_wait", timer.started)
+    return ticket
+
+
+async def _relay_stream(path: str, payload: Dict[str, Any], ticket: Ticket, timer: RequestTimer,
+                        recorder: Optional[plans.StreamRecorder] = None) -> StreamingResponse:
+    """Abre un stream hacia MAGENTA y lo reenvía tal cual llega, sin acumularlo; `recorder` guarda los planes."""
+    client = get_magenta_client()
+    hop = timer.child_span("proxy_hop", path=path).start()
+    upstream_request = client.build_request("POST", path, json=payload, headers=_trace_headers(hop))
+
+    sent_at = time.perf_counter()
+    try:
+        upstream = await client.send(upstream_request, stream=True)
+    except httpx.HTTPError as e:
+        ticket.release()
+        error = _connection_error(e)
+        hop.set_error(e)
+        hop.end()
+        timer.finish(error.status_code)
+        raise error
+    if upstream.status_code == 200:
+        timer.confirm_labels()
+    timer.stage("upstream", sent_at)
+
+    if upstream.status_code != 200:
+        await upstream.aread()
+        await upstream.aclose()
+        ticket.release()
+        hop.end()
+        timer.finish(upstream.status_code)
+        raise _magenta_error(upstream)
+
+    async def body():
+        # La plaza de la cola se ocupa hasta que termina el stream, no sólo hasta las
+        # cabeceras; se libera también si el cliente se desconecta a mitad.
+        try:
+            async for chunk in upstream.aiter_raw():
+                if recorder is not None:
+                    recorder.feed(chunk)
+                yield chunk
+            if recorder is not None:
+                await recorder.flush()
+        finally:
+            ticket.release()
+            hop.end()
+            timer.finish(200)
+
+    async def close():
+        try:
+            await upstream.aclose()
+        finally:
+            ticket.release()
+            hop.end()
+            timer.finish(200)
+
+    return StreamingResponse(
+        body(),
+        media_type=upstream.headers.get("content-type", NDJSON_MEDIA_TYPE),
+        headers=STREAM_HEADERS,
+        background=BackgroundTask(close),
+    )
+
+
+# RUTA FINAL: /run (que se convierte en /api/v1/run)
+@router.post("/run", response_model=AgentOutput, summary="Ejecuta el Agente LLM con plantillas")
+async def run_agent_inference_via_proxy(
+    request: ProxyAgentExecutionRequest, http_request: Request,
+    fields: Optional[str] = Query(None, description="Campos del AgentOutput a devolver, separados por comas (p. ej. 'status,result_json' sin raw_text).")
+):
+    """
+    Con `fields` sólo viajan esos campos, también en el salto a MAGENTA. La respuesta
+    sale comprimida (br/gzip) si el cliente lo acepta en Accept-Encoding.
+    """
+    try:
+        selected = parse_fields(fields, AgentOutput.model_fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    upstream_params = {"fields": ",".join(dict.fromkeys(selected + PLAN_FIELDS))} if selected else None
+    client = get_magenta_client()
+
+    timer = _request_timer("run", request.model_name, request.template_name, http_request)
+    ticket = await _admit(http_request, request.model_name, "interactive", timer)
+    sent_at = time.perf_counter()
+    try:
+        with timer.child_span("proxy_hop", path="/agent/run") as hop:
+            response = await client.post("/agent/run", json=_build_magenta_payload(request),
+                                         params=upstream_params, headers=_trace_headers(hop))
+    except httpx.HTTPError as e:
+        error = _connection_error(e)
+        timer.finish(error.status_code)
+        raise error
+    finally:
+        ticket.release()
+    if response.status_code == 200:
+        timer.confirm_labels()
+    timer.stage("upstream", sent_at)
+    timer.finish(response.status_code)
+
+    if response.status_code != 200:
+        raise _magenta_error(response)
+
+    output = loads(response.content)
+    await plans.record([plans.agent_plan(request.model_dump(), output)])
+    return EncodedJSONResponse(select_fields(output, selected),
+                               accept_encoding=http_request.headers.get("accept-encoding", ""))
+
+
+# RUTA: /run_stream (que se convierte en /api/v1/run_stream)
+@router.post("/run_stream", summary="Ejecuta el Agente LLM y devuelve los tokens en streaming (NDJSON)")
+async def run_agent_stream_via_proxy(
+    request: ProxyAgentExecutionRequest, http_request: Request
+):
+    """
+    Reenvía el stream NDJSON de MAGENTA tal cual llega, sin acumularlo.
+    El último evento ('result') trae el AgentOutput completo.
+    """
+    timer = _request_timer("run_stream", request.model_name, request.template_name, http_request)
+    ticket = await _admit(http_request, request.model_name, "interactive", timer)
+    payload = _build_magenta_payload(request)
+    return await _relay_stream("/agent/run_stream", payload, ticket, timer, plans.StreamRecorder([payload]))
+
+
+# RUTA: /run_batch (que se convierte en /api/v1/run_batch)
+@router.post("/run_batch", summary="Ejecuta un lote de peticiones con concurrencia acotada (NDJSON por ítem)")
+async def run_agent_batch_via_proxy(
+    batch: ProxyBatchRequest, http_request: Request
+):
+    """
+    Reenvía el lote a MAGENTA, que lo ejecuta con concurrencia acotada. Cada ítem
+    vuelve como un evento NDJSON en cuanto termina, con su propio 'status'; un
+    'parse_fail' o 'error' en un ítem no corta el lote. Cierra con un evento 'done'.
+    El lote entra en la cola con prioridad 'batch' (detrás de las interactivas) del
+    backend de sus modelos; un lote que mezcla Gemini y Ollama se rechaza con 400.
+    """
+    models = sorted({item.model_name for item in batch.items})
+    backends = sorted({backend_for(model) for model in models})
+    timer = _request_timer("run_batch", models[0] if len(models) == 1 else OTHER_LABEL, "batch", http_request)
+    if len(backends) > 1:
+        timer.finish(400)
+        raise HTTPException(status_code=400, detail=f"El lote mezcla backends ({', '.join(backends)}); "
+                                                    "envía un lote por backend.")
+    payload = {
+        "items": [_build_magenta_payload(item) for item in batch.items],
+        "concurrency": batch.concurrency,
+    }
+    ticket = await _admit(http_request, models[0], "batch", timer)
+    return await _relay_stream("/agent/run_batch", payload, ticket, timer, plans.StreamRecorder(payload["items"]))
+
+
+# RUTA: /admission/stats (que se convierte en /api/v1/admission/stats)
+@router.get("/admission/stats", summary="Profundidad de cola, esperas y rechazos del control de admisión")
+def get_admission_stats():
+    return admission.stats()
 
-        return response.json()
-        
-    except ConnectionError:
-        raise HTTPException(
-            status_code=503, 
-            detail="Error de conexión con Magenta LLM Service. Asegúrese de que el servicio esté corriendo en puerto 8001."
-        )
-    except RequestException as e:
-        raise HTTPException(
-            status_code=503, 
-            detail=f"Error de conexión con el servicio API (MAGENTA): {e}"
-        )
\ No newline at end of file
@@ -1,17 +1,50 @@
 # main.py (CIAN - VERSIÓN FINAL Y COMPROBADA)
 
 from fastapi import FastAPI, HTTPException, Request
-from gwa_studio_core.core_api import llm_proxy 
+from fastapi.responses import PlainTextResponse
+from gwa_studio_core.core_api import jobs, llm_proxy, plans
+from gwa_studio_core.core_api.metrics import metrics, watch_jobs
+from gwa_studio_core.metrics import CONTENT_TYPE
+from gwa_studio_core.readiness import WarmUp, add_health_routes
 # 💥 ¡ESTA LÍNEA DE IMPORTACIÓN FALLIDA FUE ELIMINADA!
 from starlette.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 import logging
 import time
 
+
+async def _start_jobs() -> None:
+    # Abrir (y migrar) la base de trabajos es I/O de disco: fuera del event loop.
+    await asyncio.to_thread(jobs.job_store.counts)
+    jobs.job_runner.start()
+
+
+# /live responde desde el primer momento; /ready cuando la cola de trabajos está en marcha.
+warm_up = WarmUp("cian")
+warm_up.add("jobs", _start_jobs)
+
+
+# --- Ciclo de vida: pool de conexiones hacia MAGENTA y workers de trabajos ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await llm_proxy.open_magenta_client()
+    warm_up.start()
+    try:
+        yield
+    finally:
+        # Los trabajos a medias vuelven a la cola y otro arranque (u otro proceso) los retoma.
+        await warm_up.aclose()
+        await jobs.job_runner.aclose()
+        await llm_proxy.close_magenta_client()
+
+
 # --- Inicialización de FastAPI ---
 app = FastAPI(
     title="Cian Core API - API Gateway de GWA Studio",
     version="1.2.0",
-    description="Servidor de entrada (Proxy)."
+    description="Servidor de entrada (Proxy).",
+    lifespan=lifespan,
 )
 
 # --- Middleware CORS ---
@@ -25,6 +58,10 @@ app.add_middleware(
 
 # 💥 REGISTRO DE RUTA: Define el prefijo /api/v1 💥
 app.include_router(llm_proxy.router, tags=["LLM Proxy"], prefix="/api/v1")
+app.include_router(jobs.router, tags=["Jobs"], prefix="/api/v1")
+app.include_router(plans.router, tags=["Plans"], prefix="/api/v1")
+add_health_routes(app, warm_up, tags=["Base"])
+watch_jobs(jobs.job_store)
 
 
 # --- Endpoints Base ---
@@ -32,4 +69,10 @@ app.include_router(llm_proxy.router, tags=["LLM Proxy"], prefix="/api/v1")
 @app.get("/status", tags=["Base"])
 def get_status():
     """Endpoint de estado para verificar que el servicio está activo."""
-    return {"status": "ok", "service": "Cian Core API"}
\ No newline at end of file
+    return {"status": "ok", "service": "Cian Core API"}
+
+
+@app.get("/metrics", tags=["Base"], response_class=PlainTextResponse)
+def get_metrics():
+    """Métricas en formato de texto Prometheus: etapas, códigos, in-flight y colas de admisión."""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
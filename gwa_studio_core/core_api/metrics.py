@@ -0,0 +1,125 @@
+import time
+from typing import List, Optional, Tuple
+
+from gwa_studio_core.core_api.admission import admission
+from gwa_studio_core.metrics import LabelSet, MetricsRegistry
+from gwa_studio_core.tracing import Span, Tracer, parse_traceparent
+
+# Registro de métricas de CIAN (expuesto en GET /metrics) y trazas del gateway.
+metrics = MetricsRegistry()
+tracer = Tracer("cian")
+
+# Etapas: queue_wait (control de admisión), upstream (hasta las cabeceras de MAGENTA;
+# en /run, la respuesta completa) y total (hasta el último byte reenviado al cliente).
+stage_seconds = metrics.histogram(
+    "gwa_cian_stage_seconds", "Latencia por etapa de una petición al gateway.", ("route", "stage", "model", "template")
+)
+requests_total = metrics.counter(
+    "gwa_cian_requests_total", "Peticiones al gateway por código de respuesta.", ("route", "model", "code")
+)
+# El gateway no conoce las plantillas ni los modelos de MAGENTA: un valor tiene serie
+# propia cuando MAGENTA lo sirvió con 200; hasta entonces, "other".
+model_labels = LabelSet()
+template_labels = LabelSet()
+in_flight = metrics.gauge("gwa_cian_in_flight", "Peticiones en curso en el gateway.", ("route",))
+queue_active = metrics.gauge("gwa_cian_admission_active", "Peticiones con plaza en la cola de admisión.", ("backend",))
+queue_depth = metrics.gauge("gwa_cian_admission_queued", "Peticiones esperando turno.", ("backend",))
+queue_rejected = metrics.gauge(
+    "gwa_cian_admission_rejected", "Rechazos acumulados del control de admisión.", ("backend", "reason")
+)
+
+
+def _collect_admission() -> None:
+    for name, queue in admission.queues.items():
+        queue_active.set(queue.active, backend=name)
+        queue_depth.set(queue.queued, backend=name)
+        for reason, count in queue.rejected.items():
+            queue_rejected.set(count, backend=name, reason=reason)
+    queue_rejected.set(admission.rejected_client_cap, backend="*", reason="client_cap")
+    queue_rejected.set(admission.rejected_rate, backend="*", reason="client_rate")
+
+
+metrics.add_collector(_collect_admission)
+
+# Trabajos asíncronos (jobs.py): queue_wait (de encolado a empezar), run (ejecución que
+# terminó bien) y total (de encolado a terminar, con reintentos).
+job_seconds = metrics.histogram(
+    "gwa_cian_job_seconds", "Duración por etapa de los trabajos asíncronos.", ("stage",),
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+)
+jobs_finished_total = metrics.counter(
+    "gwa_cian_jobs_finished_total", "Trabajos terminados por estado final.", ("status",)
+)
+jobs_by_status = metrics.gauge("gwa_cian_jobs", "Trabajos en el almacén por estado.", ("status",))
+# Almacén de planes (plans.py): 'stored' o 'duplicate' (ya estaba guardado).
+plans_recorded_total = metrics.counter(
+    "gwa_cian_plans_recorded_total", "Planes terminados enviados al almacén de planes.", ("source", "result")
+)
+
+
+def watch_jobs(store) -> None:
+    """Publica en cada scrape los trabajos por estado de `store` (JobStore)."""
+
+    def collect() -> None:
+        counts = store.counts()
+        for status in ("queued", "running", "done", "error", "cancelled"):
+            jobs_by_status.set(counts.get(status, 0), status=status)
+
+    metrics.add_collector(collect)
+
+
+class RequestTimer:
+    """
+    Etapas, in-flight, código final y span 'gateway' de una petición (hijo del
+    traceparent entrante, si lo hay); `finish` es idempotente (streams). Las etapas se
+    publican cuando se sabe si MAGENTA aceptó modelo y plantilla (`confirm_labels`) o
+    al terminar, para que toda la petición quede en la misma serie.
+    """
+
+    def __init__(self, route: str, model: str, template: str, traceparent: Optional[str] = None):
+        self.model = model
+        self.template = template
+        self.labels = {"route": route, "model": model, "template": template}
+        self.started = time.perf_counter()
+        self._finished = False
+        self._pending: Optional[List[Tuple[str, float]]] = []
+        self.span = tracer.start_trace("gateway", parse_traceparent(traceparent), **self.labels).start()
+        in_flight.inc(route=route)
+
+    def child_span(self, name: str, **attributes) -> Span:
+        return tracer.span(name, parent=self.span.context, **attributes)
+
+    def _settle(self) -> None:
+        if self._pending is None:
+            return
+        self.labels.update(model=model_labels(self.model), template=template_labels(self.template))
+        for stage, seconds in self._pending:
+            stage_seconds.observe(seconds, stage=stage, **self.labels)
+        self._pending = None
+
+    def confirm_labels(self) -> None:
+        """MAGENTA aceptó la petición: modelo y plantilla son reales y pasan a tener serie propia."""
+        model_labels.learn(self.model)
+        template_labels.learn(self.template)
+        self._settle()
+
+    def stage(self, stage: str, since: float) -> float:
+        now = time.perf_counter()
+        if self._pending is not None:
+            self._pending.append((stage, now - since))
+        else:
+            stage_seconds.observe(now - since, stage=stage, **self.labels)
+        return now
+
+    def finish(self, code: int) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        in_flight.dec(route=self.labels["route"])
+        self.stage("total", self.started)
+        self._settle()
+        requests_total.inc(route=self.labels["route"], model=self.labels["model"], code=str(code))
+        self.span.set_attribute("status_code", code)
+        if code >= 400:
+            self.span.status = "error"
+        self.span.end()
@@ -0,0 +1,376 @@
+# plans.py - Almacén de planes generados con índice de texto completo (CIAN)
+#
+# Cada generación que termina bien (/run, /run_stream, /run_batch, trabajos y las
+# landings de cian_mini_bridge) se guarda en SQLite (GWA_PLAN_DB). El almacén sólo
+# crece: un plan idéntico (misma plantilla, modelo y resultado; p. ej. un acierto de la
+# caché de MAGENTA) se guarda una vez. Título, resumen, pasos y petición se indexan en
+# una tabla FTS5 sin contenido (sólo el índice). Las filas de `plans` son estrechas
+# (lo que se lista y se filtra); el resultado y el contexto completos están aparte, en
+# `plan_bodies`, y sólo se leen al pedir un plan. Así buscar
+# entre cientos de miles de planes cuesta milisegundos y sale mucho más barato que
+# generar otro:
+#   GET /api/v1/plans                 más recientes primero, filtros y cursor
+#   GET /api/v1/plans/search?q=...    relevancia (bm25) o recientes, filtros y offset
+#   GET /api/v1/plans/{plan_id}       plan completo
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query
+
+from gwa_studio_core.core_api.metrics import plans_recorded_total
+
+logger = logging.getLogger(__name__)
+
+# Ruta del archivo SQLite de los planes (":memory:" = sin persistencia, para pruebas).
+PLAN_DB = os.environ.get("GWA_PLAN_DB", "gwa_plans.db").strip(' "')
+MAX_PAGE = 100
+# Con orden por relevancia se puntúan sólo las N coincidencias más recientes: un término
+# frecuente no obliga a calcular bm25 sobre cientos de miles de planes (0 = todas).
+PLAN_RANK_WINDOW = int(os.environ.get("GWA_PLAN_RANK_WINDOW", "1000"))
+
+# Peso de cada columna del índice en la relevancia: el título pesa más que los pasos.
+_FTS_COLUMNS = ("title", "summary", "body", "prompt")
+_FTS_RANK = "bm25(10.0, 4.0, 1.0, 2.0)"
+# Claves que se usan como título / resumen (planes del agente, plantilla jinja y landings).
+_TITLE_KEYS = ("title", "plan_title", "empresa")
+_SUMMARY_KEYS = ("summary", "model_notes", "slogan")
+# Ni se indexan ni se guardan: HTML renderizado, referencias y metadatos técnicos.
+_SKIP_KEYS = {"visual_html", "web_html", "page_url", "page_id", "metadata"}
+_WORD = re.compile(r"\w+")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _strings(value: Any, skip: Iterable[str] = ()) -> Iterable[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if key not in _SKIP_KEYS and key not in skip:
+                yield from _strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+
+
+def _fingerprint(plan: Dict[str, Any], result: Dict[str, Any]) -> str:
+    # La fecha de generación de las landings (data_json.metadata) no cuenta: mismo contenido, mismo plan.
+    data = result.get("data_json")
+    if isinstance(data, dict) and "metadata" in data:
+        result = {**result, "data_json": {k: v for k, v in data.items() if k != "metadata"}}
+    return hashlib.sha256(_dumps([plan["source"], plan["template"], plan["model"], result]).encode("utf-8")).hexdigest()
+
+
+def plan_text(result: Dict[str, Any]) -> Tuple[str, str, str]:
+    """(título, resumen, resto del texto) de un result_json, sea un plan o los datos de una landing."""
+    data = result.get("data_json") if isinstance(result.get("data_json"), dict) else result
+    title = next((str(data[k]) for k in _TITLE_KEYS if data.get(k)), "")
+    summary = next((str(data[k]) for k in _SUMMARY_KEYS if data.get(k)), "")
+    used = [k for k in _TITLE_KEYS + _SUMMARY_KEYS if k in data]
+    return title, summary, "\n".join(_strings(data, used))
+
+
+def match_query(q: str) -> str:
+    """
+    Texto libre -> consulta FTS5: todas las palabras (entre comillas, sin operadores ni
+    errores de sintaxis) y la última como prefijo, para buscar mientras se escribe.
+    """
+    words = _WORD.findall(q)
+    if not words:
+        raise ValueError("La búsqueda no contiene ninguna palabra.")
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+class PlanStore:
+    """Planes en SQLite con índice FTS5; segura entre hilos y entre procesos (WAL)."""
+
+    def __init__(self, db_path: str = PLAN_DB):
+        self.db_path = db_path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Se abre al primer uso: importar el gateway no crea el archivo.
+        if self._db is None:
+            db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=10)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS plans ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, fingerprint TEXT NOT NULL UNIQUE, source TEXT NOT NULL, "
+                "template TEXT NOT NULL, model TEXT NOT NULL, title TEXT NOT NULL, summary TEXT NOT NULL, "
+                "user_prompt TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            db.execute("CREATE TABLE IF NOT EXISTS plan_bodies ("
+                       "id INTEGER PRIMARY KEY, context TEXT NOT NULL, result TEXT NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS plans_template ON plans (template, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS plans_model ON plans (model, id)")
+            db.execute("CREATE INDEX IF NOT EXISTS plans_created ON plans (created_at)")
+            exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'plans_fts'").fetchone()
+            if exists is None:
+                db.execute(
+                    f"CREATE VIRTUAL TABLE plans_fts USING fts5({', '.join(_FTS_COLUMNS)}, content='', "
+                    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                )
+                db.execute("INSERT INTO plans_fts (plans_fts, rank) VALUES ('rank', ?)", (_FTS_RANK,))
+            self._db = db
+        return self._db
+
+    def add_many(self, plans: Iterable[Dict[str, Any]]) -> List[Optional[int]]:
+        """
+        Guarda planes en una sola transacción. Cada uno: source, template, model, result y,
+        opcionales, user_prompt y context. Devuelve sus ids (None = ya estaba).
+        """
+        ids: List[Optional[int]] = []
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for plan in plans:
+                    result = {k: v for k, v in plan["result"].items() if k != "visual_html"}
+                    fingerprint = _fingerprint(plan, result)
+                    title, summary, body = plan_text(result)
+                    prompt = plan.get("user_prompt") or ""
+                    cursor = db.execute(
+                        "INSERT OR IGNORE INTO plans (fingerprint, source, template, model, title, summary, "
+                        "user_prompt, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (fingerprint, plan["source"], plan["template"], plan["model"], title, summary, prompt,
+                         time.time()),
+                    )
+                    if cursor.rowcount == 0:
+                        ids.append(None)
+                        continue
+                    db.execute("INSERT INTO plan_bodies (id, context, result) VALUES (?, ?, ?)",
+                               (cursor.lastrowid, _dumps(plan.get("context") or {}), _dumps(result)))
+                    db.execute("INSERT INTO plans_fts (rowid, title, summary, body, prompt) VALUES (?, ?, ?, ?, ?)",
+                               (cursor.lastrowid, title, summary, body, prompt))
+                    ids.append(cursor.lastrowid)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return ids
+
+    def add(self, source: str, template: str, model: str, result: Dict[str, Any], user_prompt: str = "",
+            context: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        return self.add_many([{"source": source, "template": template, "model": model, "result": result,
+                               "user_prompt": user_prompt, "context": context}])[0]
+
+    def get(self, plan_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT * FROM plans p JOIN plan_bodies b ON b.id = p.id WHERE p.id = ?", (plan_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {**_summary(row), "context": json.loads(row["context"]), "result": json.loads(row["result"])}
+
+    def _filters(self, id_column: str, template, model, source, since, until) -> Optional[Tuple[str, List[Any]]]:
+        """
+        Condiciones SQL de los filtros; None si el rango de fechas está vacío. Las fechas
+        se traducen a un rango de ids (created_at se pone al insertar y el id crece con él),
+        que FTS5 aplica recorriendo el índice sin leer las filas.
+        """
+        clauses, params = [], []
+        for column, value in (("template", template), ("model", model), ("source", source)):
+            if value:
+                clauses.append(f"p.{column} = ?")
+                params.append(value)
+        for bound, op in ((since, ">="), (until, "<")):
+            if bound is None:
+                continue
+            row = self._conn().execute(
+                "SELECT id FROM plans WHERE created_at >= ? ORDER BY created_at LIMIT 1", (bound,)
+            ).fetchone()
+            if row is None:
+                if op == ">=":
+                    return None
+                continue
+            clauses.append(f"{id_column} {op} ?")
+            params.append(row[0])
+        return "".join(f" AND {c}" for c in clauses), params
+
+    def list(self, template: Optional[str] = None, model: Optional[str] = None, source: Optional[str] = None,
+             since: Optional[float] = None, until: Optional[float] = None, before: Optional[int] = None,
+             limit: int = 20) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Más recientes primero, desde el id `before` (cursor). Devuelve (planes, siguiente cursor)."""
+        with self._lock:
+            filters = self._filters("p.id", template, model, source, since, until)
+            if filters is None:
+                return [], None
+            where, params = filters
+            if before is not None:
+                where += " AND p.id < ?"
+                params.append(before)
+            rows = self._conn().execute(
+                f"SELECT * FROM plans p WHERE 1 = 1{where} ORDER BY p.id DESC LIMIT ?", (*params, limit + 1)
+            ).fetchall()
+        items = [_summary(row) for row in rows[:limit]]
+        return items, (items[-1]["plan_id"] if len(rows) > limit else None)
+
+    def search(self, q: str, template: Optional[str] = None, model: Optional[str] = None,
+               source: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+               sort: str = "relevance", offset: int = 0, limit: int = 20) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Planes que contienen todas las palabras de `q`. Devuelve (planes, hay más). No se
+        cuenta el total: con términos frecuentes obligaría a recorrer todas las coincidencias.
+        """
+        query = match_query(q)
+        with self._lock:
+            filters = self._filters("f.rowid", template, model, source, since, until)
+            if filters is None:
+                return [], False
+            where, params = filters
+            # Por id descendente FTS5 recorre el índice en orden y para al llenar la página (o
+            # la ventana). CROSS JOIN fija el orden: primero el índice, luego la fila del plan.
+            join = " CROSS JOIN plans p ON p.id = f.rowid" if "p." in where else ""
+            matches = f"SELECT f.rowid AS id, f.rank AS rank FROM plans_fts f{join} " \
+                      f"WHERE plans_fts MATCH ?{where} ORDER BY f.rowid DESC"
+            if sort == "relevance" and PLAN_RANK_WINDOW > 0:
+                matches += f" LIMIT {PLAN_RANK_WINDOW}"
+            order = "m.rank" if sort == "relevance" else "m.id DESC"
+            rows = self._conn().execute(
+                f"SELECT p.* FROM ({matches}) m JOIN plans p ON p.id = m.id ORDER BY {order} LIMIT ? OFFSET ?",
+                (query, *params, limit + 1, offset),
+            ).fetchall()
+        return [_summary(row) for row in rows[:limit]], len(rows) > limit
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn().execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def _summary(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "plan_id": row["id"],
+        "source": row["source"],
+        "template": row["template"],
+        "model": row["model"],
+        "title": row["title"],
+        "summary": row["summary"],
+        "user_prompt": row["user_prompt"],
+        "created_at": row["created_at"],
+        "url": f"/api/v1/plans/{row['id']}",
+    }
+
+
+plan_store = PlanStore()
+
+
+def agent_plan(request: Dict[str, Any], output: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Plan a guardar de una petición al agente y su AgentOutput; None si no terminó bien."""
+    if output.get("status") != "ok" or not output.get("result_json"):
+        return None
+    return {"source": "agent", "template": output.get("prompt_template") or request.get("template_name", ""),
+            "model": output.get("model_used") or request.get("model_name", ""), "result": output["result_json"],
+            "user_prompt": request.get("user_prompt", ""), "context": request.get("context")}
+
+
+async def record(plans: Iterable[Optional[Dict[str, Any]]], store: Optional[PlanStore] = None) -> None:
+    """Guarda los planes fuera del event loop. Un fallo del almacén nunca rompe la respuesta."""
+    plans = [plan for plan in plans if plan is not None]
+    if not plans:
+        return
+    store = store or plan_store
+    try:
+        ids = await asyncio.to_thread(store.add_many, plans)
+    except sqlite3.Error as e:
+        logger.error(f"No se pudieron guardar {len(plans)} planes: {e}")
+        return
+    for plan, plan_id in zip(plans, ids):
+        plans_recorded_total.inc(source=plan["source"], result="stored" if plan_id is not None else "duplicate")
+
+
+class StreamRecorder:
+    """
+    Sigue un stream NDJSON de MAGENTA mientras se reenvía byte a byte y se queda con los
+    eventos 'result' (/run_stream) o 'item' (/run_batch); sólo decodifica esas líneas.
+    """
+
+    __slots__ = ("requests", "plans", "_pending")
+
+    def __init__(self, requests: List[Dict[str, Any]]):
+        self.requests = requests
+        self.plans: List[Optional[Dict[str, Any]]] = []
+        self._pending = b""
+
+    def feed(self, chunk: bytes) -> None:
+        lines = (self._pending + chunk).split(b"\n")
+        self._pending = lines.pop()
+        for line in lines:
+            head = line[:32]
+            if b'"result"' not in head and b'"item"' not in head:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("type") == "result" and self.requests:
+                self.plans.append(agent_plan(self.requests[0], event.get("output") or {}))
+            elif event.get("type") == "item" and isinstance(event.get("index"), int) \
+                    and 0 <= event["index"] < len(self.requests):
+                self.plans.append(agent_plan(self.requests[event["index"]], event.get("output") or {}))
+
+    async def flush(self) -> None:
+        plans, self.plans = self.plans, []
+        await record(plans)
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    return value.timestamp() if value is not None else None
+
+
+# --- Rutas (montadas en /api/v1) ---
+
+router = APIRouter()
+
+
+@router.get("/plans", summary="Planes guardados, más recientes primero (cursor)")
+def list_plans(template: Optional[str] = None, model: Optional[str] = None, source: Optional[str] = None,
+               since: Optional[datetime] = None, until: Optional[datetime] = None,
+               cursor: Optional[int] = Query(None, description="`next_cursor` de la página anterior."),
+               limit: int = Query(20, ge=1, le=MAX_PAGE)):
+    items, next_cursor = plan_store.list(template, model, source, _timestamp(since), _timestamp(until), cursor, limit)
+    return {"items": items, "limit": limit, "next_cursor": next_cursor}
+
+
+@router.get("/plans/search", summary="Búsqueda de texto completo en los planes guardados")
+def search_plans(q: str = Query(..., min_length=1), template: Optional[str] = None, model: Optional[str] = None,
+                 source: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 sort: Literal["relevance", "recent"] = "relevance", offset: int = Query(0, ge=0),
+                 limit: int = Query(20, ge=1, le=MAX_PAGE)):
+    """Título, resumen, pasos y petición original; todas las palabras deben aparecer (la última como prefijo)."""
+    try:
+        items, more = plan_store.search(q, template, model, source, _timestamp(since), _timestamp(until), sort,
+                                        offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "offset": offset, "limit": limit, "next_offset": offset + limit if more else None}
+
+
+@router.get("/plans/{plan_id}", summary="Plan guardado completo")
+def get_plan(plan_id: int):
+    plan = plan_store.get(plan_id)
+    if plan is None:
+        raise HTTPException(status_code=404, detail=f"Plan '{plan_id}' no encontrado.")
+    return plan
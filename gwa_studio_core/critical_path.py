@@ -0,0 +1,132 @@
+# critical_path.py - Camino crítico de una petición a partir del fichero de spans
+#
+# Lee el JSONL que escriben los exportadores de gwa_studio_core.tracing (CIAN y
+# MAGENTA pueden compartir fichero o pasarse varios, también los rotados .1, .2...),
+# reconstruye el árbol de una traza y recorre hacia atrás desde el final del span
+# raíz: en cada nivel, el hijo que termina más tarde es el que bloquea al padre. El
+# tiempo "propio" de cada etapa es lo que no explican sus hijos del camino crítico
+# (p. ej. proxy_hop menos agent = red + cola de uvicorn en MAGENTA).
+#
+# Uso:
+#   python -m gwa_studio_core.critical_path gwa_traces.jsonl                # traza más lenta
+#   python -m gwa_studio_core.critical_path gwa_traces.jsonl --trace-id ID
+#   python -m gwa_studio_core.critical_path gwa_traces.jsonl --summary      # todas las trazas
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+Span = Dict[str, Any]
+
+
+def load_spans(paths: Iterable[str]) -> Dict[str, List[Span]]:
+    """Spans agrupados por trace_id. Las líneas corruptas (escritura a medias) se saltan."""
+    traces: Dict[str, List[Span]] = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                traces.setdefault(span["trace_id"], []).append(span)
+    return traces
+
+
+def _root(spans: List[Span]) -> Span:
+    ids = {s["span_id"] for s in spans}
+    # Raíz = span cuyo padre no está en el fichero (el frontend no exporta spans); la más larga si hay varias.
+    orphans = [s for s in spans if s.get("parent_id") not in ids]
+    return max(orphans or spans, key=lambda s: s["end_ns"] - s["start_ns"])
+
+
+def critical_path(spans: List[Span]) -> List[Tuple[int, Span, float]]:
+    """
+    [(profundidad, span, tiempo propio en ms)] en orden de ejecución. El tiempo
+    propio es la duración del span menos la de sus hijos en el camino crítico.
+    """
+    children: Dict[str, List[Span]] = {}
+    for span in spans:
+        children.setdefault(span.get("parent_id"), []).append(span)
+
+    path: List[Tuple[int, Span, float]] = []
+
+    def walk(span: Span, depth: int) -> None:
+        # Desde el final del span hacia atrás: el último hijo en terminar antes del
+        # cursor es el que bloqueaba; el cursor salta a su inicio y se repite.
+        cursor = span["end_ns"]
+        blocking: List[Span] = []
+        for child in sorted(children.get(span["span_id"], []), key=lambda s: s["end_ns"], reverse=True):
+            if child["end_ns"] <= cursor and child["start_ns"] >= span["start_ns"]:
+                blocking.append(child)
+                cursor = child["start_ns"]
+        covered = sum(c["end_ns"] - c["start_ns"] for c in blocking)
+        path.append((depth, span, (span["end_ns"] - span["start_ns"] - covered) / 1e6))
+        for child in reversed(blocking):
+            walk(child, depth + 1)
+
+    walk(_root(spans), 0)
+    return path
+
+
+def _label(span: Span) -> str:
+    attrs = span.get("attributes") or {}
+    extra = ", ".join(f"{k}={attrs[k]}" for k in ("route", "model", "template", "backend", "status") if k in attrs)
+    return f"{span['service']}:{span['name']}" + (f" ({extra})" if extra else "")
+
+
+def print_trace(trace_id: str, spans: List[Span], out=None) -> None:
+    out = out or sys.stdout
+    path = critical_path(spans)
+    root = path[0][1]
+    print(f"traza {trace_id} | {root['duration_ms']:.1f} ms | {len(spans)} spans", file=out)
+    print(f"  {'etapa':<60} {'total ms':>10} {'propio ms':>10}", file=out)
+    for depth, span, self_ms in path:
+        flag = " !" if span.get("status") == "error" else ""
+        print(f"  {('  ' * depth + _label(span))[:60]:<60} {span['duration_ms']:>10.1f} {self_ms:>10.1f}{flag}", file=out)
+    depth, slowest, self_ms = max(path, key=lambda item: item[2])
+    print(f"  etapa más lenta: {_label(slowest)} ({self_ms:.1f} ms propios, "
+          f"{100 * self_ms / max(root['duration_ms'], 1e-9):.0f}% de la petición)", file=out)
+
+
+def summarize(traces: Dict[str, List[Span]], out=None) -> None:
+    """Tiempo propio medio y máximo por etapa del camino crítico, sobre todas las trazas."""
+    out = out or sys.stdout
+    totals: Dict[str, List[float]] = {}
+    for spans in traces.values():
+        for _, span, self_ms in critical_path(spans):
+            totals.setdefault(f"{span['service']}:{span['name']}", []).append(self_ms)
+    print(f"{len(traces)} trazas", file=out)
+    print(f"  {'etapa':<30} {'n':>6} {'media ms':>10} {'máx ms':>10}", file=out)
+    for stage, values in sorted(totals.items(), key=lambda item: -sum(item[1])):
+        print(f"  {stage:<30} {len(values):>6} {sum(values) / len(values):>10.1f} {max(values):>10.1f}", file=out)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Camino crítico de una petición a partir de los spans en JSONL.")
+    parser.add_argument("files", nargs="+", help="Ficheros JSONL de spans (GWA_TRACE_FILE de CIAN y MAGENTA).")
+    parser.add_argument("--trace-id", help="Traza a analizar (por defecto, la más lenta).")
+    parser.add_argument("--summary", action="store_true", help="Tiempo propio por etapa sobre todas las trazas.")
+    args = parser.parse_args(argv)
+
+    traces = load_spans(args.files)
+    if not traces:
+        print("No hay spans en los ficheros indicados.", file=sys.stderr)
+        return 1
+    if args.summary:
+        summarize(traces)
+        return 0
+    if args.trace_id:
+        if args.trace_id not in traces:
+            print(f"Traza {args.trace_id} no encontrada.", file=sys.stderr)
+            return 1
+        trace_id = args.trace_id
+    else:
+        trace_id = max(traces, key=lambda t: _root(traces[t])["end_ns"] - _root(traces[t])["start_ns"])
+    print_trace(trace_id, traces[trace_id])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
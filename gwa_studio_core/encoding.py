@@ -0,0 +1,114 @@
+# encoding.py - Respuestas JSON compactas y comprimidas entre el cliente, CIAN y MAGENTA
+#
+# Las respuestas grandes (AgentOutput, landings) se serializan con orjson si está
+# instalado (si no, json de la biblioteca estándar en forma compacta) y se comprimen
+# con la mejor codificación que acepte el llamador (br > gzip, Accept-Encoding) a
+# partir de GWA_COMPRESS_MIN_BYTES. httpx pide y descomprime gzip (y br con el paquete
+# `brotli`) por su cuenta, así que el salto CIAN -> MAGENTA se comprime sin más. Los
+# streams NDJSON no se comprimen: se reenvían byte a byte y cada fragmento debe salir ya.
+
+import gzip
+import json
+import os
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+from fastapi import Response
+
+try:
+    import orjson  # opcional: sin él se usa json
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # opcional: sin él se sirve gzip
+except ImportError:
+    brotli = None
+
+JSON_MEDIA_TYPE = "application/json"
+# Por debajo de este tamaño comprimir cuesta más CPU de lo que ahorra en la red.
+COMPRESS_MIN_BYTES = int(os.environ.get("GWA_COMPRESS_MIN_BYTES", "1024"))
+# Respuestas dinámicas: niveles intermedios (las landings precomprimidas usan el máximo).
+GZIP_LEVEL = int(os.environ.get("GWA_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("GWA_BROTLI_QUALITY", "5"))
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def dumps(value: Any) -> bytes:
+    """JSON compacto en UTF-8 (orjson si está disponible)."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(body: bytes) -> Any:
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def negotiate_encoding(accept_encoding: str, available: Iterable[Optional[str]]) -> Optional[str]:
+    """Mejor codificación aceptada por el cliente (br > gzip); None = sin comprimir."""
+    accepted = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[tuple]:
+    """
+    `fields=status,result_json` -> ("status", "result_json"); None = todos. Un campo
+    desconocido es un ValueError (el endpoint responde 400).
+    """
+    if fields is None or not fields.strip():
+        return None
+    selected = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in selected if f not in allowed]
+    if unknown:
+        raise ValueError(f"Campos desconocidos: {', '.join(unknown)}. Disponibles: {', '.join(allowed)}.")
+    return selected
+
+
+def select_fields(value: Dict[str, Any], fields: Optional[Iterable[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return value
+    return {k: value[k] for k in fields if k in value}
+
+
+class EncodedJSONResponse(Response):
+    """
+    JSON serializado con `dumps` y comprimido según `accept_encoding`. Sustituye a la
+    respuesta por defecto de FastAPI (jsonable_encoder + json.dumps) en las rutas con
+    cuerpos grandes; `Vary: Accept-Encoding` para las cachés intermedias.
+    """
+
+    media_type = JSON_MEDIA_TYPE
+
+    def __init__(self, content: Any, status_code: int = 200, headers: Optional[Mapping[str, str]] = None,
+                 accept_encoding: str = ""):
+        self._accept_encoding = accept_encoding
+        super().__init__(content, status_code=status_code, headers={**(headers or {}), "Vary": "Accept-Encoding"})
+
+    def render(self, content: Any) -> bytes:
+        body = content if isinstance(content, bytes) else dumps(content)
+        encoding = negotiate_encoding(self._accept_encoding, ENCODINGS) if len(body) >= COMPRESS_MIN_BYTES else None
+        self.content_encoding = encoding
+        return compress(body, encoding) if encoding else body
+
+    def init_headers(self, headers: Optional[Mapping[str, str]] = None) -> None:
+        super().init_headers(headers)
+        if self.content_encoding:
+            self.raw_headers.append((b"content-encoding", self.content_encoding.encode("latin-1")))
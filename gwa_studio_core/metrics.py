@@ -0,0 +1,226 @@
+# metrics.py - Métricas en memoria con exposición en formato de texto Prometheus
+#
+# Sin dependencias: contadores, gauges e histogramas con etiquetas, pensados para
+# actualizarse desde el event loop de FastAPI con coste de nanosegundos (una
+# búsqueda en dict y un bisect por observación). CIAN y MAGENTA tienen cada uno su
+# MetricsRegistry y lo exponen en GET /metrics. Esa ruta corre en el threadpool mientras
+# el event loop añade series nuevas, así que `render` recorre una copia de cada dict.
+
+import bisect
+import operator
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.environ.get("GWA_METRICS_ENABLED", "1") != "0"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latencias de LLM: de milisegundos (render, parse) a minutos (generación local).
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 250, 500)
+
+# Etiquetas cuyo valor elige el cliente (modelo, plantilla): un valor desconocido se
+# cuenta como "other", así /metrics no crea una serie por cada nombre inventado.
+OTHER_LABEL = "other"
+# Tope de valores aprendidos por etiqueta (ver LabelSet.learn).
+MAX_LEARNED_LABELS = int(os.environ.get("GWA_METRICS_MAX_LEARNED_LABELS", "64"))
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # itemgetter devuelve la tupla de valores en una sola llamada en C.
+        self._getter = operator.itemgetter(*self.labelnames) if len(self.labelnames) > 1 else None
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if self._getter is not None:
+            return self._getter(labels)
+        return tuple(labels.values())
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+                for k, v in list(self.values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def track(self, **labels: str) -> "_Tracked":
+        """Suma 1 mientras dura el bloque (peticiones en curso)."""
+        return _Tracked(self.values, self._key(labels))
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+                for k, v in list(self.values.items())]
+
+
+class _Tracked:
+    __slots__ = ("values", "key")
+
+    def __init__(self, values: Dict[LabelValues, float], key: LabelValues):
+        self.values = values
+        self.key = key
+
+    def __enter__(self) -> None:
+        self.values[self.key] = self.values.get(self.key, 0) + 1
+
+    def __exit__(self, *exc_info) -> None:
+        self.values[self.key] -= 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Por etiquetas: [cuentas por bucket (no acumuladas) + overflow, suma, total]
+        self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, state in list(self.values.items()):
+            counts, total, count = list(state[0]), state[1], state[2]
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class LabelSet:
+    """
+    Valores admitidos en una etiqueta que viene del cliente. Se admite un valor si
+    `known(value)` lo reconoce (plantillas del registro, modelos configurados) o si ya
+    se aprendió con `learn` (el backend lo sirvió de verdad), hasta `max_learned`.
+    """
+
+    __slots__ = ("known", "learned", "max_learned")
+
+    def __init__(self, known: Optional[Callable[[str], bool]] = None, max_learned: int = MAX_LEARNED_LABELS):
+        self.known = known
+        self.learned: set = set()
+        self.max_learned = max_learned
+
+    def learn(self, value: str) -> None:
+        if value not in self.learned and len(self.learned) < self.max_learned:
+            self.learned.add(value)
+
+    def __call__(self, value: str) -> str:
+        if value in self.learned or (self.known is not None and self.known(value)):
+            return value
+        return OTHER_LABEL
+
+
+class MetricsRegistry:
+    """Conjunto de métricas de un servicio. `collectors` refrescan gauges justo antes de exponer."""
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self.metrics: List[_Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Optional[Sequence[float]] = None) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labelnames, buckets=buckets or LATENCY_BUCKETS))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
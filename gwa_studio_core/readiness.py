@@ -0,0 +1,100 @@
+# readiness.py - Warm-up en segundo plano y sondas liveness/readiness
+#
+# Importar un servicio sólo define rutas y objetos baratos; lo caro (SDK de Gemini,
+# clientes de backends, compilar plantillas, abrir bases SQLite) corre en el warm-up,
+# que el lifespan lanza sin esperarlo. Así el proceso acepta conexiones enseguida:
+#
+#   GET /live   -> 200 en cuanto el proceso sirve peticiones (el orquestador no lo reinicia)
+#   GET /ready  -> 503 mientras dura el warm-up (o si falló un paso obligatorio), luego 200
+#
+# El /status de CIAN se mantiene como antes (liveness) para los scripts existentes.
+
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+Step = Callable[[], Union[None, Awaitable[None]]]
+
+
+class WarmUp:
+    """Pasos de arranque con nombre; corren en paralelo y cada uno queda cronometrado."""
+
+    def __init__(self, service: str):
+        self.service = service
+        self.steps: List[Tuple[str, Step, bool]] = []
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.started_at = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, step: Step, required: bool = True) -> None:
+        """`step` puede ser async o síncrono (los síncronos van a un hilo). Un paso no obligatorio que falla no impide estar listo."""
+        self.steps.append((name, step, required))
+
+    async def _run_step(self, name: str, step: Step, required: bool) -> None:
+        started = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(step):
+                await step()
+            else:
+                await asyncio.to_thread(step)
+            self.results[name] = {"ok": True}
+        except Exception as e:
+            logger.error(f"Warm-up de {self.service}: falló '{name}': {e}")
+            self.results[name] = {"ok": False, "required": required, "error": str(e)}
+        self.results[name]["ms"] = round(1000 * (time.perf_counter() - started), 1)
+
+    async def run(self) -> None:
+        await asyncio.gather(*(self._run_step(*step) for step in self.steps))
+        print(f"Warm-up de {self.service} terminado en {self.elapsed_ms():.0f} ms desde el arranque: "
+              + ", ".join(f"{name} {r['ms']:.0f} ms" for name, r in self.results.items()))
+
+    def start(self) -> None:
+        self.started_at = time.monotonic()
+        self.results.clear()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def wait(self) -> None:
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def aclose(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def elapsed_ms(self) -> float:
+        return 1000 * (time.monotonic() - self.started_at)
+
+    @property
+    def ready(self) -> bool:
+        if self._task is None or not self._task.done():
+            return False
+        return all(r["ok"] or not r["required"] for r in self.results.values())
+
+    def status(self) -> Dict[str, Any]:
+        pending = [name for name, _, _ in self.steps if name not in self.results]
+        return {"service": self.service, "ready": self.ready, "uptime_ms": round(self.elapsed_ms(), 1),
+                "steps": dict(self.results), "pending": pending}
+
+
+def add_health_routes(app: FastAPI, warm_up: WarmUp, tags: Optional[List[str]] = None) -> None:
+    """Registra GET /live y GET /ready en `app`."""
+
+    @app.get("/live", tags=tags)
+    def get_live():
+        """Liveness: el proceso está vivo y atiende peticiones (aunque siga el warm-up)."""
+        return {"status": "alive", "service": warm_up.service}
+
+    @app.get("/ready", tags=tags)
+    def get_ready():
+        """Readiness: 200 cuando terminó el warm-up; 503 (con el detalle por paso) mientras tanto."""
+        return JSONResponse(warm_up.status(), status_code=200 if warm_up.ready else 503)
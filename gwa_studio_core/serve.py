@@ -0,0 +1,75 @@
+# serve.py - Lanzador de CIAN y MAGENTA con varios workers
+#
+# Uso:
+#   python -m gwa_studio_core.serve cian --workers 4
+#   python -m gwa_studio_core.serve magenta --workers 4 --port 8001
+#
+# uvicorn arranca N procesos que aceptan conexiones del mismo socket, así que el render
+# de plantillas, el parseo del JSON y la validación escalan con los núcleos. `kill -HUP`
+# al proceso supervisor recarga los workers de uno en uno: cada nuevo entra en servicio
+# antes de retirar el viejo (sin cortar peticiones), y SIGTERM espera hasta
+# GWA_GRACEFUL_TIMEOUT_S a que terminen las que están en curso.
+#
+# Con más de un worker, antes de arrancar se fija el estado compartido (gwa_studio_core.
+# shared_state) en GWA_STATE_DIR: cupos y tasa por cliente y en curso (CIAN), leases de
+# generaciones idénticas (MAGENTA) y, si no se configuró otra, la caché de respuestas de
+# MAGENTA en disco para que un acierto en un worker sirva a todos. Los trabajos de CIAN
+# (GWA_JOB_DB) ya viven en SQLite y los workers se los reparten con leases.
+
+import argparse
+import os
+import tempfile
+
+import uvicorn
+
+APPS = {
+    "cian": ("gwa_studio_core.core_api.main:app", 8000),
+    "magenta": ("gwa_studio_llms.main_service:app", 8001),
+}
+STATE_DIR = os.environ.get("GWA_STATE_DIR", os.path.join(tempfile.gettempdir(), "gwa_state")).strip(' "')
+GRACEFUL_TIMEOUT_S = float(os.environ.get("GWA_GRACEFUL_TIMEOUT_S", "30"))
+
+
+def _reset_state(db_path: str) -> None:
+    # El estado compartido es de esta ejecución: tras un reinicio del contenedor los pid se
+    # reutilizan y una plaza vieja podría parecer de un worker vivo.
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(db_path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def prepare_env(service: str, workers: int) -> None:
+    """Variables de entorno que heredan los workers (se leen al importar cada módulo)."""
+    os.environ["GWA_WORKERS"] = str(workers)
+    if workers <= 1:
+        return
+    os.makedirs(STATE_DIR, exist_ok=True)
+    if not os.environ.get("GWA_SHARED_STATE_DB"):
+        os.environ["GWA_SHARED_STATE_DB"] = os.path.join(STATE_DIR, f"{service}_state.db")
+    _reset_state(os.environ["GWA_SHARED_STATE_DB"])
+    if service == "magenta" and not os.environ.get("GWA_RESPONSE_CACHE_DB"):
+        os.environ["GWA_RESPONSE_CACHE_DB"] = os.path.join(STATE_DIR, "response_cache.db")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Arranca CIAN o MAGENTA con N workers.")
+    parser.add_argument("service", choices=sorted(APPS))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("GWA_WORKERS", "1")),
+                        help="Procesos worker (0 = uno por núcleo).")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=None)
+    args = parser.parse_args()
+
+    app, default_port = APPS[args.service]
+    workers = args.workers or os.cpu_count() or 1
+    prepare_env(args.service, workers)
+    print(f"Arrancando {args.service.upper()} con {workers} worker(s)"
+          + (f"; estado compartido en {os.environ['GWA_SHARED_STATE_DB']}" if workers > 1 else ""))
+    uvicorn.run(app, host=args.host, port=args.port or default_port, workers=workers,
+                timeout_graceful_shutdown=GRACEFUL_TIMEOUT_S)
+
+
+if __name__ == "__main__":
+    main()
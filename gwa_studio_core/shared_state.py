@@ -0,0 +1,222 @@
+# shared_state.py - Estado compartido entre los workers de un servicio
+#
+# Con varios workers (gwa_studio_core.serve --workers N) cada proceso tiene su propia
+# memoria: los contadores en curso, los cupos por cliente y los "ya lo está generando
+# otro" dejarían de ser globales. Este módulo los lleva a un archivo SQLite local
+# (GWA_SHARED_STATE_DB, WAL) que comparten todos los workers de la máquina:
+#
+#   - plazas en curso con límite (`try_acquire`/`release`): una fila por clave y proceso,
+#     así que las plazas de un worker que muere se descartan solas (pid sin vida);
+#   - contadores por ventana de tiempo (`hit`), para límites de tasa;
+#   - leases con nombre (`claim`/`unclaim`), para que una sola generación idéntica
+#     corra a la vez aunque las peticiones caigan en workers distintos.
+#
+# Las operaciones son síncronas (transacciones BEGIN IMMEDIATE que compiten con los otros
+# workers); desde el event loop se llaman con `run` (se espera el resultado) o `defer`
+# (liberaciones), que las ejecutan en un hilo propio del proceso, en orden.
+#
+# GWA_SHARED_STATE_DB vacío (un solo proceso) = desactivado: `enabled` es False y los
+# llamadores siguen con su estado en memoria, sin coste extra.
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SHARED_STATE_DB = os.environ.get("GWA_SHARED_STATE_DB", "").strip(' "')
+# Número de workers del servicio (lo fija gwa_studio_core.serve); sirve para repartir límites.
+WORKERS = max(1, int(os.environ.get("GWA_WORKERS", "1")))
+
+
+# Un solo hilo por proceso para todas las instancias: las operaciones se aplican en el
+# orden en que se pidieron (una liberación antes que la siguiente toma de plaza).
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid = 0
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    # Tras un fork el hilo no existe en el hijo: se crea otro.
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _log_failure(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Operación diferida sobre el estado compartido fallida: {future.exception()}")
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedState:
+    """Plazas, contadores y leases en un SQLite compartido por los procesos de la máquina."""
+
+    def __init__(self, db_path: str = SHARED_STATE_DB):
+        self.db_path = db_path
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.db_path)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Ejecuta `fn(*args)` (un método de esta instancia) en el hilo del estado compartido y espera el resultado."""
+        return await asyncio.get_running_loop().run_in_executor(_pool(), fn, *args)
+
+    def defer(self, fn: Callable[..., Any], *args: Any) -> None:
+        """Como `run`, sin esperar: para liberaciones que no deciden nada en la petición."""
+        _pool().submit(fn, *args).add_done_callback(_log_failure)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Se abre al primer uso (y de nuevo tras un fork: la conexión no se hereda).
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS slots ("
+                "key TEXT NOT NULL, pid INTEGER NOT NULL, value INTEGER NOT NULL, PRIMARY KEY (key, pid))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS windows ("
+                "key TEXT NOT NULL, bucket INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (key, bucket))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "key TEXT PRIMARY KEY, pid INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db = db
+            self._pid = os.getpid()
+        return self._db
+
+    def _transaction(self, fn):
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(db)
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            return result
+
+    @staticmethod
+    def _live_total(db: sqlite3.Connection, key: str) -> int:
+        total = 0
+        for pid, value in db.execute("SELECT pid, value FROM slots WHERE key = ?", (key,)).fetchall():
+            if _alive(pid):
+                total += value
+            else:
+                db.execute("DELETE FROM slots WHERE key = ? AND pid = ?", (key, pid))
+        return total
+
+    def try_acquire(self, key: str, limit: int) -> bool:
+        """Ocupa una plaza de `key` si entre todos los procesos hay menos de `limit` ocupadas."""
+
+        def acquire(db: sqlite3.Connection) -> bool:
+            if self._live_total(db, key) >= limit:
+                return False
+            db.execute(
+                "INSERT INTO slots (key, pid, value) VALUES (?, ?, 1) "
+                "ON CONFLICT (key, pid) DO UPDATE SET value = value + 1",
+                (key, os.getpid()),
+            )
+            return True
+
+        return self._transaction(acquire)
+
+    def add(self, key: str, delta: int) -> None:
+        """Suma `delta` a las plazas de este proceso en `key`, sin límite (seguimiento de peticiones en curso)."""
+        with self._lock:
+            self._conn().execute(
+                "INSERT INTO slots (key, pid, value) VALUES (?, ?, MAX(0, ?)) "
+                "ON CONFLICT (key, pid) DO UPDATE SET value = MAX(0, value + ?)",
+                (key, os.getpid(), delta, delta),
+            )
+
+    def release(self, key: str) -> None:
+        self.add(key, -1)
+
+    def total(self, key: str) -> int:
+        return self._transaction(lambda db: self._live_total(db, key))
+
+    def totals(self, prefix: str) -> Dict[str, int]:
+        """Plazas ocupadas por clave (procesos vivos) para las claves que empiezan por `prefix`."""
+
+        def collect(db: sqlite3.Connection) -> Dict[str, int]:
+            keys = [row[0] for row in db.execute("SELECT DISTINCT key FROM slots WHERE key LIKE ? || '%'", (prefix,))]
+            return {key: self._live_total(db, key) for key in keys}
+
+        return self._transaction(collect)
+
+    def hit(self, key: str, window_s: float) -> int:
+        """Cuenta un evento en la ventana actual de `window_s` segundos y devuelve el total de la ventana."""
+        bucket = int(time.time() // window_s)
+
+        def count(db: sqlite3.Connection) -> int:
+            db.execute("DELETE FROM windows WHERE key = ? AND bucket < ?", (key, bucket))
+            row = db.execute(
+                "INSERT INTO windows (key, bucket, count) VALUES (?, ?, 1) "
+                "ON CONFLICT (key, bucket) DO UPDATE SET count = count + 1 RETURNING count",
+                (key, bucket),
+            ).fetchone()
+            return row[0]
+
+        return self._transaction(count)
+
+    def claim(self, key: str, ttl_s: float) -> bool:
+        """Toma el lease `key` si está libre, vencido o en manos de un proceso muerto."""
+        now = time.time()
+
+        def take(db: sqlite3.Connection) -> bool:
+            row = db.execute("SELECT pid, expires_at FROM leases WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] > now and _alive(row[0]):
+                return False
+            db.execute(
+                "INSERT INTO leases (key, pid, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET pid = excluded.pid, expires_at = excluded.expires_at",
+                (key, os.getpid(), now + ttl_s),
+            )
+            return True
+
+        return self._transaction(take)
+
+    def unclaim(self, key: str) -> None:
+        with self._lock:
+            self._conn().execute("DELETE FROM leases WHERE key = ? AND pid = ?", (key, os.getpid()))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def split_limit(limit: int, workers: int = WORKERS) -> int:
+    """Parte de un límite global que le toca a cada worker (al menos 1)."""
+    return max(1, -(-limit // workers))
+
+
+# Instancia del proceso (desactivada salvo que el lanzador fije GWA_SHARED_STATE_DB).
+shared_state = SharedState()
@@ -0,0 +1,291 @@
+# tracing.py - Trazas con propagación W3C traceparent entre CIAN, MAGENTA y el backend
+#
+# Sin dependencias: cada etapa (gateway, salto del proxy, render, llamada al modelo,
+# parse) abre un Span hijo del span actual (contextvar), así que las tareas de asyncio
+# heredan el padre. El span actual viaja entre servicios en la cabecera `traceparent`
+# (00-<trace_id>-<span_id>-<flags>). Los spans terminados van a un exportador
+# enchufable; por defecto, una línea JSON por span en GWA_TRACE_FILE, escrita por un
+# hilo en segundo plano (la petición sólo encola) y rotada al pasar de
+# GWA_TRACE_MAX_BYTES. GWA_TRACE_EXPORTER=none desactiva la exportación.
+#
+# El camino crítico de una petición se reconstruye offline con:
+#   python -m gwa_studio_core.critical_path gwa_traces.jsonl
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional, Protocol
+
+logger = logging.getLogger(__name__)
+
+# "jsonl" (por defecto) para exportar a GWA_TRACE_FILE; none/off = no se exporta nada.
+TRACE_EXPORTER = os.environ.get("GWA_TRACE_EXPORTER", "jsonl").strip(' "').lower()
+TRACE_FILE = os.environ.get("GWA_TRACE_FILE", "gwa_traces.jsonl").strip(' "')
+# Al pasar de este tamaño el fichero pasa a <fichero>.1 (y así hasta GWA_TRACE_BACKUPS).
+TRACE_MAX_BYTES = int(os.environ.get("GWA_TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.environ.get("GWA_TRACE_BACKUPS", "3"))
+# Spans en espera de escribirse; con la cola llena se descartan (y se cuentan) en vez de frenar la petición.
+TRACE_QUEUE_SIZE = int(os.environ.get("GWA_TRACE_QUEUE_SIZE", "10000"))
+
+TRACEPARENT_HEADER = "traceparent"
+_TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class SpanContext:
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool = True):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """Contexto remoto de una cabecera traceparent; None si falta o no es válida (se ignora, no es un error)."""
+    match = _TRACEPARENT_RE.match((value or "").strip().lower())
+    if not match:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id, sampled=bool(int(flags, 16) & 1))
+
+
+_current: contextvars.ContextVar[Optional[SpanContext]] = contextvars.ContextVar("gwa_span", default=None)
+
+
+def current_context() -> Optional[SpanContext]:
+    return _current.get()
+
+
+def attach(context: Optional[SpanContext]) -> None:
+    """Adopta un contexto remoto como padre de los spans siguientes de la tarea actual."""
+    _current.set(context)
+
+
+def inject(headers: Dict[str, str]) -> Dict[str, str]:
+    """Añade `traceparent` del span actual a unas cabeceras salientes (las devuelve por comodidad)."""
+    context = _current.get()
+    if context is not None:
+        headers[TRACEPARENT_HEADER] = context.traceparent
+    return headers
+
+
+# --- Exportadores ---
+
+class SpanExporter(Protocol):
+    def export(self, span: Dict[str, Any]) -> None: ...
+
+
+class NullExporter:
+    def export(self, span: Dict[str, Any]) -> None:
+        pass
+
+
+class JsonlFileExporter:
+    """
+    Una línea JSON por span, en modo append. `export` sólo encola; un hilo en segundo
+    plano serializa y escribe por lotes, y rota el fichero por tamaño. Apto para varios
+    procesos escribiendo el mismo fichero (quien lo encuentra rotado lo reabre).
+    """
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS,
+                 queue_size: int = TRACE_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._file = None
+        self._writer: Optional[threading.Thread] = None
+
+    def export(self, span: Dict[str, Any]) -> None:
+        if self._writer is None or not self._writer.is_alive():
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._writer.start()
+
+    def _run(self) -> None:
+        while True:
+            batch: List[Optional[Dict[str, Any]]] = [self._queue.get()]
+            while len(batch) < 512:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            spans = [span for span in batch if span is not None]
+            try:
+                if spans:
+                    self._write([json.dumps(span, ensure_ascii=False, separators=(",", ":")) + "\n" for span in spans])
+            except Exception as e:
+                logger.error(f"No se pudieron escribir {len(spans)} spans en {self.path}: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(spans) < len(batch):
+                return
+
+    def _write(self, lines: List[str]) -> None:
+        with self._lock:
+            if self._file is not None and self._rotated_elsewhere():
+                self._file.close()
+                self._file = None
+            for line in lines:
+                if self._file is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line)
+                if self.max_bytes > 0 and self._file.tell() >= self.max_bytes:
+                    self._rotate()
+            if self._file is not None:
+                self._file.flush()
+
+    def _rotated_elsewhere(self) -> bool:
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def flush(self) -> None:
+        """Espera a que se escriban los spans ya encolados."""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def close(self) -> None:
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+        self._writer = None
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class MemoryExporter:
+    """Guarda los spans en una lista (tests y benchmarks)."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span: Dict[str, Any]) -> None:
+        self.spans.append(span)
+
+
+def exporter_from_env() -> SpanExporter:
+    if TRACE_EXPORTER == "jsonl":
+        return JsonlFileExporter(TRACE_FILE)
+    if TRACE_EXPORTER not in ("", "none", "0", "off"):
+        logger.warning(f"GWA_TRACE_EXPORTER='{TRACE_EXPORTER}' desconocido: no se exportan trazas.")
+    return NullExporter()
+
+
+# --- Spans ---
+
+class Span:
+    """
+    Etapa cronometrada. Se usa como context manager (`with tracer.span(...)`) o
+    con `start()`/`end()` explícitos cuando dura más que el handler (streams).
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional[SpanContext], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.context = SpanContext(parent.trace_id if parent else secrets.token_hex(16), secrets.token_hex(8),
+                                   parent.sampled if parent else True)
+        self.attributes = attributes
+        self.status = "ok"
+        self.start_ns = 0
+        self.end_ns = 0
+        self._previous: Optional[SpanContext] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, error: Any) -> None:
+        self.status = "error"
+        self.attributes["error"] = str(error)[:200]
+
+    def start(self) -> "Span":
+        self.start_ns = time.time_ns()
+        return self
+
+    def end(self) -> None:
+        """Cierra y exporta el span. Idempotente: el primer cierre gana."""
+        if self.end_ns:
+            return
+        self.end_ns = time.time_ns()
+        if self.context.sampled:
+            self.tracer.exporter.export({
+                "trace_id": self.context.trace_id,
+                "span_id": self.context.span_id,
+                "parent_id": self.parent.span_id if self.parent else None,
+                "name": self.name,
+                "service": self.tracer.service,
+                "start_ns": self.start_ns,
+                "end_ns": self.end_ns,
+                "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+                "status": self.status,
+                "attributes": self.attributes,
+            })
+
+    def __enter__(self) -> "Span":
+        self.start()
+        self._previous = _current.get()
+        _current.set(self.context)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # set() en vez de reset(token): el span puede abrirse dentro de un generador
+        # asíncrono que se reanuda desde otra tarea (StreamingResponse).
+        _current.set(self._previous)
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.set_error(exc)
+        self.end()
+
+
+class Tracer:
+    def __init__(self, service: str, exporter: Optional[SpanExporter] = None):
+        self.service = service
+        self.exporter = exporter if exporter is not None else exporter_from_env()
+
+    def span(self, name: str, parent: Optional[SpanContext] = None, **attributes: Any) -> Span:
+        """Span hijo de `parent` o, si no se da, del span actual (o raíz de una traza nueva)."""
+        return Span(self, name, parent if parent is not None else _current.get(), attributes)
+
+    def start_trace(self, name: str, remote: Optional[SpanContext] = None, **attributes: Any) -> Span:
+        """Span de entrada de una petición: hijo del contexto remoto o raíz de una traza nueva, nunca del ambiente."""
+        return Span(self, name, remote, attributes)
@@ -1,8 +1,12 @@
-import requests
-import json
-from typing import Dict, Any, List
+import time
+from typing import Dict, Any, AsyncIterator, List, Union
 from pydantic import BaseModel
 
+from ..backends import BackendError
+from ..context_budget import BUDGET_POOLS, ContextBudgeter, context_budgeter
+from ..json_extractor import IncrementalJSONExtractor, JSONExtractionError
+from ..llm_router import LLMRouter, llm_router
+
 # 1. Definición de la salida requerida del Agente (JSON)
 class AgentOutput(BaseModel):
     model_used: str
@@ -10,24 +14,19 @@ class AgentOutput(BaseModel):
     result_json: Dict[str, Any]
     execution_time_ms: int
 
-# 2. Endpoints y Configuración
-OLLAMA_URL = "http://localhost:11434/api/generate"
+# 2. Configuración (los hosts de Ollama los resuelve el router: GWA_OLLAMA_HOSTS)
 FALLBACK_RESPONSE = {"status": "ERROR_FALLBACK", "message": "Fallo de inferencia o JSON inválido. Se usó el fallback."}
 
 class LLMProcessor:
-    """Clase que maneja la conexión a Ollama y la ejecución del Agente O/S."""
+    """Clase que maneja la conexión al backend (vía router) y la ejecución del Agente O/S."""
     
-    def __init__(self, model_name: str = "llama3:8b"):
+    def __init__(self, model_name: str = "llama3:8b", router: LLMRouter = llm_router,
+                 budgeter: ContextBudgeter = context_budgeter):
         self.model_name = model_name
+        self.router = router
+        self.budgeter = budgeter
 
-    def process_request(self, system_prompt: str, user_prompt: str) -> AgentOutput:
-        """
-        Ejecuta el modelo O/S con un prompt CoT para obtener una respuesta JSON.
-        Incluye un robusto try/except para el fallback.
-        """
-        import time
-        start_time = time.time()
-        
+    def _build_payload(self, system_prompt: str, user_prompt: str) -> Dict[str, Any]:
         # 3. Armado del Prompt (Chain-of-Thought simplificado)
         full_prompt = (
             f"SYSTEM: {system_prompt}\n\n"
@@ -36,53 +35,77 @@ class LLMProcessor:
             f"PROMPT DEL USUARIO: {user_prompt}"
         )
 
-        payload = {
-            "model": self.model_name,
-            "prompt": full_prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.5,
-                "num_ctx": 4096
-            }
+        # Siempre en streaming (router.stream): permite cortar la generación en cuanto el JSON se cierra.
+        options: Dict[str, Any] = {"temperature": 0.5}
+        if self.router.pool_for(self.model_name) in BUDGET_POOLS:
+            # num_ctx a medida del prompt (antes, 4096 fijo) y num_predict acotado.
+            budget = self.budgeter.plan(self.model_name, len(full_prompt))
+            if budget.overflow:
+                print(f"Advertencia: el prompt (~{budget.prompt_tokens} tokens) no cabe en num_ctx={budget.num_ctx}.")
+            options.update(budget.options())
+        return {
+            "messages": [{"role": "user", "content": full_prompt}],
+            "options": options,
         }
-        
+
+    @staticmethod
+    def _parse_response(extractor: IncrementalJSONExtractor, raw_response_text: str) -> Dict[str, Any]:
+        # 5. Extracción y Parsing del JSON (Robusto ante charla del LLM)
         try:
-            # 4. Conexión a la capa de inferencia local (Ollama)
-            response = requests.post(OLLAMA_URL, json=payload, timeout=180.0)
-            response.raise_for_status() 
-            
-            response_data = response.json()
-            raw_response_text = response_data.get("response", "")
-            
-            # 5. Extracción y Parsing del JSON (Robusto ante charla del LLM)
-            json_start = raw_response_text.find('{')
-            json_end = raw_response_text.rfind('}') + 1
-            
-            if json_start != -1 and json_end != -1 and json_end > json_start:
-                json_string = raw_response_text[json_start:json_end]
-                result_data = json.loads(json_string)
-            else:
-                # 5.1. Fallback si el JSON no se encuentra
-                result_data = FALLBACK_RESPONSE
-                result_data["raw_output"] = raw_response_text
-                
-        except requests.exceptions.RequestException as e:
-            # 6. Fallback si Ollama está caído o hay un error de red
-            print(f"Error de conexión con Ollama: {e}")
-            result_data = FALLBACK_RESPONSE
-            result_data["error_detail"] = str(e)
-            
-        except json.JSONDecodeError:
-            # 7. Fallback si el JSON está malformado
-            print("Error: JSON malformado por el modelo.")
-            result_data = FALLBACK_RESPONSE
+            return extractor.finish()
+        except JSONExtractionError as e:
+            # 5.1. Fallback si el JSON no se encuentra o está malformado
+            print(f"Error: JSON malformado por el modelo: {e}")
+            result_data = dict(FALLBACK_RESPONSE)
             result_data["raw_output"] = raw_response_text
-            
-        end_time = time.time()
-        
-        return AgentOutput(
+            result_data["error_position"] = e.position
+            return result_data
+
+    async def process_request(self, system_prompt: str, user_prompt: str) -> AgentOutput:
+        """
+        Ejecuta el modelo O/S con un prompt CoT para obtener una respuesta JSON.
+        Incluye un robusto try/except para el fallback.
+        """
+        async for item in self.process_request_stream(system_prompt, user_prompt):
+            if isinstance(item, AgentOutput):
+                return item
+
+    async def process_request_stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[Union[str, AgentOutput]]:
+        """
+        Variante en streaming de process_request: produce cada fragmento de texto
+        a medida que el backend lo genera y, al final, el AgentOutput completo.
+        La conexión se cierra en cuanto se completa el primer objeto JSON.
+        """
+        start_time = time.time()
+        payload = self._build_payload(system_prompt, user_prompt)
+        extractor = IncrementalJSONExtractor()
+        chunks: List[str] = []
+        usage: Dict[str, Any] = {}
+
+        try:
+            # 4. Conexión a la capa de inferencia (nodo del pool elegido por el router)
+            stream = self.router.stream(self.model_name, payload["messages"], options=payload["options"], usage=usage)
+            try:
+                async for text in stream:
+                    chunks.append(text)
+                    yield text
+                    if extractor.feed(text) is not None:
+                        break
+            finally:
+                await stream.aclose()
+                if "num_ctx" in payload["options"]:
+                    self.budgeter.observe(self.model_name, len(payload["messages"][0]["content"]), usage)
+            result_data = self._parse_response(extractor, "".join(chunks))
+
+        except BackendError as e:
+            # 6. Fallback si el backend está caído o hay un error de red
+            print(f"Error de conexión con el backend LLM: {e}")
+            result_data = dict(FALLBACK_RESPONSE)
+            result_data["error_detail"] = str(e)
+
+        yield AgentOutput(
             model_used=self.model_name,
             processed_prompt=user_prompt,
             result_json=result_data,
-            execution_time_ms=int((end_time - start_time) * 1000)
-        )
\ No newline at end of file
+            execution_time_ms=int((time.time() - start_time) * 1000)
+        )
@@ -1,112 +1,224 @@
-import json
 import logging
-from typing import Any, Dict, Optional
-import re 
-from jinja2 import Environment, FileSystemLoader
-import ollama
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .backends import BackendError
+from .context_budget import BUDGET_POOLS, Budget, ContextBudgeter, context_budgeter, prompt_chars
+from .json_extractor import IncrementalJSONExtractor, JSONExtractionError
+from .response_cache import ResponseCache, make_cache_key, response_cache
+from .llm_router import LLMRouter, llm_router
+from .output_schema import OutputValidator, Validation, repair_output
+from .template_registry import PromptParts, TemplateNotFoundError, template_registry
 
 # --- Configuración ---
-OLLAMA_BASE_URL = "http://localhost:11434"
+# Los hosts de Ollama se configuran en el router (GWA_OLLAMA_HOSTS).
+OLLAMA_OPTIONS = {'temperature': 0.1}
+OLLAMA_FORMAT = 'json'
 
 # Configuración del logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configuración de Jinja2 (Debe estar en la ruta gwa_studio_llms/templates)
-try:
-    # Usamos ruta relativa para que Uvicorn lo encuentre desde la raíz del proyecto
-    env = Environment(loader=FileSystemLoader("gwa_studio_llms/templates"), autoescape=True) 
-except Exception as e:
-    logger.error(f"Error al inicializar Jinja2: {e}.")
-    env = None
-
 
 class LLMAgentExecutor:
     
-    def __init__(self):
-        try:
-            self.llm_client = ollama.Client(host=OLLAMA_BASE_URL)
-            logger.info(f"Ollama Client inicializado en: {OLLAMA_BASE_URL}")
-        except Exception as e:
-            logger.error(f"No se pudo inicializar el cliente de Ollama: {e}")
-            self.llm_client = None
-
-    def _load_and_render_template(self, template_name: str, context: Dict[str, Any], user_prompt: str) -> str:
-        if env is None:
-            raise RuntimeError("Jinja2 Environment no está configurado.")
+    def __init__(self, cache: ResponseCache = response_cache, router: LLMRouter = llm_router,
+                 budgeter: ContextBudgeter = context_budgeter):
+        self.cache = cache
+        self.router = router
+        self.budgeter = budgeter
 
+    def _load_and_render_template(self, template_name: str, context: Dict[str, Any], user_prompt: str) -> PromptParts:
         try:
-            template_file = f"{template_name}.jinja"
-            template = env.get_template(template_file)
-            system_prompt = template.render(context=context, user_prompt=user_prompt)
-            return system_prompt
+            # Plantilla ya compilada en memoria (gwa_studio_llms/templates/*.jinja): el prefijo
+            # estático va como mensaje system, idéntico en cada petición; el contexto, después.
+            return template_registry.render_jinja_parts(template_name, context=context, user_prompt=user_prompt)
         except Exception as e:
             logger.error(f"Error al cargar o renderizar la plantilla {template_name}: {e}")
             raise
 
-    def run_llm_agent(self, model_name: str, template_name: str, context: Dict[str, Any], user_prompt: str) -> Dict[str, Any]:
-        if not self.llm_client:
-            raise ConnectionError("El cliente de Ollama no se pudo inicializar o conectar.")
+    def _output_validator(self, template_name: str) -> Optional[OutputValidator]:
+        # Esquema de salida de la plantilla (<plantilla>.schema.json); si no existe, JSON libre.
+        try:
+            return template_registry.output_validator("jinja", template_name)
+        except TemplateNotFoundError:
+            return None
 
-        system_prompt = self._load_and_render_template(template_name, context, user_prompt)
+    def _cache_key(self, model_name: str, template_name: str, context: Dict[str, Any], user_prompt: str,
+                   validator: Optional[OutputValidator] = None) -> str:
+        # Caché de respuestas: mismo modelo, plantilla (y su contenido), contexto, prompt y opciones -> misma respuesta
+        output_format = validator.key if validator is not None else OLLAMA_FORMAT
+        try:
+            template_key = template_registry.content_key("jinja", template_name)
+        except TemplateNotFoundError:
+            template_key = None
+        return make_cache_key(
+            model_name, template_name, context, user_prompt, {**OLLAMA_OPTIONS, "format": output_format}, template_key
+        )
+
+    def _prepare(self, model_name: str, template_name: str, context: Dict[str, Any],
+                 user_prompt: str) -> Tuple[PromptParts, Optional[Budget]]:
+        if not self.router.is_available(model_name):
+            raise ConnectionError(f"No hay ningún backend disponible para el modelo '{model_name}'.")
+
+        budget = None
+        if self.router.pool_for(model_name) in BUDGET_POOLS:
+            # num_ctx/num_predict según el prompt; si no cabe, se recorta el contexto de menor prioridad.
+            parts, budget = self.budgeter.fit(
+                model_name, lambda ctx: self._load_and_render_template(template_name, ctx, user_prompt), context)
+            if budget.trimmed:
+                logger.warning(f"Contexto recortado para {template_name}: compactados={budget.compacted} "
+                               f"descartados={budget.dropped} overflow={budget.overflow}")
+        else:
+            parts = self._load_and_render_template(template_name, context, user_prompt)
         
         # Este log es ligero y seguro
         logger.info(f"Ejecutando modelo: {model_name} con plantilla: {template_name}") 
+        return parts, budget
+
+    async def _build_output(self, model_name: str, template_name: str, raw_response_text: str,
+                      cache_key: str, cache_mode: str, extractor: Optional[IncrementalJSONExtractor] = None,
+                      budget: Optional[Budget] = None, validation: Optional[Validation] = None) -> Dict[str, Any]:
+        # Parseo con el extractor incremental: ignora preámbulos y ```json, y se queda
+        # con el primer objeto JSON completo (la charla posterior se descarta).
+        if extractor is None:
+            extractor = IncrementalJSONExtractor()
+            extractor.feed(raw_response_text)
+
+        if validation is not None and not validation.ok:
+            logger.warning(f"Salida de {model_name} fuera del esquema de {template_name}: {validation.errors()}")
+            return {
+                "status": validation.status,
+                "raw_text": raw_response_text,
+                "model_used": model_name,
+                "prompt_template": template_name,
+                "result_json": {},
+                "validation": validation.report(),
+            }
 
         try:
-            # Petición a Ollama
-            response = self.llm_client.chat(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt}
-                ],
-                options={'temperature': 0.1}, 
-                format='json'
-            )
-
-            raw_response_text = response['message']['content']
+            result_json = validation.result if validation is not None else extractor.finish()
+            if extractor.end_position is not None:
+                raw_response_text = raw_response_text[:extractor.end_position]
             
-            # Procesamiento y Parseo de la Respuesta con limpieza agresiva (REGEX)
-            try:
-                cleaned_text = raw_response_text.strip()
-
-                # Usa REGEX para encontrar el primer bloque que se parezca a un objeto JSON { ... }
-                # Esto es crucial para limpiar el output del modelo (como "```json{}```")
-                match = re.search(r'\{.*\}', cleaned_text, re.DOTALL)
-                
-                if match:
-                    json_candidate = match.group(0).strip()
-                    # Limpieza del bloque JSON si contiene las comillas triples
-                    if json_candidate.startswith('```json'):
-                        json_candidate = json_candidate[7:].strip() 
-                    if json_candidate.endswith('```'):
-                         json_candidate = json_candidate[:-3].strip() 
-                else:
-                    json_candidate = cleaned_text # Fallback
-                
-                result_json = json.loads(json_candidate)
-                
-                # RETORNO FINAL CORRECTO (EXITO) - Estructura Plana
-                return {
-                    "status": "ok",                       
-                    "result_json": result_json,           
-                    "model_used": model_name,
-                    "prompt_template": template_name,
-                    "raw_text": raw_response_text,        
-                }
+            # RETORNO FINAL CORRECTO (EXITO) - Estructura Plana
+            output = {
+                "status": "ok",                       
+                "result_json": result_json,           
+                "model_used": model_name,
+                "prompt_template": template_name,
+                "raw_text": raw_response_text,        
+            }
+            if budget is not None:
+                output["context_budget"] = budget.report()
+            if validation is not None:
+                output["validation"] = validation.report()
+            if cache_mode != "bypass":
+                await self.cache.aset(cache_key, output)
+            return output
+        
+        except JSONExtractionError as e:
+            logger.warning(f"JSON Decode Error: {e}")
             
-            except json.JSONDecodeError as e:
-                logger.warning(f"JSON Decode Error: {e}")
-                
-                # RETORNO FINAL CORRECTO (FALLO DE PARSEO) - Estructura Plana
-                return {
-                    "status": "parse_fail",              
-                    "raw_text": raw_response_text,       
-                    "model_used": model_name,
-                    "prompt_template": template_name,
-                    "result_json": {},                   
-                }
+            # RETORNO FINAL CORRECTO (FALLO DE PARSEO) - Estructura Plana
+            return {
+                "status": "parse_fail",              
+                "raw_text": raw_response_text,       
+                "model_used": model_name,
+                "prompt_template": template_name,
+                "result_json": {},                   
+            }
+
+    async def run_llm_agent(self, model_name: str, template_name: str, context: Dict[str, Any], user_prompt: str,
+                      cache_mode: str = "use") -> Dict[str, Any]:
+        validator = self._output_validator(template_name)
+        cache_key = self._cache_key(model_name, template_name, context, user_prompt, validator)
+        if cache_mode == "use":
+            cached = await self.cache.aget(cache_key)
+            if cached is not None:
+                return dict(cached)
 
+        parts, budget = self._prepare(model_name, template_name, context, user_prompt)
+        extractor = IncrementalJSONExtractor()
+        chunks: List[str] = []
+
+        try:
+            # El router elige el nodo del pool del modelo (menos peticiones en curso).
+            async for chunk in self._chat_stream(model_name, parts, extractor, budget, validator):
+                chunks.append(chunk)
         except Exception as e:
-            logger.error(f"Error en la llamada a Ollama: {e}")
-            raise
\ No newline at end of file
+            logger.error(f"Error en la llamada a {model_name}: {e}")
+            raise
+
+        raw_text = "".join(chunks)
+        validation = await self._validate(model_name, parts, raw_text, extractor, budget, validator)
+        return await self._build_output(model_name, template_name, raw_text, cache_key, cache_mode, extractor,
+                                        budget, validation)
+
+    @staticmethod
+    def _options(budget: Optional[Budget]) -> Dict[str, Any]:
+        return {**OLLAMA_OPTIONS, **budget.options()} if budget is not None else OLLAMA_OPTIONS
+
+    async def _validate(self, model_name: str, parts: PromptParts, raw_text: str, extractor: IncrementalJSONExtractor,
+                        budget: Optional[Budget], validator: Optional[OutputValidator]) -> Optional[Validation]:
+        # Validación contra el esquema de la plantilla; si no cumple, se pide sólo lo inválido.
+        if validator is None:
+            return None
+        validation = validator.check_extracted(extractor)
+        if not validation.ok:
+            await repair_output(validation, self.router, model_name, parts.messages(), raw_text,
+                                options=self._options(budget), prefix_key=parts.prefix_key)
+        return validation
+
+    async def _chat_stream(self, model_name: str, parts: PromptParts, extractor: IncrementalJSONExtractor,
+                           budget: Optional[Budget] = None,
+                           validator: Optional[OutputValidator] = None) -> AsyncIterator[str]:
+        # Petición en streaming vía router: se corta en cuanto el objeto JSON se cierra,
+        # así el modelo no sigue generando charla que luego se descarta. Con esquema de
+        # salida, el backend restringe la decodificación a ese esquema.
+        usage: Dict[str, Any] = {}
+        stream = self.router.stream(model_name, parts.messages(), options=self._options(budget),
+                                    response_format=validator.schema if validator is not None else OLLAMA_FORMAT,
+                                    usage=usage, prefix_key=parts.prefix_key)
+        try:
+            async for text in stream:
+                yield text
+                if extractor.feed(text) is not None:
+                    break
+        finally:
+            # Cerrar el stream cierra la conexión HTTP: el backend aborta la generación.
+            await stream.aclose()
+            if budget is not None:
+                self.budgeter.observe(model_name, prompt_chars(parts), usage)
+
+    async def stream_llm_agent(self, model_name: str, template_name: str, context: Dict[str, Any], user_prompt: str,
+                               cache_mode: str = "use") -> AsyncIterator[Dict[str, Any]]:
+        """
+        Variante en streaming de run_llm_agent. Emite {"type": "token", "text": ...}
+        por cada fragmento del backend y termina con {"type": "result", "output": {...}}.
+        """
+        validator = self._output_validator(template_name)
+        cache_key = self._cache_key(model_name, template_name, context, user_prompt, validator)
+        if cache_mode == "use":
+            cached = await self.cache.aget(cache_key)
+            if cached is not None:
+                yield {"type": "token", "text": cached["raw_text"]}
+                yield {"type": "result", "output": dict(cached)}
+                return
+
+        parts, budget = self._prepare(model_name, template_name, context, user_prompt)
+        extractor = IncrementalJSONExtractor()
+        chunks: List[str] = []
+        try:
+            async for text in self._chat_stream(model_name, parts, extractor, budget, validator):
+                chunks.append(text)
+                yield {"type": "token", "text": text}
+        except BackendError as e:
+            logger.error(f"Error en el streaming de {model_name}: {e}")
+            yield {"type": "error", "detail": f"Error en la llamada a {model_name}: {e}"}
+            return
+
+        raw_text = "".join(chunks)
+        validation = await self._validate(model_name, parts, raw_text, extractor, budget, validator)
+        output = await self._build_output(model_name, template_name, raw_text, cache_key, cache_mode, extractor,
+                                          budget, validation)
+        yield {"type": "result", "output": output}
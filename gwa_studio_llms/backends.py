@@ -0,0 +1,320 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+import httpx
+
+from gwa_studio_core.tracing import inject
+
+logger = logging.getLogger(__name__)
+
+# Formato de salida pedido al backend: None (texto libre), "json" o un JSON Schema.
+ResponseFormat = Union[None, str, Dict[str, Any]]
+Messages = List[Dict[str, str]]
+
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("GWA_OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("GWA_OLLAMA_READ_TIMEOUT", "180"))
+OLLAMA_MAX_CONNECTIONS = int(os.environ.get("GWA_OLLAMA_MAX_CONNECTIONS", "64"))
+# Tiempo que Ollama mantiene un modelo cargado tras su última petición: duración
+# ("30m", "2h"), segundos ("600") o "-1" para dejarlo residente siempre.
+OLLAMA_KEEP_ALIVE = os.environ.get("GWA_OLLAMA_KEEP_ALIVE", "30m").strip(' "')
+# Políticas por modelo, p. ej. "llama3:8b=-1,phi3:mini=5m". Sin entrada se usa GWA_OLLAMA_KEEP_ALIVE.
+OLLAMA_KEEP_ALIVE_POLICIES = os.environ.get("GWA_OLLAMA_KEEP_ALIVE_POLICIES", "")
+
+
+class BackendError(Exception):
+    """Fallo del backend LLM durante la generación."""
+    pass
+
+
+class BackendUnavailableError(BackendError):
+    """El backend no es alcanzable (conexión rechazada, timeout de conexión, sin nodos sanos)."""
+    pass
+
+
+class LLMBackend:
+    """
+    Interfaz común para los backends LLM (Ollama, Gemini, ...).
+
+    `stream` produce el texto a medida que se genera; cerrar el iterador corta la
+    generación. Si se pasa `usage`, el backend lo completa al final con
+    prompt_tokens / completion_tokens (y prompt_eval_ms / cached_tokens) cuando el
+    proveedor los informa.
+    """
+
+    kind = "base"
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def stream(self, model: str, messages: Messages, options: Optional[Dict[str, Any]] = None,
+                     response_format: ResponseFormat = None,
+                     usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+    async def generate(self, model: str, messages: Messages, options: Optional[Dict[str, Any]] = None,
+                       response_format: ResponseFormat = None,
+                       usage: Optional[Dict[str, Any]] = None) -> str:
+        chunks = [chunk async for chunk in self.stream(model, messages, options, response_format, usage)]
+        return "".join(chunks)
+
+    async def health_check(self) -> bool:
+        return True
+
+    async def warm_up(self) -> None:
+        """Prepara lo caro (SDK, clientes) antes de la primera petición; se llama en el warm-up del servicio."""
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.name}>"
+
+
+def ollama_model_name(model: str) -> str:
+    """Nombre con el que Ollama lista un modelo en /api/ps (sin etiqueta = ':latest')."""
+    return model if ":" in model else f"{model}:latest"
+
+
+def parse_keep_alive_policies(raw: str) -> Dict[str, str]:
+    """'modelo=duración,...' -> {modelo: duración}; las entradas mal formadas se ignoran."""
+    policies = {}
+    for item in raw.split(","):
+        model, _, value = item.strip(' "').partition("=")
+        if model.strip() and value.strip():
+            policies[ollama_model_name(model.strip())] = value.strip()
+    return policies
+
+
+def _keep_alive_value(value: str) -> Union[str, float]:
+    # Ollama interpreta los números como segundos (negativo = siempre) y las cadenas como duraciones de Go.
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _expires_at(value: Optional[str]) -> Optional[float]:
+    """expires_at de /api/ps (RFC 3339 con nanosegundos) como epoch; None si no se puede leer."""
+    if not value:
+        return None
+    text = re.sub(r"(\.\d{6})\d+", r"\1", value).replace("Z", "+00:00")
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+
+class OllamaBackend(LLMBackend):
+    """Un host de Ollama, vía /api/chat en streaming sobre un pool keep-alive."""
+
+    kind = "ollama"
+
+    def __init__(self, base_url: str, transport: Optional[httpx.AsyncBaseTransport] = None,
+                 keep_alive: Optional[Dict[str, str]] = None, default_keep_alive: str = OLLAMA_KEEP_ALIVE):
+        super().__init__(f"ollama@{base_url}")
+        self.base_url = base_url.rstrip("/")
+        self.keep_alive = keep_alive if keep_alive is not None else parse_keep_alive_policies(OLLAMA_KEEP_ALIVE_POLICIES)
+        self.default_keep_alive = default_keep_alive
+        self._transport = transport
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def keep_alive_for(self, model: str) -> Union[str, float]:
+        return _keep_alive_value(self.keep_alive.get(ollama_model_name(model), self.default_keep_alive))
+
+    @property
+    def _client(self) -> httpx.AsyncClient:
+        # Se crea (o recrea tras aclose) en el primer uso: el pool vive en el event loop del servicio.
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS),
+                transport=self._transport,
+            )
+        return self._http
+
+    async def stream(self, model, messages, options=None, response_format=None, usage=None):
+        payload: Dict[str, Any] = {"model": model, "messages": messages, "stream": True, "options": options or {},
+                                   "keep_alive": self.keep_alive_for(model)}
+        if response_format:
+            payload["format"] = response_format
+        try:
+            async with self._client.stream("POST", "/api/chat", json=payload, headers=inject({})) as response:
+                if response.status_code != 200:
+                    body = (await response.aread()).decode("utf-8", "replace")
+                    raise BackendError(f"{self.name} respondió {response.status_code}: {body[:200]}")
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError as e:
+                        # Línea truncada o corrupta: fallo del nodo, para que el router lo vea.
+                        raise BackendError(f"{self.name}: respuesta NDJSON inválida ({e}): {line[:200]}") from e
+                    if "error" in event:
+                        raise BackendError(f"{self.name}: {event['error']}")
+                    text = event.get("message", {}).get("content", "")
+                    if text:
+                        yield text
+                    if event.get("done"):
+                        if usage is not None:
+                            # Con el prefijo en la caché KV del nodo, Ollama sólo evalúa (y cuenta) el resto.
+                            usage["prompt_tokens"] = event.get("prompt_eval_count", 0)
+                            usage["completion_tokens"] = event.get("eval_count", 0)
+                            if "prompt_eval_duration" in event:
+                                usage["prompt_eval_ms"] = event["prompt_eval_duration"] / 1e6
+                        break
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            raise BackendUnavailableError(f"{self.name} no disponible: {e}") from e
+        except httpx.HTTPError as e:
+            raise BackendError(f"{self.name}: {e}") from e
+
+    async def health_check(self) -> bool:
+        try:
+            response = await self._client.get("/api/tags", timeout=2.0)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def load(self, model: str, options: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Carga el modelo en memoria (o renueva su keep_alive) sin generar: /api/generate sin prompt.
+        `options` debe llevar el num_ctx con el que se usará: si no coincide, Ollama lo recarga.
+        """
+        payload: Dict[str, Any] = {"model": model, "stream": False, "keep_alive": self.keep_alive_for(model)}
+        if options:
+            payload["options"] = options
+        try:
+            response = await self._client.post("/api/generate", json=payload)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            raise BackendUnavailableError(f"{self.name} no disponible: {e}") from e
+        except httpx.HTTPError as e:
+            raise BackendError(f"{self.name}: {e}") from e
+        if response.status_code != 200:
+            raise BackendError(f"{self.name} no pudo cargar '{model}' ({response.status_code}): {response.text[:200]}")
+
+    async def running_models(self) -> Dict[str, Optional[float]]:
+        """Modelos cargados ahora mismo (/api/ps) -> epoch en que Ollama los descargará (None si no lo informa)."""
+        try:
+            response = await self._client.get("/api/ps", timeout=2.0)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise BackendUnavailableError(f"{self.name}: /api/ps falló: {e}") from e
+        return {m.get("name") or m.get("model"): _expires_at(m.get("expires_at"))
+                for m in response.json().get("models") or []}
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+
+
+class GeminiBackend(LLMBackend):
+    """
+    API de Gemini (google-genai, cliente asíncrono).
+
+    Con `api_key` en lugar de `client`, el SDK (casi medio segundo de import) y el
+    cliente se crean en el warm-up del servicio o, si no, en la primera petición.
+    """
+
+    kind = "gemini"
+
+    def __init__(self, client: Any = None, name: str = "gemini", api_key: Optional[str] = None, base_url: str = ""):
+        super().__init__(name)
+        self._client = client
+        self.api_key = api_key
+        self.base_url = base_url
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from google import genai
+                    from google.genai import types
+
+                    http_options = types.HttpOptions(base_url=self.base_url) if self.base_url else None
+                    self._client = genai.Client(api_key=self.api_key, http_options=http_options)
+                    print("INFO: Cliente Gemini inicializado con éxito. Clave limpiada y lista.")
+        return self._client
+
+    async def warm_up(self) -> None:
+        await asyncio.to_thread(lambda: self.client)
+
+    @staticmethod
+    def _config(messages: Messages, options: Optional[Dict[str, Any]], response_format: ResponseFormat):
+        from google.genai import types
+
+        options = options or {}
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        config: Dict[str, Any] = {}
+        if system:
+            config["system_instruction"] = system
+        if "temperature" in options:
+            config["temperature"] = options["temperature"]
+        if "num_predict" in options:
+            config["max_output_tokens"] = options["num_predict"]
+        if response_format:
+            config["response_mime_type"] = "application/json"
+            if isinstance(response_format, dict):
+                config["response_json_schema"] = response_format
+        return types.GenerateContentConfig(**config)
+
+    async def stream(self, model, messages, options=None, response_format=None, usage=None):
+        contents = "\n\n".join(m["content"] for m in messages if m["role"] != "system")
+        try:
+            stream = await self.client.aio.models.generate_content_stream(
+                model=model, contents=contents, config=self._config(messages, options, response_format)
+            )
+        except Exception as e:
+            raise BackendError(f"Error al ejecutar el modelo Gemini (API): {e}") from e
+
+        try:
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+                metadata = getattr(chunk, "usage_metadata", None)
+                if usage is not None and metadata is not None:
+                    usage["prompt_tokens"] = metadata.prompt_token_count or 0
+                    usage["completion_tokens"] = metadata.candidates_token_count or 0
+                    # Caché implícita de Gemini: tokens del prefijo (system_instruction) ya procesados.
+                    usage["cached_tokens"] = metadata.cached_content_token_count or 0
+        except BackendError:
+            raise
+        except Exception as e:
+            raise BackendError(f"Error al ejecutar el modelo Gemini (API): {e}") from e
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose:
+                await aclose()
+
+
+def clean_api_key(raw: Optional[str]) -> Optional[str]:
+    """🚨 LIMPIEZA CRÍTICA: elimina espacios, newlines y comillas de la clave."""
+    if not raw:
+        return None
+    return raw.strip().replace('"', '').replace("'", '') or None
+
+
+def gemini_backend_from_env() -> Optional[GeminiBackend]:
+    api_key = clean_api_key(os.environ.get("GEMINI_API_KEY"))
+    if not api_key:
+        print("ADVERTENCIA: GEMINI_API_KEY no configurada. Los modelos Gemini no estarán disponibles.")
+        return None
+    # GWA_GEMINI_BASE_URL: endpoint alternativo de la API (proxy corporativo, servidor falso de benchmarks).
+    # El cliente se crea después (warm-up o primer uso): importar el servicio no carga el SDK.
+    return GeminiBackend(api_key=api_key, base_url=os.environ.get("GWA_GEMINI_BASE_URL", "").strip(' "'))
+
+
+def ollama_backends_from_env() -> List[OllamaBackend]:
+    """GWA_OLLAMA_HOSTS: lista separada por comas (por defecto http://localhost:11434)."""
+    hosts = os.environ.get("GWA_OLLAMA_HOSTS", "http://localhost:11434")
+    return [OllamaBackend(h.strip(' "')) for h in hosts.split(",") if h.strip(' "')]
@@ -0,0 +1,89 @@
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict
+
+# Ventana de resultados recientes, mínimo de llamadas para evaluar y proporción de fallos que abre el circuito.
+BREAKER_WINDOW = int(os.environ.get("GWA_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.environ.get("GWA_BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATIO = float(os.environ.get("GWA_BREAKER_FAILURE_RATIO", "0.5"))
+# Tiempo en 'open' antes de dejar pasar una petición de prueba ('half_open').
+BREAKER_COOLDOWN_S = float(os.environ.get("GWA_BREAKER_COOLDOWN_S", "30"))
+# Una respuesta cuyo primer token tarda más que esto cuenta como fallo (p. ej. modelo cargándose).
+BREAKER_SLOW_S = float(os.environ.get("GWA_BREAKER_SLOW_S", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por backend (closed -> open -> half_open -> closed).
+
+    En 'closed' todo pasa y se registra el resultado de cada llamada; si en la
+    ventana la proporción de fallos (errores o primer token lento) supera el
+    umbral, pasa a 'open' y el router deja de enviarle tráfico. Tras el cooldown
+    admite una sola llamada de prueba: si sale bien se cierra, si no vuelve a abrirse.
+    """
+
+    def __init__(self, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_ratio: float = BREAKER_FAILURE_RATIO, cooldown_s: float = BREAKER_COOLDOWN_S,
+                 slow_s: float = BREAKER_SLOW_S):
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown_s = cooldown_s
+        self.slow_s = slow_s
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._probe_in_flight = False
+
+    def available(self) -> bool:
+        """¿Puede recibir una petición ahora? No consume la plaza de prueba."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown_s
+        return not self._probe_in_flight
+
+    def on_acquire(self) -> None:
+        """El router ha elegido este backend: en open/half_open, esta es la llamada de prueba."""
+        if self.state == OPEN and self.available():
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = True
+
+    def record(self, ok: bool) -> None:
+        if self.state == OPEN:
+            # Llamadas que ya estaban en curso al abrirse: no cuentan para la nueva ventana.
+            return
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+            if ok:
+                self.state = CLOSED
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        self._outcomes.append(ok)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_ratio:
+            self._open()
+
+    def release_probe(self) -> None:
+        """La llamada de prueba se canceló sin resultado (p. ej. perdió un hedge)."""
+        self._probe_in_flight = False
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self._outcomes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "times_opened": self.times_opened,
+            "recent_failures": self._outcomes.count(False),
+            "recent_calls": len(self._outcomes),
+        }
@@ -0,0 +1,258 @@
+# context_budget.py - Ventana de contexto y presupuesto del prompt por petición
+#
+# Ollama reserva la caché KV para num_ctx tokens: un num_ctx fijo (4096) desperdicia
+# memoria y tiempo de carga con prompts cortos y, con prompts largos, Ollama recorta
+# el principio del prompt sin avisar. ContextBudgeter decide por petición:
+#   - estima los tokens del prompt renderizado por caracteres, con la relación
+#     caracteres/token calibrada por modelo con el prompt_eval_count real de Ollama;
+#   - num_ctx = el menor de GWA_CTX_SIZES donde caben prompt + num_predict. Cada cambio
+#     de num_ctx obliga a Ollama a recargar el modelo, así que son pocos tamaños y, una
+#     vez que se sube, sólo se vuelve a bajar tras GWA_CTX_SHRINK_AFTER peticiones
+#     seguidas que caben en uno menor (o GWA_CTX_STICKY_S sin peticiones);
+#   - si ni el mayor alcanza, compacta (y después descarta) los campos del contexto de
+#     menor prioridad, siempre en el mismo orden, y como último recurso reduce
+#     num_predict. Lo recortado queda en el informe de la petición.
+
+import json
+import math
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .template_registry import PromptParts
+
+CTX_SIZES = sorted(int(s) for s in os.environ.get("GWA_CTX_SIZES", "2048,4096,8192").split(",") if s.strip())
+NUM_PREDICT = int(os.environ.get("GWA_NUM_PREDICT", "1024"))
+# Respuesta mínima que se reserva aunque el prompt no quepa entero.
+NUM_PREDICT_MIN = int(os.environ.get("GWA_NUM_PREDICT_MIN", "256"))
+CTX_SHRINK_AFTER = int(os.environ.get("GWA_CTX_SHRINK_AFTER", "20"))
+CTX_STICKY_S = float(os.environ.get("GWA_CTX_STICKY_S", "300"))
+# Holgura sobre la estimación (plantilla de chat del modelo y error del estimador).
+CTX_SAFETY = float(os.environ.get("GWA_CTX_SAFETY", "1.1"))
+CHARS_PER_TOKEN = float(os.environ.get("GWA_CHARS_PER_TOKEN", "3.5"))
+# Campos del contexto por importancia (el primero, el más importante). Los no listados
+# son de baja prioridad: se compactan y se descartan antes que cualquiera de estos,
+# que sólo se compactan.
+CONTEXT_PRIORITY = [f.strip() for f in os.environ.get(
+    "GWA_CONTEXT_PRIORITY", "nombre_empresa,sector,nombre_ciudad,ubicacion").split(",") if f.strip()]
+# Tamaño al que se compacta un campo largo (caracteres de su representación JSON).
+CONTEXT_FIELD_MAX_CHARS = int(os.environ.get("GWA_CONTEXT_FIELD_MAX_CHARS", "400"))
+# Pools cuyos backends usan num_ctx (Gemini gestiona su propia ventana).
+BUDGET_POOLS = {p.strip() for p in os.environ.get("GWA_CTX_BUDGET_POOLS", "ollama").split(",") if p.strip()}
+
+
+def prompt_chars(parts: PromptParts) -> int:
+    return len(parts.prefix) + len(parts.suffix)
+
+
+class TokenEstimator:
+    """Tokens ≈ caracteres / relación del modelo; la relación se ajusta con lo que informa el backend."""
+
+    def __init__(self, chars_per_token: float = CHARS_PER_TOKEN, alpha: float = 0.2):
+        self.default = chars_per_token
+        self.alpha = alpha
+        self.ratios: Dict[str, float] = {}
+        self.samples: Dict[str, int] = {}
+
+    def ratio(self, model: str) -> float:
+        return self.ratios.get(model, self.default)
+
+    def estimate(self, chars: int, model: str) -> int:
+        return math.ceil(chars / self.ratio(model))
+
+    def observe(self, model: str, chars: int, tokens: int) -> None:
+        if chars <= 0 or tokens <= 0:
+            return
+        # Una evaluación muy por debajo de lo estimado es la caché de prompt de Ollama, no el tamaño real.
+        if tokens < 0.5 * self.estimate(chars, model):
+            return
+        ratio = min(8.0, max(1.5, chars / tokens))
+        current = self.ratios.get(model)
+        self.ratios[model] = ratio if current is None else current + self.alpha * (ratio - current)
+        self.samples[model] = self.samples.get(model, 0) + 1
+
+
+class Budget:
+    """num_ctx/num_predict elegidos para una petición y qué se recortó del contexto para llegar."""
+
+    __slots__ = ("num_ctx", "num_predict", "prompt_tokens", "compacted", "dropped", "overflow")
+
+    def __init__(self, num_ctx: int, num_predict: int, prompt_tokens: int, compacted: Optional[List[str]] = None,
+                 dropped: Optional[List[str]] = None, overflow: bool = False):
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.prompt_tokens = prompt_tokens
+        self.compacted = compacted or []
+        self.dropped = dropped or []
+        self.overflow = overflow
+
+    @property
+    def trimmed(self) -> bool:
+        return bool(self.compacted or self.dropped or self.overflow)
+
+    def options(self) -> Dict[str, int]:
+        return {"num_ctx": self.num_ctx, "num_predict": self.num_predict}
+
+    def report(self) -> Dict[str, Any]:
+        return {"num_ctx": self.num_ctx, "num_predict": self.num_predict, "prompt_tokens_est": self.prompt_tokens,
+                "compacted": self.compacted, "dropped": self.dropped, "overflow": self.overflow}
+
+
+def _json_len(value: Any) -> int:
+    return len(json.dumps(value, ensure_ascii=False, default=str))
+
+
+def compact_value(value: Any, max_chars: int) -> Any:
+    """Versión acotada de un valor del contexto, del mismo tipo: texto cortado por palabra, listas y dicts reducidos."""
+    if isinstance(value, str):
+        if len(value) <= max_chars:
+            return value
+        cut = value[:max_chars]
+        if not value[max_chars].isspace() and " " in cut:
+            cut = cut.rsplit(" ", 1)[0]  # sin palabras a medias
+        return cut.rstrip() + " …"
+    if isinstance(value, list):
+        kept, used = [], 0
+        for item in value:
+            item = compact_value(item, max_chars)
+            size = _json_len(item)
+            if kept and used + size > max_chars:
+                break
+            kept.append(item)
+            used += size
+        return kept
+    if isinstance(value, dict):
+        share = max(40, max_chars // max(1, len(value)))
+        return {k: compact_value(v, share) for k, v in value.items()}
+    return value
+
+
+def _empty(value: Any) -> Any:
+    return type(value)() if isinstance(value, (str, list, dict)) else ""
+
+
+class ContextBudgeter:
+    def __init__(self, sizes: Iterable[int] = CTX_SIZES, num_predict: int = NUM_PREDICT,
+                 num_predict_min: int = NUM_PREDICT_MIN, shrink_after: int = CTX_SHRINK_AFTER,
+                 sticky_s: float = CTX_STICKY_S, safety: float = CTX_SAFETY, priority: Iterable[str] = CONTEXT_PRIORITY,
+                 field_max_chars: int = CONTEXT_FIELD_MAX_CHARS, estimator: Optional[TokenEstimator] = None):
+        self.sizes = sorted(sizes)
+        self.num_predict = num_predict
+        self.num_predict_min = num_predict_min
+        self.shrink_after = shrink_after
+        self.sticky_s = sticky_s
+        self.safety = safety
+        self.priority = list(priority)
+        self.field_max_chars = field_max_chars
+        self.estimator = estimator or TokenEstimator()
+        # modelo -> [num_ctx en uso, peticiones seguidas que cabían en menos, mayor de ellas, última petición]
+        self._held: Dict[str, List[float]] = {}
+        self.chosen: Dict[int, int] = {}
+        self.trims = {"compacted": 0, "dropped": 0, "overflow": 0}
+
+    def _needed(self, prompt_tokens: int) -> int:
+        return math.ceil(prompt_tokens * self.safety)
+
+    def fits(self, model: str, chars: int, num_predict: Optional[int] = None) -> bool:
+        tokens = self.estimator.estimate(chars, model)
+        return self._needed(tokens) + (num_predict or self.num_predict) <= self.sizes[-1]
+
+    def current_ctx(self, model: str) -> int:
+        """num_ctx con el que conviene tener cargado el modelo (el que está en uso o el menor)."""
+        held = self._held.get(model)
+        return int(held[0]) if held is not None and time.monotonic() - held[3] < self.sticky_s else self.sizes[0]
+
+    def _sticky(self, model: str, size: int) -> int:
+        # Alternar num_ctx recarga el modelo en cada cambio: se sube en cuanto hace falta,
+        # pero sólo se baja cuando las últimas `shrink_after` peticiones cabían en menos.
+        now = time.monotonic()
+        held = self._held.get(model)
+        if held is None or size >= held[0] or now - held[3] >= self.sticky_s:
+            self._held[model] = [size, 0, 0, now]
+            return size
+        held[1] += 1
+        held[2] = max(held[2], size)
+        held[3] = now
+        if held[1] >= self.shrink_after:
+            self._held[model] = [held[2], 0, 0, now]
+        return int(held[0])
+
+    def plan(self, model: str, chars: int, num_predict: Optional[int] = None) -> Budget:
+        """Menor num_ctx para un prompt de `chars` caracteres y la respuesta pedida."""
+        num_predict = num_predict or self.num_predict
+        tokens = self.estimator.estimate(chars, model)
+        needed = self._needed(tokens)
+        size = next((s for s in self.sizes if needed + num_predict <= s), None)
+        overflow = False
+        if size is None:
+            # Antes que dejar que Ollama recorte el prompt, se acorta la respuesta hasta el mínimo.
+            size = self.sizes[-1]
+            num_predict = max(self.num_predict_min, size - needed)
+            overflow = needed + self.num_predict_min > size
+        size = self._sticky(model, size)
+        self.chosen[size] = self.chosen.get(size, 0) + 1
+        return Budget(size, num_predict, tokens, overflow=overflow)
+
+    def _victims(self, context: Dict[str, Any], protected: Iterable[str]) -> List[str]:
+        """Campos recortables, de menor a mayor prioridad (los no listados primero, los más grandes antes)."""
+        protected = set(protected)
+        rank = {name: i for i, name in enumerate(self.priority)}
+        fields = [k for k in context if k not in protected]
+        return sorted(fields, key=lambda k: (-rank.get(k, len(self.priority)), -_json_len(context[k]), k))
+
+    def fit(self, model: str, render: Callable[[Dict[str, Any]], PromptParts], context: Dict[str, Any],
+            protected: Iterable[str] = (), num_predict: Optional[int] = None) -> Tuple[PromptParts, Budget]:
+        """
+        Renderiza con `render(context)` y, si el prompt no cabe en el mayor num_ctx, lo
+        reintenta con el contexto recortado: primero compacta cada campo (menor prioridad
+        primero), luego descarta los de baja prioridad. `protected` no se toca nunca.
+        """
+        parts = render(context)
+        if self.fits(model, prompt_chars(parts), num_predict):
+            return parts, self.plan(model, prompt_chars(parts), num_predict)
+
+        work = dict(context)
+        compacted: List[str] = []
+        dropped: List[str] = []
+        victims = self._victims(context, protected)
+        steps = [(name, compact_value, compacted) for name in victims]
+        steps += [(name, lambda v, _: _empty(v), dropped) for name in victims if name not in self.priority]
+        for name, shrink, done in steps:
+            value = shrink(work[name], self.field_max_chars)
+            if value == work[name]:
+                continue
+            candidate = render({**work, name: value})
+            if prompt_chars(candidate) >= prompt_chars(parts):
+                continue  # el campo no aparece en el prompt: recortarlo no ayuda
+            work[name], parts = value, candidate
+            done.append(name)
+            if self.fits(model, prompt_chars(parts), num_predict):
+                break
+
+        compacted = [name for name in compacted if name not in dropped]
+        budget = self.plan(model, prompt_chars(parts), num_predict)
+        budget.compacted, budget.dropped = compacted, dropped
+        for key, hit in (("compacted", compacted), ("dropped", dropped), ("overflow", budget.overflow)):
+            if hit:
+                self.trims[key] += 1
+        return parts, budget
+
+    def observe(self, model: str, chars: int, usage: Dict[str, Any]) -> None:
+        """Calibra el estimador con los tokens de prompt que informó el backend (salvo prefijo ya en caché)."""
+        if usage.get("prefix_hit") or usage.get("cached_tokens"):
+            return
+        self.estimator.observe(model, chars, usage.get("prompt_tokens") or 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sizes": self.sizes,
+            "num_predict": self.num_predict,
+            "chosen": {str(size): n for size, n in sorted(self.chosen.items())},
+            "trims": dict(self.trims),
+            "chars_per_token": {m: round(r, 3) for m, r in sorted(self.estimator.ratios.items())},
+            "samples": dict(self.estimator.samples),
+        }
+
+
+# Instancia compartida por AgentService, LLMAgentExecutor y LLMProcessor.
+context_budgeter = ContextBudgeter()
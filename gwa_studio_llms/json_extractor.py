@@ -0,0 +1,164 @@
+import json
+import re
+from typing import Any, Iterable, List, Optional
+
+# Fuera de un string sólo interesan llaves y strings completos; un string se salta
+# entero con una sola búsqueda (en C) en vez de recorrer carácter a carácter.
+# El grupo 1 captura la comilla de cierre: si está vacío, el string sigue en el
+# próximo fragmento.
+_TOKEN = re.compile(r'[{}]|"[^"\\]*(?:\\.[^"\\]*)*("?)', re.S)
+_STRING_REST = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*("?)', re.S)
+_DECODER = json.JSONDecoder()
+
+
+class JSONExtractionError(ValueError):
+    """No se pudo extraer un objeto JSON. `position` es el offset absoluto en el texto."""
+
+    def __init__(self, reason: str, position: int):
+        super().__init__(f"{reason} (posición {position})")
+        self.reason = reason
+        self.position = position
+
+
+class IncrementalJSONExtractor:
+    """
+    Extrae el primer objeto JSON de nivel superior de un texto que llega por partes.
+
+    Recorre cada fragmento una sola vez siguiendo profundidad de llaves, strings y
+    escapes, e ignora lo que haya antes del primer '{' (charla, ```json, etc.).
+    En cuanto el objeto se cierra, `feed` lo devuelve y `done` pasa a True: el
+    llamador puede dejar de consumir el stream para que el backend deje de generar.
+    """
+
+    def __init__(self):
+        self.result: Any = None
+        self.done = False
+        self.end_position: Optional[int] = None  # offset justo después de la '}' final
+        self.errors: List[JSONExtractionError] = []
+        self._consumed = 0          # caracteres de fragmentos anteriores
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._parts: List[str] = []  # trozos del objeto candidato de fragmentos anteriores
+        self._start = -1             # offset absoluto del '{' del candidato
+
+    def feed(self, chunk: str) -> Any:
+        """Procesa un fragmento. Devuelve el objeto si acaba de completarse, si no None."""
+        if self.done or not chunk:
+            return self.result if self.done else None
+
+        pos = 0
+        segment_start = 0 if self._depth else -1
+        n = len(chunk)
+
+        while pos < n:
+            if self._escape:
+                self._escape = False
+                pos += 1
+                continue
+
+            if self._in_string:
+                m = _STRING_REST.match(chunk, pos)
+                pos = self._after_string(m, n)
+                continue
+
+            if self._depth == 0:
+                idx = chunk.find("{", pos)
+                if idx == -1:
+                    break
+                # Camino rápido: si el objeto completo ya está en este fragmento
+                # (p. ej. texto entero), el decoder en C lo resuelve de una vez.
+                try:
+                    self.result, end = _DECODER.raw_decode(chunk, idx)
+                except json.JSONDecodeError:
+                    pass
+                else:
+                    if isinstance(self.result, dict):
+                        self.done = True
+                        self.end_position = self._consumed + end
+                        self._consumed += n
+                        return self.result
+                    self.result = None
+                self._depth = 1
+                self._start = self._consumed + idx
+                self._parts = []
+                segment_start = idx
+                pos = idx + 1
+                continue
+
+            m = _TOKEN.search(chunk, pos)
+            if m is None:
+                break
+            char = chunk[m.start()]
+            if char == '"':
+                self._in_string = True
+                pos = self._after_string(m, n)
+            elif char == "{":
+                self._depth += 1
+                pos = m.end()
+            else:
+                pos = m.end()
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(chunk[segment_start:pos])
+                    if self._close(self._consumed + pos):
+                        self._consumed += n
+                        return self.result
+                    segment_start = -1
+
+        if self._depth and segment_start != -1:
+            self._parts.append(chunk[segment_start:])
+        self._consumed += n
+        return None
+
+    def _after_string(self, m: "re.Match[str]", n: int) -> int:
+        if m.group(1):
+            self._in_string = False
+            return m.end()
+        # String sin cerrar en este fragmento; si termina en '\\' el escape sigue en el próximo.
+        if m.end() < n:
+            self._escape = True
+        return n
+
+    def _close(self, end_position: int) -> bool:
+        candidate = "".join(self._parts)
+        self._parts = []
+        try:
+            self.result = json.loads(candidate)
+        except json.JSONDecodeError as e:
+            # Bloque balanceado que no es JSON (p. ej. "{nombre}" en la charla): se sigue buscando.
+            self.errors.append(JSONExtractionError(f"JSON inválido: {e.msg}", self._start + e.pos))
+            return False
+        self.done = True
+        self.end_position = end_position
+        return True
+
+    def finish(self) -> Any:
+        """Fin del texto: devuelve el objeto o levanta JSONExtractionError con la posición del fallo."""
+        if self.done:
+            return self.result
+        if self._depth:
+            raise JSONExtractionError(
+                f"Objeto JSON incompleto: faltan {self._depth} llave(s) de cierre "
+                f"para el '{{' abierto en la posición {self._start}",
+                self._consumed,
+            )
+        if self.errors:
+            raise self.errors[-1]
+        raise JSONExtractionError("No se encontró ningún objeto JSON en la respuesta", self._consumed)
+
+
+def extract_json(text: str) -> Any:
+    """Atajo para un texto completo: devuelve el primer objeto JSON de nivel superior."""
+    extractor = IncrementalJSONExtractor()
+    extractor.feed(text)
+    return extractor.finish()
+
+
+def extract_json_from_chunks(chunks: Iterable[str]) -> Any:
+    """Consume fragmentos sólo hasta que el objeto se cierra (no agota el iterable)."""
+    extractor = IncrementalJSONExtractor()
+    for chunk in chunks:
+        if extractor.feed(chunk) is not None:
+            break
+    return extractor.finish()
@@ -1,10 +1,9 @@
+import asyncio
 import os
-import json
-from typing import Dict, Any, List
+import time
+from typing import AsyncIterator, Dict, Any, List, Literal, Optional, Tuple
 from pydantic import BaseModel, Field
 from fastapi import HTTPException
-from google import genai
-from google.genai import types
 
 try:
     # Asegúrate de que esta ruta de importación sea correcta para tu proyecto
@@ -13,110 +12,409 @@ except ImportError:
     print("ERROR: No se pudo importar 'prompt_manager'.")
     prompt_manager = None 
 
+from .response_cache import ResponseCache, make_cache_key, response_cache
+from .json_extractor import IncrementalJSONExtractor, JSONExtractionError
+from .singleflight import SingleFlight
+from .backends import BackendError, BackendUnavailableError
+from .context_budget import BUDGET_POOLS, Budget, ContextBudgeter, context_budgeter, prompt_chars
+from .llm_router import LLMRouter, llm_router
+from .output_schema import OutputValidator, Validation, repair_output
+from .template_registry import PromptParts, TemplateNotFoundError
+from . import metrics
+from gwa_studio_core.shared_state import shared_state
+from gwa_studio_core.tracing import Tracer
+
+# Spans de MAGENTA: agent > render, model_call, parse (hijos del traceparent que envía CIAN).
+tracer = Tracer("magenta")
+
 # --- Modelos Pydantic (Sin cambios) ---
 class AgentExecutionRequest(BaseModel):
-    model_name: str = Field(..., description="El modelo LLM a ejecutar (Gemini).")
+    model_name: str = Field(..., description="El modelo LLM a ejecutar ('gemini-*' -> Gemini; el resto -> pool de Ollama).")
     template_name: str = Field(..., description="Nombre de la plantilla de prompt a usar.")
     context: Dict[str, Any] = Field(..., description="Variables de contexto para inyectar.")
     user_prompt: str = Field(..., description="Instrucción específica del usuario (el 'pront trivial').")
+    cache_mode: Literal["use", "refresh", "bypass"] = Field("use", description="Uso de la caché de respuestas: 'use', 'refresh' o 'bypass'.")
 
 class AgentOutput(BaseModel):
-    status: str = Field(..., description="Estado de la ejecución: 'ok' o 'parse_fail'.")
+    status: str = Field(..., description="Estado de la ejecución: 'ok', 'parse_fail' o 'schema_fail' (JSON que no cumple el esquema de la plantilla).")
     raw_text: str = Field(..., description="Texto crudo de la respuesta del LLM.")
     result_json: Dict[str, Any] = Field(..., description="El output JSON estructurado.")
     model_used: str = Field(..., description="Modelo LLM utilizado.")
     prompt_template: str = Field(..., description="Nombre de la plantilla de prompt utilizada.")
+    context_budget: Optional[Dict[str, Any]] = Field(None, description="num_ctx/num_predict elegidos y campos del contexto compactados o descartados.")
+    validation: Optional[Dict[str, Any]] = Field(None, description="Validación contra el esquema de salida: primera pasada, reparaciones y errores restantes.")
 
+# Concurrencia por defecto y máxima de un lote, y tamaño máximo del lote.
+BATCH_CONCURRENCY = int(os.environ.get("GWA_BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("GWA_BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_ITEMS = int(os.environ.get("GWA_BATCH_MAX_ITEMS", "500"))
 
-# --- Configuración del Cliente Gemini (CON LIMPIEZA DE CLAVE) ---
+class AgentBatchRequest(BaseModel):
+    items: List[AgentExecutionRequest] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS, description="Peticiones a ejecutar.")
+    concurrency: Optional[int] = Field(None, ge=1, description="Ejecuciones simultáneas (acotado por GWA_BATCH_MAX_CONCURRENCY).")
 
-GEMINI_API_KEY_RAW = os.environ.get("GEMINI_API_KEY")
-GEMINI_API_KEY = None 
-gemini_client = None 
 
-if GEMINI_API_KEY_RAW:
-    # 🚨 LIMPIEZA CRÍTICA: Elimina espacios, newlines y comillas.
-    GEMINI_API_KEY = GEMINI_API_KEY_RAW.strip().replace('"', '').replace("'", '')
-    
-    try:
-        gemini_client = genai.Client(api_key=GEMINI_API_KEY)
-        print("INFO: Cliente Gemini inicializado con éxito. Clave limpiada y lista.")
-    except Exception as e:
-        print(f"ERROR: No se pudo inicializar el cliente Gemini. Revise la clave. {e}")
-else:
-    print("ADVERTENCIA: GEMINI_API_KEY no configurada. El servicio MAGENTA fallará con 500.")
+# Salida JSON forzada en cualquier backend (Ollama: format=json; Gemini: response_mime_type).
+# Si la plantilla declara un esquema de salida, se envía el esquema en su lugar.
+RESPONSE_FORMAT = "json"
+GENERATION_OPTIONS = {"format": RESPONSE_FORMAT}
 
 
 class AgentService:
-    def __init__(self, prompt_manager_instance):
+    def __init__(self, prompt_manager_instance, cache: ResponseCache = response_cache, router: LLMRouter = llm_router,
+                 budgeter: ContextBudgeter = context_budgeter):
         if not prompt_manager_instance:
              raise Exception("No se pudo inicializar AgentService: Falta la instancia de prompt_manager.")
         self.prompt_manager = prompt_manager_instance
-        
-    def run_agent(self, request: AgentExecutionRequest) -> AgentOutput:
-        
-        if not gemini_client:
+        self.cache = cache
+        self.router = router
+        self.budgeter = budgeter
+        self.singleflight = SingleFlight(shared_state)
+
+    def request_key(self, request: AgentExecutionRequest) -> str:
+        """Clave canónica de la petición (modelo + plantilla y su contenido + contexto + prompt + opciones)."""
+        validator = self._validator(request)
+        options = GENERATION_OPTIONS if validator is None else {"format": validator.key}
+        return make_cache_key(
+            request.model_name, request.template_name, request.context, request.user_prompt, options,
+            self._template_key(request)
+        )
+
+    def _template_key(self, request: AgentExecutionRequest) -> Optional[str]:
+        """Firma del contenido de la plantilla; None si no existe (el render da el 400)."""
+        lookup = getattr(self.prompt_manager, "template_key", None)
+        if lookup is None:
+            return None
+        try:
+            return lookup(request.template_name)
+        except TemplateNotFoundError:
+            return None
+
+    def _validator(self, request: AgentExecutionRequest) -> Optional[OutputValidator]:
+        """Esquema de salida compilado de la plantilla; None si no declara (o no existe: el render da el 400)."""
+        lookup = getattr(self.prompt_manager, "output_validator", None)
+        if lookup is None:
+            return None
+        try:
+            return lookup(request.template_name)
+        except TemplateNotFoundError:
+            return None
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Esquema de salida inválido en la plantilla: {e}")
+
+    async def run_agent_shared(self, request: AgentExecutionRequest) -> AgentOutput:
+        """
+        Punto de entrada de MAGENTA: las peticiones idénticas concurrentes comparten
+        una sola generación. 'bypass' pide explícitamente una generación propia.
+        """
+        if request.cache_mode == "bypass":
+            return await self.run_agent(request)
+        key = self.request_key(request)
+        return await self.singleflight.do(key, lambda: self.run_agent(request),
+                                          lookup=lambda: self._cached_output(request, key))
+
+    def _require_backend(self, request: AgentExecutionRequest):
+        if not self.router.is_available(request.model_name):
              raise HTTPException(
-                status_code=500,
-                detail="GEMINI_API_KEY no está configurada o es inválida. La inferencia Gemini no puede comenzar."
+                status_code=503,
+                detail=f"No hay ningún backend disponible para el modelo '{request.model_name}'."
             )
 
-        # 🚀 MODIFICACIÓN CRÍTICA: INYECTAR EL PRONT TRIVIAL EN EL CONTEXTO
-        # ----------------------------------------------------------------------
-        # 1. Copiamos el contexto base.
-        processing_context = request.context.copy()
-        # 2. Inyectamos la solicitud del usuario bajo una clave específica.
-        processing_context["user_prompt_trivial"] = request.user_prompt
-        # ----------------------------------------------------------------------
-        
+    def _render_with(self, request: AgentExecutionRequest, processing_context: Dict[str, Any]) -> PromptParts:
         # 3. Corrección: Solo pasar template_name y el contexto enriquecido.
+        #    Con render_parts el prefijo estático de la plantilla viaja aparte (mensaje system
+        #    idéntico byte a byte) para que el backend reutilice su caché de prompt.
         try:
-             final_prompt = self.prompt_manager.render_prompt(
+             render_parts = getattr(self.prompt_manager, "render_parts", None)
+             if render_parts is not None:
+                 return render_parts(request.template_name, processing_context)
+             return PromptParts("", self.prompt_manager.render_prompt(
                 request.template_name,
                 processing_context # Usamos el contexto con el pront trivial
-             ) 
+             ))
         except Exception as e:
             raise HTTPException(
                 status_code=400,
                 detail=f"Error al renderizar el prompt: {e}. Revise la definición de render_prompt en prompt_manager.py."
             )
 
-        try:
-            # 4. Llamada a la API de Gemini. Se fuerza la salida JSON.
-            response = gemini_client.models.generate_content(
-                model='gemini-2.5-flash',
-                contents=final_prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json" 
-                )
-            )
-            
-            raw_text = response.text 
-            
-            # 5. Procesar la Salida JSON
-            # ... (Resto del código de procesamiento JSON)
+    def _render_final_prompt(self, request: AgentExecutionRequest) -> Tuple[PromptParts, Optional[Budget]]:
+        # 🚀 MODIFICACIÓN CRÍTICA: INYECTAR EL PRONT TRIVIAL EN EL CONTEXTO
+        # ----------------------------------------------------------------------
+        # 1. Copiamos el contexto base.
+        processing_context = request.context.copy()
+        # 2. Inyectamos la solicitud del usuario bajo una clave específica.
+        processing_context["user_prompt_trivial"] = request.user_prompt
+        # ----------------------------------------------------------------------
+        if self.router.pool_for(request.model_name) not in BUDGET_POOLS:
+            return self._render_with(request, processing_context), None
+        # num_ctx/num_predict a medida del prompt; si no cabe, se recorta el contexto de menor
+        # prioridad (nunca la petición del usuario) en lugar de dejar que Ollama lo trunque.
+        return self.budgeter.fit(request.model_name, lambda ctx: self._render_with(request, ctx), processing_context,
+                                 protected=("user_prompt_trivial",))
+
+    def _build_output(self, request: AgentExecutionRequest, raw_text: str, cache_key: str,
+                      extractor: Optional[IncrementalJSONExtractor] = None, budget: Optional[Budget] = None,
+                      validation: Optional[Validation] = None) -> AgentOutput:
+        # 5. Procesar la Salida JSON (extractor incremental: primer objeto JSON completo),
+        #    ya validada contra el esquema de la plantilla si declara uno.
+        if validation is not None:
+            status = validation.status
+            result_json = validation.result if validation.ok else {
+                "error": "El modelo no generó un JSON que cumpla el esquema de salida. Texto crudo en 'raw_text'.",
+                "detail": validation.errors(),
+            }
+        else:
+            if extractor is None:
+                extractor = IncrementalJSONExtractor()
+                extractor.feed(raw_text)
             try:
-                result_json = json.loads(raw_text)
+                result_json = extractor.finish()
                 status = "ok"
-            except json.JSONDecodeError:
-                result_json = {"error": "El modelo no pudo generar un JSON válido. Texto crudo en 'raw_text'."}
+            except JSONExtractionError as e:
+                result_json = {
+                    "error": "El modelo no pudo generar un JSON válido. Texto crudo en 'raw_text'.",
+                    "detail": e.reason,
+                    "position": e.position,
+                }
                 status = "parse_fail"
 
-            # 6. Devolver el resultado
-            return AgentOutput(
-                status=status,
-                raw_text=raw_text,
-                result_json=result_json,
-                model_used='gemini-2.5-flash', 
-                prompt_template=request.template_name,
-            )
+        # 6. Devolver el resultado (`_finish` cachea las respuestas válidas)
+        output = AgentOutput(
+            status=status,
+            raw_text=raw_text,
+            result_json=result_json,
+            model_used=request.model_name,
+            prompt_template=request.template_name,
+            context_budget=budget.report() if budget is not None else None,
+            validation=validation.report() if validation is not None else None,
+        )
+        return output
 
-        except Exception as e:
-            print(f"Error al llamar a la API de Gemini: {e}")
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Error al ejecutar el modelo Gemini (API): {e}"
-            )
+    def _observe(self, request: AgentExecutionRequest, stage: str, started: float) -> None:
+        metrics.stage_seconds.observe(time.perf_counter() - started, stage=stage, **metrics.labels_for(request))
+
+    def _render_timed(self, request: AgentExecutionRequest) -> Tuple[PromptParts, Optional[Budget], float]:
+        """Prompt final, presupuesto y duración del render (la métrica la publica `_record_render`)."""
+        started = time.perf_counter()
+        with tracer.span("render", template=request.template_name) as span:
+            final_prompt, budget = self._render_final_prompt(request)
+            if budget is not None:
+                span.attributes.update(num_ctx=budget.num_ctx, prompt_tokens_est=budget.prompt_tokens)
+                if budget.trimmed:
+                    print(f"Contexto recortado para '{request.template_name}': compactados={budget.compacted} "
+                          f"descartados={budget.dropped} overflow={budget.overflow}")
+        # La plantilla existe (se renderizó): pasa a tener serie propia en las métricas.
+        metrics.template_labels.learn(request.template_name)
+        return final_prompt, budget, time.perf_counter() - started
+
+    def _record_render(self, request: AgentExecutionRequest, budget: Optional[Budget], render_s: float) -> None:
+        # Tras la llamada al backend: si llegó a generar, el modelo ya tiene etiqueta propia.
+        labels = metrics.labels_for(request)
+        metrics.stage_seconds.observe(render_s, stage="render", **labels)
+        if budget is not None:
+            metrics.record_budget(request.model_name, request.template_name, budget)
+
+    async def _finish(self, request: AgentExecutionRequest, final_prompt: PromptParts, raw_text: str, cache_key: str,
+                      extractor: IncrementalJSONExtractor, budget: Optional[Budget] = None,
+                      validator: Optional[OutputValidator] = None) -> AgentOutput:
+        """Parseo, validación contra el esquema de la plantilla y, si no cumple, reparación acotada."""
+        started = time.perf_counter()
+        with tracer.span("parse") as span:
+            if validator is None:
+                output = self._build_output(request, raw_text, cache_key, extractor, budget)
+                span.set_attribute("status", output.status)
+            else:
+                validation = validator.check_extracted(extractor)
+                span.set_attribute("status", validation.status)
+        self._observe(request, "parse", started)
+
+        if validator is not None:
+            if not validation.ok:
+                started = time.perf_counter()
+                with tracer.span("repair") as span:
+                    # Sólo se pide de nuevo lo inválido, con el mismo prefijo (el nodo lo tiene en caché).
+                    await repair_output(validation, self.router, request.model_name, final_prompt.messages(), raw_text,
+                                        options=budget.options() if budget is not None else None,
+                                        prefix_key=final_prompt.prefix_key)
+                    span.attributes.update(attempts=len(validation.repairs), status=validation.status,
+                                           tokens=validation.repair_tokens)
+                self._observe(request, "repair", started)
+            metrics.record_validation(request.model_name, request.template_name, validation)
+            output = self._build_output(request, raw_text, cache_key, extractor, budget, validation)
+        # 6. Sólo se cachean las respuestas válidas.
+        if output.status == "ok" and request.cache_mode != "bypass":
+            await self.cache.aset(cache_key, output.model_dump())
+        metrics.requests_total.inc(status=output.status, **metrics.labels_for(request))
+        return output
+
+    async def _generate(self, request: AgentExecutionRequest, final_prompt: PromptParts,
+                        extractor: IncrementalJSONExtractor, budget: Optional[Budget] = None,
+                        validator: Optional[OutputValidator] = None) -> AsyncIterator[str]:
+        """Fragmentos del backend elegido por el router; corta en cuanto el objeto JSON se cierra."""
+        usage: Dict[str, Any] = {}
+        stream = self.router.stream(request.model_name, final_prompt.messages(),
+                                    options=budget.options() if budget is not None else None,
+                                    response_format=validator.schema if validator is not None else RESPONSE_FORMAT,
+                                    usage=usage, prefix_key=final_prompt.prefix_key)
+        started = time.perf_counter()
+        first_token_at = None
+        chunks = 0
+        with tracer.span("model_call", model=request.model_name) as span:
+            try:
+                async for text in stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        span.set_attribute("first_token_ms", round(1000 * (first_token_at - started), 1))
+                    chunks += 1
+                    yield text
+                    if extractor.feed(text) is not None:
+                        break
+            finally:
+                await stream.aclose()
+                span.attributes.update(usage)
+                if budget is not None:
+                    self.budgeter.observe(request.model_name, prompt_chars(final_prompt), usage)
+                if first_token_at is not None:
+                    metrics.record_generation(request.model_name, request.template_name, started, first_token_at,
+                                              time.perf_counter(), usage, chunks)
+
+    async def _cached(self, request: AgentExecutionRequest, cache_key: str) -> Optional[Dict[str, Any]]:
+        if request.cache_mode != "use":
+            return None
+        return self._count_hit(request, await self.cache.aget(cache_key))
+
+    def _count_hit(self, request: AgentExecutionRequest, cached: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if cached is not None:
+            metrics.requests_total.inc(status="cache_hit", **metrics.labels_for(request))
+        return cached
+
+    def _cached_output(self, request: AgentExecutionRequest, cache_key: str) -> Optional[AgentOutput]:
+        # Lookup de SingleFlight: ya corre en un hilo, consulta la caché en síncrono.
+        if request.cache_mode != "use":
+            return None
+        cached = self._count_hit(request, self.cache.get(cache_key))
+        return AgentOutput(**cached) if cached is not None else None
+
+    async def run_agent(self, request: AgentExecutionRequest) -> AgentOutput:
+        
+        # 0. Caché de respuestas por coincidencia exacta (modelo + plantilla + contexto + prompt + opciones)
+        cache_key = self.request_key(request)
+        cached = await self._cached(request, cache_key)
+        if cached is not None:
+            return AgentOutput(**cached)
+
+        started = time.perf_counter()
+        with metrics.in_flight.track(model=metrics.model_labels(request.model_name)), \
+                tracer.span("agent", model=request.model_name, template=request.template_name):
+            self._require_backend(request)
+            final_prompt, budget, render_s = self._render_timed(request)
+            validator = self._validator(request)
+
+            chunks: List[str] = []
+            extractor = IncrementalJSONExtractor()
+            try:
+                # 4. Llamada al backend del modelo pedido. Se fuerza la salida JSON (o el esquema de la plantilla).
+                try:
+                    async for text in self._generate(request, final_prompt, extractor, budget, validator):
+                        chunks.append(text)
+                finally:
+                    self._record_render(request, budget, render_s)
+            except BackendUnavailableError as e:
+                print(f"Backend no disponible: {e}")
+                metrics.requests_total.inc(status="error", **metrics.labels_for(request))
+                raise HTTPException(status_code=503, detail=str(e))
+            except BackendError as e:
+                print(f"Error al llamar al backend LLM: {e}")
+                metrics.requests_total.inc(status="error", **metrics.labels_for(request))
+                raise HTTPException(status_code=500, detail=f"Error al ejecutar el modelo {request.model_name}: {e}")
+
+            output = await self._finish(request, final_prompt, "".join(chunks), cache_key, extractor, budget, validator)
+        self._observe(request, "total", started)
+        return output
+
+    async def run_batch(self, batch: AgentBatchRequest) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Ejecuta un lote con concurrencia acotada y emite un evento por ítem a medida
+        que termina (no en orden de entrada):
+          {"type": "item", "index": i, "status": "ok" | "parse_fail" | "error", ...}
+        y un evento final {"type": "done", ...} con el resumen. Un ítem que falla
+        no interrumpe el resto del lote.
+        """
+        concurrency = min(batch.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(index: int, request: AgentExecutionRequest) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    output = await self.run_agent_shared(request)
+                    return {"type": "item", "index": index, "status": output.status, "output": output.model_dump()}
+                except HTTPException as e:
+                    return {"type": "item", "index": index, "status": "error", "status_code": e.status_code, "detail": e.detail}
+                except Exception as e:
+                    return {"type": "item", "index": index, "status": "error", "status_code": 500, "detail": str(e)}
+
+        tasks = [asyncio.ensure_future(run_one(i, item)) for i, item in enumerate(batch.items)]
+        counts: Dict[str, int] = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                event = await next_done
+                counts[event["status"]] = counts.get(event["status"], 0) + 1
+                yield event
+        finally:
+            # Si el cliente se desconecta, no seguimos gastando el backend en el resto del lote.
+            for task in tasks:
+                task.cancel()
+
+        yield {"type": "done", "total": len(tasks), "concurrency": concurrency, "counts": counts}
+
+    async def stream_agent(self, request: AgentExecutionRequest) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Variante en streaming de run_agent. Emite eventos:
+          {"type": "token", "text": "..."}  por cada fragmento generado
+          {"type": "result", "output": {...AgentOutput...}}  al final
+          {"type": "error", "detail": "..."}  si el modelo falla a mitad de camino
+        Los errores previos al primer token (prompt inválido, sin backend, backend que
+        falla antes de generar) se levantan como HTTPException para que el endpoint
+        responda con el código correcto.
+        """
+        cache_key = self.request_key(request)
+        cached = await self._cached(request, cache_key)
+        if cached is not None:
+            yield {"type": "token", "text": cached["raw_text"]}
+            yield {"type": "result", "output": cached}
+            return
+
+        started = time.perf_counter()
+        with metrics.in_flight.track(model=metrics.model_labels(request.model_name)), \
+                tracer.span("agent", model=request.model_name, template=request.template_name):
+            self._require_backend(request)
+            final_prompt, budget, render_s = self._render_timed(request)
+            validator = self._validator(request)
+
+            chunks: List[str] = []
+            extractor = IncrementalJSONExtractor()
+            try:
+                try:
+                    async for text in self._generate(request, final_prompt, extractor, budget, validator):
+                        chunks.append(text)
+                        yield {"type": "token", "text": text}
+                finally:
+                    self._record_render(request, budget, render_s)
+            except BackendError as e:
+                print(f"Error en el streaming del backend LLM: {e}")
+                metrics.requests_total.inc(status="error", **metrics.labels_for(request))
+                if not chunks:
+                    # Aún no salió nada: el endpoint responde con el código real (503 / 500).
+                    if isinstance(e, BackendUnavailableError):
+                        raise HTTPException(status_code=503, detail=str(e))
+                    raise HTTPException(status_code=500, detail=f"Error al ejecutar el modelo {request.model_name}: {e}")
+                yield {"type": "error", "detail": f"Error al ejecutar el modelo {request.model_name}: {e}"}
+                return
+
+            output = await self._finish(request, final_prompt, "".join(chunks), cache_key, extractor, budget, validator)
+        self._observe(request, "total", started)
+        yield {"type": "result", "output": output.model_dump()}
 
 # Creación de la INSTANCIA
 agent_service = None
@@ -0,0 +1,417 @@
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+from .backends import (
+    BackendError,
+    BackendUnavailableError,
+    LLMBackend,
+    Messages,
+    ResponseFormat,
+    gemini_backend_from_env,
+    ollama_backends_from_env,
+)
+from .circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL = float(os.environ.get("GWA_HEALTH_CHECK_INTERVAL", "10"))
+# Fallos consecutivos (health check o conexión) para expulsar un nodo del pool.
+UNHEALTHY_THRESHOLD = int(os.environ.get("GWA_UNHEALTHY_THRESHOLD", "2"))
+# Sin primer token en este tiempo, la llamada se da por fallida (cuenta para el breaker).
+FIRST_TOKEN_TIMEOUT_S = float(os.environ.get("GWA_FIRST_TOKEN_TIMEOUT_S", "120"))
+
+# Hedging: si el primer intento no da el primer token en ~p95 del pool, se lanza
+# un segundo intento en otro nodo y se queda el que responda antes.
+HEDGE_ENABLED = os.environ.get("GWA_HEDGE_ENABLED", "0") == "1"
+HEDGE_QUANTILE = float(os.environ.get("GWA_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_DELAY_S = float(os.environ.get("GWA_HEDGE_MIN_DELAY_S", "0.25"))
+# Retardo mientras no hay suficientes muestras de primer token en el pool.
+HEDGE_DEFAULT_DELAY_S = float(os.environ.get("GWA_HEDGE_DEFAULT_DELAY_S", "2"))
+HEDGE_MIN_SAMPLES = 20
+TTFT_SAMPLES = 200
+
+# Afinidad de prefijo: las peticiones con el mismo prefijo estático vuelven al nodo que
+# ya lo tiene en su caché KV, salvo que ese nodo lleve más de PREFIX_AFFINITY_SLACK
+# peticiones en curso por encima del menos cargado. PREFIX_SLOTS ~ OLLAMA_NUM_PARALLEL.
+PREFIX_AFFINITY_SLACK = int(os.environ.get("GWA_PREFIX_AFFINITY_SLACK", "2"))
+PREFIX_SLOTS = int(os.environ.get("GWA_PREFIX_SLOTS", "4"))
+
+# Prefijo del nombre de modelo -> pool. Lo que no coincide va al pool por defecto.
+DEFAULT_MODEL_ROUTES = {"gemini": "gemini"}
+DEFAULT_POOL = "ollama"
+
+_END = object()  # el backend terminó sin más texto
+
+
+class Endpoint:
+    """Un backend dentro de un pool, con su estado de carga, salud y circuit breaker."""
+
+    def __init__(self, backend: LLMBackend, breaker: Optional[CircuitBreaker] = None):
+        self.backend = backend
+        self.breaker = breaker or CircuitBreaker()
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.requests = 0
+        self.errors = 0
+        # Modelos cargados en el nodo (lo mantiene ModelManager). None = desconocido, se trata como caliente.
+        self.resident: Optional[Set[str]] = None
+        # (modelo, prefix_key) de los últimos prefijos procesados: probablemente aún en la caché KV del nodo.
+        self.prefixes: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+
+    def has_prefix(self, model_name: str, prefix_key: str) -> bool:
+        return (model_name, prefix_key) in self.prefixes
+
+    def remember_prefix(self, model_name: str, prefix_key: str) -> None:
+        self.prefixes[(model_name, prefix_key)] = None
+        self.prefixes.move_to_end((model_name, prefix_key))
+        while len(self.prefixes) > PREFIX_SLOTS:
+            self.prefixes.popitem(last=False)
+
+    def available(self) -> bool:
+        return self.healthy and self.breaker.available()
+
+    def is_warm(self, model_name: str) -> bool:
+        return self.resident is None or model_name in self.resident
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.backend.name,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.failures,
+            "breaker": self.breaker.stats(),
+            "resident": sorted(self.resident) if self.resident is not None else None,
+        }
+
+
+class _Attempt:
+    """Una llamada en curso a un endpoint; `next` es la tarea que espera el siguiente fragmento."""
+
+    def __init__(self, endpoint: Endpoint):
+        self.endpoint = endpoint
+        self.usage: Dict[str, Any] = {}
+        self.started = time.monotonic()
+        self.chunks: Optional[AsyncIterator[str]] = None
+        self.next: Optional[asyncio.Future] = None
+        self.prefix_hit = False
+
+    def fetch(self) -> asyncio.Future:
+        async def _next():
+            try:
+                return await self.chunks.__anext__()
+            except StopAsyncIteration:
+                return _END
+
+        self.next = asyncio.ensure_future(_next())
+        return self.next
+
+    async def close(self) -> None:
+        if self.next is not None and not self.next.done():
+            self.next.cancel()
+            await asyncio.gather(self.next, return_exceptions=True)
+        await self.chunks.aclose()
+
+
+class LLMRouter:
+    """
+    Router de modelos: elige el pool según `model_name` y, dentro del pool, el nodo
+    disponible con menos peticiones en curso (least-outstanding-requests).
+
+    Los nodos que fallan UNHEALTHY_THRESHOLD veces seguidas (health check activo o
+    error de conexión) se expulsan; el health check periódico los readmite en
+    cuanto vuelven a responder. Además cada nodo tiene un circuit breaker que se
+    abre por tasa de errores o primer token lento, así se falla rápido o se envía
+    a otro nodo en lugar de esperar el timeout completo. Un fallo antes del primer
+    token se reintenta en otro nodo del mismo pool. Si se conoce qué modelos tiene
+    cargados cada nodo, se prefieren los que ya tienen el modelo en memoria, y las
+    peticiones con `prefix_key` vuelven al nodo que ya procesó ese prefijo.
+    """
+
+    def __init__(self, pools: Dict[str, List[LLMBackend]], model_routes: Optional[Dict[str, str]] = None,
+                 default_pool: str = DEFAULT_POOL, health_interval: float = HEALTH_CHECK_INTERVAL,
+                 unhealthy_threshold: int = UNHEALTHY_THRESHOLD, hedge: bool = HEDGE_ENABLED,
+                 first_token_timeout_s: float = FIRST_TOKEN_TIMEOUT_S, breaker_factory=CircuitBreaker):
+        self.pools: Dict[str, List[Endpoint]] = {
+            name: [Endpoint(b, breaker_factory()) for b in backends] for name, backends in pools.items()
+        }
+        self.model_routes = model_routes if model_routes is not None else dict(DEFAULT_MODEL_ROUTES)
+        self.default_pool = default_pool
+        self.health_interval = health_interval
+        self.unhealthy_threshold = unhealthy_threshold
+        self.hedge = hedge
+        self.first_token_timeout_s = first_token_timeout_s
+        self.hedge_stats = {"launched": 0, "won": 0}
+        self.prefix_stats = {"requests": 0, "hits": 0}
+        self._ttft: Dict[str, Deque[float]] = {}
+        # Última petición servida por modelo (monotonic): ModelManager calienta lo que tiene demanda.
+        self.last_requested: Dict[str, float] = {}
+        self._rr = itertools.count()
+        self._health_task: Optional[asyncio.Task] = None
+
+    # --- Selección ---
+
+    def pool_for(self, model_name: str) -> str:
+        for prefix, pool in self.model_routes.items():
+            if model_name.startswith(prefix):
+                return pool
+        return self.default_pool
+
+    def _candidates(self, model_name: str, tried: Set[Endpoint]) -> List[Endpoint]:
+        candidates = [e for e in self.pools.get(self.pool_for(model_name), []) if e.available() and e not in tried]
+        # Un nodo frío paga la carga del modelo en la petición: sólo se usa si no hay uno caliente.
+        warm = [e for e in candidates if e.is_warm(model_name)]
+        return warm or candidates
+
+    def _has_candidate(self, model_name: str, tried: Set[Endpoint]) -> bool:
+        return bool(self._candidates(model_name, tried))
+
+    def is_available(self, model_name: str) -> bool:
+        """Hay al menos un nodo sano y con el circuito no abierto que puede servir `model_name`."""
+        return self._has_candidate(model_name, set())
+
+    def _acquire(self, model_name: str, tried: Set[Endpoint], prefix_key: Optional[str] = None) -> Endpoint:
+        pool = self.pool_for(model_name)
+        if not self.pools.get(pool):
+            raise BackendUnavailableError(f"No hay backends configurados para el modelo '{model_name}' (pool '{pool}').")
+        candidates = self._candidates(model_name, tried)
+        if not candidates:
+            raise BackendUnavailableError(f"No hay nodos sanos en el pool '{pool}' para el modelo '{model_name}'.")
+        # Rotamos antes de elegir para repartir los empates en round-robin.
+        offset = next(self._rr) % len(candidates)
+        rotated = candidates[offset:] + candidates[:offset]
+        endpoint = min(rotated, key=lambda e: e.outstanding)
+        if prefix_key:
+            affine = [e for e in rotated if e.has_prefix(model_name, prefix_key)]
+            if affine:
+                best = min(affine, key=lambda e: e.outstanding)
+                if best.outstanding <= endpoint.outstanding + PREFIX_AFFINITY_SLACK:
+                    endpoint = best
+        endpoint.breaker.on_acquire()
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def _mark_failure(self, endpoint: Endpoint) -> None:
+        endpoint.failures += 1
+        if endpoint.healthy and endpoint.failures >= self.unhealthy_threshold:
+            endpoint.healthy = False
+            logger.warning(f"Nodo expulsado del pool: {endpoint.backend.name}")
+
+    def _mark_success(self, endpoint: Endpoint) -> None:
+        endpoint.failures = 0
+        if not endpoint.healthy:
+            endpoint.healthy = True
+            logger.info(f"Nodo readmitido en el pool: {endpoint.backend.name}")
+
+    def _record_ttft(self, model_name: str, ttft: float) -> None:
+        pool = self.pool_for(model_name)
+        if pool not in self._ttft:
+            self._ttft[pool] = deque(maxlen=TTFT_SAMPLES)
+        self._ttft[pool].append(ttft)
+
+    def hedge_delay(self, model_name: str) -> float:
+        """Espera antes del segundo intento: cuantil HEDGE_QUANTILE del primer token en el pool."""
+        samples = self._ttft.get(self.pool_for(model_name))
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_S
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, math.ceil(HEDGE_QUANTILE * len(ordered)) - 1)
+        return max(HEDGE_MIN_DELAY_S, ordered[index])
+
+    # --- Generación ---
+
+    def _launch(self, model_name: str, messages: Messages, options: Optional[Dict[str, Any]],
+                response_format: ResponseFormat, tried: Set[Endpoint], prefix_key: Optional[str] = None) -> _Attempt:
+        endpoint = self._acquire(model_name, tried, prefix_key)
+        tried.add(endpoint)
+        attempt = _Attempt(endpoint)
+        if prefix_key:
+            attempt.prefix_hit = endpoint.has_prefix(model_name, prefix_key)
+            self.prefix_stats["requests"] += 1
+            self.prefix_stats["hits"] += attempt.prefix_hit
+            endpoint.remember_prefix(model_name, prefix_key)
+        attempt.chunks = endpoint.backend.stream(model_name, messages, options, response_format, attempt.usage)
+        attempt.fetch()
+        return attempt
+
+    async def _discard(self, attempt: _Attempt, error: Optional[BaseException]) -> None:
+        """Cierra un intento que no se usará: perdedor de un hedge (error=None) o fallido."""
+        await attempt.close()
+        attempt.endpoint.outstanding -= 1
+        if error is None:
+            attempt.endpoint.breaker.release_probe()
+            return
+        attempt.endpoint.errors += 1
+        attempt.endpoint.breaker.record(False)
+        if isinstance(error, BackendUnavailableError):
+            self._mark_failure(attempt.endpoint)
+
+    async def _first_chunk(self, model_name: str, messages: Messages, options: Optional[Dict[str, Any]],
+                           response_format: ResponseFormat, hedge: bool,
+                           prefix_key: Optional[str] = None) -> Tuple[_Attempt, Any]:
+        """
+        Devuelve el intento ganador y su primer fragmento. Reintenta en otro nodo si
+        un intento falla antes del primer token y, con hedging, lanza un segundo
+        intento si el primero tarda más que `hedge_delay`; el perdedor se cancela.
+        """
+        tried: Set[Endpoint] = set()
+        primary = self._launch(model_name, messages, options, response_format, tried, prefix_key)
+        pending = [primary]
+        deadline = time.monotonic() + self.first_token_timeout_s
+        hedge_at = time.monotonic() + self.hedge_delay(model_name) if hedge else None
+        hedged = False
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                wake = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, _ = await asyncio.wait([a.next for a in pending], timeout=max(0.0, wake - time.monotonic()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge_at is not None and time.monotonic() < deadline:
+                        hedge_at = None
+                        if self._has_candidate(model_name, tried):
+                            hedged = True
+                            self.hedge_stats["launched"] += 1
+                            pending.append(self._launch(model_name, messages, options, response_format, tried, prefix_key))
+                        continue
+                    last_error = BackendUnavailableError(
+                        f"Sin primer token en {self.first_token_timeout_s:.0f}s para el modelo '{model_name}'."
+                    )
+                    stalled, pending = pending, []
+                    for attempt in stalled:
+                        await self._discard(attempt, last_error)
+                    break
+
+                for attempt in [a for a in pending if a.next in done]:
+                    pending.remove(attempt)
+                    error = attempt.next.exception()
+                    if error is None:
+                        losers, pending = pending, []
+                        for loser in losers:
+                            await self._discard(loser, None)
+                        if hedged and attempt is not primary:
+                            self.hedge_stats["won"] += 1
+                        return attempt, attempt.next.result()
+                    await self._discard(attempt, error)
+                    last_error = error
+                    if not isinstance(error, BackendError):
+                        raise error
+                    if self._has_candidate(model_name, tried):
+                        logger.warning(f"{attempt.endpoint.backend.name} falló antes del primer token ({error}); "
+                                       f"reintentando en otro nodo.")
+                        pending.append(self._launch(model_name, messages, options, response_format, tried, prefix_key))
+        except BaseException:
+            for attempt in pending:
+                await self._discard(attempt, None)
+            raise
+        raise last_error
+
+    async def stream(self, model_name: str, messages: Messages, options: Optional[Dict[str, Any]] = None,
+                     response_format: ResponseFormat = None, usage: Optional[Dict[str, Any]] = None,
+                     hedge: Optional[bool] = None, prefix_key: Optional[str] = None) -> AsyncIterator[str]:
+        hedge = self.hedge if hedge is None else hedge
+        attempt, first = await self._first_chunk(model_name, messages, options, response_format, hedge, prefix_key)
+        endpoint = attempt.endpoint
+        ttft = time.monotonic() - attempt.started
+        self._record_ttft(model_name, ttft)
+        self.last_requested[model_name] = time.monotonic()
+        if endpoint.resident is not None:
+            endpoint.resident.add(model_name)
+        ok = ttft <= endpoint.breaker.slow_s
+        try:
+            if first is not _END:
+                yield first
+                while True:
+                    chunk = await attempt.fetch()
+                    if chunk is _END:
+                        break
+                    yield chunk
+            self._mark_success(endpoint)
+        except BackendError:
+            endpoint.errors += 1
+            ok = False
+            raise
+        finally:
+            # Cerrar el stream del backend corta la generación (corte temprano del llamador).
+            await attempt.close()
+            endpoint.outstanding -= 1
+            endpoint.breaker.record(ok)
+            if usage is not None:
+                usage.update(attempt.usage)
+                usage["backend"] = endpoint.backend.name
+                if prefix_key:
+                    usage["prefix_hit"] = attempt.prefix_hit
+
+    async def generate(self, model_name: str, messages: Messages, options: Optional[Dict[str, Any]] = None,
+                       response_format: ResponseFormat = None, usage: Optional[Dict[str, Any]] = None,
+                       hedge: Optional[bool] = None, prefix_key: Optional[str] = None) -> str:
+        return "".join([c async for c in self.stream(model_name, messages, options, response_format, usage, hedge,
+                                                     prefix_key)])
+
+    # --- Health checks activos ---
+
+    async def check_health(self) -> None:
+        endpoints = [e for pool in self.pools.values() for e in pool]
+        results = await asyncio.gather(*(e.backend.health_check() for e in endpoints), return_exceptions=True)
+        for endpoint, ok in zip(endpoints, results):
+            if ok is True:
+                self._mark_success(endpoint)
+            else:
+                self._mark_failure(endpoint)
+
+    async def warm_up(self) -> None:
+        """Crea los clientes de todos los backends y hace un primer health check (warm-up del servicio)."""
+        backends = [e.backend for pool in self.pools.values() for e in pool]
+        results = await asyncio.gather(*(b.warm_up() for b in backends), return_exceptions=True)
+        for backend, result in zip(backends, results):
+            if isinstance(result, Exception):
+                logger.error(f"No se pudo preparar el backend {backend.name}: {result}")
+        await self.check_health()
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"Error en el health check de backends: {e}")
+
+    def start(self) -> None:
+        if self._health_task is None and self.health_interval > 0:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def aclose(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for pool in self.pools.values():
+            for endpoint in pool:
+                await endpoint.backend.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {name: [e.stats() for e in pool] for name, pool in self.pools.items()}
+        stats["hedging"] = {"enabled": self.hedge, **self.hedge_stats}
+        requests = self.prefix_stats["requests"]
+        stats["prefix_affinity"] = {**self.prefix_stats,
+                                    "hit_rate": round(self.prefix_stats["hits"] / requests, 4) if requests else 0.0}
+        return stats
+
+
+def build_router_from_env() -> LLMRouter:
+    pools: Dict[str, List[LLMBackend]] = {"ollama": list(ollama_backends_from_env())}
+    gemini = gemini_backend_from_env()
+    pools["gemini"] = [gemini] if gemini else []
+    return LLMRouter(pools)
+
+
+# Instancia compartida por AgentService, LLMAgentExecutor y LLMProcessor.
+llm_router = build_router_from_env()
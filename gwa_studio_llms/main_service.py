@@ -1,29 +1,63 @@
 # main_service.py
 
 import os
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from google import genai
-from google.genai import types
+
+from gwa_studio_core.encoding import EncodedJSONResponse, dumps, parse_fields, select_fields
+from gwa_studio_core.metrics import CONTENT_TYPE
+from gwa_studio_core.readiness import WarmUp, add_health_routes
+from gwa_studio_core.tracing import attach, parse_traceparent
+from .backends import BackendError, BackendUnavailableError
+from .context_budget import context_budgeter
+from .output_schema import compile_schema, repair_output
+from .llm_processor import AgentBatchRequest, AgentExecutionRequest, AgentOutput, agent_service
+from .llm_router import llm_router
+from .metrics import metrics, watch_models, watch_router, watch_templates
+from .model_manager import model_manager
+from .response_cache import response_cache
+from .template_registry import template_registry
 
 # ----------------------------------------------------
 # CONFIGURACIÓN
 # ----------------------------------------------------
-# La clave API se lee de la variable de entorno (CRÍTICO para la seguridad)
+# La clave API se lee de la variable de entorno (CRÍTICO para la seguridad). Sin ella
+# el servicio arranca igual: el pool de Gemini queda vacío y Ollama sigue disponible.
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
-if not GEMINI_API_KEY:
-    raise RuntimeError("GEMINI_API_KEY no encontrada. Asegúrate de configurarla.")
+# Lo caro del arranque corre tras abrir el puerto: /live responde ya y /ready cuando acaba.
+warm_up = WarmUp("magenta")
+warm_up.add("plantillas", template_registry.load)
+warm_up.add("backends", llm_router.warm_up, required=False)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Health checks activos de los backends (expulsión/readmisión de nodos del pool).
+    llm_router.start()
+    # Precarga de modelos y keep_alive en segundo plano: el arranque no espera a Ollama.
+    model_manager.start()
+    warm_up.start()
+    yield
+    await warm_up.aclose()
+    template_registry.stop_watcher()
+    await model_manager.aclose()
+    await llm_router.aclose()
 
-try:
-    client = genai.Client(api_key=GEMINI_API_KEY)
-except Exception as e:
-    raise RuntimeError(f"Error al inicializar cliente Gemini: {e}")
+
+watch_router(llm_router)
+watch_models(model_manager)
+watch_templates(template_registry)
 
 app = FastAPI(
     title="MAGENTA - Agente de Contenido Estratégico",
-    description="Servicio backend que aloja la lógica del Agente IA y el acceso a Gemini.",
+    description="Servicio backend que aloja la lógica del Agente IA y el acceso a los backends LLM (Gemini, Ollama).",
+    lifespan=lifespan,
 )
+add_health_routes(app, warm_up)
 
 # ----------------------------------------------------
 # MODELOS DE DATOS (Pydantic)
@@ -32,6 +66,7 @@ app = FastAPI(
 # El formato que esperamos del cliente (CIAN)
 class RequestPayload(BaseModel):
     user_query: str = Field(..., description="La pregunta o tarea del usuario.")
+    model_name: str = Field("gemini-2.5-flash", description="Modelo a usar; el router elige el backend.")
 
 # El formato estructurado que queremos que Gemini devuelva
 class StrategicContent(BaseModel):
@@ -39,13 +74,17 @@ class StrategicContent(BaseModel):
     summary: str = Field(..., description="Resumen ejecutivo del plan.")
     action_steps: list[str] = Field(..., description="Lista de pasos concretos a seguir.")
 
+
+# Esquema compilado una sola vez: se envía como decodificación restringida y valida la respuesta.
+STRATEGIC_SCHEMA = compile_schema(StrategicContent.model_json_schema())
+
 # ----------------------------------------------------
 # ENDPOINT PRINCIPAL
 # ----------------------------------------------------
 
 @app.post("/generate_content", response_model=StrategicContent)
 async def generate_content(payload: RequestPayload):
-    """Genera contenido estratégico utilizando el modelo Gemini."""
+    """Genera contenido estratégico con el modelo pedido (Gemini por defecto)."""
     
     # 1. Definición del Agente IA (Gem Personalizado)
     system_instruction = (
@@ -56,32 +95,164 @@ async def generate_content(payload: RequestPayload):
         "estrictamente al esquema de salida (StrategicContent)."
     )
     
-    # 2. Configuración del Modelo
-    config = types.GenerateContentConfig(
-        system_instruction=system_instruction,
-        response_mime_type="application/json",
-        response_schema=StrategicContent,
-        temperature=0.3
-    )
-    
+    # 2. Llamada al Modelo (el router elige el backend; la salida se restringe al esquema)
+    messages = [
+        {"role": "system", "content": system_instruction},
+        {"role": "user", "content": payload.user_query},
+    ]
+    options = {"temperature": 0.3}
     try:
-        # 3. Llamada al Modelo
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=payload.user_query,
-            config=config,
+        text = await llm_router.generate(
+            payload.model_name,
+            messages,
+            options=options,
+            response_format=STRATEGIC_SCHEMA.schema,
         )
-        
-        # 4. Parseo y Devolución (FastAPI valida automáticamente el JSON)
-        return response.text
-    
-    except Exception as e:
-        print(f"Error en la llamada a Gemini: {e}")
+    except BackendUnavailableError as e:
+        print(f"Backend no disponible: {e}")
+        raise HTTPException(status_code=503, detail="No hay ningún backend LLM disponible (MAGENTA).")
+    except BackendError as e:
+        print(f"Error en la llamada al modelo: {e}")
         raise HTTPException(
             status_code=500, 
             detail="Error en el procesamiento del modelo LLM (MAGENTA)."
         )
 
+    # 3. Validación contra el esquema; si no cumple, se pide de nuevo sólo lo inválido.
+    validation = STRATEGIC_SCHEMA.check_text(text)
+    if not validation.ok:
+        await repair_output(validation, llm_router, payload.model_name, messages, text, options=options)
+    if not validation.ok:
+        print(f"Respuesta fuera del esquema StrategicContent: {validation.errors()}")
+        raise HTTPException(
+            status_code=500, 
+            detail="Error en el procesamiento del modelo LLM (MAGENTA)."
+        )
+    return validation.result
+
+# ----------------------------------------------------
+# ENDPOINTS DEL AGENTE (llamados por CIAN con el token interno)
+# ----------------------------------------------------
+INTERNAL_TOKEN = "gwa_token_magenta"
+
+
+def verify_internal_token(authorization: str = Header(None)):
+    """Sólo CIAN (que conoce el token interno) puede invocar al agente."""
+    if authorization != f"Bearer {INTERNAL_TOKEN}":
+        raise HTTPException(status_code=403, detail="Token interno inválido.")
+
+
+async def trace_context(traceparent: Optional[str] = Header(None)):
+    """
+    Continúa la traza de CIAN: los spans de la petición (agent, render, model_call,
+    parse) cuelgan del salto del proxy. Es async para correr en la misma tarea que
+    el endpoint (las dependencias síncronas van al threadpool y perderían el contexto).
+    """
+    attach(parse_traceparent(traceparent))
+
+
+@app.post("/agent/run", response_model=AgentOutput, dependencies=[Depends(verify_internal_token), Depends(trace_context)])
+async def run_agent(request: AgentExecutionRequest,
+                    fields: Optional[str] = Query(None, description="Campos del AgentOutput a devolver, separados por comas (p. ej. 'status,result_json')."),
+                    accept_encoding: str = Header("")):
+    """
+    Ejecuta el agente con plantillas. Usa la caché de respuestas y coalesce las
+    peticiones idénticas que llegan mientras otra igual está generando. Con `fields`
+    sólo viajan esos campos (CIAN no necesita raw_text); la respuesta sale comprimida
+    si el llamador lo acepta.
+    """
+    if agent_service is None:
+        raise HTTPException(status_code=500, detail="AgentService no está inicializado.")
+    try:
+        selected = parse_fields(fields, AgentOutput.model_fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    output = await agent_service.run_agent_shared(request)
+    return EncodedJSONResponse(select_fields(output.model_dump(), selected), accept_encoding=accept_encoding)
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Evita que proxies intermedios (nginx, etc.) acumulen el stream antes de reenviarlo.
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+async def _ndjson(events: AsyncIterator[Dict[str, Any]], first: Optional[Dict[str, Any]] = None) -> AsyncIterator[bytes]:
+    if first is not None:
+        yield dumps(first) + b"\n"
+    async for event in events:
+        yield dumps(event) + b"\n"
+
+
+@app.post("/agent/run_stream", dependencies=[Depends(verify_internal_token), Depends(trace_context)])
+async def run_agent_stream(request: AgentExecutionRequest):
+    """
+    Igual que /agent/run pero emite los tokens a medida que llegan, como NDJSON.
+    El último evento ('result') trae el AgentOutput completo con result_json.
+    """
+    if agent_service is None:
+        raise HTTPException(status_code=500, detail="AgentService no está inicializado.")
+    events = agent_service.stream_agent(request)
+    # Los errores previos al primer token salen como HTTPException con su código real.
+    first = await anext(events)
+    return StreamingResponse(_ndjson(events, first), media_type=NDJSON_MEDIA_TYPE, headers=STREAM_HEADERS)
+
+
+@app.post("/agent/run_batch", dependencies=[Depends(verify_internal_token), Depends(trace_context)])
+async def run_agent_batch(batch: AgentBatchRequest):
+    """
+    Ejecuta un lote de peticiones con concurrencia acotada. Devuelve NDJSON con un
+    evento 'item' por petición a medida que termina y un evento 'done' al final.
+    """
+    if agent_service is None:
+        raise HTTPException(status_code=500, detail="AgentService no está inicializado.")
+    return StreamingResponse(_ndjson(agent_service.run_batch(batch)), media_type=NDJSON_MEDIA_TYPE, headers=STREAM_HEADERS)
+
+
+@app.get("/agent/cache/stats", dependencies=[Depends(verify_internal_token)])
+def get_cache_stats():
+    """Contadores de aciertos/fallos de la caché de respuestas."""
+    return response_cache.stats()
+
+
+@app.get("/agent/backends/stats", dependencies=[Depends(verify_internal_token)])
+def get_backend_stats():
+    """Estado de cada nodo por pool: sano/expulsado, peticiones en curso y errores."""
+    return llm_router.stats()
+
+
+@app.get("/agent/context/stats", dependencies=[Depends(verify_internal_token)])
+def get_context_stats():
+    """num_ctx elegidos, recortes de contexto y relación caracteres/token calibrada por modelo."""
+    return context_budgeter.stats()
+
+
+@app.get("/agent/models", dependencies=[Depends(verify_internal_token)])
+def get_models():
+    """Modelos cargados por nodo, modelos que se mantienen calientes y su keep_alive."""
+    return model_manager.status()
+
+
+@app.get("/agent/models/ready")
+def get_models_ready(model: Optional[str] = None):
+    """200 si los modelos precargados (o `model`) están en memoria en algún nodo; 503 mientras se cargan."""
+    if not model_manager.ready(model):
+        raise HTTPException(status_code=503, detail="Modelos todavía cargándose.")
+    return {"ready": True}
+
+
+@app.get("/agent/singleflight/stats", dependencies=[Depends(verify_internal_token)])
+def get_singleflight_stats():
+    """Generaciones lanzadas vs. peticiones coalescidas sobre una generación en vuelo."""
+    if agent_service is None:
+        raise HTTPException(status_code=500, detail="AgentService no está inicializado.")
+    return agent_service.singleflight.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Métricas en formato de texto Prometheus: latencia por etapa, tokens, tokens/s, parse_fail e in-flight."""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
 # ----------------------------------------------------
 # COMANDO DE EJECUCIÓN (Ventana 1)
 # ----------------------------------------------------
@@ -0,0 +1,150 @@
+from typing import Dict
+
+from gwa_studio_core.metrics import TOKENS_PER_SECOND_BUCKETS, LabelSet, MetricsRegistry
+
+# Registro de métricas de MAGENTA (expuesto en GET /metrics).
+metrics = MetricsRegistry()
+
+# Modelo y plantilla vienen del cliente: sólo las plantillas del registro (watch_templates)
+# y los modelos precargados, cargados en algún nodo (watch_models) o que ya generaron
+# algo tienen serie propia; el resto va a "other".
+model_labels = LabelSet()
+template_labels = LabelSet()
+
+
+def labels_for(request) -> Dict[str, str]:
+    """Etiquetas model/template acotadas de una petición (AgentExecutionRequest)."""
+    return {"model": model_labels(request.model_name), "template": template_labels(request.template_name)}
+
+
+# Etapas: render (plantilla), first_token (desde que se pide al backend), generation
+# (stream completo), parse (cierre del extractor JSON y validación contra el esquema),
+# repair (reparación de una salida inválida) y total (petición entera).
+stage_seconds = metrics.histogram(
+    "gwa_magenta_stage_seconds", "Latencia por etapa de una ejecución del agente.", ("stage", "model", "template")
+)
+requests_total = metrics.counter(
+    "gwa_magenta_requests_total", "Ejecuciones del agente por resultado (ok, parse_fail, schema_fail, error, cache_hit).",
+    ("model", "template", "status"),
+)
+tokens_total = metrics.counter(
+    "gwa_magenta_tokens_total", "Tokens de prompt y de respuesta informados por el backend.", ("model", "kind")
+)
+tokens_per_second = metrics.histogram(
+    "gwa_magenta_tokens_per_second", "Velocidad de generación (tokens de respuesta / tiempo tras el primer token).",
+    ("model",), buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+prompt_eval_seconds = metrics.histogram(
+    "gwa_magenta_prompt_eval_seconds", "Tiempo de evaluación del prompt informado por Ollama (sin el prefijo en caché).",
+    ("model", "template"),
+)
+prefix_reuse_total = metrics.counter(
+    "gwa_magenta_prefix_reuse_total", "Peticiones con prefijo estático enviadas al nodo que ya lo tenía (hit) o no (miss).",
+    ("model", "template", "result"),
+)
+num_ctx_total = metrics.counter(
+    "gwa_magenta_num_ctx_total", "Peticiones por num_ctx elegido por el presupuesto de contexto.", ("model", "num_ctx")
+)
+context_trim_total = metrics.counter(
+    "gwa_magenta_context_trim_total",
+    "Peticiones cuyo contexto no cabía: campos compactados, descartados o prompt que no cabe ni así (overflow).",
+    ("model", "template", "action"),
+)
+validation_total = metrics.counter(
+    "gwa_magenta_validation_total",
+    "Resultado de la generación original contra el esquema de salida de la plantilla (valid, invalid, parse_fail).",
+    ("model", "template", "result"),
+)
+repair_total = metrics.counter(
+    "gwa_magenta_repair_total",
+    "Intentos de reparación por alcance (partial: sólo las claves inválidas; full: el objeto entero) y resultado.",
+    ("model", "template", "scope", "result"),
+)
+repair_tokens_total = metrics.counter(
+    "gwa_magenta_repair_tokens_total", "Tokens de respuesta gastados en reparaciones de salidas inválidas.",
+    ("model", "template"),
+)
+in_flight = metrics.gauge("gwa_magenta_in_flight", "Ejecuciones del agente en curso.", ("model",))
+backend_outstanding = metrics.gauge(
+    "gwa_magenta_backend_outstanding", "Peticiones en curso por nodo del router.", ("pool", "backend")
+)
+backend_healthy = metrics.gauge(
+    "gwa_magenta_backend_up", "1 si el nodo está sano y con el circuito no abierto.", ("pool", "backend")
+)
+
+model_resident = metrics.gauge(
+    "gwa_magenta_model_resident", "1 si el modelo está cargado en memoria en el nodo (según /api/ps).", ("backend", "model")
+)
+model_load_seconds = metrics.histogram(
+    "gwa_magenta_model_load_seconds", "Duración de las cargas/renovaciones de modelos lanzadas por ModelManager.",
+    ("model",),
+)
+
+
+def record_generation(model: str, template: str, started: float, first_token_at: float, finished: float,
+                      usage: dict, chunks: int) -> None:
+    """Primer token, generación, tokens y tokens/s de una llamada al backend (tiempos de perf_counter)."""
+    # El backend generó con este modelo: es real y pasa a tener serie propia.
+    model_labels.learn(model)
+    model, template = model_labels(model), template_labels(template)
+    stage_seconds.observe(first_token_at - started, stage="first_token", model=model, template=template)
+    stage_seconds.observe(finished - started, stage="generation", model=model, template=template)
+    # Con corte temprano Ollama no llega a enviar eval_count: se aproxima con los fragmentos.
+    completion = usage.get("completion_tokens") or chunks
+    if usage.get("prompt_tokens"):
+        tokens_total.inc(usage["prompt_tokens"], model=model, kind="prompt")
+    tokens_total.inc(completion, model=model, kind="completion")
+    if finished > first_token_at and completion > 1:
+        tokens_per_second.observe(completion / (finished - first_token_at), model=model)
+    if "prompt_eval_ms" in usage:
+        prompt_eval_seconds.observe(usage["prompt_eval_ms"] / 1000, model=model, template=template)
+    if "prefix_hit" in usage:
+        prefix_reuse_total.inc(model=model, template=template, result="hit" if usage["prefix_hit"] else "miss")
+
+
+def record_budget(model: str, template: str, budget) -> None:
+    """num_ctx elegido y, si hubo que recortar el contexto, qué se hizo."""
+    model, template = model_labels(model), template_labels(template)
+    num_ctx_total.inc(model=model, num_ctx=str(budget.num_ctx))
+    for action, hit in (("compacted", budget.compacted), ("dropped", budget.dropped), ("overflow", budget.overflow)):
+        if hit:
+            context_trim_total.inc(model=model, template=template, action=action)
+
+
+def record_validation(model: str, template: str, validation) -> None:
+    """Resultado de la primera pasada y de cada intento de reparación (con sus tokens)."""
+    model, template = model_labels(model), template_labels(template)
+    validation_total.inc(model=model, template=template, result=validation.first)
+    for attempt in validation.repairs:
+        scope = "full" if attempt["fields"] is None else "partial"
+        repair_total.inc(model=model, template=template, scope=scope, result="ok" if attempt["ok"] else "failed")
+        if attempt["tokens"]:
+            repair_tokens_total.inc(attempt["tokens"], model=model, template=template)
+
+
+def watch_router(router) -> None:
+    """Refresca los gauges de cada nodo del router al exponer /metrics."""
+    def collect() -> None:
+        for pool, endpoints in router.pools.items():
+            for endpoint in endpoints:
+                backend_outstanding.set(endpoint.outstanding, pool=pool, backend=endpoint.backend.name)
+                backend_healthy.set(int(endpoint.available()), pool=pool, backend=endpoint.backend.name)
+    metrics.add_collector(collect)
+
+
+def watch_templates(registry) -> None:
+    """Las plantillas del registro (TemplateRegistry) son valores válidos de la etiqueta 'template'."""
+    template_labels.known = registry.exists
+
+
+def watch_models(manager) -> None:
+    """Residencia de cada modelo que ModelManager quiere caliente, por nodo."""
+    model_labels.known = manager.knows
+    def collect() -> None:
+        wanted = manager.wanted()
+        for endpoint in manager._endpoints():
+            # Los pedidos recientes vienen del cliente: sólo se publican los modelos reales.
+            for model in {m for m in wanted if model_labels(m) == m} | (endpoint.resident or set()):
+                model_resident.set(int(endpoint.resident is not None and model in endpoint.resident),
+                                   backend=endpoint.backend.name, model=model)
+    metrics.add_collector(collect)
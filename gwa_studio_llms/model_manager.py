@@ -0,0 +1,152 @@
+# model_manager.py - Ciclo de vida de los modelos de Ollama en MAGENTA
+#
+# La primera llamada a un modelo que Ollama no tiene en memoria paga su carga
+# completa (decenas de segundos para llama3:8b en CPU). ModelManager la saca del
+# camino de la petición:
+#   - al arrancar, precarga GWA_PRELOAD_MODELS en todos los nodos sanos del pool;
+#   - cada GWA_WARM_INTERVAL_S consulta /api/ps de cada nodo, publica en el router
+#     qué modelos tiene cargados (el router prefiere nodos calientes) y vuelve a
+#     cargar, o renueva antes de que caduque, todo modelo precargado o pedido en
+#     los últimos GWA_WARM_WINDOW_S;
+#   - el keep_alive de cada modelo sale de las políticas de OllamaBackend
+#     (GWA_OLLAMA_KEEP_ALIVE / GWA_OLLAMA_KEEP_ALIVE_POLICIES), y se carga con el
+#     num_ctx que está usando ContextBudgeter (otro num_ctx obligaría a recargarlo).
+# `ready()` indica si todos los modelos precargados están en memoria en algún nodo.
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from .backends import BackendError, ollama_model_name
+from .context_budget import ContextBudgeter, context_budgeter
+from .llm_router import Endpoint, LLMRouter, llm_router
+from .metrics import model_load_seconds
+
+logger = logging.getLogger(__name__)
+
+PRELOAD_MODELS = [m.strip(' "') for m in os.environ.get("GWA_PRELOAD_MODELS", "llama3:8b").split(",") if m.strip(' "')]
+WARM_INTERVAL_S = float(os.environ.get("GWA_WARM_INTERVAL_S", "15"))
+# Un modelo pedido dentro de esta ventana se mantiene cargado en todos los nodos del pool.
+WARM_WINDOW_S = float(os.environ.get("GWA_WARM_WINDOW_S", "900"))
+
+
+class ModelManager:
+    def __init__(self, router: LLMRouter, preload: Optional[List[str]] = None, pool: str = "ollama",
+                 interval_s: float = WARM_INTERVAL_S, window_s: float = WARM_WINDOW_S,
+                 budgeter: ContextBudgeter = context_budgeter):
+        self.router = router
+        self.budgeter = budgeter
+        self.preload = list(PRELOAD_MODELS if preload is None else preload)
+        self.pool = pool
+        self.interval_s = interval_s
+        self.window_s = window_s
+        # Se renueva el keep_alive de un modelo al que le quede menos que esto para descargarse.
+        self.renew_margin_s = 2 * interval_s
+        self.loads = 0
+        self.load_errors = 0
+        self.last_pass: Optional[float] = None
+        self._expires: Dict[str, Dict[str, Optional[float]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _endpoints(self) -> List[Endpoint]:
+        return [e for e in self.router.pools.get(self.pool, []) if hasattr(e.backend, "load")]
+
+    def knows(self, model: str) -> bool:
+        """Modelo precargado o cargado en algún nodo del pool (etiqueta de métricas válida)."""
+        return model in self.preload or any(e.resident is not None and model in e.resident for e in self._endpoints())
+
+    def wanted(self) -> Set[str]:
+        """Modelos del pool que deben estar cargados: los precargados y los pedidos en la ventana."""
+        horizon = time.monotonic() - self.window_s
+        recent = [m for m, at in self.router.last_requested.items() if at >= horizon]
+        return {m for m in (*self.preload, *recent) if self.router.pool_for(m) == self.pool}
+
+    async def _refresh(self, endpoint: Endpoint) -> None:
+        try:
+            running = await endpoint.backend.running_models()
+        except BackendError as e:
+            logger.warning(f"No se pudo consultar los modelos cargados en {endpoint.backend.name}: {e}")
+            return
+        resident = set(running)
+        # El router compara con el nombre pedido: "llama3" está cargado si lo está "llama3:latest".
+        resident.update(name[: -len(":latest")] for name in running if name.endswith(":latest"))
+        endpoint.resident = resident
+        self._expires[endpoint.backend.name] = running
+
+    def _needs_load(self, endpoint: Endpoint, model: str) -> bool:
+        if endpoint.resident is None or model not in endpoint.resident:
+            return True
+        expires = self._expires.get(endpoint.backend.name, {}).get(ollama_model_name(model))
+        return expires is not None and expires - time.time() < self.renew_margin_s
+
+    async def _load(self, endpoint: Endpoint, model: str) -> None:
+        started = time.perf_counter()
+        try:
+            await endpoint.backend.load(model, {"num_ctx": self.budgeter.current_ctx(model)})
+        except BackendError as e:
+            self.load_errors += 1
+            logger.warning(f"No se pudo cargar '{model}' en {endpoint.backend.name}: {e}")
+            return
+        self.loads += 1
+        model_load_seconds.observe(time.perf_counter() - started, model=model)
+        if endpoint.resident is not None:
+            endpoint.resident.add(model)
+
+    async def warm(self) -> None:
+        """Una pasada: residencia de cada nodo sano y carga de lo que falte o esté por caducar."""
+        endpoints = [e for e in self._endpoints() if e.healthy]
+        await asyncio.gather(*(self._refresh(e) for e in endpoints))
+        wanted = self.wanted()
+        await asyncio.gather(*(self._load(e, m) for e in endpoints if e.resident is not None
+                               for m in sorted(wanted) if self._needs_load(e, m)))
+        self.last_pass = time.time()
+
+    def ready(self, model: Optional[str] = None) -> bool:
+        """`model` (o todos los precargados) está en memoria en al menos un nodo disponible."""
+        models = [model] if model else self.preload
+        endpoints = [e for e in self._endpoints() if e.available()]
+        if not endpoints:
+            return not models
+        return all(any(e.resident is not None and m in e.resident for e in endpoints) for m in models)
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.warm()
+            except Exception as e:
+                logger.error(f"Error al calentar modelos: {e}")
+            await asyncio.sleep(self.interval_s)
+
+    def start(self) -> None:
+        """Lanza la precarga (primera pasada inmediata) y el mantenimiento periódico, sin bloquear el arranque."""
+        if self._task is None and self._endpoints() and self.interval_s > 0:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready(),
+            "preload": self.preload,
+            "wanted": sorted(self.wanted()),
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "last_pass": self.last_pass,
+            "nodes": {
+                e.backend.name: {
+                    "resident": sorted(e.resident) if e.resident is not None else None,
+                    "keep_alive": {m: e.backend.keep_alive_for(m) for m in sorted(self.wanted())},
+                }
+                for e in self._endpoints()
+            },
+        }
+
+
+# Instancia compartida por main_service (arranque, estado y readiness).
+model_manager = ModelManager(llm_router)
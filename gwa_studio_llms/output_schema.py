@@ -0,0 +1,371 @@
+# output_schema.py - Esquema de salida por plantilla: validador compilado y reparación acotada
+#
+# Cada plantilla declara el JSON que debe devolver el modelo: la clave "output_schema" de
+# un .json o un archivo <plantilla>.schema.json junto a la plantilla. El esquema viaja al
+# backend como formato de decodificación restringida (Ollama: format=<esquema>; Gemini:
+# response_json_schema) y se compila una sola vez, al cargar la plantilla, en funciones
+# anidadas: validar una respuesta no vuelve a interpretar el esquema.
+#
+# Si la respuesta no cumple, en lugar de regenerarla entera se pide al modelo sólo lo que
+# falló: las claves de primer nivel inválidas, con su sub-esquema, o el objeto completo si
+# el problema es el objeto en sí (JSON roto, no es un objeto). Como mucho
+# GWA_REPAIR_ATTEMPTS veces por respuesta.
+
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .backends import BackendError
+from .json_extractor import IncrementalJSONExtractor, JSONExtractionError
+
+logger = logging.getLogger(__name__)
+
+# Reparaciones por respuesta (0 = sin reparación: sólo se valida).
+REPAIR_ATTEMPTS = int(os.environ.get("GWA_REPAIR_ATTEMPTS", "2"))
+# Errores que se le enumeran al modelo al pedir la reparación.
+REPAIR_MAX_LISTED = 10
+
+Path = Tuple[Union[str, int], ...]
+
+_TYPES: Dict[str, Callable[[Any], bool]] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+# Anotaciones: se envían al backend (ayudan al modelo) pero no se validan.
+_ANNOTATIONS = {"title", "description", "default", "examples", "format", "$schema", "$id", "$comment"}
+_KEYWORDS = {"type", "enum", "const", "anyOf", "properties", "required", "additionalProperties", "items",
+             "minItems", "maxItems", "minLength", "maxLength", "pattern", "minimum", "maximum",
+             "exclusiveMinimum", "exclusiveMaximum"}
+
+
+class SchemaError(ValueError):
+    """El esquema de salida declarado por la plantilla no es válido o usa palabras clave no soportadas."""
+    pass
+
+
+class Violation:
+    """Un incumplimiento del esquema: ruta dentro de la respuesta y motivo."""
+
+    __slots__ = ("path", "message")
+
+    def __init__(self, path: Path, message: str):
+        self.path = path
+        self.message = message
+
+    def __str__(self) -> str:
+        where = "/" + "/".join(str(p) for p in self.path) if self.path else "(raíz)"
+        return f"{where}: {self.message}"
+
+    def __repr__(self) -> str:
+        return f"Violation({self})"
+
+
+Check = Callable[[Any, Path, List[Violation]], None]
+
+
+def _accept(value: Any, path: Path, errors: List[Violation]) -> None:
+    return None
+
+
+def _resolve(schema: Any, defs: Dict[str, Any], stack: Tuple[str, ...] = ()) -> Any:
+    """Sustituye los $ref locales (#/$defs/X, #/definitions/X) por su definición; sin referencias recursivas."""
+    if isinstance(schema, list):
+        return [_resolve(item, defs, stack) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if "$ref" in schema:
+        ref = schema["$ref"]
+        name = ref.rsplit("/", 1)[-1]
+        if not re.fullmatch(r"#/(\$defs|definitions)/[^/]+", ref) or name not in defs:
+            raise SchemaError(f"referencia no soportada: {ref}")
+        if name in stack:
+            raise SchemaError(f"referencia recursiva: {ref}")
+        extra = {k: v for k, v in schema.items() if k != "$ref"}
+        return {**_resolve(defs[name], defs, stack + (name,)), **extra}
+    return {k: _resolve(v, defs, stack) for k, v in schema.items() if k not in ("$defs", "definitions")}
+
+
+def _compile(schema: Any) -> Check:
+    if schema is True or schema == {}:
+        return _accept
+    if not isinstance(schema, dict):
+        raise SchemaError(f"se esperaba un objeto de esquema, no {schema!r}")
+    unknown = set(schema) - _KEYWORDS - _ANNOTATIONS
+    if unknown:
+        raise SchemaError(f"palabras clave no soportadas: {sorted(unknown)}")
+
+    types = schema.get("type")
+    type_names = [types] if isinstance(types, str) else list(types or [])
+    if any(t not in _TYPES for t in type_names):
+        raise SchemaError(f"tipo desconocido: {types}")
+    type_checks = [_TYPES[t] for t in type_names]
+    expected = " o ".join(type_names)
+    checks: List[Check] = []
+
+    if "enum" in schema:
+        options = list(schema["enum"])
+        checks.append(lambda v, p, e: None if v in options else e.append(Violation(p, f"debe ser uno de {options}")))
+    if "const" in schema:
+        const = schema["const"]
+        checks.append(lambda v, p, e: None if v == const else e.append(Violation(p, f"debe ser {const!r}")))
+    if "anyOf" in schema:
+        branches = [_compile(branch) for branch in schema["anyOf"]]
+
+        def any_of(value, path, errors):
+            for branch in branches:
+                found: List[Violation] = []
+                branch(value, path, found)
+                if not found:
+                    return
+            errors.append(Violation(path, "no coincide con ninguna de las alternativas"))
+        checks.append(any_of)
+
+    properties = {name: _compile(sub) for name, sub in schema.get("properties", {}).items()}
+    required = list(schema.get("required", []))
+    additional = schema.get("additionalProperties", True)
+    extra_check = _compile(additional) if isinstance(additional, dict) else None
+    if properties or required or additional is not True:
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    errors.append(Violation(path + (name,), "falta la clave obligatoria"))
+            for name, item in value.items():
+                sub = properties.get(name)
+                if sub is not None:
+                    sub(item, path + (name,), errors)
+                elif additional is False:
+                    errors.append(Violation(path + (name,), "clave no permitida"))
+                elif extra_check is not None:
+                    extra_check(item, path + (name,), errors)
+        checks.append(check_object)
+
+    if "items" in schema or "minItems" in schema or "maxItems" in schema:
+        item_check = _compile(schema.get("items", True))
+        min_items, max_items = schema.get("minItems", 0), schema.get("maxItems")
+
+        def check_array(value, path, errors):
+            if not isinstance(value, list):
+                return
+            if len(value) < min_items:
+                errors.append(Violation(path, f"se esperaban al menos {min_items} elementos"))
+            if max_items is not None and len(value) > max_items:
+                errors.append(Violation(path, f"se esperaban como mucho {max_items} elementos"))
+            for i, item in enumerate(value):
+                item_check(item, path + (i,), errors)
+        checks.append(check_array)
+
+    if "minLength" in schema or "maxLength" in schema or "pattern" in schema:
+        min_length, max_length = schema.get("minLength", 0), schema.get("maxLength")
+        pattern = re.compile(schema["pattern"]) if "pattern" in schema else None
+
+        def check_string(value, path, errors):
+            if not isinstance(value, str):
+                return
+            if len(value) < min_length:
+                errors.append(Violation(path, f"se esperaban al menos {min_length} caracteres"))
+            if max_length is not None and len(value) > max_length:
+                errors.append(Violation(path, f"se esperaban como mucho {max_length} caracteres"))
+            if pattern is not None and not pattern.search(value):
+                errors.append(Violation(path, f"no cumple el patrón {pattern.pattern}"))
+        checks.append(check_string)
+
+    bounds = [(schema[k], k) for k in ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum") if k in schema]
+    if bounds:
+        tests = {"minimum": lambda v, b: v >= b, "maximum": lambda v, b: v <= b,
+                 "exclusiveMinimum": lambda v, b: v > b, "exclusiveMaximum": lambda v, b: v < b}
+
+        def check_number(value, path, errors):
+            if not _TYPES["number"](value):
+                return
+            for bound, keyword in bounds:
+                if not tests[keyword](value, bound):
+                    errors.append(Violation(path, f"{keyword} {bound}"))
+        checks.append(check_number)
+
+    def check(value: Any, path: Path, errors: List[Violation]) -> None:
+        if type_checks and not any(t(value) for t in type_checks):
+            errors.append(Violation(path, f"se esperaba {expected}"))
+            return
+        for c in checks:
+            c(value, path, errors)
+
+    return check
+
+
+class OutputValidator:
+    """
+    Esquema de salida de una plantilla, ya resuelto (sin $ref) y compilado.
+    `schema` es lo que se envía al backend; `key` lo identifica en la clave de caché.
+    """
+
+    __slots__ = ("schema", "key", "_check", "_subsets")
+
+    def __init__(self, schema: Dict[str, Any]):
+        if not isinstance(schema, dict):
+            raise SchemaError("el esquema de salida debe ser un objeto JSON")
+        self.schema = _resolve(schema, {**schema.get("definitions", {}), **schema.get("$defs", {})})
+        self.key = hashlib.sha256(json.dumps(self.schema, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self._check = _compile(self.schema)
+        self._subsets: Dict[Tuple[str, ...], OutputValidator] = {}
+
+    @property
+    def properties(self) -> Dict[str, Any]:
+        return self.schema.get("properties", {})
+
+    def validate(self, value: Any) -> List[Violation]:
+        errors: List[Violation] = []
+        self._check(value, (), errors)
+        return errors
+
+    def prune(self, value: Any) -> Any:
+        """Quita las claves de primer nivel no declaradas si el esquema no las admite (no hace falta el modelo)."""
+        if isinstance(value, dict) and self.schema.get("additionalProperties") is False:
+            return {k: v for k, v in value.items() if k in self.properties}
+        return value
+
+    def check(self, value: Any) -> "Validation":
+        return Validation(self, value)
+
+    def check_extracted(self, extractor: IncrementalJSONExtractor) -> "Validation":
+        try:
+            return Validation(self, extractor.finish())
+        except JSONExtractionError as e:
+            return Validation(self, None, f"JSON inválido: {e}")
+
+    def check_text(self, text: str) -> "Validation":
+        extractor = IncrementalJSONExtractor()
+        extractor.feed(text)
+        return self.check_extracted(extractor)
+
+    def repair_fields(self, violations: List[Violation]) -> Optional[List[str]]:
+        """Claves de primer nivel a pedir de nuevo, o None si hay que rehacer el objeto entero."""
+        fields = []
+        for violation in violations:
+            if not violation.path or violation.path[0] not in self.properties:
+                return None
+            if violation.path[0] not in fields:
+                fields.append(violation.path[0])
+        return fields
+
+    def subset(self, fields: List[str]) -> "OutputValidator":
+        """Esquema con sólo `fields` (todas obligatorias): lo que se le pide al modelo al reparar."""
+        key = tuple(fields)
+        sub = self._subsets.get(key)
+        if sub is None:
+            sub = OutputValidator({"type": "object", "properties": {f: self.properties[f] for f in fields},
+                                   "required": list(fields)})
+            self._subsets[key] = sub
+        return sub
+
+
+def compile_schema(schema: Dict[str, Any]) -> OutputValidator:
+    return OutputValidator(schema)
+
+
+class Validation:
+    """
+    Resultado de validar una respuesta contra el esquema de su plantilla y de las
+    reparaciones posteriores. `first` es el resultado de la generación original
+    ('valid', 'invalid' o 'parse_fail'); `status` el final ('ok', 'schema_fail' o 'parse_fail').
+    """
+
+    __slots__ = ("validator", "result", "violations", "first", "repairs")
+
+    def __init__(self, validator: OutputValidator, result: Any, parse_error: Optional[str] = None):
+        self.validator = validator
+        self.repairs: List[Dict[str, Any]] = []
+        if parse_error is not None:
+            self.result, self.violations = None, [Violation((), parse_error)]
+        else:
+            self.update(result)
+        self.first = "valid" if self.ok else ("parse_fail" if self.result is None else "invalid")
+
+    def update(self, result: Any) -> None:
+        self.result = self.validator.prune(result)
+        self.violations = self.validator.validate(self.result)
+
+    @property
+    def ok(self) -> bool:
+        return not self.violations
+
+    @property
+    def status(self) -> str:
+        if self.ok:
+            return "ok"
+        return "parse_fail" if self.result is None else "schema_fail"
+
+    @property
+    def repair_tokens(self) -> int:
+        return sum(r["tokens"] for r in self.repairs)
+
+    def errors(self) -> List[str]:
+        return [str(v) for v in self.violations[:REPAIR_MAX_LISTED]]
+
+    def report(self) -> Dict[str, Any]:
+        return {"schema": self.validator.key, "first_pass": self.first, "repairs": list(self.repairs),
+                "errors": self.errors()}
+
+
+def repair_messages(messages: List[Dict[str, str]], previous: str, violations: List[Violation],
+                    fields: Optional[List[str]]) -> List[Dict[str, str]]:
+    """La conversación original (mismo prefijo: el nodo lo tiene en caché), la respuesta anterior y qué corregir."""
+    problems = "\n".join(f"- {v}" for v in violations[:REPAIR_MAX_LISTED])
+    if fields is None:
+        ask = "Devuelve de nuevo el objeto JSON completo, corregido y conforme al esquema."
+    else:
+        ask = (f"Devuelve SÓLO un objeto JSON con las claves {', '.join(fields)} corregidas; "
+               "el resto de la respuesta ya es válido y no debe repetirse.")
+    return [*messages, {"role": "assistant", "content": previous},
+            {"role": "user", "content": f"La respuesta anterior no cumple el esquema de salida:\n{problems}\n{ask}"}]
+
+
+async def repair_output(validation: Validation, router, model_name: str, messages: List[Dict[str, str]],
+                        raw_text: str, options: Optional[Dict[str, Any]] = None, prefix_key: Optional[str] = None,
+                        attempts: int = REPAIR_ATTEMPTS) -> Validation:
+    """
+    Pide al modelo sólo la parte inválida de la respuesta (o el objeto entero si está
+    roto) y la fusiona con el resto, como mucho `attempts` veces. Cada intento queda en
+    `validation.repairs` con las claves pedidas, los tokens gastados y si dejó la
+    respuesta válida. Un error del backend corta la reparación sin propagarse.
+    """
+    validator = validation.validator
+    for _ in range(attempts):
+        if validation.ok:
+            break
+        fields = validator.repair_fields(validation.violations)
+        target = validator if fields is None else validator.subset(fields)
+        previous = raw_text if validation.result is None else json.dumps(validation.result, ensure_ascii=False)
+        attempt: Dict[str, Any] = {"fields": fields, "tokens": 0, "ok": False}
+        validation.repairs.append(attempt)
+        usage: Dict[str, Any] = {}
+        chunks: List[str] = []
+        try:
+            async for chunk in router.stream(model_name, repair_messages(messages, previous, validation.violations, fields),
+                                             options=options, response_format=target.schema, usage=usage,
+                                             prefix_key=prefix_key):
+                chunks.append(chunk)
+        except BackendError as e:
+            logger.warning(f"No se pudo reparar la salida de {model_name}: {e}")
+            attempt["error"] = str(e)
+            break
+        # Como en las métricas de generación: sin eval_count se aproxima con los fragmentos.
+        attempt["tokens"] = usage.get("completion_tokens") or len(chunks)
+        patch = target.check_text("".join(chunks))
+        if fields is None and patch.result is not None:
+            validation.update(patch.result)
+        elif isinstance(patch.result, dict):
+            validation.update({**validation.result, **{f: patch.result[f] for f in fields if f in patch.result}})
+        else:
+            continue
+        attempt["ok"] = validation.ok
+    return validation
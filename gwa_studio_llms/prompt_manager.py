@@ -1,63 +1,60 @@
-import json
-from pathlib import Path
-from string import Template
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import logging
 
-logger = logging.getLogger(__name__)
-
-# Definición de la ruta base para las plantillas de prompts.
-BASE_DIR = Path(__file__).parent / "templates"
+from .output_schema import OutputValidator
+# TemplateNotFoundError y BASE_DIR se re-exportan por compatibilidad.
+from .template_registry import BASE_DIR, PromptParts, TemplateNotFoundError, TemplateRegistry, template_registry
 
-class TemplateNotFoundError(Exception):
-    """Excepción levantada cuando una plantilla solicitada no existe."""
-    pass
+logger = logging.getLogger(__name__)
 
 class PromptManager:
     """
-    Gestiona la carga de plantillas de prompts desde archivos JSON
+    Gestiona las plantillas de prompts definidas en archivos JSON
     y la inyección de datos dinámicos usando Template de Python.
+    Las plantillas se leen y compilan una sola vez en el TemplateRegistry.
     """
     
-    def __init__(self):
+    def __init__(self, registry: TemplateRegistry = template_registry):
         """Inicializa el manager y asegura que el directorio de plantillas exista."""
-        if not BASE_DIR.is_dir():
-            BASE_DIR.mkdir(exist_ok=True)
-            logger.info(f"Directorio de plantillas creado: {BASE_DIR}")
+        self.registry = registry
+        if not self.registry.base_dir.is_dir():
+            self.registry.base_dir.mkdir(exist_ok=True)
+            logger.info(f"Directorio de plantillas creado: {self.registry.base_dir}")
 
     def load_template(self, template_name: str) -> Dict[str, Any]:
-        """Carga la plantilla JSON completa por su nombre."""
-        file_path = BASE_DIR / f"{template_name}.json"
-        
-        if not file_path.is_file():
-            raise TemplateNotFoundError(f"Plantilla '{template_name}.json' no encontrada en {BASE_DIR}")
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        """Devuelve la plantilla JSON completa por su nombre (desde memoria)."""
+        return dict(self.registry.get("json", template_name).data)
 
     def render_prompt(self, template_name: str, context: Dict[str, Any]) -> str:
         """
         Carga una plantilla, le inyecta las variables de contexto y devuelve el prompt renderizado.
         """
-        template_data = self.load_template(template_name)
-        template_string = template_data.get("prompt", "")
+        return self.render_parts(template_name, context).text
 
-        if not template_string:
+    def render_parts(self, template_name: str, context: Dict[str, Any]) -> PromptParts:
+        """Como render_prompt, pero separando el prefijo estático (reutilizable por el backend) del resto."""
+        entry = self.registry.get("json", template_name)
+
+        if entry.compiled is None:
             raise ValueError(f"La plantilla '{template_name}' no contiene la clave 'prompt'.")
 
-        template = Template(template_string)
-        
-        # Sustituimos las variables.
+        # Sustituimos las variables (sólo en el sufijo: el prefijo no tiene).
         # Si falta alguna en 'context' (como la que causó el error 400), Template levantará un KeyError
         # que es capturado por la capa superior y devuelto como 400.
-        rendered_prompt = template.substitute(context)
-        
-        return rendered_prompt
+        return PromptParts(entry.prefix, entry.suffix.substitute(context), entry.prefix_key)
+
+    def output_validator(self, template_name: str) -> Optional[OutputValidator]:
+        """Esquema de salida compilado de la plantilla (None si no declara ninguno)."""
+        return self.registry.output_validator("json", template_name)
+
+    def template_key(self, template_name: str) -> str:
+        """Firma del contenido de la plantilla (cambia al editarla; ver make_cache_key)."""
+        return self.registry.content_key("json", template_name)
 
     # CORRECCIÓN: Renombrada para coincidir con la llamada en main_service.py
     def get_template_names(self) -> List[str]: 
         """Lista todos los nombres de plantillas disponibles (sin extensión)."""
-        return [f.stem for f in BASE_DIR.glob("*.json")]
+        return self.registry.json_names()
 
 # Instancia única para ser utilizada por el servicio
 prompt_manager = PromptManager()
\ No newline at end of file
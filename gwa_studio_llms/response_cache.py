@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración (variables de entorno) ---
+RESPONSE_CACHE_SIZE = int(os.environ.get("GWA_RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.environ.get("GWA_RESPONSE_CACHE_TTL", "3600"))
+# Ruta del archivo SQLite del nivel persistente. Vacío = sólo memoria.
+RESPONSE_CACHE_DB = os.environ.get("GWA_RESPONSE_CACHE_DB", "").strip(' "')
+
+# Modos de caché por petición:
+#   "use"     -> lee y escribe la caché (por defecto)
+#   "refresh" -> ignora lo guardado, llama al modelo y reemplaza la entrada
+#   "bypass"  -> ni lee ni escribe
+CACHE_MODES = ("use", "refresh", "bypass")
+
+
+def make_cache_key(model_name: str, template_name: str, context: Dict[str, Any],
+                   user_prompt: str, options: Optional[Dict[str, Any]] = None,
+                   template_key: Optional[str] = None) -> str:
+    """
+    Hash canónico (orden de claves estable) de todo lo que determina la respuesta.
+    `template_key` es la firma del contenido de la plantilla (TemplateRegistry.content_key):
+    editarla cambia la clave aunque el nombre sea el mismo.
+    """
+    canonical = json.dumps(
+        {
+            "model": model_name,
+            "template": template_name,
+            "template_key": template_key,
+            "context": context,
+            "user_prompt": user_prompt,
+            "options": options or {},
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caché de respuestas del LLM por coincidencia exacta.
+
+    Nivel 1: LRU en memoria con TTL. Nivel 2 (opcional): SQLite en disco, que
+    sobrevive a reinicios y repuebla el nivel 1 cuando hay un acierto.
+
+    Desde el event loop se usan `aget`/`aset`: el LRU se consulta en línea y el
+    SQLite (compartido por los workers de MAGENTA, que pueden tener su lock de
+    escritura) en un hilo. `get`/`set` son las mismas operaciones en síncrono.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl_seconds: float = RESPONSE_CACHE_TTL,
+                 db_path: str = RESPONSE_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+        except sqlite3.Error as e:
+            logger.error(f"No se pudo abrir la caché persistente en {db_path}: {e}")
+            self._db = None
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = self._get_disk(key)
+        return self._counted(value)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            value = await asyncio.to_thread(self._get_disk, key)
+        return self._counted(value)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        created_at = self._set_memory(key, value)
+        if self._db is not None:
+            self._set_disk(key, value, created_at)
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        created_at = self._set_memory(key, value)
+        if self._db is not None:
+            await asyncio.to_thread(self._set_disk, key, value, created_at)
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._memory.get(key)
+            if item is None:
+                return None
+            if not self._expired(item[0]):
+                self._memory.move_to_end(key)
+                return item[1]
+            del self._memory[key]
+            return None
+
+    def _get_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, created_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        value = json.loads(row[0])
+        with self._lock:
+            self._store_memory(key, value, row[1])
+            self.disk_hits += 1
+        return value
+
+    def _counted(self, value: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _set_memory(self, key: str, value: Dict[str, Any]) -> float:
+        created_at = time.time()
+        with self._lock:
+            self._store_memory(key, value, created_at)
+            self.writes += 1
+        return created_at
+
+    def _set_disk(self, key: str, value: Dict[str, Any], created_at: float) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), created_at),
+            )
+
+    def _store_memory(self, key: str, value: Dict[str, Any], created_at: float) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM response_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "persistent": self._db is not None,
+        }
+
+
+# Instancia compartida por AgentService y LLMAgentExecutor.
+response_cache = ResponseCache()
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from gwa_studio_core.shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Con varios workers: duración máxima del lease de una generación (como el timeout de lectura
+# de CIAN hacia MAGENTA) y cada cuánto miran la caché compartida los que esperan en otro worker.
+FLIGHT_LEASE_S = float(os.environ.get("GWA_FLIGHT_LEASE_S", "600"))
+FLIGHT_POLL_S = float(os.environ.get("GWA_FLIGHT_POLL_S", "0.1"))
+
+
+class SingleFlight:
+    """
+    Coalescencia de llamadas idénticas en vuelo ("single-flight").
+
+    La primera petición para una clave lanza la generación; las peticiones
+    concurrentes con la misma clave esperan la misma tarea y reciben el mismo
+    resultado (o la misma excepción). Si un cliente cancela, sólo deja de
+    esperar; la generación se cancela cuando ya no queda nadie esperándola.
+
+    Con estado compartido entre workers (`shared`) y un `lookup` en la caché común,
+    el líder de cada worker toma además un lease por clave: si la misma generación
+    ya corre en otro worker, espera a que su resultado aparezca en la caché.
+    """
+
+    def __init__(self, shared: Optional[SharedState] = None, lease_s: float = FLIGHT_LEASE_S,
+                 poll_s: float = FLIGHT_POLL_S):
+        self.shared = shared if shared is not None and shared.enabled else None
+        self.lease_s = lease_s
+        self.poll_s = poll_s
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.remote_waits = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    async def _lead(self, key: str, fn: Callable[[], Awaitable[T]], lookup: Optional[Callable[[], Optional[T]]]) -> T:
+        if self.shared is None or lookup is None:
+            return await fn()
+        lease = f"flight:{key}"
+        waited = False
+        # El lease y la caché (SQLite) se consultan fuera del event loop.
+        while not await self.shared.run(self.shared.claim, lease, self.lease_s):
+            if not waited:
+                waited = True
+                self.remote_waits += 1
+                logger.info(f"Generación en vuelo en otro worker; esperando su resultado ({key[:12]}...)")
+            await asyncio.sleep(self.poll_s)
+            found = await asyncio.to_thread(lookup)
+            if found is not None:
+                return found
+        try:
+            # Puede que el otro worker terminara justo antes de soltar el lease.
+            found = await asyncio.to_thread(lookup) if waited else None
+            return found if found is not None else await fn()
+        finally:
+            self.shared.defer(self.shared.unclaim, lease)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]],
+                 lookup: Optional[Callable[[], Optional[T]]] = None) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._lead(key, fn, lookup))
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            self.leaders += 1
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+        else:
+            self.coalesced += 1
+            logger.info(f"Petición coalescida con una generación en vuelo ({key[:12]}...)")
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1:
+                # Último interesado: no tiene sentido seguir generando.
+                task.cancel()
+                self.cancelled += 1
+            raise
+        finally:
+            if key in self._waiters and self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+        }
+        if self.shared is not None:
+            stats["remote_waits"] = self.remote_waits
+        return stats
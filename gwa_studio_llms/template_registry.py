@@ -0,0 +1,346 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from string import Template
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from .output_schema import OutputValidator, compile_schema
+
+if TYPE_CHECKING:
+    # Jinja se importa al compilar la primera plantilla .jinja, no al importar el módulo.
+    from jinja2 import Environment
+    from jinja2 import Template as JinjaTemplate
+
+logger = logging.getLogger(__name__)
+
+# Misma carpeta que usan PromptManager y LLMAgentExecutor.
+BASE_DIR = Path(__file__).parent / "templates"
+
+# Cada cuántos segundos el watcher revisa los mtime de la carpeta (0 = sin watcher).
+TEMPLATE_POLL_SECONDS = float(os.environ.get("GWA_TEMPLATE_POLL_SECONDS", "2"))
+
+_KINDS = {".json": "json", ".jinja": "jinja"}
+# <plantilla>.schema.json: esquema de salida de la plantilla del mismo nombre (.jinja o .json).
+SCHEMA_SUFFIX = ".schema"
+
+# Prefijo estático de las plantillas: lo que va antes de este comentario en un .jinja,
+# o la clave "system" de un .json. Sin él, se toma el texto anterior a la primera
+# variable (cortado en el último párrafo completo).
+PREFIX_MARKER = "{# --- fin del prefijo estático --- #}"
+_JINJA_TAG_RE = re.compile(r"\{\{|\{%")
+
+
+class PromptParts:
+    """
+    Prompt renderizado partido en prefijo estático (idéntico byte a byte en todas
+    las peticiones de la plantilla) y sufijo dinámico. El prefijo viaja como mensaje
+    system para que el backend reutilice su estado (caché KV de Ollama, caché
+    implícita de Gemini); `prefix_key` identifica ese prefijo ante el router.
+    """
+
+    __slots__ = ("prefix", "suffix", "prefix_key")
+
+    def __init__(self, prefix: str, suffix: str, prefix_key: Optional[str] = None):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.prefix_key = prefix_key if prefix_key is not None else prefix_hash(prefix)
+
+    @property
+    def text(self) -> str:
+        return f"{self.prefix}\n\n{self.suffix}" if self.prefix else self.suffix
+
+    def messages(self) -> List[Dict[str, str]]:
+        if not self.prefix:
+            return [{"role": "user", "content": self.suffix}]
+        return [{"role": "system", "content": self.prefix}, {"role": "user", "content": self.suffix}]
+
+
+def prefix_hash(prefix: str) -> Optional[str]:
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16] if prefix else None
+
+
+def _static_cut(text: str, first_dynamic: Optional[int]) -> int:
+    """Posición del último salto de párrafo antes de la primera parte dinámica (0 = sin prefijo)."""
+    if first_dynamic is None:
+        return 0
+    cut = text.rfind("\n\n", 0, first_dynamic)
+    return max(cut, 0)
+
+
+class TemplateNotFoundError(Exception):
+    """Excepción levantada cuando una plantilla solicitada no existe."""
+    pass
+
+
+class CompiledTemplate:
+    """Plantilla ya parseada y compilada, lista para renderizar sin tocar disco."""
+
+    __slots__ = ("name", "kind", "path", "signature", "source", "source_key", "includes", "data", "compiled", "prefix",
+                 "prefix_key", "suffix", "validator", "error")
+
+    def __init__(self, name: str, kind: str, path: Path, signature: Tuple[int, int]):
+        self.name = name
+        self.kind = kind
+        self.path = path
+        self.signature = signature  # (mtime_ns, size) para detectar cambios
+        self.source: str = ""
+        # Hash del fuente (entra en la clave de la caché de respuestas) y plantillas que incluye.
+        self.source_key: Optional[str] = None
+        self.includes: Tuple[str, ...] = ()
+        self.data: Dict[str, Any] = {}
+        self.compiled: Any = None
+        # Prefijo estático ya renderizado y plantilla compilada del resto (ver PromptParts).
+        self.prefix: str = ""
+        self.prefix_key: Optional[str] = None
+        self.suffix: Any = None
+        # Validador compilado del esquema de salida ("output_schema" de un .json o un .schema.json).
+        self.validator: Optional[OutputValidator] = None
+        self.error: Optional[Exception] = None
+
+
+class TemplateRegistry:
+    """
+    Registro en memoria de las plantillas de `templates/` (*.json y *.jinja).
+
+    Cada archivo se lee y compila una sola vez; un watcher por polling de mtime
+    recompila únicamente los archivos modificados, agregados o borrados, de modo
+    que el render por petición no hace I/O de disco.
+    """
+
+    def __init__(self, base_dir: Path = BASE_DIR, poll_interval: float = TEMPLATE_POLL_SECONDS):
+        self.base_dir = Path(base_dir)
+        self.poll_interval = poll_interval
+        self._entries: Dict[Tuple[str, str], CompiledTemplate] = {}
+        self._json_names: List[str] = []
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.reload_count = 0
+        self._jinja_env: Optional["Environment"] = None
+
+    @property
+    def jinja_env(self) -> "Environment":
+        if self._jinja_env is None:
+            from jinja2 import Environment, FunctionLoader
+
+            self._jinja_env = Environment(loader=FunctionLoader(self._jinja_source), autoescape=True)
+        return self._jinja_env
+
+    # --- Carga y compilación ---
+
+    def _jinja_source(self, filename: str):
+        """Loader para {% include %}: sirve el fuente desde memoria, nunca desde disco."""
+        entry = self._entries.get(("jinja", filename.removesuffix(".jinja")))
+        if entry is None:
+            return None
+        return entry.source, str(entry.path), lambda: True
+
+    def _compile(self, entry: CompiledTemplate) -> None:
+        try:
+            entry.source = entry.path.read_text(encoding="utf-8")
+            entry.source_key = hashlib.sha256(entry.source.encode("utf-8")).hexdigest()[:16]
+            if entry.kind == "schema":
+                entry.data = json.loads(entry.source)
+                entry.validator = compile_schema(entry.data)
+            elif entry.kind == "json":
+                entry.data = json.loads(entry.source)
+                self._compile_json(entry)
+                if "output_schema" in entry.data:
+                    entry.validator = compile_schema(entry.data["output_schema"])
+            else:
+                entry.compiled = self.jinja_env.from_string(entry.source)
+                from jinja2 import meta
+
+                entry.includes = tuple(sorted(
+                    t.removesuffix(".jinja") for t in meta.find_referenced_templates(self.jinja_env.parse(entry.source))
+                    if t))
+                self._compile_jinja_parts(entry)
+            entry.prefix_key = prefix_hash(entry.prefix)
+        except Exception as e:
+            logger.error(f"Error al compilar la plantilla {entry.path.name}: {e}")
+            entry.error = e
+
+    @staticmethod
+    def _compile_json(entry: CompiledTemplate) -> None:
+        prompt = entry.data.get("prompt", "")
+        system = entry.data.get("system", "")
+        if system:
+            if any(m.group("named") or m.group("braced") for m in Template.pattern.finditer(system)):
+                raise ValueError("la clave 'system' es el prefijo estático y no puede llevar variables ($...)")
+            entry.prefix, rest = system.strip(), prompt
+            prompt = f"{entry.prefix}\n\n{prompt}" if prompt else ""
+        else:
+            first = Template.pattern.search(prompt)
+            cut = _static_cut(prompt, first.start() if first else None)
+            entry.prefix, rest = prompt[:cut].strip(), prompt[cut:].lstrip("\n")
+        entry.compiled = Template(prompt) if prompt else None
+        entry.suffix = Template(rest) if prompt else None
+
+    def _compile_jinja_parts(self, entry: CompiledTemplate) -> None:
+        source = entry.source
+        if PREFIX_MARKER in source:
+            static, rest = source.split(PREFIX_MARKER, 1)
+            from jinja2 import meta
+
+            variables = meta.find_undeclared_variables(self.jinja_env.parse(static))
+            if variables:
+                raise ValueError(f"el prefijo estático no puede usar variables: {sorted(variables)}")
+        else:
+            first = _JINJA_TAG_RE.search(source)
+            cut = _static_cut(source, first.start() if first else None)
+            static, rest = source[:cut], source[cut:]
+        entry.prefix = self.jinja_env.from_string(static).render().strip() if static.strip() else ""
+        entry.suffix = self.jinja_env.from_string(rest) if entry.prefix else entry.compiled
+
+    def _scan(self) -> Dict[Tuple[str, str], Tuple[Path, Tuple[int, int]]]:
+        found = {}
+        try:
+            with os.scandir(self.base_dir) as it:
+                for item in it:
+                    name, ext = os.path.splitext(item.name)
+                    kind = _KINDS.get(ext)
+                    if kind is None or not item.is_file():
+                        continue
+                    if kind == "json" and name.endswith(SCHEMA_SUFFIX):
+                        kind, name = "schema", name.removesuffix(SCHEMA_SUFFIX)
+                    st = item.stat()
+                    found[(kind, name)] = (Path(item.path), (st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            pass
+        return found
+
+    def refresh(self) -> Dict[str, List[str]]:
+        """Sincroniza el registro con el disco y devuelve qué plantillas cambiaron."""
+        found = self._scan()
+        changes: Dict[str, List[str]] = {"loaded": [], "removed": []}
+
+        with self._lock:
+            entries = dict(self._entries)
+            for key in list(entries):
+                if key not in found:
+                    del entries[key]
+                    changes["removed"].append(f"{key[1]}.{key[0]}")
+
+            for key, (path, signature) in found.items():
+                current = entries.get(key)
+                if current is not None and current.signature == signature:
+                    continue
+                entry = CompiledTemplate(key[1], key[0], path, signature)
+                self._compile(entry)
+                entries[key] = entry
+                changes["loaded"].append(f"{key[1]}.{key[0]}")
+
+            if changes["loaded"] or changes["removed"]:
+                if self._jinja_env is not None and any(
+                        k.endswith(".jinja") for k in changes["loaded"] + changes["removed"]):
+                    self._jinja_env.cache.clear()
+                self._entries = entries
+                self._json_names = sorted(name for kind, name in entries if kind == "json")
+                for key in entries:
+                    if key[0] != "schema" and f"{key[1]}.{key[0]}" in changes["loaded"] and \
+                            entries[key].validator is None and ("schema", key[1]) not in entries:
+                        logger.warning(f"La plantilla {key[1]}.{key[0]} no declara esquema de salida: JSON sin validar.")
+                if self._loaded:
+                    self.reload_count += 1
+                    logger.info(f"Plantillas recargadas: {changes}")
+            self._loaded = True
+
+        return changes
+
+    # --- Watcher por polling de mtime ---
+
+    def start_watcher(self) -> None:
+        if self.poll_interval <= 0 or (self._watcher and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="template-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+        if self._watcher:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error en el watcher de plantillas: {e}")
+
+    def load(self) -> None:
+        """Carga inicial + watcher de recarga en caliente (paso de warm-up del servicio)."""
+        self.refresh()
+        self.start_watcher()
+
+    # --- Acceso (sin I/O de disco) ---
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load()
+
+    def get(self, kind: str, name: str) -> CompiledTemplate:
+        self._ensure_loaded()
+        entry = self._entries.get((kind, name))
+        if entry is None:
+            raise TemplateNotFoundError(f"Plantilla '{name}.{kind}' no encontrada en {self.base_dir}")
+        if entry.error is not None:
+            raise entry.error
+        return entry
+
+    def content_key(self, kind: str, name: str) -> str:
+        """
+        Firma del contenido actual de la plantilla (fuente, plantillas incluidas y esquema
+        .schema.json): cambia al editarla, así la caché de respuestas no sirve salidas
+        generadas con la versión anterior.
+        """
+        self._ensure_loaded()
+        entries = self._entries
+        if (kind, name) not in entries:
+            raise TemplateNotFoundError(f"Plantilla '{name}.{kind}' no encontrada en {self.base_dir}")
+        keys, pending, seen = [], [(kind, name), ("schema", name)], set()
+        while pending:
+            key = pending.pop()
+            entry = entries.get(key)
+            if entry is None or key in seen:
+                continue
+            seen.add(key)
+            keys.append(f"{key[1]}.{key[0]}:{entry.source_key}")
+            pending.extend(("jinja", include) for include in entry.includes)
+        return hashlib.sha256("|".join(sorted(keys)).encode("utf-8")).hexdigest()[:16]
+
+    def exists(self, name: str) -> bool:
+        """Hay una plantilla .json o .jinja con ese nombre."""
+        self._ensure_loaded()
+        return ("json", name) in self._entries or ("jinja", name) in self._entries
+
+    def get_jinja(self, name: str) -> "JinjaTemplate":
+        return self.get("jinja", name).compiled
+
+    def output_validator(self, kind: str, name: str) -> Optional[OutputValidator]:
+        """Validador del esquema de salida de la plantilla (propio o de <name>.schema.json), o None si no declara."""
+        entry = self.get(kind, name)
+        if entry.validator is not None:
+            return entry.validator
+        if ("schema", name) not in self._entries:
+            return None
+        return self.get("schema", name).validator
+
+    def render_jinja_parts(self, name: str, **variables: Any) -> PromptParts:
+        """Plantilla .jinja como prefijo estático (renderizado al compilar) + sufijo renderizado ahora."""
+        entry = self.get("jinja", name)
+        return PromptParts(entry.prefix, entry.suffix.render(**variables).strip(), entry.prefix_key)
+
+    def json_names(self) -> List[str]:
+        self._ensure_loaded()
+        return list(self._json_names)
+
+
+# Instancia compartida por PromptManager y LLMAgentExecutor.
+template_registry = TemplateRegistry()
@@ -0,0 +1,94 @@
+# history_store.py - Historial de planes del frontend: acotado, paginado y persistente
+#
+# El historial ya no vive en st.session_state (crecía sin límite, se perdía al recargar
+# y se volvía a pintar entero en cada rerun). Cada plan se guarda en SQLite bajo el id
+# de usuario que el frontend deja en la URL (?uid=...), así sobrevive a recargas y a
+# sesiones nuevas. Por usuario se conservan los últimos GWA_HISTORY_MAX_ITEMS y la
+# página visible sale de una consulta indexada (user, id DESC) con LIMIT/OFFSET: el
+# coste de un rerun no depende de cuántos planes haya generado el usuario.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+HISTORY_DB = os.environ.get("GWA_HISTORY_DB", "gwa_history.db").strip(' "')
+# Planes que se conservan por usuario (los más antiguos se borran al guardar uno nuevo).
+HISTORY_MAX_ITEMS = int(os.environ.get("GWA_HISTORY_MAX_ITEMS", "200"))
+HISTORY_PAGE_SIZE = int(os.environ.get("GWA_HISTORY_PAGE_SIZE", "5"))
+
+
+class HistoryStore:
+    """Historial por usuario en SQLite; una instancia se comparte entre sesiones y es segura entre hilos."""
+
+    def __init__(self, db_path: str = HISTORY_DB, max_items: int = HISTORY_MAX_ITEMS):
+        self.db_path = db_path
+        self.max_items = max_items
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Se abre al primer uso: importar el módulo no crea el archivo.
+        if self._db is None:
+            db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=10)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT NOT NULL, query TEXT NOT NULL, "
+                "response TEXT NOT NULL, ok INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS history_user ON history (user, id DESC)")
+            self._db = db
+        return self._db
+
+    def add(self, user: str, query: str, response: Any, ok: bool = True) -> int:
+        """Guarda un plan y recorta los más antiguos del usuario por encima de `max_items`."""
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                item_id = db.execute(
+                    "INSERT INTO history (user, query, response, ok, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (user, query, json.dumps(response, ensure_ascii=False), int(ok), time.time()),
+                ).lastrowid
+                db.execute(
+                    "DELETE FROM history WHERE user = ? AND id <= "
+                    "(SELECT id FROM history WHERE user = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (user, user, self.max_items),
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return item_id
+
+    def count(self, user: str) -> int:
+        with self._lock:
+            return self._conn().execute("SELECT COUNT(*) FROM history WHERE user = ?", (user,)).fetchone()[0]
+
+    def page(self, user: str, page: int = 0, size: int = HISTORY_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Planes de la página `page` (0 = los más recientes), del más nuevo al más antiguo."""
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT id, query, response, ok, created_at FROM history WHERE user = ? "
+                "ORDER BY id DESC LIMIT ? OFFSET ?",
+                (user, size, max(page, 0) * size),
+            ).fetchall()
+        return [{"id": r["id"], "query": r["query"], "response": json.loads(r["response"]), "ok": bool(r["ok"]),
+                 "created_at": r["created_at"]} for r in rows]
+
+    def pages(self, user: str, size: int = HISTORY_PAGE_SIZE) -> int:
+        return max(1, -(-self.count(user) // size))
+
+    def clear(self, user: str) -> None:
+        with self._lock:
+            self._conn().execute("DELETE FROM history WHERE user = ?", (user,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
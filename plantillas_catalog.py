@@ -0,0 +1,294 @@
+# plantillas_catalog.py - Catálogo en memoria de plantillas_json/ con índices y recarga en caliente
+#
+# Cada fichero se parsea una vez y se normaliza a una forma compacta común (los
+# JSON tienen esquemas distintos: unos traen nombre/empresa/slogan, otros
+# categoria/secciones/servicios/colores/fuente). Se indexan por categoría,
+# sección y palabra clave; las consultas no tocan disco. `refresh()` vuelve a
+# leer sólo los ficheros cuyo mtime/tamaño cambió y quita los borrados.
+
+import bisect
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+PLANTILLAS_DIR = os.environ.get("GWA_PLANTILLAS_DIR", str(Path(__file__).resolve().parent / "plantillas_json")).strip(' "')
+SIN_CATEGORIA = "Sin categoría"
+# Resultados ordenados de list/search por consulta; se vacía cuando cambia la versión del catálogo.
+QUERY_CACHE_SIZE = int(os.environ.get("GWA_CATALOG_QUERY_CACHE", "1024"))
+
+# Campos conocidos; el resto de listas (cursos, modelos, areas...) se agrupan en `items`.
+_STYLE_FIELDS = {"color_fondo": "color_fondo", "color_acento": "color_acento", "fuente": "fuente"}
+_KNOWN_FIELDS = {"nombre", "categoria", "empresa", "empresa_default", "slogan", "slogan_default",
+                 "telefono_default", "secciones", "presupuesto", "posts_redes", "texto_quienes_somos",
+                 *_STYLE_FIELDS}
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas y sin tildes: 'Educación' y 'educacion' indexan igual."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    normalized = normalize_text(text)
+    return [t for t in "".join(c if c.isalnum() else " " for c in normalized).split() if len(t) > 1]
+
+
+def _item_text(item: Any) -> str:
+    # Los servicios vienen como texto o como {"titulo", "descripcion"}.
+    if isinstance(item, dict):
+        return str(item.get("titulo") or item.get("nombre") or next(iter(item.values()), ""))
+    return str(item)
+
+
+class Plantilla:
+    """Entrada normalizada del catálogo. `body` es el JSON ya serializado para servirlo sin recodificar."""
+
+    __slots__ = ("id", "nombre", "name_key", "categoria", "secciones", "keywords", "summary", "body", "etag", "stamp")
+
+    def __init__(self, plantilla_id: str, raw: Dict[str, Any], stamp: Tuple[int, int], digest: str):
+        self.id = plantilla_id
+        self.stamp = stamp
+        self.etag = f'"{digest}"'
+        self.nombre = str(raw.get("nombre") or plantilla_id)
+        self.name_key = normalize_text(self.nombre)
+        self.categoria = str(raw.get("categoria") or SIN_CATEGORIA)
+        self.secciones = tuple(str(s) for s in raw.get("secciones") or ())
+
+        items = {k: [_item_text(i) for i in v] for k, v in raw.items()
+                 if k not in _KNOWN_FIELDS and isinstance(v, list)}
+        extra = {k: v for k, v in raw.items() if k not in _KNOWN_FIELDS and not isinstance(v, list)}
+        self.summary = {
+            "id": plantilla_id,
+            "nombre": self.nombre,
+            "categoria": self.categoria,
+            "empresa": raw.get("empresa_default") or raw.get("empresa") or "",
+            "slogan": raw.get("slogan_default") or raw.get("slogan") or "",
+        }
+        full = {
+            **self.summary,
+            "telefono": raw.get("telefono_default", ""),
+            "estilo": {key: raw[field] for field, key in _STYLE_FIELDS.items() if field in raw},
+            "secciones": list(self.secciones),
+            "items": items,
+            "presupuesto": raw.get("presupuesto") or {},
+            "posts_redes": raw.get("posts_redes") or [],
+            "texto_quienes_somos": raw.get("texto_quienes_somos", ""),
+            "extra": extra,
+        }
+        self.body = json.dumps(full, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+        words: Set[str] = set()
+        for text in (self.nombre, self.categoria, self.summary["empresa"], self.summary["slogan"], plantilla_id,
+                     *self.secciones, *(i for values in items.values() for i in values)):
+            words.update(tokenize(text))
+        self.keywords = frozenset(words)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return json.loads(self.body)
+
+
+class Scan:
+    """Resultado de leer el directorio: entradas nuevas/modificadas, ficheros rotos y nombres presentes."""
+
+    def __init__(self):
+        self.parsed: List[Plantilla] = []
+        self.errors: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self.seen: Set[str] = set()
+
+
+class PlantillasCatalog:
+    """
+    Plantillas por id más índices invertidos (categoría, sección, palabra clave).
+    Las lecturas sólo consultan diccionarios; `scan()` es el único que va a disco
+    y `apply()` el único que modifica los índices.
+    """
+
+    def __init__(self, directory: str = PLANTILLAS_DIR):
+        self.directory = Path(directory)
+        self.entries: Dict[str, Plantilla] = {}
+        self.errors: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self.by_category: Dict[str, Set[str]] = {}
+        self.by_section: Dict[str, Set[str]] = {}
+        self.by_keyword: Dict[str, Set[str]] = {}
+        self.version = ""
+        self.parsed = 0
+        self._ids: List[str] = []
+        self._vocabulary: List[str] = []
+        self._queries: Dict[Tuple, List[str]] = {}
+        self._lock = threading.Lock()
+
+    # --- Carga ---
+
+    def _index(self, entry: Plantilla, add: bool) -> None:
+        keys = ((self.by_category, [normalize_text(entry.categoria)]),
+                (self.by_section, [normalize_text(s) for s in entry.secciones]),
+                (self.by_keyword, entry.keywords))
+        for index, values in keys:
+            for value in values:
+                if add:
+                    index.setdefault(value, set()).add(entry.id)
+                else:
+                    ids = index.get(value)
+                    if ids is not None:
+                        ids.discard(entry.id)
+                        if not ids:
+                            del index[value]
+
+    def scan(self) -> "Scan":
+        """
+        Lee de disco sólo lo nuevo o modificado, sin tocar los índices (puede correr
+        en un hilo mientras el event loop sigue sirviendo consultas).
+        """
+        result = Scan()
+        try:
+            files = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            files = []
+        for item in files:
+            if not item.name.endswith(".json") or not item.is_file():
+                continue
+            plantilla_id = item.name[:-5]
+            result.seen.add(plantilla_id)
+            stat = item.stat()
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            current = self.entries.get(plantilla_id)
+            if current is not None and current.stamp == stamp:
+                continue
+            if self.errors.get(plantilla_id, (None,))[0] == stamp:
+                continue  # sigue roto tal cual: no se vuelve a parsear ni a informar
+            try:
+                data = Path(item.path).read_bytes()
+                raw = json.loads(data)
+                if not isinstance(raw, dict):
+                    raise ValueError("el fichero no contiene un objeto JSON")
+                result.parsed.append(Plantilla(plantilla_id, raw, stamp, hashlib.sha1(data).hexdigest()[:16]))
+            except (OSError, ValueError) as e:
+                # Un fichero roto no tumba el catálogo: se informa y se conserva la versión anterior si la había.
+                result.errors[plantilla_id] = (stamp, str(e))
+        return result
+
+    def apply(self, scan: "Scan") -> Dict[str, List[str]]:
+        """Aplica un `scan` a los índices (rápido: sin E/S). Devuelve qué cambió."""
+        with self._lock:
+            changes: Dict[str, List[str]] = {"added": [], "updated": [], "removed": [], "errors": list(scan.errors)}
+            self.errors.update(scan.errors)
+            for entry in scan.parsed:
+                current = self.entries.get(entry.id)
+                self.parsed += 1
+                self.errors.pop(entry.id, None)
+                if current is not None:
+                    self._index(current, add=False)
+                self._index(entry, add=True)
+                self.entries[entry.id] = entry
+                changes["updated" if current is not None else "added"].append(entry.id)
+
+            for plantilla_id in [p for p in self.entries if p not in scan.seen]:
+                self._index(self.entries.pop(plantilla_id), add=False)
+                changes["removed"].append(plantilla_id)
+            for plantilla_id in [p for p in self.errors if p not in scan.seen]:
+                del self.errors[plantilla_id]
+
+            if changes["added"] or changes["updated"] or changes["removed"] or not self.version:
+                self._ids = sorted(self.entries)
+                self._vocabulary = sorted(self.by_keyword)
+                self._queries = {}
+                digest = hashlib.sha1("".join(f"{i}{self.entries[i].etag}" for i in self._ids).encode())
+                self.version = digest.hexdigest()[:16]
+            return changes
+
+    def refresh(self) -> Dict[str, List[str]]:
+        """Relee sólo los ficheros nuevos o modificados y quita los borrados. Devuelve qué cambió."""
+        return self.apply(self.scan())
+
+    # --- Consultas ---
+
+    def get(self, plantilla_id: str) -> Optional[Plantilla]:
+        return self.entries.get(plantilla_id)
+
+    def _filter(self, ids: Optional[Set[str]], categoria: Optional[str], seccion: Optional[str]) -> Optional[Set[str]]:
+        for index, value in ((self.by_category, categoria), (self.by_section, seccion)):
+            if value:
+                matches = index.get(normalize_text(value), set())
+                ids = matches if ids is None else ids & matches
+        return ids
+
+    def _prefix_matches(self, token: str) -> Set[str]:
+        """Ids cuyas palabras empiezan por `token` (búsqueda binaria sobre el vocabulario ordenado)."""
+        ids: Set[str] = set()
+        start = bisect.bisect_left(self._vocabulary, token)
+        for word in self._vocabulary[start:]:
+            if not word.startswith(token):
+                break
+            ids |= self.by_keyword[word]
+        return ids
+
+    def _page(self, key: Tuple, compute, offset: int, limit: int) -> Tuple[int, List[Plantilla]]:
+        ordered = self._queries.get(key)
+        if ordered is None:
+            ordered = compute()
+            if len(self._queries) >= QUERY_CACHE_SIZE:
+                self._queries.pop(next(iter(self._queries)))
+            self._queries[key] = ordered
+        return len(ordered), [self.entries[i] for i in ordered[offset:offset + limit]]
+
+    def list(self, categoria: Optional[str] = None, seccion: Optional[str] = None,
+             offset: int = 0, limit: int = 20) -> Tuple[int, List[Plantilla]]:
+        def compute() -> List[str]:
+            ids = self._filter(None, categoria, seccion)
+            return self._ids if ids is None else sorted(ids)
+
+        return self._page(("list", categoria, seccion), compute, offset, limit)
+
+    def search(self, query: str, categoria: Optional[str] = None, seccion: Optional[str] = None,
+               offset: int = 0, limit: int = 20) -> Tuple[int, List[Plantilla]]:
+        """Todas las palabras de `query` deben aparecer (como prefijo). Primero las que coinciden en el nombre."""
+        tokens = tokenize(query)
+        return self._page(("search", tuple(tokens), categoria, seccion),
+                          lambda: self._search(tokens, categoria, seccion), offset, limit)
+
+    def _search(self, tokens: List[str], categoria: Optional[str], seccion: Optional[str]) -> List[str]:
+        ids: Optional[Set[str]] = None
+        for token in tokens:
+            matches = self._prefix_matches(token)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                break
+        ids = self._filter(ids if tokens else None, categoria, seccion)
+        if ids is None:
+            ids = set(self._ids)
+
+        if not tokens:
+            return sorted(ids)
+        entries = self.entries
+        return sorted(ids, key=lambda i: (-sum(t in entries[i].name_key for t in tokens), i))
+
+    def categories(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for entry in self.entries.values():
+            counts[entry.categoria] = counts.get(entry.categoria, 0) + 1
+        return dict(sorted(counts.items()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": str(self.directory),
+            "plantillas": len(self.entries),
+            "version": self.version,
+            "categorias": len(self.by_category),
+            "secciones": len(self.by_section),
+            "palabras": len(self.by_keyword),
+            "parsed_total": self.parsed,
+            "errors": {k: v[1] for k, v in self.errors.items()},
+        }
+
+
+def summaries(entries: Iterable[Plantilla]) -> List[Dict[str, Any]]:
+    return [e.summary for e in entries]
+
+
+# Instancia compartida (se carga en el arranque del bridge).
+catalog = PlantillasCatalog()
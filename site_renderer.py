@@ -0,0 +1,249 @@
+# site_renderer.py - Motor de render de las landings de cian_mini_bridge
+#
+# La página se compila una vez por plantilla (id + etag del catálogo): el layout se
+# parte en literales y huecos `{{clave}}`, y los datos fijos de la plantilla (título,
+# nombre de la lista de ítems) se resuelven en ese momento. Por petición sólo se
+# rellenan los huecos de estilo y contenido, ya escapados.
+#
+# Las páginas renderizadas se guardan en una LRU direccionada por contenido: la clave
+# es el hash de (plantilla, estilo, contenido), así que entradas idénticas no se
+# vuelven a renderizar ni a comprimir. Cada entrada guarda el HTML y sus versiones
+# gzip (y brotli si el paquete `brotli` está instalado) para servirlas tal cual con
+# ETag en GET /api/v1/pages/{page_id}.
+
+import gzip
+import hashlib
+import html
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from gwa_studio_core.encoding import negotiate_encoding
+
+try:
+    import brotli  # opcional: sin él se sirve gzip
+except ImportError:
+    brotli = None
+
+PAGE_CACHE_SIZE = int(os.environ.get("GWA_PAGE_CACHE_SIZE", "512"))
+GZIP_LEVEL = int(os.environ.get("GWA_PAGE_GZIP_LEVEL", "9"))
+BROTLI_QUALITY = int(os.environ.get("GWA_PAGE_BROTLI_QUALITY", "11"))
+
+# Estilo que se usa cuando la petición y la plantilla no lo dan (o no es válido).
+DEFAULT_STYLE = {
+    "c_bg": "#0f172a",
+    "c_accent": "#00d2ff",
+    "c_text": "#f8fafc",
+    "c_slogan": "inherit",
+    "f_main": "Montserrat",
+    "s_h": "3",
+    "s_s": "1.5",
+}
+
+_COLOR_RE = re.compile(r"^(#[0-9a-fA-F]{3,8}|[a-zA-Z]{3,20}|(rgb|rgba|hsl|hsla)\([0-9.,%\s]{5,40}\))$")
+_FONT_RE = re.compile(r"^[\w \-]{1,40}$")
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+LAYOUT = """
+<!DOCTYPE html>
+<html lang="es">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{titulo}}</title>
+    <style>
+        :root { --accent: {{c_accent}}; --bg: {{c_bg}}; --text: {{c_text}}; }
+        body { background: var(--bg); color: var(--text); font-family: '{{f_main}}', sans-serif; margin: 0; padding: 20px; }
+        .hero { text-align: center; padding: 60px 20px; border: 2px solid var(--accent); border-radius: 30px; }
+        h1 { font-size: {{s_h}}rem; color: var(--accent); margin: 0; }
+        .slogan { font-size: {{s_s}}rem; color: {{c_slogan}}; font-weight: bold; }
+        .grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(280px, 1fr)); gap: 20px; margin-top: 30px; }
+        .card { background: rgba(255,255,255,0.05); padding: 20px; border-radius: 15px; border-left: 5px solid var(--accent); }
+    </style>
+</head>
+<body>
+    <div class="hero">
+        <h1>{{empresa}}</h1>
+        <p class="slogan">{{slogan}}</p>
+    </div>
+    <div class="grid">
+        <div class="card"><h3>🎯 Misión</h3><p>{{mision}}</p></div>
+        <div class="card"><h3>🛠️ {{items_label}}</h3><ul>{{servicios}}</ul></div>
+    </div>
+</body>
+</html>
+"""
+
+
+class PageTemplate:
+    """Layout precompilado: literales intercalados con claves. `render` sólo concatena."""
+
+    __slots__ = ("key", "literals", "keys")
+
+    def __init__(self, key: str, literals: List[str], keys: List[str]):
+        self.key = key
+        self.literals = literals
+        self.keys = keys
+
+    @classmethod
+    def compile(cls, key: str, source: str) -> "PageTemplate":
+        # Sin sangría ni líneas vacías: el HTML que viaja es más corto y no cambia el resultado.
+        source = "\n".join(line.strip() for line in source.splitlines() if line.strip())
+        parts = _PLACEHOLDER_RE.split(source)
+        return cls(key, parts[0::2], parts[1::2])
+
+    def bind(self, key: str, values: Dict[str, str]) -> "PageTemplate":
+        """Nueva plantilla con algunas claves ya resueltas (los valores deben venir escapados)."""
+        literals, keys = [self.literals[0]], []
+        for name, literal in zip(self.keys, self.literals[1:]):
+            if name in values:
+                literals[-1] += values[name] + literal
+            else:
+                keys.append(name)
+                literals.append(literal)
+        return PageTemplate(key, literals, keys)
+
+    def render(self, values: Dict[str, str]) -> str:
+        out = [self.literals[0]]
+        for name, literal in zip(self.keys, self.literals[1:]):
+            out.append(values[name])
+            out.append(literal)
+        return "".join(out)
+
+
+class RenderedPage:
+    """HTML final y sus variantes comprimidas, calculadas una sola vez."""
+
+    __slots__ = ("page_id", "etag", "html", "bodies")
+
+    def __init__(self, page_id: str, text: str):
+        self.page_id = page_id
+        self.etag = f'"{page_id}"'
+        self.html = text
+        raw = text.encode("utf-8")
+        self.bodies: Dict[Optional[str], bytes] = {None: raw, "gzip": gzip.compress(raw, GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(raw, quality=BROTLI_QUALITY)
+
+    def body(self, accept_encoding: str) -> Tuple[Optional[str], bytes]:
+        encoding = negotiate_encoding(accept_encoding, self.bodies)
+        return encoding, self.bodies[encoding]
+
+
+def _text(value: Any) -> str:
+    return html.escape(str(value)) if value is not None else ""
+
+
+def _style(data: Dict[str, Any]) -> Dict[str, str]:
+    """Valores CSS de la petición; lo que no es un color/fuente/tamaño válido vuelve al valor por defecto."""
+    style = {}
+    for key, default in DEFAULT_STYLE.items():
+        value = str(data.get(key) or "").strip()
+        if key.startswith("c_"):
+            ok = bool(_COLOR_RE.match(value))
+        elif key == "f_main":
+            ok = bool(_FONT_RE.match(value))
+        else:
+            try:
+                ok = 0 < float(value) <= 20
+            except ValueError:
+                ok = False
+        style[key] = value if ok else default
+    return style
+
+
+class SiteRenderer:
+    def __init__(self, max_pages: int = PAGE_CACHE_SIZE):
+        self.max_pages = max_pages
+        self.layout = PageTemplate.compile("layout", LAYOUT)
+        self.default_template = self.layout.bind("default", {"titulo": "G.WA Agency", "items_label": "Servicios"})
+        self._templates: Dict[str, PageTemplate] = {}
+        self._pages: "OrderedDict[str, RenderedPage]" = OrderedDict()
+        # Entradas tal cual llegan -> page_id: un acierto no valida, serializa ni hashea nada.
+        self._memo: Dict[Tuple, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def template_for(self, entry) -> PageTemplate:
+        """Layout compilado para una plantilla del catálogo; se recompila sólo si cambia su etag."""
+        if entry is None:
+            return self.default_template
+        key = f"{entry.id}:{entry.etag.strip(chr(34))}"
+        template = self._templates.get(entry.id)
+        if template is None or template.key != key:
+            items = next(iter(entry.to_dict()["items"]), "servicios")
+            template = self.layout.bind(key, {"titulo": _text(entry.nombre),
+                                              "items_label": _text(items.replace("_", " ").capitalize())})
+            self._templates[entry.id] = template
+        return template
+
+    def render(self, entry, data: Dict[str, Any], content: Dict[str, Any]) -> RenderedPage:
+        """Página para (plantilla, estilo de `data`, contenido); sale de la caché si ya se generó."""
+        template = self.template_for(entry)
+        servicios = content.get("servicios") or []
+        if isinstance(servicios, str):
+            servicios = [servicios]
+        try:
+            memo_key = (template.key, *(data.get(k) for k in DEFAULT_STYLE), content.get("empresa"),
+                        content.get("slogan"), content.get("mision"), *servicios)
+            hash(memo_key)
+        except TypeError:  # valores no hashables (listas, dicts): se resuelve por el camino largo
+            memo_key = None
+
+        with self._lock:
+            page = self._pages.get(self._memo.get(memo_key, ""))
+            if page is not None:
+                self._pages.move_to_end(page.page_id)
+                self.hits += 1
+                return page
+
+        style = _style(data)
+        fields = {"empresa": content.get("empresa"), "slogan": content.get("slogan"),
+                  "mision": content.get("mision"), "servicios": [str(s) for s in servicios]}
+        canonical = json.dumps({"template": template.key, "style": style, "content": fields},
+                               sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        page_id = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+        with self._lock:
+            page = self._pages.get(page_id)
+            if page is not None:
+                self._pages.move_to_end(page_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if page is None:
+            values = {**style, "empresa": _text(fields["empresa"]), "slogan": _text(fields["slogan"]),
+                      "mision": _text(fields["mision"]),
+                      "servicios": "".join(f"<li>{_text(s)}</li>" for s in fields["servicios"])}
+            page = RenderedPage(page_id, template.render(values))
+
+        with self._lock:
+            self._pages[page_id] = page
+            self._pages.move_to_end(page_id)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+            if memo_key is not None:
+                if len(self._memo) >= 4 * self.max_pages:
+                    self._memo.clear()
+                self._memo[memo_key] = page_id
+        return page
+
+    def get(self, page_id: str) -> Optional[RenderedPage]:
+        with self._lock:
+            page = self._pages.get(page_id)
+            if page is not None:
+                self._pages.move_to_end(page_id)
+            return page
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"pages": len(self._pages), "max_pages": self.max_pages, "hits": self.hits,
+                    "misses": self.misses, "templates": len(self._templates),
+                    "encodings": ["br", "gzip"] if brotli is not None else ["gzip"]}
+
+
+renderer = SiteRenderer()
@@ -0,0 +1,121 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from benchmarks.fakes import build_fake_magenta
+from gwa_studio_core.core_api import admission, llm_proxy
+from gwa_studio_core.core_api.admission import AdmissionController
+from gwa_studio_core.core_api.main import app as cian_app
+
+PAYLOAD = {"template_name": "plan", "context": {}, "user_prompt": "hola"}
+
+
+def test_interactive_requests_jump_ahead_of_batch():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=10)
+        order = []
+
+        async def job(name, priority):
+            ticket = await controller.admit("ollama", priority=priority, client_id=name)
+            order.append(name)
+            await asyncio.sleep(0.01)
+            ticket.release()
+
+        holder = await controller.admit("ollama", client_id="holder")
+        tasks = [asyncio.ensure_future(job("batch-1", "batch")), asyncio.ensure_future(job("batch-2", "batch"))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(job("ui", "interactive")))
+        await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*tasks)
+        return order, controller.stats()
+
+    order, stats = asyncio.run(scenario())
+
+    assert order == ["ui", "batch-1", "batch-2"]
+    assert stats["backends"]["ollama"]["active"] == 0
+    assert stats["backends"]["ollama"]["admitted"] == 4
+
+
+def test_rejects_with_retry_after_when_queue_full_or_deadline_too_short():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=1)
+        controller.queue("gemini").service_time_s = 3.0
+        await controller.admit("gemini", client_id="a")
+        waiter = asyncio.ensure_future(controller.admit("gemini", client_id="b"))
+        await asyncio.sleep(0)
+
+        errors = []
+        for deadline in (None, 0.5):
+            try:
+                await controller.admit("gemini", client_id="c", deadline_s=deadline)
+            except HTTPException as e:
+                errors.append(e)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return errors, controller.stats()
+
+    errors, stats = asyncio.run(scenario())
+
+    assert [e.status_code for e in errors] == [503, 503]
+    assert errors[0].headers["Retry-After"] == "6"
+    assert stats["backends"]["gemini"]["rejected"]["queue_full"] == 2
+    assert stats["clients_in_flight"] == 1
+
+
+def test_deadline_check_rejects_before_queueing():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=5)
+        controller.queue("ollama").service_time_s = 10.0
+        await controller.admit("ollama", client_id="a")
+        with pytest.raises(HTTPException) as exc:
+            await controller.admit("ollama", client_id="b", deadline_s=2.0)
+        return exc.value, controller.stats()
+
+    error, stats = asyncio.run(scenario())
+
+    assert error.status_code == 503 and error.headers["Retry-After"] == "10"
+    assert stats["backends"]["ollama"]["rejected"]["deadline"] == 1
+    assert stats["backends"]["ollama"]["queued"] == 0
+
+
+async def _three_runs(headers):
+    await llm_proxy.open_magenta_client(transport=httpx.ASGITransport(app=build_fake_magenta(latency_s=0.2)))
+    try:
+        transport = httpx.ASGITransport(app=cian_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://cian") as client:
+            return await asyncio.gather(*(client.post("/api/v1/run", json=PAYLOAD, headers=h) for h in headers))
+    finally:
+        await llm_proxy.close_magenta_client()
+
+
+def test_per_client_cap_returns_429(monkeypatch):
+    controller = AdmissionController(max_concurrency=10, client_max_concurrency=1)
+    monkeypatch.setattr(llm_proxy, "admission", controller)
+    monkeypatch.setattr(admission, "FRONTEND_TOKEN", "secreto")
+    frontend = {"X-GWA-Frontend-Token": "secreto"}
+
+    responses = asyncio.run(_three_runs([{**frontend, "X-Client-Id": "streamlit-1"},
+                                         {**frontend, "X-Client-Id": "streamlit-1"},
+                                         {**frontend, "X-Client-Id": "streamlit-2"}]))
+
+    assert sorted(r.status_code for r in responses) == [200, 200, 429]
+    assert next(r for r in responses if r.status_code == 429).headers["Retry-After"]
+    assert controller.stats()["clients_in_flight"] == 0
+
+
+def test_client_id_header_is_ignored_without_the_frontend_token(monkeypatch):
+    controller = AdmissionController(max_concurrency=10, client_max_concurrency=1)
+    monkeypatch.setattr(llm_proxy, "admission", controller)
+    monkeypatch.setattr(admission, "FRONTEND_TOKEN", "secreto")
+
+    # Cambiar X-Client-Id en cada petición (sin token o con uno falso) no esquiva el cupo de la IP.
+    responses = asyncio.run(_three_runs([{"X-Client-Id": "a"},
+                                         {"X-Client-Id": "b", "X-GWA-Frontend-Token": "adivinado"},
+                                         {"X-Client-Id": "c"}]))
+
+    assert sorted(r.status_code for r in responses) == [200, 429, 429]
+    assert "'127.0.0.1'" in next(r for r in responses if r.status_code == 429).json()["detail"]
+    assert controller.stats()["clients_in_flight"] == 0
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import os
+import time
+
+import httpx
+from fastapi import HTTPException
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from gwa_studio_core.core_api import llm_proxy
+from gwa_studio_core.core_api.main import app as cian_app
+from gwa_studio_llms import llm_processor
+from gwa_studio_llms.llm_processor import AgentOutput
+from gwa_studio_llms.main_service import app as magenta_app
+
+
+def _fake_run_agent(latency: float, active: dict):
+    async def run_agent(request):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        try:
+            await asyncio.sleep(latency)
+            if request.context.get("plantilla") == "rota":
+                raise HTTPException(status_code=400, detail="Plantilla inválida")
+            return AgentOutput(status="ok", raw_text="{}", result_json={"plantilla": request.context["plantilla"]},
+                               model_used="gemini-2.5-flash", prompt_template=request.template_name)
+        finally:
+            active["now"] -= 1
+
+    return run_agent
+
+
+async def _run_batch_via_cian(items, concurrency):
+    await llm_proxy.open_magenta_client(transport=httpx.ASGITransport(app=magenta_app))
+    try:
+        transport = httpx.ASGITransport(app=cian_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://cian") as client:
+            response = await client.post("/api/v1/run_batch", json={"items": items, "concurrency": concurrency})
+    finally:
+        await llm_proxy.close_magenta_client()
+    return response
+
+
+def test_batch_runs_with_bounded_concurrency_and_per_item_status(monkeypatch):
+    active = {"now": 0, "max": 0}
+    monkeypatch.setattr(llm_processor.agent_service, "run_agent", _fake_run_agent(0.1, active))
+    names = [f"p{i}" for i in range(11)] + ["rota"]
+    items = [{"template_name": "plan", "context": {"plantilla": n}, "user_prompt": "hola"} for n in names]
+
+    start = time.perf_counter()
+    response = asyncio.run(_run_batch_via_cian(items, concurrency=4))
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+    results = {e["index"]: e for e in events if e["type"] == "item"}
+    assert len(results) == 12
+    assert results[11]["status"] == "error" and results[11]["status_code"] == 400
+    assert results[0]["output"]["result_json"] == {"plantilla": "p0"}
+    assert events[-1] == {"type": "done", "total": 12, "concurrency": 4, "counts": {"ok": 11, "error": 1}}
+    assert active["max"] == 4
+    assert elapsed < 12 * 0.1
+
+
+def test_batch_is_admitted_on_its_backend_and_mixed_or_oversized_batches_are_rejected(monkeypatch):
+    active = {"now": 0, "max": 0}
+    monkeypatch.setattr(llm_processor.agent_service, "run_agent", _fake_run_agent(0.01, active))
+    item = {"template_name": "plan", "context": {"plantilla": "p"}, "user_prompt": "hola"}
+
+    def admitted(backend):
+        queue = llm_proxy.admission.queues.get(backend)
+        return queue.admitted if queue is not None else 0
+
+    before = {backend: admitted(backend) for backend in ("gemini", "ollama")}
+    ollama = asyncio.run(_run_batch_via_cian([{**item, "model_name": "llama3:8b"}] * 2, concurrency=2))
+    assert ollama.status_code == 200
+    assert admitted("ollama") == before["ollama"] + 1 and admitted("gemini") == before["gemini"]
+
+    mixed = asyncio.run(_run_batch_via_cian([{**item, "model_name": "llama3:8b"},
+                                             {**item, "model_name": "gemini-2.5-flash"}], concurrency=2))
+    assert mixed.status_code == 400 and "gemini, ollama" in mixed.json()["detail"]
+
+    oversized = asyncio.run(_run_batch_via_cian([item] * (llm_proxy.BATCH_MAX_ITEMS + 1), concurrency=2))
+    assert oversized.status_code == 422
+    assert admitted("ollama") == before["ollama"] + 1 and admitted("gemini") == before["gemini"]
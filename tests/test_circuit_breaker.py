@@ -0,0 +1,88 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from benchmarks.fakes import FAKE_RESULT, FakeBackend
+from gwa_studio_llms.backends import BackendError, BackendUnavailableError
+from gwa_studio_llms.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from gwa_studio_llms.llm_router import LLMRouter
+
+MESSAGES = [{"role": "user", "content": "hola"}]
+
+
+def test_breaker_opens_half_opens_and_closes(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("gwa_studio_llms.circuit_breaker.time.monotonic", lambda: now[0])
+    breaker = CircuitBreaker(window=4, min_calls=4, failure_ratio=0.5, cooldown_s=10)
+
+    for ok in (True, False, True, False):
+        breaker.record(ok)
+    assert breaker.state == OPEN and not breaker.available()
+
+    now[0] += 10
+    assert breaker.available()
+    breaker.on_acquire()
+    assert breaker.state == HALF_OPEN and not breaker.available()
+    breaker.record(False)
+    assert breaker.state == OPEN
+
+    now[0] += 10
+    breaker.on_acquire()
+    breaker.record(True)
+    assert breaker.state == CLOSED and breaker.stats()["times_opened"] == 2
+
+
+def test_open_circuit_fails_fast_instead_of_waiting():
+    broken = FakeBackend(error=BackendError("modelo no cargado"))
+    router = LLMRouter({"ollama": [broken]}, health_interval=0,
+                       breaker_factory=lambda: CircuitBreaker(min_calls=2, cooldown_s=60))
+
+    for _ in range(2):
+        with pytest.raises(BackendError):
+            asyncio.run(router.generate("llama3:8b", MESSAGES))
+
+    with pytest.raises(BackendUnavailableError):
+        asyncio.run(router.generate("llama3:8b", MESSAGES))
+    assert broken.calls == 2
+    assert router.stats()["ollama"][0]["breaker"]["state"] == OPEN
+
+
+def test_slow_first_token_reroutes_to_healthy_node():
+    slow = FakeBackend(latency_s=0.2, name="slow")
+    fast = FakeBackend(name="fast")
+    router = LLMRouter({"ollama": [slow, fast]}, health_interval=0,
+                       breaker_factory=lambda: CircuitBreaker(min_calls=1, cooldown_s=60, slow_s=0.1))
+
+    async def scenario():
+        await asyncio.gather(*(router.generate("llama3:8b", MESSAGES) for _ in range(2)))
+        for _ in range(5):
+            await router.generate("llama3:8b", MESSAGES)
+
+    asyncio.run(scenario())
+
+    assert slow.calls == 1 and fast.calls == 6
+
+
+def test_hedged_request_keeps_first_answer_and_cancels_loser(monkeypatch):
+    monkeypatch.setattr("gwa_studio_llms.llm_router.HEDGE_DEFAULT_DELAY_S", 0.05)
+    stalled = FakeBackend(latency_s=5.0, name="stalled")
+    backup = FakeBackend(latency_s=0.01, name="backup")
+    router = LLMRouter({"ollama": [stalled, backup]}, health_interval=0, hedge=True)
+    router._rr = iter([0, 0])  # el primer intento va al nodo atascado
+
+    async def scenario():
+        start = time.perf_counter()
+        usage = {}
+        text = await router.generate("llama3:8b", MESSAGES, usage=usage)
+        return text, usage, time.perf_counter() - start
+
+    text, usage, elapsed = asyncio.run(scenario())
+
+    assert json.loads(text) == FAKE_RESULT
+    assert usage["backend"] == "backup"
+    assert elapsed < 1.0
+    assert stalled.cancelled == 1
+    assert router.stats()["hedging"] == {"enabled": True, "launched": 1, "won": 1}
+    assert all(e["outstanding"] == 0 for e in router.stats()["ollama"])
@@ -0,0 +1,87 @@
+import asyncio
+
+from benchmarks.fakes import FakeBackend
+from gwa_studio_llms.context_budget import ContextBudgeter, TokenEstimator, compact_value
+from gwa_studio_llms.llm_processor import AgentExecutionRequest, AgentService
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.prompt_manager import PromptManager
+from gwa_studio_llms.response_cache import ResponseCache
+from gwa_studio_llms.template_registry import PromptParts, TemplateRegistry
+
+
+def test_picks_smallest_context_and_keeps_a_recent_larger_one():
+    budgeter = ContextBudgeter(sizes=(2048, 4096, 8192), num_predict=512, safety=1.0, shrink_after=3,
+                               estimator=TokenEstimator(chars_per_token=4))
+
+    assert budgeter.plan("m", 4000).options() == {"num_ctx": 2048, "num_predict": 512}
+    assert budgeter.plan("m", 10_000).num_ctx == 4096
+    # Los prompts cortos que siguen no bajan a 2048 enseguida: Ollama recargaría el modelo.
+    assert [budgeter.plan("m", 4000).num_ctx for _ in range(4)] == [4096, 4096, 4096, 2048]
+    assert budgeter.current_ctx("m") == 2048
+    budgeter.plan("m", 10_000)
+    budgeter.sticky_s = 0  # tras un rato sin peticiones se vuelve a elegir el mínimo
+    assert budgeter.plan("m", 4000).num_ctx == 2048
+
+    # Ni en 8192 cabe prompt + 512: se acorta la respuesta antes que truncar el prompt.
+    big = budgeter.plan("m", 31_000)
+    assert (big.num_ctx, big.num_predict, big.overflow) == (8192, 442, False)
+    assert budgeter.plan("m", 40_000).overflow
+
+    # Calibración con lo que informa el backend; una evaluación con caché no cuenta.
+    budgeter.observe("m", 3000, {"prompt_tokens": 1000})
+    assert budgeter.estimator.ratio("m") == 3.0
+    budgeter.observe("m", 3000, {"prompt_tokens": 10, "prefix_hit": True})
+    assert budgeter.estimator.ratio("m") == 3.0
+
+
+def test_fit_trims_low_priority_fields_deterministically():
+    budgeter = ContextBudgeter(sizes=(640,), num_predict=100, safety=1.0, priority=("empresa",),
+                               field_max_chars=120, estimator=TokenEstimator(chars_per_token=1))
+    context = {"empresa": "GWA " * 30, "notas": "nota larga " * 40, "historial": ["x" * 50] * 20,
+               "extra": "sin usar " * 100, "pedido": "plan " * 20}
+
+    def render(ctx):
+        return PromptParts("Instrucciones.", f"{ctx['empresa']}|{ctx['notas']}|{ctx['historial']}|{ctx['pedido']}")
+
+    parts, budget = budgeter.fit("m", render, context, protected=("pedido",))
+    again, budget_again = budgeter.fit("m", render, context, protected=("pedido",))
+
+    assert parts.suffix == again.suffix and budget.report() == budget_again.report()
+    assert len(parts.prefix) + len(parts.suffix) + 100 <= 640
+    # Primero los campos no listados (el mayor antes); "extra" no aparece en el prompt y no se toca.
+    assert budget.compacted == ["historial", "notas"] and budget.dropped == []
+    assert ("plan " * 20) in parts.suffix and context["notas"] == "nota larga " * 40
+
+    tight = ContextBudgeter(sizes=(512,), num_predict=100, safety=1.0, priority=("empresa",), field_max_chars=120,
+                            estimator=TokenEstimator(chars_per_token=1))
+    _, trimmed = tight.fit("m", render, context, protected=("pedido",))
+    # Compactar no basta: se descarta el de menor prioridad y el resto queda compactado.
+    assert (trimmed.compacted, trimmed.dropped) == (["notas"], ["historial"])
+    assert compact_value("uno dos tres", 7) == "uno dos …"
+
+
+def test_agent_service_sends_budgeted_options_only_to_ollama():
+    ollama, gemini = FakeBackend(name="ollama"), FakeBackend(name="gemini")
+    router = LLMRouter({"ollama": [ollama], "gemini": [gemini]}, health_interval=0)
+    agent = AgentService(PromptManager(registry=TemplateRegistry(poll_interval=0)), cache=ResponseCache(db_path=""),
+                         router=router, budgeter=ContextBudgeter(sizes=(2048, 4096), num_predict=1024))
+    context = {"ubicacion": "Córdoba", "sector": "salud", "nombre_empresa": "X"}
+
+    def run(model, ctx):
+        request = AgentExecutionRequest(model_name=model, template_name="template_empresa_melanoma",
+                                        context=ctx, user_prompt="plan", cache_mode="bypass")
+        return asyncio.run(agent.run_agent(request))
+
+    output = run("llama3:8b", context)
+    assert ollama.last_options == {"num_ctx": 2048, "num_predict": 1024}
+    assert output.context_budget["num_ctx"] == 2048 and output.context_budget["dropped"] == []
+
+    output = run("llama3:8b", {**context, "ubicacion": "Córdoba, " * 600})
+    assert ollama.last_options["num_ctx"] == 4096 and output.context_budget["compacted"] == []
+
+    output = run("llama3:8b", {**context, "ubicacion": "Córdoba, " * 2000})
+    assert output.context_budget["compacted"] == ["ubicacion"]
+    assert "Córdoba, " * 2000 not in ollama.last_messages[-1]["content"]
+
+    output = run("gemini-2.5-flash", context)
+    assert gemini.last_options is None and output.context_budget is None
@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import history_store
+from history_store import HistoryStore
+
+APP = str(Path(__file__).resolve().parents[1] / "app_frontend.py")
+PLAN = {"title": "Plan", "summary": "Resumen", "action_steps": ["Lanzar"]}
+
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "history.db")
+    monkeypatch.setattr(history_store, "HISTORY_DB", db_path)
+    st.cache_resource.clear()
+    yield db_path
+    st.cache_resource.clear()
+
+
+def _app(uid: str) -> AppTest:
+    at = AppTest.from_file(APP, default_timeout=30)
+    at.query_params["uid"] = uid
+    return at.run()
+
+
+def test_history_is_bounded_per_user_paginated_and_persistent(tmp_path):
+    db_path = str(tmp_path / "history.db")
+    store = HistoryStore(db_path, max_items=5)
+    for i in range(8):
+        store.add("ana", f"consulta {i}", {**PLAN, "title": f"Plan {i}"})
+    store.add("luis", "otra", {"error": "parse"}, ok=False)
+
+    assert store.count("ana") == 5
+    assert [item["query"] for item in store.page("ana", 0, size=2)] == ["consulta 7", "consulta 6"]
+    assert [item["query"] for item in store.page("ana", 2, size=2)] == ["consulta 3"]
+    assert store.pages("ana", size=2) == 3
+    store.close()
+
+    reopened = HistoryStore(db_path, max_items=5)
+    assert reopened.page("ana", 0, size=1)[0]["response"]["title"] == "Plan 7"
+    assert reopened.page("luis")[0]["ok"] is False
+    reopened.clear("ana")
+    assert reopened.count("ana") == 0 and reopened.pages("ana") == 1
+
+
+def test_rerun_renders_only_the_visible_page(history_db):
+    store = HistoryStore(history_db)
+    for i in range(3 * history_store.HISTORY_PAGE_SIZE + 1):
+        store.add("ana", f"consulta {i}", PLAN)
+
+    at = _app("ana")
+    assert not at.exception
+    assert len(at.expander) == history_store.HISTORY_PAGE_SIZE
+    assert at.expander[0].label.startswith(f"**Solicitud:** consulta {3 * history_store.HISTORY_PAGE_SIZE}")
+
+    at.button(key="history_older").click().run()
+    at.button(key="history_older").click().run()
+    at.button(key="history_older").click().run()
+    assert len(at.expander) == 1 and at.expander[0].label.startswith("**Solicitud:** consulta 0")
+    assert at.button(key="history_older").disabled
+
+
+def test_history_follows_the_user_id_across_sessions(history_db):
+    first = _app("ana")
+    assert first.query_params["uid"] == "ana"
+    assert first.info[0].value == "Aún no se ha generado ningún plan estratégico."
+
+    HistoryStore(history_db).add("ana", "plan de marketing", PLAN)
+    # Una sesión nueva (otra pestaña, recarga) con el mismo ?uid ve el mismo historial.
+    again = _app("ana")
+    assert len(again.expander) == 1 and again.expander[0].label.startswith("**Solicitud:** plan de marketing")
+    assert len(_app("luis").expander) == 0
+
+    fresh = AppTest.from_file(APP, default_timeout=30).run()
+    assert len(fresh.query_params["uid"]) == 12
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from benchmarks.fakes import FAKE_RESULT, ServerThread, build_fake_magenta
+from gwa_studio_core.core_api import jobs, llm_proxy
+from gwa_studio_core.core_api.main import app as cian_app
+
+PAYLOAD = {"model_name": "llama-jobs", "template_name": "plan", "context": {}, "user_prompt": "hola"}
+
+
+@pytest.fixture
+def job_env(tmp_path, monkeypatch):
+    store = jobs.JobStore(str(tmp_path / "jobs.db"))
+    received = []
+    hook = FastAPI()
+
+    @hook.post("/hook")
+    async def callback(request: Request):
+        received.append(await request.json())
+        return {"ok": True}
+
+    def make_runner(**kwargs):
+        runner = jobs.JobRunner(store, poll_s=0.02, callback_transport=httpx.ASGITransport(app=hook), **kwargs)
+        monkeypatch.setattr(jobs, "job_runner", runner)
+        return runner
+
+    monkeypatch.setattr(jobs, "job_store", store)
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", ("hook",))
+    yield store, make_runner, received
+    store.close()
+
+
+async def _with_magenta(scenario, transport=None):
+    await llm_proxy.open_magenta_client(transport=transport)
+    try:
+        return await scenario()
+    finally:
+        await llm_proxy.close_magenta_client()
+
+
+def test_submit_poll_result_dedupe_and_callback(job_env):
+    store, make_runner, received = job_env
+    runner = make_runner(workers=2)
+
+    async def scenario():
+        runner.start()
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=cian_app), base_url="http://cian") as client:
+                body = {**PAYLOAD, "callback_url": "http://hook/hook"}
+                first = await client.post("/api/v1/jobs", json=body, headers={"X-Client-Id": "ana"})
+                again = await client.post("/api/v1/jobs", json=body, headers={"X-Client-Id": "ana"})
+                for _ in range(200):
+                    result = await client.get(f"/api/v1/jobs/{first.json()['job_id']}/result")
+                    if result.status_code != 202:
+                        break
+                    await asyncio.sleep(0.02)
+                status = (await client.get(first.headers["location"])).json()
+                for _ in range(100):
+                    if received:
+                        break
+                    await asyncio.sleep(0.02)
+                return first, again, result, status
+        finally:
+            await runner.aclose()
+
+    first, again, result, status = asyncio.run(_with_magenta(scenario, httpx.ASGITransport(app=build_fake_magenta(latency_s=0.05))))
+
+    assert first.status_code == 202 and again.status_code == 200
+    assert again.json()["job_id"] == first.json()["job_id"]
+    assert result.status_code == 200
+    assert result.json()["result_json"] == FAKE_RESULT
+    assert status["status"] == "done" and status["attempts"] == 1
+    assert status["progress"]["tokens"] >= 5
+    assert received[0]["job_id"] == first.json()["job_id"] and received[0]["result"]["result_json"] == FAKE_RESULT
+    assert store.get(first.json()["job_id"])["callback_status"] == "ok"
+
+
+def test_orphaned_job_is_resumed_after_restart_until_max_attempts(job_env):
+    store, make_runner, _ = job_env
+    # Un gateway anterior los tomó y murió sin renovar el lease: uno tres veces, otro una.
+    doomed, _ = store.submit({**PAYLOAD, "user_prompt": "otro"}, "ana")
+    for attempt in range(3):
+        assert store.claim(f"muerto-{attempt}", lease_s=-1)["id"] == doomed["id"]
+    resumed, _ = store.submit(PAYLOAD, "ana", priority="interactive")
+    assert store.claim("muerto", lease_s=-1)["id"] == resumed["id"]
+
+    runner = make_runner(workers=1, max_attempts=3)
+
+    async def scenario():
+        runner.start()
+        try:
+            for _ in range(200):
+                if all(store.get(j["id"])["status"] in jobs.TERMINAL for j in (resumed, doomed)):
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            await runner.aclose()
+
+    asyncio.run(_with_magenta(scenario, httpx.ASGITransport(app=build_fake_magenta(latency_s=0.05))))
+
+    done, failed = store.get(resumed["id"]), store.get(doomed["id"])
+    assert done["status"] == "done" and done["attempts"] == 2
+    assert json.loads(done["result"])["result_json"] == FAKE_RESULT
+    assert failed["status"] == "error" and "3 intentos" in failed["error"]
+    assert store.counts() == {"done": 1, "error": 1}
+
+
+def test_events_reconnect_replays_generated_text_then_follows(job_env, monkeypatch):
+    store, make_runner, _ = job_env
+    runner = make_runner(workers=1)
+
+    async def scenario():
+        job, _ = store.submit(PAYLOAD, "ana")
+        runner.start()
+        try:
+            first = []
+            events = jobs._job_events(job["id"])
+            async for line in events:
+                first.append(json.loads(line))
+                if sum(e["type"] == "token" for e in first) == 2:
+                    break
+            await events.aclose()  # El navegador se cae a mitad de la generación.
+            await asyncio.sleep(0.1)
+            second = [json.loads(line) async for line in jobs._job_events(job["id"])]
+            return first, second
+        finally:
+            await runner.aclose()
+
+    # Servidor real: por ASGITransport el stream de MAGENTA llegaría de golpe.
+    with ServerThread(build_fake_magenta(latency_s=0.5, tokens=10)) as magenta:
+        monkeypatch.setattr(llm_proxy, "MAGENTA_BASE_URL", magenta.base_url)
+        first, second = asyncio.run(_with_magenta(scenario))
+
+    first_text = "".join(e["text"] for e in first if e["type"] == "token")
+    second_text = "".join(e["text"] for e in second if e["type"] == "token")
+    replayed = next(e for e in second if e["type"] == "token")
+    assert len(replayed["text"]) > len(first_text)
+    assert second_text == json.dumps(FAKE_RESULT)
+    assert second[-1]["type"] == "result" and second[-1]["output"]["result_json"] == FAKE_RESULT
+
+
+def test_callback_url_must_be_an_allowed_public_host(job_env, monkeypatch):
+    store, make_runner, received = job_env
+    runner = make_runner(workers=1)
+
+    async def fake_getaddrinfo(self, host, port, *args, **kwargs):
+        return [(2, 1, 6, "", ("10.0.0.7" if host == "interno.example" else "93.184.216.34", port))]
+
+    monkeypatch.setattr(asyncio.BaseEventLoop, "getaddrinfo", fake_getaddrinfo)
+
+    async def submit(url):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=cian_app), base_url="http://cian") as client:
+            return await client.post("/api/v1/jobs", json={**PAYLOAD, "callback_url": url})
+
+    # Con lista de hosts sólo vale lo listado.
+    assert asyncio.run(submit("http://otro/hook")).status_code == 400
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", ())
+    for url in ("http://127.0.0.1:8001/api/v1/agent/run", "http://localhost/", "http://[::ffff:10.0.0.1]/",
+                "http://169.254.169.254/latest/meta-data/", "http://192.168.1.10/hook"):
+        response = asyncio.run(submit(url))
+        assert response.status_code == 400, url
+
+    # Un nombre que resuelve a una red privada se bloquea al avisar, sin reintentos.
+    job, _ = store.submit(PAYLOAD, "ana", callback_url="http://interno.example/hook")
+    asyncio.run(runner._callback(store.get(job["id"])))
+    assert store.get(job["id"])["callback_status"] == "blocked" and not received
+    assert asyncio.run(jobs._resolves_to_public("https://publico.example/hook"))
+
+
+def test_job_workers_do_not_block_the_event_loop_on_the_shared_lock(job_env):
+    store, make_runner, _ = job_env
+    job, _ = store.submit(PAYLOAD, "ana")
+    other_gateway = sqlite3.connect(store.db_path, isolation_level=None)
+    runner = make_runner(workers=2)
+
+    async def scenario():
+        other_gateway.execute("BEGIN IMMEDIATE")  # otro proceso de CIAN con el lock de escritura
+        runner.start()
+        try:
+            gaps, last = [], time.perf_counter()
+            for _ in range(20):
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+            # Se lee por la conexión que tiene el lock: la del store espera a un worker.
+            pending = other_gateway.execute("SELECT status FROM jobs WHERE id = ?", (job["id"],)).fetchone()[0] == "queued"
+            other_gateway.execute("COMMIT")
+            for _ in range(200):
+                if (await asyncio.to_thread(store.get, job["id"]))["status"] in jobs.TERMINAL:
+                    break
+                await asyncio.sleep(0.02)
+            return pending, max(gaps)
+        finally:
+            await runner.aclose()
+
+    pending, worst_gap = asyncio.run(_with_magenta(scenario, httpx.ASGITransport(app=build_fake_magenta(latency_s=0.01))))
+
+    assert pending and worst_gap < 0.1
+    assert store.get(job["id"])["status"] == "done"
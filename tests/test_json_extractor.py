@@ -0,0 +1,62 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from benchmarks.fakes import FakeBackend
+from gwa_studio_llms.agent_executor import LLMAgentExecutor
+from gwa_studio_llms.json_extractor import IncrementalJSONExtractor, JSONExtractionError, extract_json
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.response_cache import ResponseCache
+from gwa_studio_llms.template_registry import PromptParts
+
+PLAN = {"title": "Plan {beta}", "steps": ["a \"citado\"", "b\\\\", {"nested": "}"}]}
+
+
+@pytest.mark.parametrize("text", [
+    json.dumps(PLAN),
+    f"```json\n{json.dumps(PLAN)}\n```",
+    f"Claro, aquí va {{sin json}}:\n{json.dumps(PLAN)}\nEspero que {{te}} sirva }}",
+])
+def test_extracts_first_object_from_noisy_output(text):
+    assert extract_json(text) == PLAN
+
+
+def test_same_result_for_any_chunking():
+    text = "Respuesta: " + json.dumps(PLAN) + " y más texto {\"otro\": 1}"
+    rng = random.Random(7)
+    for _ in range(200):
+        extractor = IncrementalJSONExtractor()
+        pos = 0
+        while pos < len(text) and not extractor.done:
+            size = rng.randint(1, 6)
+            extractor.feed(text[pos:pos + size])
+            pos += size
+        assert extractor.finish() == PLAN
+        assert text[:extractor.end_position].endswith(json.dumps(PLAN))
+
+
+@pytest.mark.parametrize("text, position", [
+    ('hola {"a": 1,, "b": 2}', 13),
+    ('hola {"a": {"b": 1}', 19),
+    ("sin objeto", 10),
+])
+def test_reports_failure_position(text, position):
+    with pytest.raises(JSONExtractionError) as exc:
+        extract_json(text)
+    assert exc.value.position == position
+
+
+def test_executor_stops_generation_when_object_closes(monkeypatch):
+    monkeypatch.setattr(LLMAgentExecutor, "_load_and_render_template", lambda self, *a: PromptParts("", "prompt"))
+    backend = FakeBackend(['{"title":', ' "Plan"}', " Nota:", " texto", " extra"] * 10)
+    router = LLMRouter({"ollama": [backend]}, health_interval=0)
+    executor = LLMAgentExecutor(cache=ResponseCache(db_path=""), router=router)
+
+    output = asyncio.run(executor.run_llm_agent("llama3:8b", "plan", {}, "hola"))
+
+    assert output["status"] == "ok"
+    assert output["result_json"] == {"title": "Plan"}
+    assert output["raw_text"] == '{"title": "Plan"}'
+    assert backend.sent == 2
@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+from benchmarks.fakes import build_fake_magenta
+from gwa_studio_core.core_api import admission, llm_proxy
+from gwa_studio_core.core_api.main import app as cian_app
+
+PAYLOAD = {"template_name": "GWA_STRATEGIC_PLAN", "context": {}, "user_prompt": "hola"}
+FRONTEND_TOKEN = "secreto-del-frontend"
+
+
+async def _post_via_cian(magenta_transport: httpx.AsyncBaseTransport, count: int = 1):
+    await llm_proxy.open_magenta_client(transport=magenta_transport)
+    try:
+        transport = httpx.ASGITransport(app=cian_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://cian") as client:
+            # Un cliente distinto por petición: el cupo por cliente del control de admisión no aplica.
+            return await asyncio.gather(*(
+                client.post("/api/v1/run", json=PAYLOAD,
+                            headers={"X-Client-Id": f"user-{i}", "X-GWA-Frontend-Token": FRONTEND_TOKEN})
+                for i in range(count)
+            ))
+    finally:
+        await llm_proxy.close_magenta_client()
+
+
+def test_proxy_forwards_to_magenta_concurrently(monkeypatch):
+    """Las llamadas lentas se solapan: no se serializan detrás del threadpool."""
+    monkeypatch.setattr(admission, "FRONTEND_TOKEN", FRONTEND_TOKEN)
+    transport = httpx.ASGITransport(app=build_fake_magenta(latency_s=0.2))
+
+    start = time.perf_counter()
+    responses = asyncio.run(_post_via_cian(transport, count=100))
+    elapsed = time.perf_counter() - start
+
+    assert all(r.status_code == 200 for r in responses)
+    assert responses[0].json()["model_used"] == "gemini-2.5-flash"
+    assert elapsed < 2.0
+
+
+def test_proxy_relays_magenta_errors():
+    magenta = FastAPI()
+
+    @magenta.post("/agent/run")
+    def failing_run():
+        raise HTTPException(status_code=400, detail="Plantilla inválida")
+
+    (response,) = asyncio.run(_post_via_cian(httpx.ASGITransport(app=magenta)))
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Plantilla inválida"
+
+
+def test_proxy_returns_503_when_magenta_is_down():
+    def refuse(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("connection refused", request=request)
+
+    (response,) = asyncio.run(_post_via_cian(httpx.MockTransport(refuse)))
+
+    assert response.status_code == 503
@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+from benchmarks.fakes import FAKE_RESULT, FakeBackend, build_fake_ollama
+from gwa_studio_llms.backends import BackendError, BackendUnavailableError, OllamaBackend
+from gwa_studio_llms.llm_router import LLMRouter
+
+MESSAGES = [{"role": "user", "content": "hola"}]
+
+
+def _ollama_pool(apps):
+    return [OllamaBackend(f"http://ollama-{i}", transport=httpx.ASGITransport(app=app)) for i, app in enumerate(apps)]
+
+
+def test_dispatches_on_model_name():
+    gemini, ollama = FakeBackend(name="gemini"), FakeBackend(name="ollama")
+    router = LLMRouter({"gemini": [gemini], "ollama": [ollama]}, health_interval=0)
+
+    asyncio.run(router.generate("gemini-2.5-flash", MESSAGES))
+    asyncio.run(router.generate("llama3:8b", MESSAGES))
+
+    assert (gemini.calls, ollama.calls) == (1, 1)
+
+
+def test_balances_concurrent_requests_across_ollama_hosts():
+    apps = [build_fake_ollama(latency_s=0.05) for _ in range(3)]
+    router = LLMRouter({"ollama": _ollama_pool(apps)}, health_interval=0)
+
+    async def scenario():
+        usage = {}
+        texts = await asyncio.gather(*(router.generate("llama3:8b", MESSAGES, usage=usage) for _ in range(30)))
+        await router.aclose()
+        return texts, usage
+
+    texts, usage = asyncio.run(scenario())
+
+    assert all(json.loads(t) == FAKE_RESULT for t in texts)
+    assert [app.state.requests for app in apps] == [10, 10, 10]
+    assert usage["prompt_tokens"] == 42
+    assert all(e["outstanding"] == 0 for e in router.stats()["ollama"])
+
+
+def test_fails_over_when_a_host_is_unreachable():
+    dead = OllamaBackend("http://127.0.0.1:1")
+    alive = FakeBackend(name="alive")
+    router = LLMRouter({"ollama": [dead, alive]}, health_interval=0, unhealthy_threshold=1)
+
+    async def scenario():
+        texts = [await router.generate("llama3:8b", MESSAGES) for _ in range(3)]
+        await router.aclose()
+        return texts
+
+    texts = asyncio.run(scenario())
+
+    assert all(json.loads(t) == FAKE_RESULT for t in texts)
+    assert alive.calls == 3
+    assert [e["healthy"] for e in router.stats()["ollama"]] == [False, True]
+
+
+def test_health_checks_eject_and_readmit_nodes():
+    apps = [build_fake_ollama(latency_s=0) for _ in range(2)]
+    router = LLMRouter({"ollama": _ollama_pool(apps)}, health_interval=0, unhealthy_threshold=2)
+
+    async def scenario():
+        apps[0].state.healthy = False
+        await router.check_health()
+        await router.check_health()
+        ejected = [e["healthy"] for e in router.stats()["ollama"]]
+        for _ in range(4):
+            await router.generate("llama3:8b", MESSAGES)
+        served_while_ejected = [app.state.requests for app in apps]
+
+        apps[0].state.healthy = True
+        await router.check_health()
+        readmitted = [e["healthy"] for e in router.stats()["ollama"]]
+        await router.aclose()
+        return ejected, served_while_ejected, readmitted
+
+    ejected, served, readmitted = asyncio.run(scenario())
+
+    assert ejected == [False, True]
+    assert served == [0, 4]
+    assert readmitted == [True, True]
+
+
+def test_raises_when_no_healthy_node_remains():
+    router = LLMRouter({"ollama": [FakeBackend(error=BackendUnavailableError("caído"))]},
+                       health_interval=0, unhealthy_threshold=1)
+
+    with pytest.raises(BackendUnavailableError):
+        asyncio.run(router.generate("llama3:8b", MESSAGES))
+    with pytest.raises(BackendUnavailableError, match="nodos sanos"):
+        asyncio.run(router.generate("llama3:8b", MESSAGES))
+    assert not router.is_available("llama3:8b")
+
+
+def test_malformed_ndjson_from_ollama_fails_over_and_counts_for_the_breaker():
+    garbled = FastAPI()
+
+    @garbled.post("/api/chat")
+    async def chat():
+        # Conexión cortada a mitad de una línea NDJSON.
+        return PlainTextResponse('{"message": {"content": "{\\"ti', media_type="application/x-ndjson")
+
+    alive = FakeBackend(name="alive")
+    router = LLMRouter({"ollama": _ollama_pool([garbled]) + [alive]}, health_interval=0)
+
+    async def scenario():
+        text = await router.generate("llama3:8b", MESSAGES)
+        await router.aclose()
+        return text
+
+    assert json.loads(asyncio.run(scenario())) == FAKE_RESULT
+    broken = router.stats()["ollama"][0]
+    assert broken["errors"] == 1 and broken["outstanding"] == 0
+    assert alive.calls == 1
+
+
+    async def direct():
+        async for _ in _ollama_pool([garbled])[0].stream("llama3:8b", MESSAGES):
+            pass
+
+    with pytest.raises(BackendError, match="NDJSON inválida"):
+        asyncio.run(direct())
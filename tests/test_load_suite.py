@@ -0,0 +1,40 @@
+import asyncio
+import os
+
+import httpx
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from benchmarks.fakes import LatencyProfile, build_fake_ollama
+from benchmarks.load_suite import compare, percentile
+from gwa_studio_llms.backends import OllamaBackend
+
+MESSAGES = [{"role": "user", "content": "hola"}]
+
+
+def test_lognormal_profile_matches_requested_percentiles():
+    profile = LatencyProfile("lognormal", p50_s=0.2, p99_s=1.0, seed=7)
+    samples = [profile.first_token_s() for _ in range(20000)]
+
+    assert abs(percentile(samples, 0.50) - 0.2) < 0.02
+    assert abs(percentile(samples, 0.99) - 1.0) < 0.15
+
+
+def test_fake_ollama_emits_malformed_output_at_configured_rate():
+    profile = LatencyProfile("fixed", p50_s=0.0, tokens_per_s=0, malformed_rate=1.0)
+    backend = OllamaBackend("http://ollama", transport=httpx.ASGITransport(app=build_fake_ollama(profile=profile)))
+
+    text = asyncio.run(backend.generate("llama3:8b", MESSAGES))
+
+    assert text.startswith("Claro, aquí tienes el plan:")
+
+
+def test_compare_flags_latency_and_throughput_regressions():
+    baseline = {"levels": [{"rate_rps": 10.0, "requests": 500, "p50_ms": 100, "p95_ms": 200, "p99_ms": 300,
+                            "throughput_rps": 10.0, "error_rate": 0.0}]}
+    same = {"levels": [dict(baseline["levels"][0], p95_ms=220)]}
+    worse = {"levels": [dict(baseline["levels"][0], p99_ms=500, throughput_rps=6.0)]}
+
+    assert compare(same, baseline, tolerance=0.3) == []
+    problems = compare(worse, baseline, tolerance=0.3)
+    assert any("p99_ms" in p for p in problems) and any("throughput_rps" in p for p in problems)
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import httpx
+from fastapi.testclient import TestClient
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from benchmarks.fakes import FakeBackend, build_fake_magenta
+from gwa_studio_core.core_api import llm_proxy
+from gwa_studio_core.core_api.main import app as cian_app
+from gwa_studio_core.metrics import LabelSet, MetricsRegistry
+from gwa_studio_llms.llm_processor import AgentExecutionRequest, AgentService
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.main_service import app as magenta_app
+from gwa_studio_llms.response_cache import ResponseCache
+
+PAYLOAD = {"template_name": "plan", "context": {}, "user_prompt": "hola"}
+
+
+def _value(text: str, line_prefix: str) -> float:
+    return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(line_prefix))
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry(enabled=True)
+    latency = registry.histogram("demo_seconds", "demo", ("stage",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, stage="render")
+
+    text = registry.render()
+
+    assert '# TYPE demo_seconds histogram' in text
+    assert 'demo_seconds_bucket{stage="render",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="render",le="1"} 2' in text
+    assert 'demo_seconds_bucket{stage="render",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{stage="render"} 3' in text
+
+
+def test_render_while_new_series_are_added_from_another_thread():
+    # /metrics se sirve desde el threadpool mientras el event loop crea series nuevas.
+    registry = MetricsRegistry(enabled=True)
+    calls = registry.counter("demo_total", "demo", ("status",))
+    active = registry.gauge("demo_active", "demo", ("model",))
+    latency = registry.histogram("demo_seconds", "demo", ("stage",))
+    errors, done = [], threading.Event()
+
+    def scrape():
+        while not done.is_set():
+            try:
+                registry.render()
+            except RuntimeError as e:
+                errors.append(e)
+
+    scraper = threading.Thread(target=scrape)
+    previous = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    scraper.start()
+    try:
+        for i in range(5000):
+            calls.inc(status=f"s{i}")
+            active.set(1, model=f"m{i}")
+            latency.observe(0.1, stage=f"t{i}")
+    finally:
+        done.set()
+        scraper.join()
+        sys.setswitchinterval(previous)
+
+    assert errors == []
+    assert 'demo_seconds_count{stage="t4999"} 1' in registry.render()
+
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry(enabled=False)
+    calls = registry.counter("demo_total", "demo", ("status",))
+    calls.inc(status="ok")
+    assert "demo_total{" not in registry.render()
+
+
+def test_run_agent_records_stages_tokens_and_parse_failures():
+    router = LLMRouter({"ollama": [FakeBackend(['{"title": ', '"Plan"}'])]}, health_interval=0)
+    service = AgentService(SimpleNamespace(render_prompt=lambda name, ctx: "prompt"),
+                           cache=ResponseCache(db_path=""), router=router)
+    ok = AgentExecutionRequest(model_name="llama-metrics", template_name="plan", context={}, user_prompt="a")
+    broken = ok.model_copy(update={"template_name": "roto"})
+
+    asyncio.run(service.run_agent(ok))
+    service.router = LLMRouter({"ollama": [FakeBackend(["sin json"])]}, health_interval=0)
+    asyncio.run(service.run_agent(broken))
+
+    text = TestClient(magenta_app).get("/metrics").text
+    for stage in ("render", "first_token", "generation", "parse", "total"):
+        assert _value(text, f'gwa_magenta_stage_seconds_count{{stage="{stage}",model="llama-metrics",template="plan"}}') == 1
+    assert _value(text, 'gwa_magenta_requests_total{model="llama-metrics",template="plan",status="ok"}') == 1
+    assert _value(text, 'gwa_magenta_requests_total{model="llama-metrics",template="roto",status="parse_fail"}') == 1
+    assert _value(text, 'gwa_magenta_tokens_total{model="llama-metrics",kind="completion"}') == 3
+    assert _value(text, 'gwa_magenta_in_flight{model="llama-metrics"}') == 0
+
+
+def test_cian_metrics_cover_queue_wait_upstream_and_codes():
+    async def scenario():
+        await llm_proxy.open_magenta_client(transport=httpx.ASGITransport(app=build_fake_magenta(latency_s=0.01)))
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=cian_app), base_url="http://cian") as client:
+                await client.post("/api/v1/run", json={"model_name": "llama-cian", **PAYLOAD})
+                return (await client.get("/metrics")).text
+        finally:
+            await llm_proxy.close_magenta_client()
+
+    text = asyncio.run(scenario())
+
+    for stage in ("queue_wait", "upstream", "total"):
+        assert _value(text, f'gwa_cian_stage_seconds_count{{route="run",stage="{stage}",model="llama-cian",template="plan"}}') == 1
+    assert _value(text, 'gwa_cian_requests_total{route="run",model="llama-cian",code="200"}') == 1
+    assert _value(text, 'gwa_cian_in_flight{route="run"}') == 0
+    assert 'gwa_cian_admission_active{backend="ollama"} 0' in text
+
+
+def test_client_chosen_model_and_template_labels_are_bounded():
+    labels = LabelSet(known={"plan"}.__contains__, max_learned=1)
+    labels.learn("llama3:8b")
+    labels.learn("inventado")
+    assert [labels(v) for v in ("plan", "llama3:8b", "inventado", "x")] == ["plan", "llama3:8b", "other", "other"]
+
+    async def scenario():
+        await llm_proxy.open_magenta_client(transport=httpx.ASGITransport(app=magenta_app))
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=cian_app), base_url="http://cian") as client:
+                codes = [(await client.post("/api/v1/run", json={**PAYLOAD, "model_name": f"spam-{i}",
+                                                                  "template_name": f"spam-{i}"})).status_code
+                         for i in range(3)]
+                return codes, (await client.get("/metrics")).text
+        finally:
+            await llm_proxy.close_magenta_client()
+
+    codes, cian_text = asyncio.run(scenario())
+    magenta_text = TestClient(magenta_app).get("/metrics").text
+
+    assert all(code >= 400 for code in codes)
+    assert "spam-" not in cian_text and "spam-" not in magenta_text
+    assert _value(cian_text, f'gwa_cian_requests_total{{route="run",model="other",code="{codes[0]}"}}') >= 3
+    assert _value(cian_text, 'gwa_cian_stage_seconds_count{route="run",stage="total",model="other",template="other"}') >= 3
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.fakes import build_fake_ollama
+from gwa_studio_llms.backends import OllamaBackend
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.model_manager import ModelManager
+
+MESSAGES = [{"role": "user", "content": "hola"}]
+
+
+def _router(apps, **keep_alive):
+    backends = [OllamaBackend(f"http://ollama-{i}", transport=httpx.ASGITransport(app=app),
+                              keep_alive=keep_alive.get("policies", {}), default_keep_alive="10m")
+                for i, app in enumerate(apps)]
+    return LLMRouter({"ollama": backends}, health_interval=0)
+
+
+async def _timed(router, model):
+    started = time.perf_counter()
+    await router.generate(model, MESSAGES)
+    return time.perf_counter() - started
+
+
+def test_preload_removes_cold_start_from_requests():
+    cold_app, warm_app = build_fake_ollama(latency_s=0.01, load_s=0.3), build_fake_ollama(latency_s=0.01, load_s=0.3)
+
+    async def scenario():
+        cold = await _timed(_router([cold_app]), "llama3:8b")
+        router = _router([warm_app], policies={"llama3:8b": "-1"})
+        manager = ModelManager(router, preload=["llama3:8b"], interval_s=10)
+        assert not manager.ready()
+        await manager.warm()
+        warm = await _timed(router, "llama3:8b")
+        return cold, warm, manager
+
+    cold, warm, manager = asyncio.run(scenario())
+
+    assert cold >= 0.3 and warm < 0.2
+    assert manager.ready() and manager.loads == 1
+    assert warm_app.state.loads == 1
+    assert warm_app.state.keep_alives == [-1.0, -1.0]  # la carga y el chat llevan la política del modelo
+
+
+def test_router_prefers_nodes_with_the_model_resident():
+    apps = [build_fake_ollama(latency_s=0.01) for _ in range(2)]
+    router = _router(apps)
+    cold, warm = router.pools["ollama"]
+    cold.resident, warm.resident = set(), {"llama3:8b"}
+
+    async def scenario():
+        await asyncio.gather(*(router.generate("llama3:8b", MESSAGES) for _ in range(6)))
+
+    asyncio.run(scenario())
+
+    assert [app.state.requests for app in apps] == [0, 6]
+
+
+def test_recent_demand_is_warmed_on_every_node_and_renewed_before_expiry():
+    apps = [build_fake_ollama(latency_s=0.01, load_s=0.05) for _ in range(2)]
+    router = _router(apps, policies={"phi3:mini": "30s"})
+    manager = ModelManager(router, preload=[], interval_s=5, window_s=60)
+
+    async def scenario():
+        await manager.warm()
+        assert manager.loads == 0
+        await router.generate("phi3:mini", MESSAGES)  # sólo un nodo lo carga al servir
+        await manager.warm()
+        loads_after_demand = manager.loads
+        manager.renew_margin_s = 40
+        await manager.warm()  # caduca en 30s < margen de 40s: se renueva en ambos nodos
+        return loads_after_demand
+
+    loads_after_demand = asyncio.run(scenario())
+
+    assert loads_after_demand == 1  # el otro nodo
+    assert manager.loads == 3
+    assert all("phi3:mini" in e.resident for e in router.pools["ollama"])
+    assert [app.state.loads for app in apps] == [1, 1]
+    router.last_requested["phi3:mini"] -= 120
+    assert manager.wanted() == set()
@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import pytest
+from pydantic import BaseModel
+
+from benchmarks.fakes import FakeBackend
+from gwa_studio_llms.agent_executor import LLMAgentExecutor
+from gwa_studio_llms.llm_processor import AgentExecutionRequest, AgentService
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.output_schema import SchemaError, compile_schema
+from gwa_studio_llms.prompt_manager import PromptManager
+from gwa_studio_llms.response_cache import ResponseCache
+from gwa_studio_llms.template_registry import TemplateRegistry
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "action_steps": {"type": "array", "minItems": 1, "items": {"type": "string"}},
+        "budget": {"type": "integer", "minimum": 0},
+    },
+    "required": ["title", "action_steps", "budget"],
+    "additionalProperties": False,
+}
+
+
+class ScriptedBackend(FakeBackend):
+    """Una respuesta distinta por llamada; guarda el formato y los mensajes de cada una."""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.formats = []
+        self.conversations = []
+
+    async def stream(self, model, messages, options=None, response_format=None, usage=None):
+        self.formats.append(response_format)
+        self.conversations.append(messages)
+        self.chunks = [self.responses[min(self.calls, len(self.responses) - 1)]]
+        async for chunk in super().stream(model, messages, options, response_format, usage):
+            yield chunk
+
+
+def test_compiled_validator_reports_paths_and_resolves_refs(tmp_path):
+    class Step(BaseModel):
+        name: str
+        weeks: int
+
+    class Plan(BaseModel):
+        title: str
+        steps: list[Step]
+
+    validator = compile_schema(Plan.model_json_schema())
+    assert "$defs" not in json.dumps(validator.schema)
+    assert validator.validate({"title": "Plan", "steps": [{"name": "a", "weeks": 2}]}) == []
+    errors = validator.validate({"title": 3, "steps": [{"name": "a", "weeks": True}, {}]})
+    assert [str(e) for e in errors] == ["/title: se esperaba string", "/steps/0/weeks: se esperaba integer",
+                                        "/steps/1/name: falta la clave obligatoria",
+                                        "/steps/1/weeks: falta la clave obligatoria"]
+    assert validator.repair_fields(errors) == ["title", "steps"]
+    with pytest.raises(SchemaError):
+        compile_schema({"type": "object", "patternProperties": {}})
+
+    (tmp_path / "plan.json").write_text(json.dumps({"prompt": "Plan $x", "output_schema": SCHEMA}), encoding="utf-8")
+    (tmp_path / "plan.jinja").write_text("{{ user_prompt }}", encoding="utf-8")
+    (tmp_path / "plan.schema.json").write_text(json.dumps({"type": "object", "required": ["plan_title"]}),
+                                               encoding="utf-8")
+    (tmp_path / "rota.json").write_text(json.dumps({"prompt": "x", "output_schema": {"type": "tabla"}}),
+                                        encoding="utf-8")
+    registry = TemplateRegistry(base_dir=tmp_path, poll_interval=0)
+    assert registry.output_validator("json", "plan").schema == SCHEMA
+    assert registry.output_validator("jinja", "plan").schema["required"] == ["plan_title"]
+    assert registry.json_names() == ["plan", "rota"]
+    with pytest.raises(SchemaError):
+        registry.get("json", "rota")
+
+
+def test_invalid_fields_are_repaired_without_regenerating_the_plan(tmp_path):
+    (tmp_path / "plan.json").write_text(json.dumps({"system": "Eres un estratega.", "prompt": "Plan para $empresa",
+                                                    "output_schema": SCHEMA}), encoding="utf-8")
+    backend = ScriptedBackend([
+        json.dumps({"title": "Plan", "action_steps": [], "budget": "mucho", "extra": 1}),
+        json.dumps({"action_steps": ["Lanzar"], "budget": 5000}),
+    ])
+    agent = AgentService(PromptManager(registry=TemplateRegistry(base_dir=tmp_path, poll_interval=0)),
+                         cache=ResponseCache(db_path=""), router=LLMRouter({"ollama": [backend]}, health_interval=0))
+    request = AgentExecutionRequest(model_name="llama3:8b", template_name="plan", context={"empresa": "X"},
+                                    user_prompt="plan")
+
+    output = asyncio.run(agent.run_agent(request))
+
+    assert output.status == "ok"
+    assert output.result_json == {"title": "Plan", "action_steps": ["Lanzar"], "budget": 5000}
+    assert backend.formats[0] == SCHEMA
+    assert backend.formats[1]["required"] == ["action_steps", "budget"]
+    repair = backend.conversations[1]
+    assert repair[:2] == backend.conversations[0] and repair[2]["role"] == "assistant"
+    assert "/budget: se esperaba integer" in repair[3]["content"]
+    assert output.validation["first_pass"] == "invalid"
+    assert output.validation["repairs"] == [{"fields": ["action_steps", "budget"], "tokens": 1, "ok": True}]
+    # La respuesta reparada se cachea: la siguiente petición igual no llama al backend.
+    assert asyncio.run(agent.run_agent(request)).result_json == output.result_json and backend.calls == 2
+
+
+def test_broken_output_gets_bounded_full_repairs_and_is_not_cached():
+    backend = ScriptedBackend(['{"plan_title": "Plan", "marketing_points": [', "sin json"])
+    executor = LLMAgentExecutor(cache=ResponseCache(db_path=""), router=LLMRouter({"ollama": [backend]},
+                                                                                  health_interval=0))
+
+    output = asyncio.run(executor.run_llm_agent("llama3:8b", "template_empresa_melanoma", {}, "hola"))
+
+    assert output["status"] == "parse_fail"
+    assert backend.calls == 3  # generación + GWA_REPAIR_ATTEMPTS reparaciones del objeto entero
+    assert all(f["required"] == ["plan_title", "model_notes", "marketing_points", "is_complete"]
+               for f in backend.formats)
+    assert [r["fields"] for r in output["validation"]["repairs"]] == [None, None]
+    assert executor.cache.get(executor._cache_key("llama3:8b", "template_empresa_melanoma", {}, "hola",
+                                                  executor._output_validator("template_empresa_melanoma"))) is None
+
+    backend.responses = ['{"plan_title": "Plan", "model_notes": "", "marketing_points": [], "is_complete": true}',
+                         '{"marketing_points": [{"title": "SEO", "description": "Blog", "tactics": ["Notas"]}]}']
+    backend.calls = 0
+    output = asyncio.run(executor.run_llm_agent("llama3:8b", "template_empresa_melanoma", {}, "hola"))
+    assert output["status"] == "ok" and output["result_json"]["marketing_points"][0]["title"] == "SEO"
+    assert output["validation"]["repairs"][0]["fields"] == ["marketing_points"]
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import cian_mini_bridge
+from benchmarks.fakes import FAKE_RESULT, build_fake_magenta
+from gwa_studio_core.core_api import llm_proxy, plans
+from gwa_studio_core.core_api.main import app as cian_app
+
+PAYLOAD = {"model_name": "llama3:8b", "template_name": "plan", "context": {"empresa": "Café"},
+           "user_prompt": "plan de lanzamiento"}
+JINJA_PLAN = {"plan_title": "Campaña de verano", "model_notes": "Público joven",
+              "marketing_points": [{"title": "SEO", "description": "Blog de recetas", "tactics": ["Guías"]}],
+              "is_complete": True}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = plans.PlanStore(str(tmp_path / "plans.db"))
+    monkeypatch.setattr(plans, "plan_store", store)
+    yield store
+    store.close()
+
+
+def test_store_indexes_plans_dedupes_and_filters(store):
+    first = store.add("agent", "plan", "llama3:8b", {"title": "Lanzamiento de Cafetería", "summary": "Apertura",
+                                                     "action_steps": ["Promoción en redes"]}, "cafeterías")
+    assert store.add("agent", "plan", "llama3:8b", {"title": "Lanzamiento de Cafetería", "summary": "Apertura",
+                                                    "action_steps": ["Promoción en redes"]}) is None
+    jinja = store.add("agent", "template_empresa_melanoma", "gemini-2.5-flash", JINJA_PLAN)
+    assert store.count() == 2
+
+    # Sin tildes, por prefijo y en cualquier campo (pasos anidados incluidos).
+    assert [p["plan_id"] for p in store.search("cafeteria")[0]] == [first]
+    assert [p["plan_id"] for p in store.search("promoc")[0]] == [first]
+    hits, more = store.search("recetas")
+    assert [p["title"] for p in hits] == ["Campaña de verano"] and not more
+    assert store.search("guías", template="plan")[0] == []
+    assert store.search("verano", model="gemini-2.5-flash", since=time.time() - 60)[0][0]["plan_id"] == jinja
+    assert store.search("verano", until=time.time() - 60)[0] == []
+    assert store.search("verano", since=time.time() + 1)[0] == [] and store.list(since=time.time() + 1) == ([], None)
+    assert store.get(jinja)["result"] == JINJA_PLAN
+
+    for i in range(5):
+        store.add("agent", "plan", "llama3:8b", {"title": f"Plan {i}", "summary": "Cafetería"})
+    page, cursor = store.list(template="plan", limit=4)
+    assert [p["title"] for p in page] == ["Plan 4", "Plan 3", "Plan 2", "Plan 1"]
+    rest, end = store.list(template="plan", before=cursor, limit=4)
+    assert [p["plan_id"] for p in rest][-1] == first and end is None
+    # El título pesa más que el resumen; 'recent' ordena por id.
+    assert store.search("cafeteria", limit=2)[0][0]["plan_id"] == first
+    recent, more = store.search("cafeteria", sort="recent", limit=2)
+    assert [p["title"] for p in recent] == ["Plan 4", "Plan 3"] and more
+    assert plans.match_query('"OR" (NEAR') == '"OR" "NEAR"*'
+    with pytest.raises(ValueError):
+        plans.match_query("¿?")
+
+
+def test_gateway_records_completed_generations_and_serves_search(store):
+    def scenario():
+        async def run():
+            await llm_proxy.open_magenta_client(transport=httpx.ASGITransport(app=build_fake_magenta(0.05, 4)))
+            try:
+                async with httpx.AsyncClient(transport=httpx.ASGITransport(app=cian_app),
+                                             base_url="http://cian") as client:
+                    assert (await client.post("/api/v1/run", json=PAYLOAD)).status_code == 200
+                    async with client.stream("POST", "/api/v1/run_stream",
+                                             json={**PAYLOAD, "model_name": "gemini-2.5-flash"}) as response:
+                        lines = [line async for line in response.aiter_lines() if line]
+                    assert json.loads(lines[-1])["type"] == "result"
+                    return (await client.get("/api/v1/plans/search", params={"q": FAKE_RESULT["title"][:6]}),
+                            await client.get("/api/v1/plans", params={"model": "gemini-2.5-flash"}),
+                            await client.get("/api/v1/plans/search", params={"q": "¿?"}),
+                            await client.get("/api/v1/plans/999"))
+            finally:
+                await llm_proxy.close_magenta_client()
+        return asyncio.run(run())
+
+    search, listed, bad, missing = scenario()
+
+    assert search.status_code == 200
+    hits = search.json()["items"]
+    assert sorted(p["model"] for p in hits) == ["gemini-2.5-flash", "llama3:8b"]
+    assert {p["user_prompt"] for p in hits} == {"plan de lanzamiento"} and search.json()["next_offset"] is None
+    assert [p["model"] for p in listed.json()["items"]] == ["gemini-2.5-flash"]
+    plan = store.get(hits[0]["plan_id"])
+    assert plan["result"] == FAKE_RESULT and plan["context"] == {"empresa": "Café"}
+    assert (bad.status_code, missing.status_code) == (400, 404)
+
+
+def test_batch_items_and_landings_are_recorded(store):
+    recorder = plans.StreamRecorder([PAYLOAD, {**PAYLOAD, "user_prompt": "otro"}])
+    ok = {"status": "ok", "result_json": JINJA_PLAN, "model_used": "llama3:8b", "prompt_template": "jinja"}
+    stream = "".join(json.dumps(e) + "\n" for e in (
+        {"type": "item", "index": 1, "status": "ok", "output": ok},
+        {"type": "item", "index": 0, "status": "parse_fail", "output": {**ok, "status": "parse_fail"}},
+        {"type": "done", "items": 2},
+    )).encode("utf-8")
+    for i in range(0, len(stream), 7):  # líneas partidas entre fragmentos
+        recorder.feed(stream[i:i + 7])
+    asyncio.run(recorder.flush())
+    assert [(p["template"], p["user_prompt"]) for p in store.list()[0]] == [("jinja", "otro")]
+
+    with TestClient(cian_mini_bridge.app) as client:
+        result = client.post("/api/v1/run", json={"template_type": "academia_idiomas", "modo_ejecucion": "B",
+                                                  "canales_lista": ["Instagram"]}).json()["result_json"]
+        client.post("/api/v1/run", json={"template_type": "academia_idiomas", "modo_ejecucion": "B",
+                                         "canales_lista": ["Instagram"]})
+        found = client.get("/api/v1/plans/search", params={"q": "instagram", "source": "landing"}).json()["items"]
+
+    assert len(found) == 1 and found[0]["template"] == "academia_idiomas"
+    landing = store.get(found[0]["plan_id"])["result"]
+    assert landing["page_id"] == result["page_id"] and "visual_html" not in landing
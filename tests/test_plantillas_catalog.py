@@ -0,0 +1,78 @@
+import json
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+import cian_mini_bridge
+from plantillas_catalog import PLANTILLAS_DIR, PlantillasCatalog
+
+
+def _write(directory, name, data):
+    path = directory / f"{name}.json"
+    path.write_text(data if isinstance(data, str) else json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def test_catalog_normalizes_every_schema_and_skips_broken_files():
+    catalog = PlantillasCatalog(PLANTILLAS_DIR)
+    catalog.refresh()
+
+    assert len(catalog.entries) == 78
+    assert "membresias_cursos" in catalog.errors  # fichero vacío
+    pizzeria = catalog.get("pizzeria").to_dict()  # esquema corto: nombre/empresa/slogan
+    assert (pizzeria["empresa"], pizzeria["categoria"]) == ("Napoli", "Sin categoría")
+    tech = catalog.get("tech_moderna").to_dict()  # servicios como objetos {titulo, descripcion}
+    assert tech["estilo"] == {"color_fondo": "#000000", "color_acento": "#00ffea", "fuente": "Roboto"}
+    assert tech["items"]["servicios"][0] == "Desarrollo Web"
+
+
+def test_indexes_filter_search_and_paginate():
+    catalog = PlantillasCatalog(PLANTILLAS_DIR)
+    catalog.refresh()
+
+    total, page = catalog.list(categoria="educacion", limit=2)
+    assert total >= 3 and len(page) == 2 and all(p.categoria == "Educación" for p in page)
+    total, found = catalog.search("ingles toefl")
+    assert [p.id for p in found] == ["academia_idiomas"]
+    _, found = catalog.search("veterin")  # prefijo
+    assert {"veterinaria", "landing_veterinaria"} <= {p.id for p in found}
+    total, _ = catalog.search("", seccion="Hero")
+    assert total > 50
+
+
+def test_refresh_reparses_only_changed_files(tmp_path):
+    for i in range(5):
+        _write(tmp_path, f"p{i}", {"nombre": f"Plantilla {i}", "categoria": "Demo", "secciones": ["Hero"]})
+    catalog = PlantillasCatalog(str(tmp_path))
+    catalog.refresh()
+    version = catalog.version
+    assert catalog.parsed == 5
+
+    assert catalog.refresh() == {"added": [], "updated": [], "removed": [], "errors": []}
+    path = _write(tmp_path, "p1", {"nombre": "Panadería Nueva", "categoria": "Gastronomía"})
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+    (tmp_path / "p2.json").unlink()
+    changes = catalog.refresh()
+
+    assert changes["updated"] == ["p1"] and changes["removed"] == ["p2"]
+    assert catalog.parsed == 6
+    assert catalog.version != version
+    assert [p.id for p in catalog.search("panaderia")[1]] == ["p1"]
+    assert catalog.list(categoria="Demo")[0] == 3
+
+
+def test_endpoints_serve_etags_and_304():
+    with TestClient(cian_mini_bridge.app) as client:
+        response = client.get("/api/v1/plantillas", params={"limit": 5})
+        assert response.status_code == 200
+        assert response.json()["total"] == 78 and len(response.json()["items"]) == 5
+        etag = response.headers["etag"]
+        assert client.get("/api/v1/plantillas", params={"limit": 5}, headers={"If-None-Match": etag}).status_code == 304
+
+        item = client.get("/api/v1/plantillas/academia_idiomas")
+        assert item.json()["nombre"] == "Academia de Idiomas"
+        assert client.get("/api/v1/plantillas/academia_idiomas",
+                          headers={"If-None-Match": item.headers["etag"]}).status_code == 304
+        assert client.get("/api/v1/plantillas/no_existe").status_code == 404
+        assert client.get("/api/v1/plantillas/search", params={"q": "cerveza"}).json()["items"][0]["id"] == "bar_cerveceria"
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+
+from benchmarks.fakes import FakeBackend
+from gwa_studio_llms.llm_processor import AgentExecutionRequest, AgentService
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.prompt_manager import PromptManager
+from gwa_studio_llms.response_cache import ResponseCache
+from gwa_studio_llms.template_registry import PREFIX_MARKER, TemplateRegistry
+
+MESSAGES = [{"role": "user", "content": "hola"}]
+
+
+def _registry(tmp_path, files):
+    for name, content in files.items():
+        (tmp_path / name).write_text(content, encoding="utf-8")
+    registry = TemplateRegistry(base_dir=tmp_path, poll_interval=0)
+    registry.refresh()
+    return registry
+
+
+def test_templates_split_into_byte_stable_prefix_and_dynamic_suffix(tmp_path):
+    registry = _registry(tmp_path, {
+        "explicito.json": json.dumps({"system": "Eres un estratega.", "prompt": "Plan para $empresa"}),
+        "auto.json": json.dumps({"prompt": "Instrucciones fijas.\n\nMás reglas.\n\nPlan para $empresa"}),
+        "plan.jinja": f"Responde en JSON.\n{PREFIX_MARKER}\nEmpresa: {{{{ context.empresa }}}}",
+        "roto.jinja": f"Hola {{{{ user_prompt }}}}\n{PREFIX_MARKER}\nresto",
+    })
+    manager = PromptManager(registry=registry)
+
+    a, b = manager.render_parts("explicito", {"empresa": "A"}), manager.render_parts("explicito", {"empresa": "B"})
+    assert (a.prefix, a.suffix) == ("Eres un estratega.", "Plan para A")
+    assert a.prefix_key == b.prefix_key and a.messages()[0] == {"role": "system", "content": "Eres un estratega."}
+    assert manager.render_prompt("explicito", {"empresa": "A"}) == "Eres un estratega.\n\nPlan para A"
+
+    auto = manager.render_parts("auto", {"empresa": "A"})
+    assert (auto.prefix, auto.suffix) == ("Instrucciones fijas.\n\nMás reglas.", "Plan para A")
+    assert manager.render_prompt("auto", {"empresa": "A"}) == "Instrucciones fijas.\n\nMás reglas.\n\nPlan para A"
+
+    jinja = registry.render_jinja_parts("plan", context={"empresa": "A"}, user_prompt="x")
+    assert (jinja.prefix, jinja.suffix) == ("Responde en JSON.", "Empresa: A")
+    with pytest.raises(ValueError):  # variables en el prefijo estático
+        registry.get("jinja", "roto")
+
+
+def test_router_sends_each_prefix_back_to_the_node_that_has_it():
+    nodes = [FakeBackend(name=f"n{i}") for i in range(2)]
+    router = LLMRouter({"ollama": nodes}, health_interval=0)
+
+    async def scenario():
+        usages = []
+        for i in range(10):
+            usage = {}
+            await router.generate("llama3:8b", MESSAGES, usage=usage, prefix_key="ab"[i % 2])
+            usages.append(usage)
+        return usages
+
+    usages = asyncio.run(scenario())
+
+    backends = {(u["backend"], key) for u, key in zip(usages, "ab" * 5)}
+    assert len(backends) == 2 and len({b for b, _ in backends}) == 2  # cada prefijo fijo en un nodo distinto
+    assert [u["prefix_hit"] for u in usages] == [False, False] + [True] * 8
+    assert router.stats()["prefix_affinity"] == {"requests": 10, "hits": 8, "hit_rate": 0.8}
+
+
+def test_agent_service_sends_the_template_prefix_as_a_stable_system_message():
+    backend = FakeBackend()
+    router = LLMRouter({"ollama": [backend]}, health_interval=0)
+    agent = AgentService(PromptManager(registry=TemplateRegistry(poll_interval=0)), cache=ResponseCache(db_path=""),
+                         router=router)
+    sent = []
+    for city in ("Córdoba", "Salta"):
+        request = AgentExecutionRequest(model_name="llama3:8b", template_name="template_empresa_melanoma",
+                                        context={"ubicacion": city, "sector": "salud", "nombre_empresa": "X"},
+                                        user_prompt="plan", cache_mode="bypass")
+        asyncio.run(agent.run_agent(request))
+        sent.append(backend.last_messages)
+
+    assert [m["role"] for m in sent[0]] == ["system", "user"]
+    assert sent[0][0] == sent[1][0]
+    assert "Córdoba" in sent[0][1]["content"] and "Salta" in sent[1][1]["content"]
+    assert router.stats()["prefix_affinity"]["hits"] == 1
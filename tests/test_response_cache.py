@@ -0,0 +1,139 @@
+import asyncio
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.fakes import FakeBackend
+from gwa_studio_llms import agent_executor
+from gwa_studio_llms.llm_processor import AgentExecutionRequest, AgentService
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.prompt_manager import PromptManager
+from gwa_studio_llms.response_cache import ResponseCache, make_cache_key
+from gwa_studio_llms.template_registry import TemplateRegistry
+
+
+def test_cache_key_is_canonical():
+    a = make_cache_key("m", "t", {"a": 1, "b": {"x": 1, "y": 2}}, "p")
+    b = make_cache_key("m", "t", {"b": {"y": 2, "x": 1}, "a": 1}, "p")
+    assert a == b
+    assert a != make_cache_key("m", "t", {"a": 1, "b": {"x": 1, "y": 2}}, "p", {"temperature": 0.2})
+
+
+def test_editing_a_template_changes_the_cache_key(tmp_path, monkeypatch):
+    registry = TemplateRegistry(base_dir=tmp_path, poll_interval=0)
+    (tmp_path / "plan.json").write_text('{"prompt": "Plan para $empresa"}', encoding="utf-8")
+    (tmp_path / "ficha.jinja").write_text('{% include "pie.jinja" %} {{ user_prompt }}', encoding="utf-8")
+    (tmp_path / "pie.jinja").write_text("Firma v1", encoding="utf-8")
+    agent = AgentService(PromptManager(registry=registry), cache=ResponseCache(db_path=""))
+    executor = agent_executor.LLMAgentExecutor(cache=ResponseCache(db_path=""))
+    monkeypatch.setattr(agent_executor, "template_registry", registry)
+    request = AgentExecutionRequest(model_name="llama3:8b", template_name="plan", context={"empresa": "Café"}, user_prompt="hola")
+
+    def keys():
+        return agent.request_key(request), executor._cache_key("llama3:8b", "ficha", {}, "hola")
+
+    before = keys()
+    assert keys() == before
+    (tmp_path / "plan.json").write_text('{"prompt": "Plan detallado para $empresa"}', encoding="utf-8")
+    (tmp_path / "pie.jinja").write_text("Firma v2 (plantilla incluida)", encoding="utf-8")
+    registry.refresh()
+    after = keys()
+    assert after[0] != before[0] and after[1] != before[1]
+
+    # El esquema .schema.json también forma parte de la firma; una plantilla inexistente no rompe la clave.
+    (tmp_path / "plan.schema.json").write_text('{"type": "object"}', encoding="utf-8")
+    registry.refresh()
+    assert agent.request_key(request) != after[0]
+    assert agent.request_key(request.model_copy(update={"template_name": "nada"}))
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = ResponseCache(max_entries=2, ttl_seconds=10, db_path="")
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    cache.get("a")
+    cache.set("c", {"v": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+
+    now = time.time()
+    monkeypatch.setattr("gwa_studio_llms.response_cache.time.time", lambda: now + 60)
+    assert cache.get("c") is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_persistent_tier_survives_restart(tmp_path):
+    db = str(tmp_path / "cache.sqlite")
+    ResponseCache(db_path=db).set("k", {"status": "ok"})
+
+    restarted = ResponseCache(db_path=db)
+
+    assert restarted.get("k") == {"status": "ok"}
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_persistent_tier_does_not_block_the_event_loop_on_the_shared_lock(tmp_path):
+    db = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(db_path=db)
+    other_worker = sqlite3.connect(db, isolation_level=None)
+
+    async def scenario():
+        other_worker.execute("BEGIN IMMEDIATE")  # otro worker de MAGENTA con el lock de escritura
+        write = asyncio.ensure_future(cache.aset("k", {"status": "ok"}))
+        gaps, last = [], time.perf_counter()
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+        pending = not write.done()
+        hit = await cache.aget("k")  # el LRU responde mientras el disco espera
+        other_worker.execute("COMMIT")
+        await write
+        return pending, max(gaps), hit
+
+    pending, worst_gap, hit = asyncio.run(scenario())
+
+    assert pending and worst_gap < 0.1
+    assert hit == {"status": "ok"}
+    assert asyncio.run(ResponseCache(db_path=db).aget("k")) == {"status": "ok"}
+
+
+@pytest.fixture
+def service():
+    backend = FakeBackend(['{"title": "Plan"}'])
+    prompts = SimpleNamespace(render_prompt=lambda name, ctx: f"{name}: {ctx}")
+    router = LLMRouter({"gemini": [backend]}, health_interval=0)
+    return AgentService(prompts, cache=ResponseCache(db_path=""), router=router), backend
+
+
+def _request(**overrides):
+    data = {"model_name": "gemini-2.5-flash", "template_name": "plan", "context": {"a": 1}, "user_prompt": "hola"}
+    data.update(overrides)
+    return AgentExecutionRequest(**data)
+
+
+def test_agent_service_serves_repeated_requests_from_cache(service):
+    agent, backend = service
+
+    first = asyncio.run(agent.run_agent(_request()))
+    second = asyncio.run(agent.run_agent(_request()))
+
+    assert backend.calls == 1
+    assert second == first
+    assert agent.cache.stats()["hits"] == 1
+
+
+def test_agent_service_bypass_and_refresh(service):
+    agent, backend = service
+    asyncio.run(agent.run_agent(_request()))
+
+    asyncio.run(agent.run_agent(_request(cache_mode="bypass")))
+    asyncio.run(agent.run_agent(_request(cache_mode="refresh")))
+    asyncio.run(agent.run_agent(_request()))
+
+    assert backend.calls == 3
+    assert agent.cache.stats()["writes"] == 2
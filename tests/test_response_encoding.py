@@ -0,0 +1,106 @@
+import asyncio
+import gzip
+import json
+import os
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import cian_mini_bridge
+from benchmarks.fakes import FakeBackend
+from gwa_studio_core import encoding
+from gwa_studio_core.core_api import llm_proxy, plans
+from gwa_studio_core.core_api.main import app as cian_app
+from gwa_studio_llms import llm_processor
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.main_service import app as magenta_app
+from gwa_studio_llms.response_cache import ResponseCache
+
+PLAN = {"title": "Plan de expansión", "summary": "Crecimiento en Córdoba " * 20,
+        "action_steps": [f"Paso {i}: campaña local con seguimiento semanal" for i in range(20)]}
+PAYLOAD = {"model_name": "gemini-2.5-flash", "template_name": "plan", "context": {}, "user_prompt": "hola"}
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Transporte hacia MAGENTA que guarda cada petición y las cabeceras/bytes de cada respuesta."""
+
+    def __init__(self, app):
+        self.inner = httpx.ASGITransport(app=app)
+        self.hops = []
+
+    async def handle_async_request(self, request):
+        response = await self.inner.handle_async_request(request)
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+        self.hops.append((request, response.headers, len(body)))
+        return httpx.Response(response.status_code, headers=response.headers, content=body)
+
+
+@pytest.fixture
+def magenta(tmp_path, monkeypatch):
+    service = llm_processor.agent_service
+    monkeypatch.setattr(service, "router", LLMRouter({"gemini": [FakeBackend([json.dumps(PLAN)])]}, health_interval=0))
+    monkeypatch.setattr(service, "prompt_manager", SimpleNamespace(render_prompt=lambda name, ctx: "prompt"))
+    monkeypatch.setattr(service, "cache", ResponseCache(db_path=""))
+    monkeypatch.setattr(plans, "plan_store", plans.PlanStore(str(tmp_path / "plans.db")))
+    return RecordingTransport(magenta_app)
+
+
+def test_encoded_response_serializes_compactly_and_negotiates_compression():
+    small = encoding.EncodedJSONResponse({"título": "ñ"}, accept_encoding="gzip")
+    assert small.body == '{"título":"ñ"}'.encode("utf-8") and "content-encoding" not in small.headers
+
+    big = encoding.EncodedJSONResponse(PLAN, accept_encoding="deflate, gzip;q=0.5")
+    assert big.headers["content-encoding"] == "gzip" and big.headers["vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(big.body)) == PLAN and len(big.body) < len(encoding.dumps(PLAN)) / 3
+    assert "content-encoding" not in encoding.EncodedJSONResponse(PLAN, accept_encoding="gzip;q=0").headers
+
+    assert encoding.parse_fields(" result_json,status,result_json ", ["status", "result_json"]) == ("result_json",
+                                                                                                   "status")
+    assert encoding.parse_fields("", ["status"]) is None
+    with pytest.raises(ValueError, match="raw"):
+        encoding.parse_fields("status,raw", ["status", "result_json"])
+
+
+def test_run_fields_are_applied_on_both_hops_and_compressed(magenta):
+    async def scenario():
+        await llm_proxy.open_magenta_client(transport=magenta)
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=cian_app), base_url="http://cian") as client:
+                slim = await client.post("/api/v1/run", json=PAYLOAD, params={"fields": "result_json"},
+                                         headers={"Accept-Encoding": "gzip"})
+                full = await client.post("/api/v1/run", json=PAYLOAD, headers={"Accept-Encoding": "identity"})
+                bad = await client.post("/api/v1/run", json=PAYLOAD, params={"fields": "raw"})
+                return slim, full, bad
+        finally:
+            await llm_proxy.close_magenta_client()
+
+    slim, full, bad = asyncio.run(scenario())
+
+    assert slim.json() == {"result_json": PLAN} and slim.headers["content-encoding"] == "gzip"
+    assert int(slim.headers["content-length"]) < len(encoding.dumps({"result_json": PLAN})) / 3
+    assert full.json()["raw_text"] == json.dumps(PLAN) and "content-encoding" not in full.headers
+    assert bad.status_code == 400 and len(magenta.hops) == 2
+
+    # CIAN pide a MAGENTA lo del cliente más lo que necesita el almacén de planes, comprimido.
+    (slim_request, slim_headers, slim_bytes), (full_request, full_headers, full_bytes) = magenta.hops
+    assert slim_request.url.params["fields"] == "result_json,status,model_used,prompt_template"
+    assert "fields" not in full_request.url.params
+    assert slim_headers["content-encoding"] == full_headers["content-encoding"] == "gzip"
+    assert slim_bytes < full_bytes < len(encoding.dumps(PLAN))
+    assert plans.plan_store.search("expansion")[0][0]["model"] == "gemini-2.5-flash"
+
+
+def test_landing_is_served_compressed():
+    payload = {"template_type": "academia_idiomas", "mision": "Enseñar"}
+    with TestClient(cian_mini_bridge.app) as client:
+        plain = client.post("/api/v1/run", json=payload, headers={"Accept-Encoding": "identity"})
+        packed = client.post("/api/v1/run", json=payload, headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in plain.headers and packed.headers["content-encoding"] == "gzip"
+    assert packed.json()["result_json"]["visual_html"] == plain.json()["result_json"]["visual_html"]
+    assert "English World" in packed.json()["result_json"]["visual_html"]
+    assert int(packed.headers["content-length"]) < len(plain.content) * 0.6
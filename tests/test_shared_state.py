@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import sqlite3
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from gwa_studio_core.core_api.admission import AdmissionController
+from gwa_studio_core.shared_state import SharedState
+from gwa_studio_llms.singleflight import SingleFlight
+
+
+def _hold_slots(db_path, key, count, ready, done):
+    state = SharedState(db_path)
+    for _ in range(count):
+        assert state.try_acquire(key, 10)
+    ready.set()
+    done.wait(10)
+
+
+def test_slots_are_shared_across_processes_and_freed_when_a_worker_dies(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    state = SharedState(db_path)
+    ctx = multiprocessing.get_context("spawn")
+    ready, done = ctx.Event(), ctx.Event()
+    worker = ctx.Process(target=_hold_slots, args=(db_path, "client:ana", 2, ready, done))
+    worker.start()
+    assert ready.wait(30)
+
+    assert state.try_acquire("client:ana", 3)
+    assert not state.try_acquire("client:ana", 3)
+    assert state.total("client:ana") == 3
+
+    done.set()
+    worker.join(10)
+    # Las plazas del worker que terminó ya no cuentan.
+    assert state.total("client:ana") == 1
+    assert state.try_acquire("client:ana", 3)
+    state.release("client:ana")
+    state.release("client:ana")
+    assert state.totals("client:") == {"client:ana": 0}
+
+
+def test_admission_caps_and_rates_clients_across_workers(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    # Dos workers de CIAN con el mismo estado compartido.
+    a, b = (AdmissionController(max_concurrency=8, max_queue=8, client_max_concurrency=1, client_max_rpm=3,
+                                shared=SharedState(db_path), workers=4) for _ in range(2))
+
+    async def scenario():
+        ticket = await a.admit("ollama", client_id="ana")
+        with pytest.raises(HTTPException) as capped:
+            await b.admit("ollama", client_id="ana")
+        stats = a.stats()
+        ticket.release()
+        (await b.admit("ollama", client_id="ana")).release()
+        with pytest.raises(HTTPException) as rated:
+            await a.admit("ollama", client_id="ana")
+        return capped.value, rated.value, stats
+
+    capped, rated, stats = asyncio.run(scenario())
+
+    assert capped.status_code == 429 and "simultáneas" in capped.detail
+    assert rated.status_code == 429 and "por minuto" in rated.detail and rated.headers["Retry-After"]
+    assert a.queue("ollama").max_concurrency == 2 and a.queue("ollama").max_queue == 2
+    assert stats["service_active"] == {"ollama": 1}
+    assert b.stats()["service_active"] == {"ollama": 0}
+
+
+def test_identical_generation_runs_once_across_workers(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    shared_cache = {}
+    calls = 0
+
+    async def generate():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        shared_cache["k"] = {"title": "Plan"}
+        return shared_cache["k"]
+
+    async def scenario():
+        workers = [SingleFlight(SharedState(db_path), poll_s=0.01) for _ in range(3)]
+        results = await asyncio.gather(*(w.do("k", generate, lookup=lambda: shared_cache.get("k")) for w in workers))
+        return workers, results
+
+    workers, results = asyncio.run(scenario())
+
+    assert calls == 1
+    assert results == [{"title": "Plan"}] * 3
+    assert sum(w.stats()["remote_waits"] for w in workers) == 2
+    # Sin estado compartido (un solo worker) las estadísticas son las de siempre.
+    assert SingleFlight(SharedState("")).stats().get("remote_waits") is None
+
+
+def test_admission_does_not_block_the_event_loop_on_the_shared_lock(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    controller = AdmissionController(client_max_concurrency=2, client_max_rpm=100, shared=SharedState(db_path))
+    other_worker = sqlite3.connect(db_path, isolation_level=None)
+    SharedState(db_path).total("warm")  # crea las tablas
+
+    async def scenario():
+        other_worker.execute("BEGIN IMMEDIATE")  # otro worker con el lock de escritura
+        admit = asyncio.ensure_future(controller.admit("ollama", client_id="ana"))
+        gaps, last = [], time.perf_counter()
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+        pending = not admit.done()
+        other_worker.execute("COMMIT")
+        ticket = await admit
+        ticket.release()
+        await controller.shared.run(lambda: None)  # espera a las liberaciones diferidas
+        return pending, max(gaps)
+
+    pending, worst_gap = asyncio.run(scenario())
+
+    assert pending and worst_gap < 0.1
+    assert controller.stats()["service_active"] == {"ollama": 0}
+    assert controller.shared.total("client:ana") == 0
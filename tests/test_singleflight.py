@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.fakes import FakeBackend
+from gwa_studio_llms.llm_processor import AgentExecutionRequest, AgentService
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.response_cache import ResponseCache
+from gwa_studio_llms.singleflight import SingleFlight
+
+
+def test_identical_calls_share_one_execution():
+    async def scenario():
+        group = SingleFlight()
+        calls = 0
+
+        async def generate():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return {"title": "Plan"}
+
+        results = await asyncio.gather(*(group.do("k", generate) for _ in range(5)))
+        return group, calls, results
+
+    group, calls, results = asyncio.run(scenario())
+
+    assert calls == 1
+    assert all(r is results[0] for r in results)
+    assert group.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4, "errors": 0, "cancelled": 0}
+
+
+def test_errors_propagate_to_every_waiter():
+    async def scenario():
+        group = SingleFlight()
+
+        async def boom():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("Ollama caído")
+
+        results = await asyncio.gather(*(group.do("k", boom) for _ in range(3)), return_exceptions=True)
+        return group, results
+
+    group, results = asyncio.run(scenario())
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert group.stats()["errors"] == 1
+
+
+def test_cancelling_one_waiter_keeps_generation_alive():
+    async def scenario():
+        group = SingleFlight()
+        finished = asyncio.Event()
+
+        async def generate():
+            await asyncio.sleep(0.05)
+            finished.set()
+            return "ok"
+
+        impatient = asyncio.ensure_future(group.do("k", generate))
+        patient = asyncio.ensure_future(group.do("k", generate))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        return await patient, finished.is_set(), group
+
+    result, finished, group = asyncio.run(scenario())
+
+    assert result == "ok" and finished
+    assert group.stats()["cancelled"] == 0
+
+
+def test_generation_is_cancelled_when_nobody_waits():
+    async def scenario():
+        group = SingleFlight()
+        started = asyncio.Event()
+
+        async def generate():
+            started.set()
+            await asyncio.sleep(10)
+
+        waiter = asyncio.ensure_future(group.do("k", generate))
+        await started.wait()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        return group
+
+    group = asyncio.run(scenario())
+
+    assert group.stats()["cancelled"] == 1
+    assert group.stats()["in_flight"] == 0
+
+
+def test_agent_service_coalesces_identical_requests():
+    backend = FakeBackend(['{"title": "Plan"}'], latency_s=0.1)
+    prompts = SimpleNamespace(render_prompt=lambda name, ctx: "prompt")
+    router = LLMRouter({"gemini": [backend]}, health_interval=0)
+    agent = AgentService(prompts, cache=ResponseCache(db_path=""), router=router)
+    request = AgentExecutionRequest(model_name="gemini-2.5-flash", template_name="plan", context={}, user_prompt="hola")
+
+    async def scenario():
+        return await asyncio.gather(*(agent.run_agent_shared(request) for _ in range(4)))
+
+    outputs = asyncio.run(scenario())
+
+    assert backend.calls == 1
+    assert len({o.raw_text for o in outputs}) == 1
+    assert agent.singleflight.stats()["coalesced"] == 3
@@ -0,0 +1,63 @@
+import gzip
+
+from fastapi.testclient import TestClient
+
+import cian_mini_bridge
+from plantillas_catalog import PLANTILLAS_DIR, PlantillasCatalog
+from site_renderer import PageTemplate, SiteRenderer, negotiate_encoding
+
+
+def test_compiled_template_binds_static_fields_and_renders():
+    template = PageTemplate.compile("t", "<h1>{{titulo}}</h1>\n   <p>{{texto}}</p>{{pie}}")
+    bound = template.bind("t:1", {"titulo": "Hola"})
+
+    assert bound.keys == ["texto", "pie"]
+    assert bound.render({"texto": "a", "pie": "b"}) == "<h1>Hola</h1>\n<p>a</p>b"
+
+
+def test_pages_are_content_addressed_escaped_and_compressed():
+    catalog = PlantillasCatalog(PLANTILLAS_DIR)
+    catalog.refresh()
+    renderer = SiteRenderer(max_pages=2)
+    entry = catalog.get("academia_idiomas")
+    content = {"empresa": "<script>x</script>", "slogan": "Hola", "mision": "M", "servicios": ["Inglés"]}
+
+    page = renderer.render(entry, {"c_accent": "#ff6b00", "c_bg": "red;}</style>"}, content)
+    again = renderer.render(entry, {"c_accent": "#ff6b00", "c_bg": "red;}</style>"}, dict(content))
+
+    assert again is page and (renderer.hits, renderer.misses) == (1, 1)
+    assert "&lt;script&gt;" in page.html and "<script>" not in page.html
+    assert "--bg: #0f172a" in page.html  # color inválido -> valor por defecto
+    assert "<title>Academia de Idiomas</title>" in page.html and "🛠️ Cursos" in page.html
+    assert gzip.decompress(page.bodies["gzip"]).decode("utf-8") == page.html
+    assert renderer.render(None, {}, content).page_id != page.page_id
+
+    renderer.render(None, {}, {"empresa": "otra"})
+    renderer.render(None, {}, {"empresa": "tercera"})
+    assert renderer.get(page.page_id) is None  # LRU de 2 páginas
+
+
+def test_negotiate_encoding():
+    available = {None: b"", "gzip": b""}
+    assert negotiate_encoding("gzip, deflate, br", available) == "gzip"
+    assert negotiate_encoding("br;q=1, gzip;q=0", {**available, "br": b""}) == "br"
+    assert negotiate_encoding("gzip;q=0", available) is None
+    assert negotiate_encoding("", available) is None
+
+
+def test_run_engine_sends_page_once_and_serves_it_with_etag():
+    payload = {"template_type": "academia_idiomas", "mision": "Enseñar", "c_text": "#222"}
+    with TestClient(cian_mini_bridge.app) as client:
+        result = client.post("/api/v1/run", json=payload).json()["result_json"]
+        assert result["data_json"]["web_html"] == {"ref": "visual_html", "page_id": result["page_id"],
+                                                    "url": result["page_url"]}
+        assert "English World Córdoba" in result["visual_html"]
+        assert client.post("/api/v1/run", json=payload).json()["result_json"]["page_id"] == result["page_id"]
+        lean = client.post("/api/v1/run", json={**payload, "inline_html": False}).json()["result_json"]
+        assert "visual_html" not in lean
+
+        page = client.get(result["page_url"], headers={"Accept-Encoding": "gzip"})
+        assert page.status_code == 200 and page.headers["content-encoding"] == "gzip"
+        assert page.text == result["visual_html"]
+        assert client.get(result["page_url"], headers={"If-None-Match": page.headers["etag"]}).status_code == 304
+        assert client.get("/api/v1/pages/no_existe").status_code == 404
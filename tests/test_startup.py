@@ -0,0 +1,112 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from gwa_studio_core.readiness import WarmUp, add_health_routes
+from gwa_studio_llms.backends import GeminiBackend
+from gwa_studio_llms.llm_router import LLMRouter
+
+
+def test_services_import_without_gemini_key_or_heavy_sdks():
+    code = (
+        "import sys; import gwa_studio_llms.main_service, gwa_studio_core.core_api.main; "
+        "print(sorted(m for m in ('google.genai', 'jinja2') if m in sys.modules))"
+    )
+    env = {k: v for k, v in os.environ.items() if k != "GEMINI_API_KEY"}
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, timeout=60)
+
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip().splitlines()[-1] == "[]"
+
+
+def _app(warm_up: WarmUp) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        warm_up.start()
+        yield
+        await warm_up.aclose()
+
+    app = FastAPI(lifespan=lifespan)
+    add_health_routes(app, warm_up)
+    return app
+
+
+def _wait_ready(client: TestClient) -> dict:
+    for _ in range(200):
+        response = client.get("/ready")
+        if response.status_code == 200:
+            return response.json()
+        time.sleep(0.01)
+    return response.json()
+
+
+def test_live_answers_during_warm_up_and_ready_waits_for_required_steps():
+    release = threading.Event()
+    warm_up = WarmUp("prueba")
+    warm_up.add("lento", lambda: release.wait(5))
+    warm_up.add("opcional", lambda: 1 / 0, required=False)
+
+    with TestClient(_app(warm_up)) as client:
+        assert client.get("/live").status_code == 200
+        pending = client.get("/ready")
+        release.set()
+        ready = _wait_ready(client)
+
+    assert pending.status_code == 503 and pending.json()["pending"] == ["lento"]
+    assert ready["ready"] is True and ready["steps"]["lento"]["ok"] is True
+    assert ready["steps"]["opcional"]["ok"] is False and "division" in ready["steps"]["opcional"]["error"]
+
+    broken = WarmUp("rota")
+    broken.add("plantillas", lambda: 1 / 0)
+    with TestClient(_app(broken)) as client:
+        _wait_ready(client)
+        assert client.get("/live").status_code == 200
+        assert client.get("/ready").status_code == 503
+
+
+def test_gemini_client_is_built_on_warm_up_not_on_construction():
+    backend = GeminiBackend(api_key="test-key", base_url="http://127.0.0.1:9")
+    router = LLMRouter({"gemini": [backend]}, health_interval=0)
+    assert backend._client is None
+
+    asyncio.run(router.warm_up())
+
+    assert backend._client is not None
+    assert router.is_available("gemini-2.5-flash")
+
+
+def test_template_warm_up_leaves_the_hot_reload_watcher_running(tmp_path):
+    from gwa_studio_llms import main_service
+    from gwa_studio_llms.template_registry import TemplateRegistry, template_registry
+
+    warm_up = WarmUp("magenta")
+    warm_up.steps = [step for step in main_service.warm_up.steps if step[0] == "plantillas"]
+    template_registry.stop_watcher()
+    asyncio.run(warm_up.run())
+    try:
+        assert warm_up.results["plantillas"]["ok"] is True
+        assert template_registry._watcher is not None and template_registry._watcher.is_alive()
+    finally:
+        template_registry.stop_watcher()
+
+    # Lo mismo con una carpeta propia: una edición tras el warm-up se recoge sin reiniciar.
+    (tmp_path / "plan.json").write_text('{"prompt": "v1"}', encoding="utf-8")
+    registry = TemplateRegistry(tmp_path, poll_interval=0.02)
+    registry.load()
+    try:
+        assert registry.get("json", "plan").data["prompt"] == "v1"
+        (tmp_path / "plan.json").write_text('{"prompt": "versión 2"}', encoding="utf-8")
+        for _ in range(250):
+            if registry.get("json", "plan").data["prompt"] != "v1":
+                break
+            time.sleep(0.02)
+        assert registry.get("json", "plan").data["prompt"] == "versión 2" and registry.reload_count == 1
+    finally:
+        registry.stop_watcher()
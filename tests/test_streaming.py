@@ -0,0 +1,110 @@
+import asyncio
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from benchmarks.fakes import FAKE_RESULT, FakeBackend, ServerThread, build_fake_magenta
+from gwa_studio_core.core_api import llm_proxy
+from gwa_studio_core.core_api.main import app as cian_app
+from gwa_studio_llms import llm_processor
+from gwa_studio_llms.backends import BackendError, BackendUnavailableError
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.main_service import app as magenta_app
+from gwa_studio_llms.response_cache import ResponseCache
+
+AUTH = {"Authorization": "Bearer gwa_token_magenta"}
+PAYLOAD = {"template_name": "plan", "context": {}, "user_prompt": "hola"}
+
+
+def test_cian_relays_tokens_without_buffering(monkeypatch):
+    with ServerThread(build_fake_magenta(latency_s=1.0, tokens=10)) as magenta:
+        monkeypatch.setattr(llm_proxy, "MAGENTA_BASE_URL", magenta.base_url)
+        with ServerThread(cian_app) as cian:
+            start = time.perf_counter()
+            first_token_at = None
+            events = []
+            with httpx.stream("POST", f"{cian.base_url}/api/v1/run_stream", json=PAYLOAD, timeout=10) as response:
+                assert response.status_code == 200
+                for line in response.iter_lines():
+                    if line:
+                        events.append(json.loads(line))
+                        first_token_at = first_token_at or time.perf_counter() - start
+            total = time.perf_counter() - start
+
+    assert first_token_at < 0.5 < total
+    assert [e["type"] for e in events].count("token") >= 10
+    assert events[-1]["type"] == "result"
+    assert events[-1]["output"]["result_json"] == FAKE_RESULT
+
+
+@pytest.fixture
+def magenta(monkeypatch):
+    service = llm_processor.agent_service
+    router = LLMRouter({"gemini": [FakeBackend(['{"title": ', '"Plan"}'])]}, health_interval=0)
+    monkeypatch.setattr(service, "router", router)
+    monkeypatch.setattr(service, "prompt_manager", SimpleNamespace(render_prompt=lambda name, ctx: "prompt"))
+    monkeypatch.setattr(service, "cache", ResponseCache(db_path=""))
+    return TestClient(magenta_app)
+
+
+def test_magenta_streams_ndjson_events(magenta):
+    payload = {"model_name": "gemini-2.5-flash", **PAYLOAD}
+
+    response = magenta.post("/agent/run_stream", json=payload, headers=AUTH)
+    events = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [e["text"] for e in events if e["type"] == "token"] == ['{"title": ', '"Plan"}']
+    assert events[-1]["output"]["status"] == "ok"
+    assert events[-1]["output"]["result_json"] == {"title": "Plan"}
+
+
+def test_magenta_stream_reports_render_errors_as_http_status(magenta, monkeypatch):
+    def broken(name, ctx):
+        raise KeyError("sector")
+
+    monkeypatch.setattr(llm_processor.agent_service, "prompt_manager", SimpleNamespace(render_prompt=broken))
+
+    response = magenta.post("/agent/run_stream", json={"model_name": "gemini-2.5-flash", **PAYLOAD}, headers=AUTH)
+
+    assert response.status_code == 400
+
+
+class BreaksMidStream(FakeBackend):
+    async def stream(self, model, messages, options=None, response_format=None, usage=None):
+        yield '{"title": '
+        raise BackendError("conexión cortada")
+
+
+def test_magenta_stream_backend_failures_before_and_after_the_first_token(magenta, monkeypatch):
+    payload = {"model_name": "gemini-2.5-flash", **PAYLOAD}
+    service = llm_processor.agent_service
+    down = FakeBackend(error=BackendUnavailableError("nodo caído"))
+    monkeypatch.setattr(service, "router", LLMRouter({"gemini": [down]}, health_interval=0))
+
+    before = magenta.post("/agent/run_stream", json=payload, headers=AUTH)
+    assert before.status_code == 503 and "application/json" in before.headers["content-type"]
+
+    # CIAN reenvía el 503 (y lo cuenta como tal), no un 200 con una línea de error.
+    async def via_cian():
+        await llm_proxy.open_magenta_client(transport=httpx.ASGITransport(app=magenta_app))
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=cian_app), base_url="http://cian") as client:
+                return await client.post("/api/v1/run_stream", json=payload)
+        finally:
+            await llm_proxy.close_magenta_client()
+
+    assert asyncio.run(via_cian()).status_code == 503
+
+    monkeypatch.setattr(service, "router", LLMRouter({"gemini": [BreaksMidStream()]}, health_interval=0))
+    after = magenta.post("/agent/run_stream", json=payload, headers=AUTH)
+    events = [json.loads(line) for line in after.text.splitlines()]
+    assert after.status_code == 200
+    assert [e["type"] for e in events] == ["token", "error"] and "conexión cortada" in events[-1]["detail"]
@@ -0,0 +1,56 @@
+import json
+import os
+
+import pytest
+
+from gwa_studio_llms.prompt_manager import PromptManager
+from gwa_studio_llms.template_registry import TemplateNotFoundError, TemplateRegistry
+
+
+def _write(path, content):
+    path.write_text(content, encoding="utf-8")
+    # Fuerza un mtime distinto aunque el sistema de archivos tenga poca resolución.
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    _write(tmp_path / "plan.json", json.dumps({"prompt": "Plan para $empresa"}))
+    _write(tmp_path / "otro.json", json.dumps({"prompt": "Otro $x"}))
+    _write(tmp_path / "plan.jinja", "Empresa: {{ context.empresa }} / {{ user_prompt }}")
+    reg = TemplateRegistry(base_dir=tmp_path, poll_interval=0)
+    reg.refresh()
+    return reg
+
+
+def test_renders_from_memory_without_disk_io(registry, tmp_path):
+    manager = PromptManager(registry=registry)
+    for f in tmp_path.iterdir():
+        f.unlink()
+
+    assert manager.render_prompt("plan", {"empresa": "GWA"}) == "Plan para GWA"
+    assert registry.get_jinja("plan").render(context={"empresa": "GWA"}, user_prompt="hola") == "Empresa: GWA / hola"
+    assert manager.get_template_names() == ["otro", "plan"]
+
+
+def test_refresh_reloads_only_changed_files(registry, tmp_path):
+    untouched = registry.get("json", "otro")
+    _write(tmp_path / "plan.json", json.dumps({"prompt": "Nuevo plan para $empresa"}))
+    (tmp_path / "plan.jinja").unlink()
+
+    changes = registry.refresh()
+
+    assert changes == {"loaded": ["plan.json"], "removed": ["plan.jinja"]}
+    assert registry.get("json", "otro") is untouched
+    assert PromptManager(registry=registry).render_prompt("plan", {"empresa": "X"}) == "Nuevo plan para X"
+    with pytest.raises(TemplateNotFoundError):
+        registry.get_jinja("plan")
+
+
+def test_template_without_prompt_raises_value_error(registry, tmp_path):
+    _write(tmp_path / "vacia.json", json.dumps({"name": "sin prompt"}))
+    registry.refresh()
+
+    with pytest.raises(ValueError):
+        PromptManager(registry=registry).render_prompt("vacia", {})
@@ -0,0 +1,109 @@
+import asyncio
+import io
+import json
+import os
+from types import SimpleNamespace
+
+import httpx
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+from benchmarks.fakes import build_fake_ollama
+from gwa_studio_core import critical_path, tracing
+from gwa_studio_core.core_api import llm_proxy
+from gwa_studio_core.core_api import metrics as cian_metrics
+from gwa_studio_core.core_api.main import app as cian_app
+from gwa_studio_core.tracing import MemoryExporter, parse_traceparent
+from gwa_studio_llms import llm_processor
+from gwa_studio_llms.backends import OllamaBackend
+from gwa_studio_llms.llm_router import LLMRouter
+from gwa_studio_llms.main_service import app as magenta_app
+from gwa_studio_llms.response_cache import ResponseCache
+
+PAYLOAD = {"model_name": "llama3:8b", "template_name": "plan", "context": {}, "user_prompt": "hola"}
+INCOMING = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def test_parse_traceparent_rejects_malformed_headers():
+    context = parse_traceparent(INCOMING)
+    assert (context.trace_id, context.span_id, context.sampled) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True)
+    assert context.traceparent == INCOMING
+    for bad in (None, "", "00-xyz-00f067aa0ba902b7-01", "00-" + "0" * 32 + "-00f067aa0ba902b7-01"):
+        assert parse_traceparent(bad) is None
+
+
+def test_trace_spans_gateway_proxy_hop_and_model_call(monkeypatch):
+    exporter = MemoryExporter()
+    monkeypatch.setattr(cian_metrics.tracer, "exporter", exporter)
+    monkeypatch.setattr(llm_processor.tracer, "exporter", exporter)
+    ollama = build_fake_ollama(latency_s=0.05, tokens=5)
+    service = llm_processor.agent_service
+    backend = OllamaBackend("http://ollama", transport=httpx.ASGITransport(app=ollama))
+    monkeypatch.setattr(service, "router", LLMRouter({"ollama": [backend]}, health_interval=0))
+    monkeypatch.setattr(service, "prompt_manager", SimpleNamespace(render_prompt=lambda name, ctx: "prompt"))
+    monkeypatch.setattr(service, "cache", ResponseCache(db_path=""))
+
+    async def scenario():
+        await llm_proxy.open_magenta_client(transport=httpx.ASGITransport(app=magenta_app))
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=cian_app), base_url="http://cian") as client:
+                return await client.post("/api/v1/run", json=PAYLOAD, headers={"traceparent": INCOMING})
+        finally:
+            await llm_proxy.close_magenta_client()
+
+    assert asyncio.run(scenario()).status_code == 200
+
+    spans = {s["name"]: s for s in exporter.spans}
+    assert {s["trace_id"] for s in exporter.spans} == {"4bf92f3577b34da6a3ce929d0e0e4736"}
+    assert spans["gateway"]["parent_id"] == "00f067aa0ba902b7"
+    assert spans["proxy_hop"]["parent_id"] == spans["gateway"]["span_id"]
+    assert spans["agent"]["parent_id"] == spans["proxy_hop"]["span_id"]
+    for name in ("render", "model_call", "parse"):
+        assert spans[name]["parent_id"] == spans["agent"]["span_id"]
+    assert spans["model_call"]["attributes"]["backend"] == "ollama@http://ollama"
+    # La llamada a Ollama lleva como padre el span model_call.
+    assert parse_traceparent(ollama.state.traceparents[0]).span_id == spans["model_call"]["span_id"]
+
+    path = [span["name"] for _, span, _ in critical_path.critical_path(exporter.spans)]
+    assert path == ["gateway", "admission", "proxy_hop", "agent", "render", "model_call", "parse"]
+    out = io.StringIO()
+    critical_path.print_trace("4bf92f3577b34da6a3ce929d0e0e4736", exporter.spans, out=out)
+    assert "etapa más lenta: magenta:model_call" in out.getvalue()
+
+
+def test_critical_path_cli_reads_jsonl(tmp_path, capsys):
+    spans = [
+        {"trace_id": "t", "span_id": "a", "parent_id": None, "name": "gateway", "service": "cian",
+         "start_ns": 0, "end_ns": 100_000_000, "duration_ms": 100.0},
+        {"trace_id": "t", "span_id": "b", "parent_id": "a", "name": "proxy_hop", "service": "cian",
+         "start_ns": 10_000_000, "end_ns": 90_000_000, "duration_ms": 80.0},
+    ]
+    path = tmp_path / "spans.jsonl"
+    path.write_text("\n".join(json.dumps(s) for s in spans) + "\n{roto\n", encoding="utf-8")
+
+    assert critical_path.main([str(path)]) == 0
+    assert "etapa más lenta: cian:proxy_hop (80.0 ms propios, 80% de la petición)" in capsys.readouterr().out
+
+
+def test_jsonl_exporter_writes_in_background_and_rotates(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "default.jsonl"))
+    assert isinstance(tracing.exporter_from_env(), tracing.JsonlFileExporter)
+    monkeypatch.setattr(tracing, "TRACE_EXPORTER", "none")
+    assert isinstance(tracing.exporter_from_env(), tracing.NullExporter)
+
+    path = tmp_path / "traces" / "spans.jsonl"
+    exporter = tracing.JsonlFileExporter(str(path), max_bytes=2000, backups=2)
+    tracer = tracing.Tracer("cian", exporter)
+    for i in range(60):
+        with tracer.span("gateway", request=i):
+            pass
+    exporter.flush()
+    exporter.close()
+
+    files = sorted(p.name for p in path.parent.iterdir())
+    assert files == ["spans.jsonl", "spans.jsonl.1", "spans.jsonl.2"]
+    assert all(p.stat().st_size < 2000 + 400 for p in path.parent.iterdir())
+    spans = [json.loads(line) for name in reversed(files) for line in (path.parent / name).read_text().splitlines()]
+    # Lo más reciente se conserva entero y en orden; lo más antiguo se descartó al rotar.
+    assert [s["attributes"]["request"] for s in spans] == list(range(60 - len(spans), 60))
+    assert exporter.dropped == 0